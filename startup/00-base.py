@@ -1,3 +1,5 @@
+from BMM.functions import run_report
+run_report(__file__, text='bluesky and databroker')
 import nslsii
 ip = get_ipython()
 
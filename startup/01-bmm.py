@@ -5,7 +5,8 @@ logger.setLevel('WARNING')
 logger = logging.getLogger('bluesky')
 logger.setLevel('WARNING')
 
-from BMM.workspace import initialize_workspace, rkvs
+run_report('\t'+'workspace')
+from BMM.workspace import initialize_workspace, workspace_report, rkvs
 initialize_workspace()
 
 import json, time
@@ -17,7 +18,7 @@ BMM_CONFIGURATION_LOCATION = '/home/xf06bm/git/BMM-beamline-configuration/'
 nas_mount_point = '/mnt/nfs/nas1'
 nas_path = os.path.join(nas_mount_point, 'xf06bm', 'experiments', 'XAS', 'snapshots')
 
-from BMM.functions           import now, colored, run_report, boxedtext, elapsed_time
+from BMM.functions           import now, colored, run_report, startup_report, boxedtext, elapsed_time, Deferred, made
 from BMM.functions           import error_msg, warning_msg, go_msg, url_msg, bold_msg, verbosebold_msg, list_msg, disconnected_msg, info_msg, whisper
 run_report(__file__, text='functions and other basics')
 run_report('\t'+'logging')
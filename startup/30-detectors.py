@@ -218,20 +218,26 @@ quadem2 = BMMQuadEM('XF:06BM-BI{EM:2}EM180:', name='quadem2')
 ####################################################
 
 run_report('\t'+'cameras')
-from BMM.camera_device import BMMSnapshot, snap
+from BMM.camera_device import BMMSnapshot, snap, camera_pool
 from BMM.db import file_resource
 
-## see 01-bmm.py for definition of nas_path
-xascam = BMMSnapshot(root=nas_path, which='XAS',    name='xascam')
-xrdcam = BMMSnapshot(root=nas_path, which='XRD',    name='xrdcam')
-anacam = BMMSnapshot(root=nas_path, which='analog', name='anacam')
-anacam.device = '/dev/v4l/by-id/usb-MACROSIL_AV_TO_USB2.0-video-index0'
-anacam.x, anacam.y = 640, 480    # width, height
-
-econcam = BMMSnapshot(root=nas_path, which='econ', name='econcam')
-econcam.device = '/dev/v4l/by-id/usb-e-con_systems_See3CAM_CU55_1CD90500-video-index0'
-econcam.x, econcam.y = 1280, 720 # width, height
-econcam.brightness = 50
+## the cameras, the Pilatus, and the Xspress3 are made the first time
+## they are used, see Deferred in BMM/functions.py
+def _camera(which, name, device=None, x=640, y=480, brightness=30):
+    def make():
+        ## see 01-bmm.py for definition of nas_path
+        cam = BMMSnapshot(root=nas_path, which=which, name=name)
+        cam.device = device
+        cam.x, cam.y = x, y          # width, height
+        cam.brightness = brightness
+        return cam
+    return Deferred(name, make)
+
+xascam  = _camera('XAS',    'xascam')
+xrdcam  = _camera('XRD',    'xrdcam')
+anacam  = _camera('analog', 'anacam',  device='/dev/v4l/by-id/usb-MACROSIL_AV_TO_USB2.0-video-index0')
+econcam = _camera('econ',   'econcam', device='/dev/v4l/by-id/usb-e-con_systems_See3CAM_CU55_1CD90500-video-index0',
+                  x=1280, y=720, brightness=50)
 
 ## the output file names is hidden away in the dict returned by this: a.describe()['args']['get_resources']()
 #
@@ -264,8 +270,8 @@ from BMM.pilatus import MyDetector, PilatusGrabber
 
 ## prosilica3 = MyDetector('XF:06BM-BI{Scr:3}', name='Prosilica3')
 ## p3         = ImageGrabber(prosilica3)
-pilatus = MyDetector('XF:06BMB-ES{Det:PIL100k}:', name='Pilatus')
-pil     = PilatusGrabber(pilatus)
+pilatus = Deferred('pilatus', lambda: MyDetector('XF:06BMB-ES{Det:PIL100k}:', name='Pilatus'))
+pil     = Deferred('pil',     lambda: PilatusGrabber(made(pilatus)))
 
 
 
@@ -281,94 +287,107 @@ pil     = PilatusGrabber(pilatus)
 from BMM.xspress3_4element import BMMXspress3Detector_4Element
 from BMM.xspress3_1element import BMMXspress3Detector_1Element
 use_4element = True
-if with_xspress3 is True:
-    if use_4element:
-        run_report('\t'+'4-element SDD with Xspress3')
-
-        xs  = BMMXspress3Detector_4Element('XF:06BM-ES{Xsp:1}:', name='xs')
-        # This is necessary for when the ioc restarts
-        # we have to trigger one image for the hdf5 plugin to work correctly
-        # else, we get file writing errors
-        xs.hdf5.warmup()
-
-        # Hints:
-        for n in range(1,5):
-            for m in range(1,17):
-                r = getattr(xs, f'channel{n}').rois
-                thisroi = getattr(r, 'roi{:02}'.format(m))
-                thisroi.value.kind = 'hinted'
-                #getattr(xs, f'channel{n}').rois.roi01.value.kind = 'hinted'
-                #getattr(xs, f'channel{n}').rois.roi02.value.kind = 'hinted'
-                #getattr(xs, f'channel{n}').rois.roi03.value.kind = 'hinted'
-                #getattr(xs, f'channel{n}').rois.roi04.value.kind = 'hinted'
-
-        xs.settings.configuration_attrs = ['acquire_period',
-                                           'acquire_time',
-                                           'gain',
-                                           'image_mode',
-                                           'manufacturer',
-                                           'model',
-                                           'num_exposures',
-                                           'num_images',
-                                           'temperature',
-                                           'temperature_actual',
-                                           'trigger_mode',
-                                           'config_path',
-                                           'config_save_path',
-                                           'invert_f0',
-                                           'invert_veto',
-                                           'xsp_name',
-                                           'num_channels',
-                                           'num_frames_config',
-                                           'run_flags',
-                                           'trigger_signal']
-
-        for n, d in xs.channels.items():
-            roi_names = ['roi{:02}'.format(j) for j in range(1,17)]
-            d.rois.read_attrs = roi_names
-            d.rois.configuration_attrs = roi_names
-            for roi_n in roi_names:
-                getattr(d.rois, roi_n).value_sum.kind = 'omitted'
-
-        xs.set_rois()
-        #xrf = xs.measure_xrf
-
-    else:
-        run_report('\t'+'1-element SDD with Xspress3')
-        xs1 = BMMXspress3Detector_1Element('XF:06BM-ES{Xsp:1}:', name='xs1')
-        xs1.hdf5.warmup()
 
+## the Xspress3 takes seconds to connect, configure, and (sometimes) warm
+## up, so this is done the first time it is used, see Deferred in
+## BMM/functions.py.  That is also when its ROIs are set for BMMuser.element.
+def _make_xs():
+    xs  = BMMXspress3Detector_4Element('XF:06BM-ES{Xsp:1}:', name='xs')
+    # This is necessary for when the ioc restarts
+    # we have to trigger one image for the hdf5 plugin to work correctly
+    # else, we get file writing errors
+    xs.hdf5.warmup()
+
+    # Hints:
+    for n in range(1,5):
         for m in range(1,17):
-            r = xs1.channel8.rois
+            r = getattr(xs, f'channel{n}').rois
             thisroi = getattr(r, 'roi{:02}'.format(m))
             thisroi.value.kind = 'hinted'
-        xs1.settings.configuration_attrs = ['acquire_period',
-                                            'acquire_time',
-                                            'gain',
-                                            'image_mode',
-                                            'manufacturer',
-                                            'model',
-                                            'num_exposures',
-                                            'num_images',
-                                            'temperature',
-                                            'temperature_actual',
-                                            'trigger_mode',
-                                            'config_path',
-                                            'config_save_path',
-                                            'invert_f0',
-                                            'invert_veto',
-                                            'xsp_name',
-                                            'num_channels',
-                                            'num_frames_config',
-                                            'run_flags',
-                                            'trigger_signal']
-
-        #for n, d in xs1.channels.items():
+            #getattr(xs, f'channel{n}').rois.roi01.value.kind = 'hinted'
+            #getattr(xs, f'channel{n}').rois.roi02.value.kind = 'hinted'
+            #getattr(xs, f'channel{n}').rois.roi03.value.kind = 'hinted'
+            #getattr(xs, f'channel{n}').rois.roi04.value.kind = 'hinted'
+
+    xs.settings.configuration_attrs = ['acquire_period',
+                                       'acquire_time',
+                                       'gain',
+                                       'image_mode',
+                                       'manufacturer',
+                                       'model',
+                                       'num_exposures',
+                                       'num_images',
+                                       'temperature',
+                                       'temperature_actual',
+                                       'trigger_mode',
+                                       'config_path',
+                                       'config_save_path',
+                                       'invert_f0',
+                                       'invert_veto',
+                                       'xsp_name',
+                                       'num_channels',
+                                       'num_frames_config',
+                                       'run_flags',
+                                       'trigger_signal']
+
+    for n, d in xs.channels.items():
         roi_names = ['roi{:02}'.format(j) for j in range(1,17)]
-        xs1.channel8.rois.read_attrs = roi_names
-        xs1.channel8.rois.configuration_attrs = roi_names
+        d.rois.read_attrs = roi_names
+        d.rois.configuration_attrs = roi_names
         for roi_n in roi_names:
-            getattr(xs1.channel8.rois, roi_n).value_sum.kind = 'omitted'
-        xs1.set_rois()
-        #xrf1 = xs1.measure_xrf
+            getattr(d.rois, roi_n).value_sum.kind = 'omitted'
+
+    xs.set_rois()
+    if BMMuser.element is not None: # make sure Xspress3 is configured to measure from the correct ROI
+        BMMuser.verify_roi(xs, BMMuser.element, BMMuser.edge)
+    return xs
+
+
+def _make_xs1():
+    xs1 = BMMXspress3Detector_1Element('XF:06BM-ES{Xsp:1}:', name='xs1')
+    xs1.hdf5.warmup()
+
+    for m in range(1,17):
+        r = xs1.channel8.rois
+        thisroi = getattr(r, 'roi{:02}'.format(m))
+        thisroi.value.kind = 'hinted'
+    xs1.settings.configuration_attrs = ['acquire_period',
+                                        'acquire_time',
+                                        'gain',
+                                        'image_mode',
+                                        'manufacturer',
+                                        'model',
+                                        'num_exposures',
+                                        'num_images',
+                                        'temperature',
+                                        'temperature_actual',
+                                        'trigger_mode',
+                                        'config_path',
+                                        'config_save_path',
+                                        'invert_f0',
+                                        'invert_veto',
+                                        'xsp_name',
+                                        'num_channels',
+                                        'num_frames_config',
+                                        'run_flags',
+                                        'trigger_signal']
+
+    #for n, d in xs1.channels.items():
+    roi_names = ['roi{:02}'.format(j) for j in range(1,17)]
+    xs1.channel8.rois.read_attrs = roi_names
+    xs1.channel8.rois.configuration_attrs = roi_names
+    for roi_n in roi_names:
+        getattr(xs1.channel8.rois, roi_n).value_sum.kind = 'omitted'
+    xs1.set_rois()
+    #if BMMuser.element is not None:
+    #    BMMuser.verify_roi(xs1, BMMuser.element, BMMuser.edge)
+    return xs1
+
 
+if with_xspress3 is True:
+    if use_4element:
+        run_report('\t'+'4-element SDD with Xspress3')
+        xs  = Deferred('xs', _make_xs)
+    else:
+        run_report('\t'+'1-element SDD with Xspress3')
+        xs1 = Deferred('xs1', _make_xs1)
@@ -6,11 +6,21 @@ run_report('\t'+'resting state')
 from BMM.resting_state import resting_state, resting_state_plan, end_of_macro
 
 run_report('\t'+'motor status reporting')
+from BMM.pvsnapshot import PVSnapshot
+pvsnap = PVSnapshot()
 from BMM.motor_status import motor_metadata, motor_status, ms, motor_sidebar, xrd_motors, xrdm
 
 run_report('\t'+'derived plot')
 from BMM.derivedplot import close_all_plots, close_last_plot, interpret_click
 
+run_report('\t'+'timing spans')
+from BMM.spans import SpanRecorder
+spans = SpanRecorder()
+
+run_report('\t'+'health checks')
+from BMM.healthcheck import HealthCheck
+health = HealthCheck()
+
 run_report('\t'+'suspenders')
 from BMM.suspenders import BMM_suspenders, BMM_clear_to_start
 
@@ -51,6 +61,9 @@ from BMM.energystep import energystep
 run_report('\t'+'other plans')
 from BMM.plans import tu, td, recover_mirror2, recover_mirrors, recover_screens, mvbct, mvrbct, mvbender, mvrbender
 
+run_report('\t'+'workspace checks')
+workspace_report()              # the git pull must be finished before reading Modes.json
+
 run_report('\t'+'change_mode, change_xtals')
 from BMM.modes import change_mode, describe_mode, get_mode, mode, read_mode_data, change_xtals, pds_motors_ready
 
@@ -97,9 +110,21 @@ run_report('\t'+'machine learning and data evaluation')
 from BMM.ml import BMMDataEvaluation
 clf = BMMDataEvaluation()
 
+run_report('\t'+'Google drive sync')
+from BMM.gdrive import GdriveSync
+gsync = GdriveSync()
+gsync.start()
+
+run_report('\t'+'post-scan work queue')
+from BMM.postscan import BMMPostScan
+postscan = BMMPostScan()
+
 run_report('\t'+'xafs')
 from BMM.xafs import howlong, xafs, db2xdi
 
+run_report('\t'+'fly scans')
+from BMM.flyscan import xafs_fly
+
 run_report('\t'+'mono calibration')
 from BMM.mono_calibration import calibrate, calibrate_high_end, calibrate_low_end, calibrate_mono
 
@@ -124,6 +149,9 @@ run_report('\t'+'telemetry')
 from BMM.telemetry import BMMTelementry
 tele = BMMTelementry()
 
+run_report('\t'+'benchmarks')
+from BMM.functions import bmm_benchmark, benchmark_history
+
 run_report('\t'+'user interaction')
 from BMM.wdywtd import WDYWTD
 _do = WDYWTD()
@@ -142,17 +170,12 @@ if rois.trigger is True:        # set Struck rois from persistent user informati
      rois.trigger = False
 
 if BMMuser.element is None:
-     try:
-          BMMuser.element = str(rkvs.get('BMM:pds:element'), 'utf-8')
-     except:
-          pass
-     try:
-          BMMuser.edge    = str(rkvs.get('BMM:pds:edge'), 'utf-8')
-     except:
-          pass
-if BMMuser.element is not None: # make sure Xspress3 is configured to measure from the correct ROI
-     BMMuser.verify_roi(xs, BMMuser.element, BMMuser.edge)
-     #BMMuser.verify_roi(xs1, BMMuser.element, BMMuser.edge)
+     pds = rkvs.values('BMM:pds:element', 'BMM:pds:edge')
+     if pds['BMM:pds:element'] is not None:
+          BMMuser.element = pds['BMM:pds:element']
+     if pds['BMM:pds:edge'] is not None:
+          BMMuser.edge    = pds['BMM:pds:edge']
+if BMMuser.element is not None: # the Xspress3 ROIs are set for this element when it is first used, see 30-detectors.py
      show_edges()
 
 
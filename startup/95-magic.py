@@ -76,3 +76,5 @@ if BMMuser.trigger is True:     # provide feedback if importing persistent user
     print('')
     whoami()
     BMMuser.trigger = False
+
+startup_report()
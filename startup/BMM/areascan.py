@@ -174,9 +174,7 @@ def areascan(detector,
             BMMuser.final_log_entry = True
             return uid
 
-        rkvs.set('BMM:scan:type',      'area')
-        rkvs.set('BMM:scan:starttime', str(datetime.datetime.timestamp(datetime.datetime.now())))
-        rkvs.set('BMM:scan:estimated', estimate)
+        rkvs.scan_started('area', estimated=estimate)
         
         BMM_log_info('begin areascan observing: %s\n%s%s' % (detector, line1, line2))
         uid = yield from make_areascan(dets,
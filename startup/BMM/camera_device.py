@@ -1,8 +1,14 @@
 import os
+import time
 import uuid
 import threading
 import itertools
 import numpy
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import matplotlib
 
 import requests
 import bluesky
@@ -23,41 +29,113 @@ from IPython import get_ipython
 user_ns = get_ipython().user_ns
 
 from BMM.db import file_resource
-from BMM.functions import now
+from BMM.functions import now, error_msg
 from BMM.logging import report
 
 
-def annotate_image(imagefile, text):
-    bluesky_path_as_list = bluesky.__path__[0].split('/') # crude, but finds current collection folder
-    font_path = os.path.join('/', *bluesky_path_as_list[:4], 'lib', 'python3.7', 'site-packages', 'matplotlib', 'mpl-data', 'fonts', 'ttf')
-    img = Image.open(imagefile)
+class CameraPool():
+    '''Persistent threads for capturing and finishing camera images.
+
+    Captures run on a small pool of threads, so several cameras can be
+    read at the same time.  Each capture thread keeps its own HTTP
+    session, so the connection to a webcam is reused from one image
+    to the next rather than being set up for every image.  Slower
+    work which is not needed to finish a trigger, like drawing the
+    annotation and encoding the JPEG, runs on a separate pool.
+
+    Attributes
+    ----------
+    workers : int
+        number of capture threads
+    finishers : int
+        number of threads for annotating and encoding images
+    timeout : float
+        time (seconds) allowed for a webcam to answer, also the time
+        allowed for pending annotations when a camera is unstaged
+    '''
+    def __init__(self):
+        self.workers   = 4
+        self.finishers = 2
+        self.timeout   = 10.0
+        self.proxies   = {"http": None, "https": None,}
+        self.__local   = threading.local()
+        self.__capture = None
+        self.__finish  = None
+
+    def session(self):
+        '''Return the HTTP session belonging to the calling thread.'''
+        if getattr(self.__local, 'session', None) is None:
+            self.__local.session = requests.Session()
+            self.__local.session.trust_env = False   # never go through a proxy to reach a camera
+        return self.__local.session
+
+    def fetch(self, url):
+        '''Return the content of url, reusing this thread's connection.'''
+        r = self.session().get(url, proxies=self.proxies, timeout=self.timeout)
+        r.raise_for_status()
+        return r.content
+
+    def capture(self, func, *args, **kwargs):
+        if self.__capture is None or self.__capture._max_workers != self.workers:
+            self.__capture = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='BMM camera')
+        return self.__capture.submit(func, *args, **kwargs)
+
+    def finish(self, func, *args, **kwargs):
+        if self.__finish is None or self.__finish._max_workers != self.finishers:
+            self.__finish = ThreadPoolExecutor(max_workers=self.finishers, thread_name_prefix='BMM annotate')
+        return self.__finish.submit(func, *args, **kwargs)
+
+camera_pool = CameraPool()
+
+
+@lru_cache(maxsize=4)
+def annotation_font(size=24):
+    return ImageFont.truetype(os.path.join(matplotlib.get_data_path(), 'fonts', 'ttf', 'DejaVuSans.ttf'), size)
+
+def annotate(img, text):
+    '''Draw text in a translucent banner along the bottom of a PIL image.'''
     width, height = img.size
     draw = ImageDraw.Draw(img, 'RGBA')
     draw.rectangle(((0, int(9.5*height/10)), (width, height)), fill=(255,255,255,125))
-    font = ImageFont.truetype(font_path + '/DejaVuSans.ttf', 24)
-    draw.text((int(0.2*width/10), int(9.6*height/10)), text, (0,0,0), font=font)
+    draw.text((int(0.2*width/10), int(9.6*height/10)), text, (0,0,0), font=annotation_font())
+    return img
+
+def annotate_image(imagefile, text):
+    img = Image.open(imagefile)
+    annotate(img, text)
     img.save(imagefile)
 
+def write_annotated(content, filename, text):
+    '''Annotate the JPEG bytes in content and write them to filename.
+    The image is written to a temporary file and moved into place, so
+    a reader never sees a partly written image.'''
+    img = annotate(Image.open(BytesIO(content)), text)
+    temp = filename + '.part'
+    img.save(temp, 'JPEG')
+    os.replace(temp, filename)
+
 def xas_webcam(filename=None, **kwargs):
     XASURL = 'http://xf06bm-cam6/axis-cgi/jpg/image.cgi'
-    CAM_PROXIES = {"http": None, "https": None,}
     if filename is None:
         filename = os.environ['HOME'] + '/XAS_camera_' + now() + '.jpg'
-    r=requests.get(XASURL, proxies=CAM_PROXIES)
-    Image.open(BytesIO(r.content)).save(filename, 'JPEG')
+    content = camera_pool.fetch(XASURL)
     if 'annotation' in kwargs:
-        annotate_image(filename, kwargs['annotation'])
+        write_annotated(content, filename, kwargs['annotation'])
+    else:
+        with open(filename, 'wb') as fh:
+            fh.write(content)
     report('XAS webcam image written to %s' % filename)
 
 def xrd_webcam(filename=None, **kwargs):
     XRDURL = 'http://xf06bm-cam6/axis-cgi/jpg/image.cgi'
-    CAM_PROXIES = {"http": None, "https": None,}
     if filename is None:
         filename = os.environ['HOME'] + '/XRD_camera_' + now() + '.jpg'
-    r=requests.get(XRDURL, proxies=CAM_PROXIES)
-    Image.open(BytesIO(r.content)).save(filename, 'JPEG')
+    content = camera_pool.fetch(XRDURL)
     if 'annotation' in kwargs:
-        annotate_image(filename, kwargs['annotation'])
+        write_annotated(content, filename, kwargs['annotation'])
+    else:
+        with open(filename, 'wb') as fh:
+            fh.write(content)
     report('XRD webcam image written to %s' % filename)
 
 
@@ -202,6 +280,7 @@ class BMMSnapshot(Device):
         self._acquiring_lock = threading.Lock()
         self._counter = None  # set to an itertools.count object when staged
         self._asset_docs_cache = []
+        self._finishing = []    # annotations still being drawn
         self._annotation_string = ''
         self.device = None      # needed for the fswebcam interface
         self.x = 640
@@ -232,29 +311,41 @@ class BMMSnapshot(Device):
         self._asset_docs_cache.clear()
 
     def unstage(self):
+        self.wait_for_images()
         self._counter = None
         self._asset_docs_cache.clear()
         return super().unstage()
 
+    def wait_for_images(self):
+        '''Block until the annotated images are all written to disk.'''
+        done, pending = wait(self._finishing, timeout=camera_pool.timeout)
+        for f in done:
+            if f.exception() is not None:
+                print(error_msg(f'{self.name}: could not annotate image: {f.exception()}'))
+        if len(pending) > 0:
+            print(error_msg(f'{self.name}: {len(pending)} image(s) not annotated within {camera_pool.timeout:.1f} seconds'))
+        self._finishing = []
+
     def _capture(self, status, i):
-        "This runs on a background thread."
+        "This runs on a capture thread."
+        if not self._acquiring_lock.acquire(timeout=0):
+            status.set_exception(RuntimeError("Cannot trigger, currently trigggering!"))
+            return
         try:
-            if not self._acquiring_lock.acquire(timeout=0):
-                raise RuntimeError("Cannot trigger, currently trigggering!")
             filename = os.path.join(self._root, self._rel_path_template % i)
             # Kick off requests, or subprocess, or whatever with the result
             # that a file is saved at `filename`.
 
             if self._SPEC == "BMM_XAS_WEBCAM" or self._SPEC == "BMM_XRD_WEBCAM":
-                CAM_PROXIES = {"http": None, "https": None,}
-                r=requests.get(self._url, proxies=CAM_PROXIES)
-                im = Image.open(BytesIO(r.content))
-                im.save(filename, 'JPEG')
-                #print(f'w: {im.width}    h: {im.height}')
+                content = camera_pool.fetch(self._url)
+                with open(filename, 'wb') as fh:  # the camera already serves a JPEG
+                    fh.write(content)
+                im = Image.open(BytesIO(content)) # only reads the header
                 self.image.shape = (im.height, im.width, 3)
 
+                ## the annotated image replaces the plain one once it is drawn
                 annotation = 'NIST BMM (NSLS-II 06BM)      ' + self._annotation_string + '      ' + now()
-                annotate_image(filename, annotation)
+                self._finishing.append(camera_pool.finish(write_annotated, content, filename, annotation))
             else:
                 analog_camera(device=self.device, x=self.x, y=self.y, brightness=self.brightness,
                               filename=filename, sample=self._annotation_string, folder=self._root, quiet=True)
@@ -274,8 +365,7 @@ class BMMSnapshot(Device):
     def trigger(self):
         status = DeviceStatus(self)
         i = next(self._counter)
-        thread = threading.Thread(target=self._capture, args=(status, i))
-        thread.start()
+        camera_pool.capture(self._capture, status, i)
         return status
 
 def snap(which, filename=None, **kwargs):
@@ -289,3 +379,63 @@ def snap(which, filename=None, **kwargs):
 
 
 
+
+
+class SyntheticCamera():
+    '''A local HTTP server which behaves like an Axis webcam, for testing.
+
+    Every GET returns a freshly drawn JPEG after a delay of latency
+    seconds.  The server speaks HTTP/1.1, so a client can reuse its
+    connection, and it counts the connections made to it.
+
+    Example
+    -------
+    >>> cam = SyntheticCamera(latency=0.5).start()
+    >>> xascam._url = cam.url
+    >>> cam.stop()
+    '''
+    def __init__(self, latency=0.2, width=640, height=480):
+        self.latency     = latency
+        self.width       = width
+        self.height      = height
+        self.requests    = 0
+        self.connections = 0
+        self.__server    = None
+
+    def jpeg(self):
+        shade = (37*self.requests) % 256
+        img = Image.new('RGB', (self.width, self.height), (shade, 128, 255-shade))
+        buffer = BytesIO()
+        img.save(buffer, 'JPEG')
+        return buffer.getvalue()
+
+    def start(self):
+        camera = self
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            def setup(self):
+                camera.connections += 1
+                super().setup()
+            def do_GET(self):
+                camera.requests += 1
+                time.sleep(camera.latency)
+                body = camera.jpeg()
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def log_message(self, *args):
+                pass
+        self.__server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.__server.daemon_threads = True
+        threading.Thread(target=self.__server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.__server.server_address[1]}/axis-cgi/jpg/image.cgi'
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
@@ -3,11 +3,15 @@ import os
 from IPython import get_ipython
 user_ns = get_ipython().user_ns
 
-def file_resource(record):
+def file_resource(record, spec=None):
     '''Return the fully resolved path to the filestore image collected by a BMMSnapshot device
 
     Argument is either a uid string or db.v2 (databroker.core.BlueskyRun) object.
 
+    When a run holds images from more than one camera, spec (for
+    example "BMM_ANALOG_CAMERA") selects the camera.  Otherwise the
+    first resource in the run is used.
+
     Anything that cannot be interpreted to return a path will return None.
     '''
     if type(record) is str:
@@ -21,8 +25,12 @@ def file_resource(record):
         #return(template % 0)
         return(None)
     elif 'databroker.core.BlueskyRun' in str(type(record)) :
-        template = os.path.join(record.describe()['args']['get_resources']()[0]['root'],
-                                record.describe()['args']['get_resources']()[0]['resource_path'])
+        resources = record.describe()['args']['get_resources']()
+        if spec is not None:
+            resources = [r for r in resources if r['spec'] == spec]
+            if len(resources) == 0:
+                return(None)
+        template = os.path.join(resources[0]['root'], resources[0]['resource_path'])
         try:
             return(template % 0)
         except:
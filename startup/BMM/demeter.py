@@ -1,6 +1,7 @@
 import subprocess
-import os
+import os, gzip, hashlib, datetime, numpy
 
+from BMM.functions import etok
 from BMM.functions import error_msg, warning_msg, go_msg, url_msg, bold_msg, verbosebold_msg, list_msg, disconnected_msg, info_msg, whisper
 
 from IPython import get_ipython
@@ -64,3 +65,105 @@ def toprj(folder=None, name=None, base=None, start=None, end=None, bounds=None,
     #png.close()
     return(pngfile)
 
+
+
+
+def _perl_string(value):
+    '''Render a value as a single-quoted Perl string.'''
+    return "'" + str(value).replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+def _perl_array(values):
+    return ','.join(_perl_string(repr(float(v))) for v in numpy.asarray(values).tolist())
+
+def _athena_args(group, label, key):
+    '''The @args list for one record of an Athena project file.  Athena
+    supplies defaults for anything not specified here.'''
+    g = group.group
+    pre, bkg, fft = group.pre, group.bkg, group.fft
+    args = {'label'        : label,
+            'tag'          : key,
+            'datagroup'    : key,
+            'file'         : label,
+            'datatype'     : 'xmu',
+            'is_xmu'       : 1,
+            'is_merge'     : int(label == 'merge'),
+            'is_proj'      : 1,
+            'npts'         : len(g.energy),
+            'xmin'         : '%.1f' % g.energy.min(),
+            'xmax'         : '%.1f' % g.energy.max(),
+            'bkg_e0'       : g.e0,
+            'bkg_pre1'     : pre['pre1'],
+            'bkg_pre2'     : pre['pre2'],
+            'bkg_nor1'     : pre['norm1'],
+            'bkg_nor2'     : pre['norm2'],
+            'bkg_nnorm'    : 2 if pre['nnorm'] is None else pre['nnorm'],
+            'bkg_rbkg'     : bkg['rbkg'],
+            'bkg_kw'       : bkg['kweight'],
+            'bkg_spl1'     : bkg['kmin'],
+            'bkg_spl2'     : etok(g.energy.max() - g.e0) if bkg['kmax'] is None else bkg['kmax'],
+            'bkg_step'     : getattr(g, 'edge_step', 1),
+            'fft_kmin'     : fft['kmin'],
+            'fft_kmax'     : fft['kmax'],
+            'fft_dk'       : fft['dk'],
+            'fft_kwindow'  : fft['window'].lower(),
+            'bft_rmin'     : group.bft['rmin'],
+            'bft_rmax'     : group.bft['rmax'],
+            'bft_dr'       : group.bft['dr'],
+            'bft_rwindow'  : group.bft['window'].lower(),
+            'i0_string'    : '1',
+            'signal_string': '1',
+            'titles'       : group.title,
+           }
+    return ', '.join(f'{_perl_string(k)}, {_perl_string(v)}' for k,v in args.items())
+
+def write_athena_project(filename, groups, labels=None, merge=False):
+    '''Write an Athena project file from a list of Pandrosus objects.
+
+    This replaces running the toprj.pl script with the data read back
+    from the XDI files.  The data are written as they are held in the
+    Pandrosus groups, along with the processing parameters, in the
+    same (gzipped, perl-like) format that Demeter writes.
+
+    Parameters
+    ----------
+    filename : str
+        fully resolved path of the project file
+    groups : list of Pandrosus
+        processed data sets
+    labels : list of str
+        labels for the records in the project, default is each group's name
+    merge : Pandrosus or False
+        a merged data set to include as the last record
+    '''
+    if labels is None or len(labels) != len(groups):
+        labels = [g.name for g in groups]
+    records = list(zip(groups, labels))
+    if merge:
+        records.append((merge, 'merge'))
+    stamp = datetime.datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    lines = ['# Athena project file -- Demeter version 0.9.26',
+             f'# This file created at {stamp}',
+             '# Using the BMM data collection profile, written without Demeter',
+             '# -------------------------------------------------',
+             '@journal = ();',
+             '']
+    for i, (group, label) in enumerate(records):
+        ## Athena identifies each record by a 5 letter key, make it reproducible
+        key = ''.join(chr(97 + b % 26) for b in hashlib.md5(f'{filename}{i}{label}'.encode()).digest()[:5])
+        g = group.group
+        lines.append(f"$old_group = '{key}';")
+        lines.append(f'@args = ({_athena_args(group, label, key)});')
+        lines.append(f'@x = ({_perl_array(g.energy)});')
+        lines.append(f'@y = ({_perl_array(g.mu)});')
+        if getattr(g, 'i0', None) is not None:
+            lines.append(f'@i0 = ({_perl_array(g.i0)});')
+        if getattr(g, 'signal', None) is not None:
+            lines.append(f'@signal = ({_perl_array(g.signal)});')
+        lines.append('[record] # ')
+        lines.append('')
+    lines.extend(['1;', '', '',
+                  '# Local Variables:', '# truncate-lines: t', '# End:', ''])
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with gzip.open(filename, 'wt') as fh:
+        fh.write('\n'.join(lines))
+    return filename
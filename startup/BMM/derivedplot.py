@@ -5,7 +5,7 @@ from cycler import cycler
 import numpy as np
 import warnings
 from numpy import log
-import threading
+import threading, time
 
 #from bluesky.callbacks import CallbackBase
 from bluesky.callbacks.mpl_plotting import QtAwareCallback, initialize_qt_teleporter
@@ -71,6 +71,20 @@ def close_all_plots():
 initialize_qt_teleporter()
 #class DerivedPlot(CallbackBase):
 class DerivedPlot(QtAwareCallback):
+    '''Live plot of a quantity derived from each event.
+
+    Redrawing the whole figure for every event makes the Qt event loop
+    the bottleneck in a fast scan.  Instead, the data are accumulated
+    in a growable numpy buffer and the plot is refreshed at most
+    max_fps times per second.  When the new data fit within the
+    current axis limits, only the line is redrawn and blitted onto a
+    saved background.  The whole figure is redrawn only when the
+    limits must grow (or if the canvas does not support blitting).
+    The most recent data are always drawn at the next frame boundary,
+    and all of it when the run stops.
+    '''
+    max_fps = 10
+
     def __init__(self, func, ax=None, xlabel=None, ylabel=None, title=None, legend_keys=None, stream_name='primary', **kwargs):
         """
         func expects an Event document which looks like this:
@@ -96,6 +110,7 @@ class DerivedPlot(QtAwareCallback):
             if ax is None:
                 fig, ax = plt.subplots()
             self.ax = ax
+            fig = ax.figure
             if BMMuser.fig is not None:
                 BMMuser.prev_fig = BMMuser.fig
             if BMMuser.ax is not None:
@@ -123,17 +138,23 @@ class DerivedPlot(QtAwareCallback):
             self.legend_title = " :: ".join([name for name in self.legend_keys])
             self.stream_name = stream_name
             self.descriptors = {}
+            self.background = None
+            self.ax.figure.canvas.mpl_connect('draw_event', self._on_draw)
         self.__setup = setup
 
     def start(self, doc):
         self.__setup()
         # The doc is not used; we just use the signal that a new run began.
-        self.x_data, self.y_data = [], []
+        self.buffer = np.empty((256, 2))
+        self.npoints = 0
+        self.drawn = 0
+        self.last_frame = 0
+        self.timer = None
         self.descriptors.clear()
         label = " :: ".join(
             [str(doc.get(name, name)) for name in self.legend_keys])
         kwargs = ChainMap(self.kwargs, {'label': label})
-        self.current_line, = self.ax.plot([], [], **kwargs)
+        self.current_line, = self.ax.plot([], [], animated=True, **kwargs)
         self.lines.append(self.current_line)
         self.legend = self.ax.legend(
             loc=0, title=self.legend_title).set_draggable(True)
@@ -143,18 +164,73 @@ class DerivedPlot(QtAwareCallback):
         if doc['name'] == self.stream_name:
             self.descriptors[doc['uid']] = doc
 
+    @property
+    def x_data(self):
+        return self.buffer[:self.npoints, 0]
+
+    @property
+    def y_data(self):
+        return self.buffer[:self.npoints, 1]
+
     def event(self, doc):
         if not doc['descriptor'] in self.descriptors:
             # This is from some other event stream and we should ignore it.
             return
         x, y = self.func(doc)
-        self.y_data.append(y)
-        self.x_data.append(x)
+        if self.npoints == len(self.buffer):
+            self.buffer = np.concatenate((self.buffer, np.empty_like(self.buffer)))
+        self.buffer[self.npoints] = (x, y)
+        self.npoints += 1
+        if time.monotonic() - self.last_frame >= 1.0/self.max_fps:
+            self.render()
+        elif self.timer is None:
+            ## make sure the latest points get drawn even if no more events arrive soon
+            self.timer = self.ax.figure.canvas.new_timer(interval=int(1000/self.max_fps))
+            self.timer.single_shot = True
+            self.timer.add_callback(self.render)
+            self.timer.start()
+
+    def render(self):
+        '''Show all data received so far, blitting if possible.'''
+        if self.timer is not None:
+            self.timer.stop()
+            self.timer = None
+        self.last_frame = time.monotonic()
+        if self.drawn == self.npoints:
+            return
+        new = self.buffer[self.drawn:self.npoints]
+        self.drawn = self.npoints
         self.current_line.set_data(self.x_data, self.y_data)
-        # Rescale and redraw.
+        canvas = self.ax.figure.canvas
+        (xmin, xmax), (ymin, ymax) = sorted(self.ax.get_xlim()), sorted(self.ax.get_ylim())
+        inside = (self.npoints > len(new) and
+                  new[:,0].min() >= xmin and new[:,0].max() <= xmax and
+                  new[:,1].min() >= ymin and new[:,1].max() <= ymax)
+        if inside and self.background is not None and getattr(canvas, 'supports_blit', False):
+            canvas.restore_region(self.background)
+            self.ax.draw_artist(self.current_line)
+            canvas.blit(self.ax.figure.bbox)
+        else:
+            # Rescale and redraw.
+            self.ax.relim(visible_only=True)
+            self.ax.autoscale_view(tight=True)
+            canvas.draw_idle()
+
+    def _on_draw(self, event):
+        '''After a full redraw, save the background for blitting and draw
+        the line, which is animated and so left out of the full draw.'''
+        canvas = self.ax.figure.canvas
+        if not getattr(canvas, 'supports_blit', False):
+            return
+        self.background = canvas.copy_from_bbox(self.ax.figure.bbox)
+        if len(self.lines) > 0 and self.current_line.get_animated():
+            self.ax.draw_artist(self.current_line)
+
+    def stop(self, doc):
+        self.render()
+        ## the finished line becomes part of the ordinary figure
+        self.current_line.set_animated(False)
         self.ax.relim(visible_only=True)
         self.ax.autoscale_view(tight=True)
         self.ax.figure.canvas.draw_idle()
-
-    def stop(self, doc):
         super().stop(doc)
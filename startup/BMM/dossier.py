@@ -0,0 +1,112 @@
+import os
+
+
+#########################################################################
+# The dossier is a static html page for each XAFS scan sequence, plus  #
+# an index page, 00INDEX.html, listing all the pages in the MANIFEST.  #
+# Over a multi-day experiment with hundreds of scan sequences, the     #
+# work at the end of each sequence should not grow with the size of    #
+# the experiment.  So:                                                 #
+#   * templates are read from disk only when they change               #
+#   * the next sequence number for a sample is remembered              #
+#   * a new entry is written into 00INDEX.html in place, rather than   #
+#     regenerating the page from the whole MANIFEST                    #
+#########################################################################
+
+_templates = dict()   # template file -> (mtime, text)
+_indexes   = dict()   # 00INDEX.html  -> what is needed to add to it in place
+_sequences = dict()   # (dossier folder, sample filename) -> last sequence number used
+
+SENTINEL = '\x00experimentlist\x00'
+
+
+def read_template(path):
+    '''Return the text of a template file, reading it from disk only if it
+    has changed since the last time.'''
+    mtime = os.path.getmtime(path)
+    cached = _templates.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path) as f:
+            cached = (mtime, f.read())
+        _templates[path] = cached
+    return cached[1]
+
+
+def next_sequence(dossier, filename):
+    '''Return the sequence number, basename, and html file name for the next
+    dossier page for a sample.  The first page for a sample is
+    <filename>-01.html with basename <filename>, later ones are
+    <filename>-NN.html with basename <filename>-NN.'''
+    htmlfilename = os.path.join(dossier, filename+'-01.html')
+    if not os.path.isfile(htmlfilename):
+        _sequences[(dossier, filename)] = 1
+        return 1, filename, htmlfilename
+    seqnumber = max(_sequences.get((dossier, filename), 1), 1) + 1
+    while os.path.isfile(os.path.join(dossier, "%s-%2.2d.html" % (filename,seqnumber))):
+        seqnumber += 1
+    _sequences[(dossier, filename)] = seqnumber
+    basename = "%s-%2.2d" % (filename,seqnumber)
+    return seqnumber, basename, os.path.join(dossier, basename+'.html')
+
+
+def index_entry(htmlfile):
+    '''The line of 00INDEX.html for one dossier page.'''
+    this = os.path.basename(htmlfile)
+    return '<li><a href="./%s">%s</a></li>\n' % (this, this)
+
+
+def _stamp(indexfile):
+    st = os.stat(indexfile)
+    return (st.st_size, st.st_mtime_ns)
+
+
+def rebuild_index(dossier, date):
+    '''Write 00INDEX.html from the whole MANIFEST, skipping pages which no
+    longer exist.  Returns the name of the index file.'''
+    with open(os.path.join(dossier, 'MANIFEST')) as f:
+        lines = [line.rstrip('\n') for line in f]
+    experimentlist = ''.join(index_entry(l) for l in lines if os.path.isfile(l))
+    template = read_template(os.path.join(dossier, 'manifest.tmpl'))
+    head, tail = template.format(date=date, experimentlist=SENTINEL).split(SENTINEL)
+    indexfile = os.path.join(dossier, '00INDEX.html')
+    with open(indexfile, 'wb') as o:
+        o.write((head + experimentlist).encode('utf-8'))
+        offset = o.tell()
+        o.write(tail.encode('utf-8'))
+    _indexes[indexfile] = {'offset'   : offset,
+                           'tail'     : tail.encode('utf-8'),
+                           'date'     : date,
+                           'template' : template,
+                           'stamp'    : _stamp(indexfile), }
+    return indexfile
+
+
+def add_to_index(dossier, date, htmlfile):
+    '''Add a dossier page to the MANIFEST and to 00INDEX.html.
+
+    The new entry is written over the end of the index page, followed
+    by the rest of the page, so the cost does not depend on the
+    length of the MANIFEST.  If the index page was written by someone
+    else, or the template or the date have changed, the whole page is
+    rebuilt instead.'''
+    with open(os.path.join(dossier, 'MANIFEST'), 'a') as manifest:
+        manifest.write(htmlfile + '\n')
+    indexfile = os.path.join(dossier, '00INDEX.html')
+    state = _indexes.get(indexfile)
+    try:
+        current = (state is not None and
+                   state['date'] == date and
+                   state['template'] is read_template(os.path.join(dossier, 'manifest.tmpl')) and
+                   _stamp(indexfile) == state['stamp'])
+    except OSError:
+        current = False
+    if not current:
+        return rebuild_index(dossier, date)
+    entry = index_entry(htmlfile).encode('utf-8')
+    with open(indexfile, 'r+b') as o:
+        o.seek(state['offset'])
+        o.write(entry + state['tail'])
+        o.truncate()
+    state['offset'] += len(entry)
+    state['stamp']   = _stamp(indexfile)
+    return indexfile
@@ -5,7 +5,7 @@ from bluesky.plan_stubs import null, abs_set, sleep, mv, mvr
 
 from BMM.logging       import BMM_log_info, BMM_msg_hook, report
 from BMM.periodictable import edge_energy, Z_number, element_symbol
-from BMM.functions     import boxedtext, countdown, approximate_pitch
+from BMM.functions     import boxedtext, countdown, approximate_pitch, Deferred
 from BMM.suspenders    import BMM_clear_to_start
 from BMM.functions     import error_msg, warning_msg, go_msg, url_msg, bold_msg, verbosebold_msg, list_msg, disconnected_msg, info_msg, whisper
 from BMM.wheel         import show_reference_wheel
@@ -20,7 +20,9 @@ user_ns = get_ipython().user_ns
 
 def show_edges():
     rois = user_ns['rois']
-    if user_ns['with_xspress3'] is True:
+    if user_ns['with_xspress3'] is True and isinstance(user_ns['xs'], Deferred):
+        text = show_reference_wheel() + '\n' + f'Xspress3 ROIs will be set for {user_ns["BMMuser"].element} when it is first used\n'
+    elif user_ns['with_xspress3'] is True:
         text = show_reference_wheel() + '\n' + user_ns['xs'].show_rois()
     else:
         text = show_reference_wheel() + '\n' + rois.show()
@@ -145,9 +147,9 @@ def change_edge(el, focus=False, edge='K', energy=None, slits=True, target=300.,
     BMMuser.edge        = edge
     BMMuser.element     = el
     BMMuser.edge_energy = energy
-    rkvs.set('BMM:pds:edge',        edge)
-    rkvs.set('BMM:pds:element',     el)
-    rkvs.set('BMM:pds:edge_energy', energy)
+    rkvs.update({'BMM:pds:edge'        : edge,
+                 'BMM:pds:element'     : el,
+                 'BMM:pds:edge_energy' : energy})
 
     
     if energy > 8000:
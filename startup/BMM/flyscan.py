@@ -0,0 +1,129 @@
+import os
+
+from bluesky.plan_stubs import mv, null
+from bluesky.preprocessors import subs_wrapper, finalize_wrapper
+
+from BMM.flyscan_functions import FlyCollector, fly_energy
+from BMM.functions      import countdown, error_msg, bold_msg, info_msg
+from BMM.logging        import BMM_log_info, report
+from BMM.metadata       import bmm_metadata, metadata_at_this_moment
+from BMM.resting_state  import resting_state_plan
+from BMM.suspenders     import BMM_clear_to_start
+from BMM.xafs           import scan_parameters, channelcut_energy
+from BMM.xafs_functions import conventional_grid
+from BMM.xdi            import sample_stage
+
+from IPython import get_ipython
+user_ns = get_ipython().user_ns
+
+
+def xafs_fly(inifile=None, sample_time=0.1, **kwargs):
+    '''Read an INI file for scan metadata, then perform an XAFS scan
+    sequence by flying the Bragg axis through the conventional grid.
+
+    This is a companion to xafs(), using the same INI file.  The grid
+    defined by bounds, steps, and times is used both to choose the
+    Bragg velocity and to rebin the readings.  The XDI file has the
+    same format as for a step scan.
+
+    Parameters
+    ----------
+    inifile : str or ScanParameters
+        the INI file describing the measurement
+    sample_time : float
+        integration time of each detector reading
+    '''
+    RE, BMMuser, dcm, dcm_bragg = user_ns['RE'], user_ns['BMMuser'], user_ns['dcm'], user_ns['dcm_bragg']
+    quadem1, postscan, _locked_dwell_time = user_ns['quadem1'], user_ns['postscan'], user_ns['_locked_dwell_time']
+
+    if BMMuser.macro_dryrun:
+        print(info_msg('\nBMMuser.macro_dryrun is True.  Sleeping for %.1f seconds rather than running a fly scan.\n' %
+                       BMMuser.macro_sleep))
+        countdown(BMMuser.macro_sleep)
+        return(yield from null())
+
+    params = scan_parameters(inifile, **kwargs)
+    if params is None:
+        return(yield from null())
+    p = params
+    if 'force' not in kwargs or kwargs['force'] is not True:
+        (ok, text) = BMM_clear_to_start()
+        if ok is False:
+            print(error_msg('\n'+text))
+            print(bold_msg('Quitting fly scan sequence....\n'))
+            return(yield from null())
+
+    (energy_grid, time_grid, approx_time, delta) = conventional_grid(p.bounds, p.steps, p.times, e0=p.e0, element=p.element, edge=p.edge, ththth=p.ththth)
+    if energy_grid is None:
+        print(error_msg('Cannot interpret scan grid parameters!  Bailing out....'))
+        return(yield from null())
+    ## in Si(333) mode the grid is already divided by 3, so it is
+    ## converted to angle with the Si(111) spacing, as in channelcut_energy
+    twod = dcm._twod
+
+    use_xs = user_ns['with_xspress3'] and any(x in p.mode for x in ('xs', 'fluo', 'flou'))
+    flyers = []
+    if any(x in p.mode for x in ('trans', 'ref', 'yield', 'test')):
+        detectors = [quadem1]
+    elif use_xs:
+        ## the Xspress3 free-runs, its frames are time-stamped and rebinned with the rest
+        detectors = [quadem1]
+        flyers    = [user_ns['xs']]
+    else:
+        detectors = [quadem1, user_ns['vor']]
+
+    def main_plan():
+        eave = channelcut_energy(p.e0, list(p.bounds), p.ththth)
+        report('entering pseudo-channel-cut mode at %.1f eV' % eave, 'bold')
+        dcm.mode = 'fixed'
+        yield from mv(dcm.energy, eave)
+        dcm.mode = 'channelcut'
+        yield from mv(_locked_dwell_time, sample_time)
+        if use_xs:
+            yield from mv(user_ns['xs'].spectra_per_point, 1)
+
+        md = bmm_metadata(measurement   = p.mode,
+                          experimenters = p.experimenters,
+                          edge          = p.edge,
+                          element       = p.element,
+                          edge_energy   = p.e0,
+                          direction     = 1,
+                          scantype      = 'fly',
+                          channelcut    = p.channelcut,
+                          mono          = 'Si(%s)' % dcm._crystal,
+                          i0_gas        = 'N2',
+                          it_gas        = 'N2',
+                          ir_gas        = 'N2',
+                          sample        = p.sample,
+                          prep          = p.prep,
+                          stoichiometry = None,
+                          mode          = p.mode,
+                          comment       = p.comment,
+                          ththth        = p.ththth,
+        )
+        report(f'Beginning fly scan measurement of "{p.filename}", {p.element} {p.edge} edge, {p.nscans} scans', level='bold', slack=True)
+        for i in range(p.start, p.start+p.nscans):
+            fname = "%s.%3.3d" % (p.filename, i)
+            datafile = os.path.join(p.folder, fname)
+            if os.path.isfile(datafile):
+                report('%s already exists! Bailing out....' % (datafile), 'error')
+                return
+            md['_filename'] = fname
+            md['_kind'] = '333' if p.ththth else 'xafs'
+            rightnow = metadata_at_this_moment()
+            for family in rightnow.keys():
+                if type(rightnow[family]) is dict:
+                    md.setdefault(family, dict()).update(rightnow[family])
+            collector = FlyCollector(datafile, energy_grid, twod, bragg=dcm_bragg.name, sample_time=sample_time, stage=sample_stage())
+            uid = yield from subs_wrapper(fly_energy(detectors, dcm_bragg, energy_grid, time_grid, twod,
+                                                     sample_time=sample_time, flyers=flyers, md={'XDI': md}),
+                                          collector)
+            BMM_log_info(f'fly scan finished, uid = {uid}, scan_id = {RE.md["scan_id"]}\ndata file written to {datafile}')
+            postscan.enqueue(uid=uid, datafile=datafile, mode=p.mode, context=collector.context)
+
+    def cleanup_plan():
+        dcm.mode = 'fixed'
+        postscan.join()
+        yield from resting_state_plan()
+
+    yield from finalize_wrapper(main_plan(), cleanup_plan())
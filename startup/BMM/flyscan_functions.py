@@ -0,0 +1,294 @@
+import numpy, datetime
+
+from bluesky import plan_stubs as bps
+from bluesky.plan_stubs import mv
+from bluesky.preprocessors import run_decorator, stage_decorator, finalize_wrapper
+from bluesky.callbacks import CallbackBase
+
+from BMM.functions import HBARC, error_msg, warning_msg, bold_msg
+from BMM.xdi       import xdi_header, xdi_underscore, xdi_layout, xdi_context
+
+
+##############################################################################
+# On-the-fly XAFS: rather than stepping dcm.energy point by point, the
+# Bragg axis is slewed at a velocity chosen so that each point of the
+# conventional grid gets about its requested dwell time.  The
+# detectors are read as fast as they will go along the way, each
+# reading is assigned the energy at the middle of its integration
+# window from the Bragg readbacks on either side, and the readings are
+# rebinned onto the conventional grid at the end.  The XDI file has
+# the same columns as for a step scan.
+#
+# Only the Bragg axis moves, so the DCM must be in pseudo-channel-cut
+# mode for the duration, as it is for a step scan sequence.
+##############################################################################
+
+def energy2bragg(energy, twod):
+    '''Convert energy (eV) to Bragg angle (degrees), works on arrays.'''
+    return numpy.degrees(numpy.arcsin(2*numpy.pi*HBARC / (numpy.asarray(energy, dtype=float)*twod)))
+
+def bragg2energy(angle, twod):
+    '''Convert Bragg angle (degrees) to energy (eV), works on arrays.'''
+    return 2*numpy.pi*HBARC / (twod*numpy.sin(numpy.radians(numpy.asarray(angle, dtype=float))))
+
+
+def bragg_trajectory(energy_grid, time_grid, twod, tolerance=0.25):
+    '''Compute a piecewise-constant Bragg velocity profile for a fly scan.
+
+    Between adjacent points of the grid, the Bragg axis would ideally
+    move at the speed which spends the requested dwell time on each
+    point.  That speed changes continuously in the k-space part of a
+    conventional grid, but the motor can only be given one velocity
+    per move.  So adjacent intervals are gathered into segments over
+    which the ideal speed varies by less than a factor of
+    (1+tolerance), and each segment is flown at its average speed.
+    A point repeated in the grid, as conventional_grid can make at a
+    region boundary in Si(333) mode, is flown once.
+
+    Parameters
+    ----------
+    energy_grid : array
+        energies of the conventional grid, increasing
+    time_grid : array
+        dwell time at each point of the grid
+    twod : float
+        2d spacing of the mono crystal
+    tolerance : float
+        allowed spread of ideal speeds within a segment
+
+    Returns a list of (target angle, velocity in deg/sec, duration in sec),
+    one per segment, in order.
+    '''
+    energy_grid, keep = numpy.unique(energy_grid, return_index=True)
+    angles = energy2bragg(energy_grid, twod)
+    times  = numpy.asarray(time_grid, dtype=float)[keep]
+    ## the dwell time for the interval between points i and i+1 is
+    ## shared between the two points
+    dt     = (times[:-1] + times[1:]) / 2
+    ideal  = numpy.abs(numpy.diff(angles)) / dt
+    segments = []
+    first, lo, hi = 0, ideal[0], ideal[0]
+    for i in range(1, len(ideal)+1):
+        if i < len(ideal):
+            lo, hi = min(lo, ideal[i]), max(hi, ideal[i])
+            if hi <= lo * (1+tolerance):
+                continue
+        duration = dt[first:i].sum()
+        segments.append((angles[i], abs(angles[i]-angles[first]) / duration, duration))
+        if i < len(ideal):
+            first, lo, hi = i, ideal[i], ideal[i]
+    return segments
+
+
+def rebin(energy, columns, grid):
+    '''Average fly scan readings onto an energy grid.
+
+    Each grid point gets a bin extending halfway to its neighbors.
+    Readings outside the first and last bins are discarded.  A bin
+    that received no readings is interpolated from its neighbors.
+
+    Parameters
+    ----------
+    energy : array
+        energy assigned to each reading
+    columns : dict
+        data key -> array of readings
+    grid : array
+        energies of the conventional grid, increasing
+
+    Returns a dict of binned columns and the number of readings in each bin.
+    '''
+    grid   = numpy.asarray(grid, dtype=float)
+    energy = numpy.asarray(energy, dtype=float)
+    edges  = numpy.empty(len(grid)+1)
+    edges[1:-1] = (grid[:-1] + grid[1:]) / 2
+    edges[0]    = grid[0]  - (grid[1]  - grid[0])  / 2
+    edges[-1]   = grid[-1] + (grid[-1] - grid[-2]) / 2
+    which  = numpy.digitize(energy, edges) - 1
+    inside = (which >= 0) & (which < len(grid))
+    which  = which[inside]
+    counts = numpy.bincount(which, minlength=len(grid))
+    filled = counts > 0
+    binned = dict()
+    for k, v in columns.items():
+        sums = numpy.bincount(which, weights=numpy.asarray(v, dtype=float)[inside], minlength=len(grid))
+        mean = numpy.zeros(len(grid))
+        mean[filled] = sums[filled] / counts[filled]
+        if filled.any() and not filled.all():
+            mean[~filled] = numpy.interp(grid[~filled], grid[filled], mean[filled])
+        binned[k] = mean
+    return binned, counts
+
+
+class FlyCollector(CallbackBase):
+    '''A bluesky callback which gathers the readings of a fly scan, then
+    rebins them onto the conventional grid and writes an XDI file when
+    the run stops.
+
+    Attributes
+    ----------
+    datafile : str or None
+        XDI file to write, None to only gather the readings
+    grid : array
+        energies of the conventional grid
+    twod : float
+        2d spacing of the mono crystal
+    bragg : str
+        data key of the Bragg readback
+    sample_time : float
+        integration time of each reading, used for the dwell time column
+    '''
+    def __init__(self, datafile, grid, twod, bragg='dcm_bragg', sample_time=0.1, stage=None):
+        super().__init__()
+        self.datafile    = datafile
+        self.grid        = numpy.asarray(grid, dtype=float)
+        self.twod        = twod
+        self.bragg       = bragg
+        self.sample_time = sample_time
+        self.context     = None if datafile is None else xdi_context(stage)
+        self.stage       = None if datafile is None else self.context.stage
+        self.startdoc    = None
+        self.baseline    = dict()
+        self.streams     = dict()
+        self.rows        = []
+        self.times       = []
+        self.flown       = []
+        self.counts      = None
+
+    def start(self, doc):
+        self.startdoc = doc
+        self.rows     = []
+        self.times    = []
+        self.flown    = []
+
+    def descriptor(self, doc):
+        self.streams[doc['uid']] = doc['name']
+
+    def event(self, doc):
+        stream = self.streams.get(doc['descriptor'])
+        if stream == 'baseline':
+            if len(self.baseline) == 0:
+                self.baseline = dict(doc['data'])
+        elif stream == 'primary':
+            self.rows.append(doc['data'])
+            self.times.append(doc['time'])
+        elif stream is not None:
+            ## the time stamps of flyer readings are the times of the frames,
+            ## the event time may be the time of collection
+            self.flown.append((min(doc['timestamps'].values()), doc['data']))
+
+    def table(self):
+        '''Return the rebinned data as a dict of columns named as for a step scan.'''
+        angles = numpy.array([r[self.bragg] for r in self.rows], dtype=float)
+        ## each reading integrates while the mono moves from the
+        ## previous readback to this one, so use the middle
+        middle = angles.copy()
+        middle[1:] = (angles[:-1] + angles[1:]) / 2
+        energy = bragg2energy(middle, self.twod)
+        keys = [k for k,v in self.rows[0].items() if k != self.bragg and numpy.ndim(v) == 0]
+        columns = {k: [r[k] for r in self.rows] for k in keys}
+        columns['dcm_energy'] = energy
+        binned, self.counts = rebin(energy, columns, self.grid)
+        if len(self.flown) > 0:
+            ## readings from flyers are placed in energy by their time stamps
+            stamps = numpy.array([t for t,d in self.flown])
+            energy = bragg2energy(numpy.interp(stamps, self.times, angles), self.twod)
+            columns = {k: [d[k] for t,d in self.flown] for k in self.flown[0][1]}
+            flown, counts = rebin(energy, columns, self.grid)
+            binned.update(flown)
+        binned['dcm_energy_setpoint'] = self.grid.copy()
+        binned['dwti_dwell_time']     = self.counts * self.sample_time
+        return binned
+
+    def stop(self, doc):
+        if self.datafile is None or len(self.rows) < 2:
+            return
+        try:
+            data = self.table()
+            mode, comment, kind = xdi_underscore(self.startdoc)
+            column_list, template, derived = xdi_layout(mode, kind, self.context)
+            for k, f in derived.items():
+                data[k] = f(data)
+            d = datetime.datetime.fromtimestamp(round(doc['time']))
+            with open(self.datafile, 'w') as handle:
+                for line in xdi_header(self.startdoc, self.baseline, datetime.datetime.isoformat(d), context=self.context):
+                    handle.write(line + '\n')
+                handle.write(''.join(map(template.__mod__, zip(*[data[c].tolist() for c in column_list]))))
+            print(bold_msg('wrote %s' % self.datafile))
+            empty = int((self.counts == 0).sum())
+            if empty > 0:
+                print(warning_msg(f'{empty} of {len(self.grid)} grid points received no readings and were interpolated'))
+        except Exception as e:
+            print(error_msg(f'could not write {self.datafile}: {e}'))
+
+
+def fly_energy(detectors, bragg, energy_grid, time_grid, twod, sample_time=0.1, runup=5, tolerance=0.25, flyers=(), md=None):
+    '''Measure one fly scan over a conventional energy grid.
+
+    The Bragg axis is moved to a little below the first grid point,
+    then flown through the grid along the velocity profile from
+    bragg_trajectory while the detectors are triggered and read
+    continuously together with the Bragg readback.  Rebinning is done
+    by a FlyCollector subscribed to the run.
+
+    Flyers, like the Xspress3 in flyable mode, free-run during the
+    motion.  They are sized for the length of the trajectory, kicked
+    off before the motion, and collected after it.  Their readings are
+    placed in energy by their time stamps.
+
+    Parameters
+    ----------
+    detectors : list
+        detectors to read, their integration time should already be
+        set to sample_time
+    bragg : EpicsMotor
+        the Bragg axis, it must have a velocity component
+    energy_grid, time_grid : arrays
+        the conventional grid, as from conventional_grid
+    twod : float
+        2d spacing of the mono crystal
+    sample_time : float
+        integration time of each detector reading
+    runup : float
+        distance in eV below the first point at which to start moving
+    tolerance : float
+        see bragg_trajectory
+    flyers : list
+        flyable detectors, each with a fly_size method (see
+        BMM.xspress3.Xspress3FlyerMixin)
+    md : dict
+        metadata for the start document
+    '''
+    segments = bragg_trajectory(energy_grid, time_grid, twod, tolerance)
+    start    = float(energy2bragg(energy_grid[0] - runup, twod))
+    velocity = bragg.velocity.get()
+    _md = {'plan_name'  : 'fly_energy',
+           'num_points' : len(energy_grid),
+           'segments'   : [[float(a), float(v), float(d)] for a,v,d in segments], }
+    _md.update(md or {})
+    for f in flyers:
+        f.fly_size(sum(d for a,v,d in segments), frame_time=sample_time)
+
+    @stage_decorator(list(detectors) + list(flyers))
+    @run_decorator(md=_md)
+    def fly():
+        yield from bps.trigger_and_read(list(detectors) + [bragg])
+        for f in flyers:
+            yield from bps.kickoff(f, wait=True)
+        for (target, speed, duration) in segments:
+            yield from mv(bragg.velocity, speed)
+            status = yield from bps.abs_set(bragg, target)
+            while not status.done:
+                yield from bps.trigger_and_read(list(detectors) + [bragg])
+        for f in flyers:
+            yield from bps.complete(f, wait=True)
+            yield from bps.collect(f)
+
+    def restore():
+        yield from mv(bragg.velocity, velocity)
+
+    def main():
+        yield from mv(bragg, start)
+        return (yield from fly())
+
+    return (yield from finalize_wrapper(main(), restore()))
@@ -1,4 +1,4 @@
-import os, time, datetime
+import os, time, datetime, threading
 from numpy import pi, sin, cos, arcsin, sqrt
 from IPython import get_ipython
 user_ns = get_ipython().user_ns
@@ -45,9 +45,15 @@ def colored(text, tint='white', attrs=[]):
         tint = tint.capitalize()
     return '{0}{1}{2}'.format(getattr(color, tint), text, color.Normal)
 
+## (label, start time) of each step of startup, as marked by run_report
+startup_steps = []
+
 def run_report(thisfile, text=None):
     '''
     Noisily proclaim to be importing a file of python code.
+
+    Each call also marks the start of a step of startup, so that
+    startup_report() can say how long each step took.
     '''
     add = '...'
     if text is not None:
@@ -55,8 +61,83 @@ def run_report(thisfile, text=None):
     importing = 'Importing'
     if thisfile[0] == '\t':
         importing = '\t'
+    label = thisfile.strip().split("/")[-1]
+    startup_steps.append(('  '+label if thisfile[0] == '\t' else label, time.time()))
     print(colored(f'{importing} {thisfile.split("/")[-1]} {add}', 'lightcyan'))
 
+def startup_report(slow=1.0, top=None):
+    '''
+    Print the time taken by each step of startup, i.e. the time from
+    one call to run_report to the next.  Steps taking longer than slow
+    seconds are highlighted.  Set top to an integer to show only the
+    slowest steps.
+    '''
+    if len(startup_steps) == 0:
+        return
+    end = time.time()
+    steps = [(label, (startup_steps[i+1][1] if i+1 < len(startup_steps) else end) - start)
+             for i, (label, start) in enumerate(startup_steps)]
+    if top is not None:
+        steps = sorted(steps, key=lambda x: x[1], reverse=True)[:top]
+    print(colored(f'Startup took {end - startup_steps[0][1]:.1f} seconds', 'lightcyan'))
+    for label, elapsed in steps:
+        line = f'\t{label:50} {elapsed:7.2f} s'
+        print(warning_msg(line) if elapsed > slow else colored(line, 'lightcyan'))
+
+
+class Deferred():
+    '''A stand-in for a device which is slow to make, e.g. an area
+    detector, whose constructor waits for its IOC to connect.
+
+    The device is made by calling factory() the first time any of its
+    attributes is used.  At that time, the stand-in is replaced by the
+    device in the IPython user namespace, so later lookups of name get
+    the device itself.  Until then, startup does not pay for it and
+    does not fail if its IOC is down.
+
+    Example
+    -------
+    >>> pilatus = Deferred('pilatus', lambda: MyDetector('XF:06BMB-ES{Det:PIL100k}:', name='Pilatus'))
+    >>> pilatus.cam.acquire_time.get()    # the detector is made here
+    '''
+    def __init__(self, name, factory):
+        object.__setattr__(self, '_name',    name)
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_device',  None)
+        object.__setattr__(self, '_lock',    threading.RLock())
+
+    def _make(self):
+        if self._device is None:
+            with self._lock:
+                if self._device is None:
+                    start = time.time()
+                    object.__setattr__(self, '_device', self._factory())
+                    if user_ns.get(self._name) is self:
+                        user_ns[self._name] = self._device
+                    print(whisper(f'  made {self._name} on first use ({time.time()-start:.1f} s)'))
+        return self._device
+
+    def __getattr__(self, attr):
+        return getattr(self._make(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._make(), attr, value)
+
+    def __dir__(self):
+        return dir(self._make())
+
+    def __repr__(self):
+        if self._device is None:
+            return f'<{self._name}, not made until first use>'
+        return repr(self._device)
+
+def made(thing):
+    '''Return the device behind a Deferred, making it if need be, or
+    thing itself if it is not a Deferred.'''
+    if isinstance(thing, Deferred):
+        return thing._make()
+    return thing
+
 
 def error_msg(text):
     '''Red text'''
@@ -164,9 +245,7 @@ def boxedtext(title, text, tint, width=75):
 
 def clear_dashboard():
     '''Clean up in a way that helps the cadashboard utility'''
-    user_ns['rkvs'].set('BMM:scan:type',      '')
-    user_ns['rkvs'].set('BMM:scan:starttime', '')
-    user_ns['rkvs'].set('BMM:scan:estimated', '')
+    user_ns['rkvs'].scan_finished()
     
 
 def countdown(t):
@@ -208,3 +287,20 @@ def present_options(suffix='xlsx'):
     except:
         return None
 
+
+
+## BMM/simulated.py builds a whole simulated beamline, with its own
+## RunEngine, databroker, and cameras, so it is only imported when a
+## benchmark is first asked for rather than at startup
+def bmm_benchmark(names=None, repeat=1, speedup=10.0, save=True):
+    '''Run the plan benchmarks against a simulated BMM.  See
+    BMM.simulated.bmm_benchmark.'''
+    from BMM.simulated import bmm_benchmark
+    return bmm_benchmark(names=names, repeat=repeat, speedup=speedup, save=save)
+
+
+def benchmark_history(name):
+    '''Print the wall clock time of every saved run of a benchmark.  See
+    BMM.simulated.benchmark_history.'''
+    from BMM.simulated import benchmark_history
+    return benchmark_history(name)
@@ -11,18 +11,23 @@
 # Slack.                                                                            #
 #####################################################################################
 
-import os, subprocess, shutil
+import os, subprocess, shutil, threading, time, fnmatch, traceback
+
+from BMM.functions import error_msg, warning_msg, bold_msg, whisper
 
 from IPython import get_ipython
 user_ns = get_ipython().user_ns
 
 gdrive_folder = os.path.join(os.environ['HOME'], 'gdrive')
-
+DRIVE = ['/home/xf06bm/go/bin/drive', 'push', '-quiet', '.']
 
 
         
 def copy_to_gdrive(fname):
     BMMuser = user_ns['BMMuser']
+    if 'gsync' in user_ns and user_ns['gsync'].enabled:
+        user_ns['gsync'].add(os.path.join(BMMuser.folder, fname))
+        return()
     user_gdrive_folder = os.path.join(gdrive_folder, 'Data', BMMuser.name, BMMuser.date)
     print(f'copying {fname} to {user_gdrive_folder}')
     shutil.copyfile(os.path.join(BMMuser.folder, fname), os.path.join(user_gdrive_folder, fname))
@@ -30,12 +35,12 @@ def copy_to_gdrive(fname):
 
 def synch_gdrive_folder(prefix=''):
     BMMuser = user_ns['BMMuser']
+    if 'gsync' in user_ns and user_ns['gsync'].enabled:
+        user_ns['gsync'].push()
+        return()
     print(f'{prefix}updating {gdrive_folder}')
     user_gdrive_folder = os.path.join(gdrive_folder, 'Data', BMMuser.name, BMMuser.date)
-    here = os.getcwd()
-    os.chdir(user_gdrive_folder)
-    subprocess.run(['/home/xf06bm/go/bin/drive', 'push', '-quiet', '.']) 
-    os.chdir(here)
+    subprocess.run(DRIVE, cwd=user_gdrive_folder)
     return()
 
 def make_gdrive_folder(prefix='', update=True):
@@ -47,3 +52,284 @@ def make_gdrive_folder(prefix='', update=True):
     if update is True:
         synch_gdrive_folder(prefix)
     return(user_folder)
+
+
+class GdriveSync():
+    '''Keep the Google drive folder for the current experiment in step
+    with the data folder, from a background thread.
+
+    Every self.interval seconds, the thread looks at the data folder
+    (the top level and the subfolders in self.watch) for files which
+    are missing from the Google drive folder or newer than the copy
+    there.  Files can also be handed to add() explicitly, which is
+    how files with a different name on Google drive get there.
+
+    Changes are debounced.  Nothing is copied or pushed until the data
+    folder has been quiet for self.quiet seconds, or until the oldest
+    change has been waiting self.max_wait seconds.  Then the waiting
+    files are copied and the push command is run once.  A push which
+    fails is retried, waiting self.delay seconds, doubling each time
+    up to 10 minutes, and the files stay in the backlog until a push
+    succeeds.
+
+    Plans never wait on any of this.  add() and push() return right
+    away.
+
+    Attributes
+    ----------
+    enabled : bool
+        False to copy files synchronously on add() and push with the
+        drive tool, as before
+    command : list or None
+        the push command, run in the Google drive folder, None to only
+        copy files
+    folder : str or None
+        the data folder, None means BMMuser.folder
+    remote : str or None
+        the Google drive folder, None means ~/gdrive/Data/<name>/<date>
+    watch : tuple
+        subfolders of the data folder to watch, '' is the top level
+    ignore : tuple
+        glob patterns of file names never to copy
+    interval : float
+        seconds between looks at the data folder
+    quiet, max_wait : float
+        debounce times in seconds, see above
+    delay : float
+        seconds to wait before the first retry of a failed push
+    timeout : float
+        seconds to wait for the push command
+
+    Example
+    -------
+    >>> gsync.add('/path/to/dossier/Fe-foil-01.html')
+    >>> gsync.push()         # push soon, without waiting for things to go quiet
+    >>> gsync.status()       # report on the backlog
+    >>> gsync.wait()         # block until the backlog is empty
+    '''
+    def __init__(self, command=DRIVE, folder=None, remote=None):
+        self.enabled   = True
+        self.command   = command
+        self.folder    = folder
+        self.remote    = remote
+        self.watch     = ('', 'dossier', 'prj', 'snapshots', 'XRF')
+        self.ignore    = ('.*', '*~', '#*', '*.tmp', '*.tmpl', 'MANIFEST')
+        self.interval  = 5
+        self.quiet     = 15
+        self.max_wait  = 120
+        self.delay     = 10
+        self.timeout   = 300
+        self.pending   = dict()    # source -> target
+        self.pushes    = 0
+        self.copied    = 0
+        self.failures  = 0
+        self.last_push = None
+        self.error     = None
+        self.__seen    = dict()    # source -> (mtime, size) when last looked at
+        self.__first   = None      # time of the oldest change in the backlog
+        self.__last    = None      # time of the latest change
+        self.__retry   = 0         # no push before this time
+        self.__forced  = False
+        self.__lock    = threading.Lock()
+        self.__wake    = threading.Event()
+        self.__idle    = threading.Event()
+        self.__idle.set()
+        self.__thread  = None
+
+    def start(self):
+        '''Start the background thread, if it is not already running.'''
+        with self.__lock:
+            if self.__thread is not None and self.__thread.is_alive():
+                return
+            self.__thread = threading.Thread(target=self._worker, name='BMM gdrive sync', daemon=True)
+            self.__thread.start()
+
+    def _folders(self):
+        BMMuser = user_ns.get('BMMuser')
+        folder, remote = self.folder, self.remote
+        if folder is None:
+            folder = getattr(BMMuser, 'folder', None)
+        if remote is None and getattr(BMMuser, 'name', None) is not None and getattr(BMMuser, 'date', None) is not None:
+            remote = os.path.join(os.environ['HOME'], 'gdrive', 'Data', BMMuser.name, BMMuser.date)
+        if folder is None or remote is None or not os.path.isdir(folder):
+            return None, None
+        return folder, remote
+
+    def _ignored(self, name):
+        return any(fnmatch.fnmatch(name, pattern) for pattern in self.ignore)
+
+    def _queue(self, source, target):
+        now = time.time()
+        with self.__lock:
+            self.pending[source] = target
+            if self.__first is None:
+                self.__first = now
+            self.__last = now
+            self.__idle.clear()
+
+    ## ---- called from plans and the command line ------------------------
+
+    def add(self, source, target=None):
+        '''Copy source to Google drive soon.  The default target is the
+        same place relative to the Google drive folder as source is to
+        the data folder.'''
+        if source is None:
+            return
+        if target is None:
+            folder, remote = self._folders()
+            if folder is None:
+                print(warning_msg(f'no Google drive folder for {source}'))
+                return
+            target = os.path.join(remote, os.path.relpath(source, folder))
+        if self.enabled is False:
+            try:
+                self._copy(source, target)
+            except Exception as E:
+                print(error_msg(f'could not copy {source} to Google drive: {E}'))
+            return
+        self._queue(source, target)
+        self.start()
+
+    def push(self):
+        '''Copy the backlog and push at the next opportunity, without
+        waiting for the data folder to go quiet.'''
+        if self.enabled is False:
+            folder, remote = self._folders()
+            if remote is not None and self.command is not None:
+                subprocess.run(self.command, cwd=remote, timeout=self.timeout)
+            return
+        with self.__lock:
+            self.__forced = True
+            self.__retry  = 0
+        self.__idle.clear()
+        self.start()
+        self.__wake.set()
+
+    def backlog(self):
+        '''Number of files waiting to be copied and pushed.'''
+        return len(self.pending)
+
+    def wait(self, timeout=None):
+        '''Push now and block until the backlog is empty.  Returns False
+        if the timeout (in seconds) was reached first.'''
+        self.push()
+        return self.__idle.wait(timeout)
+
+    def status(self):
+        '''Print a short summary of the state of the sync service.'''
+        folder, remote = self._folders()
+        print(bold_msg('Google drive sync:'))
+        print(f'\tthread running : {self.__thread is not None and self.__thread.is_alive()}')
+        print(f'\tdata folder    : {folder}')
+        print(f'\tGoogle drive   : {remote}')
+        print(f'\tbacklog        : {self.backlog()} files')
+        print(f'\tcopied         : {self.copied} files in {self.pushes} pushes')
+        if self.last_push is not None:
+            print(f'\tlast push      : {time.strftime("%H:%M:%S", time.localtime(self.last_push))}')
+        if self.failures > 0:
+            print(error_msg(f'\tfailed pushes  : {self.failures} in a row, last error: {self.error}'))
+
+    ## ---- the background thread ------------------------------------------
+
+    def _worker(self):
+        while True:
+            self.__wake.wait(self.interval)
+            self.__wake.clear()
+            if self.enabled is False:
+                continue
+            try:
+                self._look()
+                if self._due():
+                    self._sync()
+            except Exception as E:  # never let the thread die
+                self.error = E
+                print(error_msg(f'Google drive sync: {E}'))
+            with self.__lock:
+                if len(self.pending) == 0:
+                    self.__forced = False
+                    self.__idle.set()
+
+    def _look(self):
+        '''Queue every watched file that is missing from Google drive or
+        newer than the copy there.'''
+        folder, remote = self._folders()
+        if folder is None:
+            return
+        for sub in self.watch:
+            here = os.path.join(folder, sub)
+            if not os.path.isdir(here):
+                continue
+            with os.scandir(here) as entries:
+                for entry in entries:
+                    if not entry.is_file() or self._ignored(entry.name):
+                        continue
+                    st = entry.stat()
+                    if self.__seen.get(entry.path) == (st.st_mtime, st.st_size):
+                        continue
+                    self.__seen[entry.path] = (st.st_mtime, st.st_size)
+                    target = os.path.join(remote, sub, entry.name)
+                    try:
+                        there = os.stat(target)
+                        if there.st_size == st.st_size and there.st_mtime >= st.st_mtime:
+                            continue
+                    except FileNotFoundError:
+                        pass
+                    self._queue(entry.path, target)
+
+    def _due(self):
+        now = time.time()
+        if len(self.pending) == 0 or now < self.__retry:
+            return False
+        return (self.__forced or now - self.__last > self.quiet or now - self.__first > self.max_wait)
+
+    def _copy(self, source, target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copy2(source, target)
+
+    def _sync(self):
+        with self.__lock:
+            batch = dict(self.pending)
+        copied, done, failed = 0, [], []
+        for source, target in batch.items():
+            try:
+                self._copy(source, target)
+                copied += 1
+                done.append(source)
+            except FileNotFoundError:
+                print(warning_msg(f'Google drive sync: {source} has gone away, skipping it'))
+                done.append(source)
+            except Exception as E:
+                print(error_msg(f'Google drive sync: could not copy {source}: {E}'))
+                failed.append(source)
+        folder, remote = self._folders()
+        if self.command is not None and remote is not None:
+            try:
+                proc = subprocess.run(self.command, cwd=remote, capture_output=True, timeout=self.timeout)
+                if proc.returncode != 0:
+                    raise RuntimeError(f'{" ".join(self.command[:2])} returned {proc.returncode}: {proc.stderr.decode(errors="replace").strip()[:200]}')
+            except Exception as E:
+                self.failures += 1
+                self.error = E
+                wait = min(self.delay * 2**(self.failures-1), 600)
+                self.__retry = time.time() + wait
+                print(warning_msg(f'Google drive push failed ({E}), {self.backlog()} files waiting, retrying in {wait:.0f} s'))
+                return
+        ## files which could not be copied stay in the backlog for the
+        ## next sync and are forgotten by _look so they are noticed again
+        with self.__lock:
+            for source in done:
+                if self.pending.get(source) == batch[source]:
+                    del self.pending[source]
+            for source in failed:
+                self.__seen.pop(source, None)
+            if len(self.pending) == 0:
+                self.__first, self.__last = None, None
+            elif len(failed) > 0:
+                self.__retry = time.time() + self.delay
+        if self.failures > 0:
+            print(whisper(f'  Google drive push succeeded after {self.failures} failures'))
+        self.failures  = 0
+        self.error     = None
+        self.pushes   += 1
+        self.copied   += copied
+        self.last_push = time.time()
@@ -0,0 +1,170 @@
+import time, threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from BMM.functions import error_msg, bold_msg
+
+
+class CheckResult():
+    '''The outcome of a single health check.
+
+    Attributes
+    ----------
+    name : str
+        name of the check
+    ok : bool
+        True if the check passed
+    text : str
+        explanation of a failed check, empty if it passed
+    elapsed : float
+        time (seconds) the check took
+    '''
+    def __init__(self, name, ok, text, elapsed):
+        self.name    = name
+        self.ok      = ok
+        self.text    = text
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return f'<CheckResult {self.name}: {"ok" if self.ok else "FAILED"} ({1000*self.elapsed:.1f} ms)>'
+
+
+class HealthReport():
+    '''A structured report on a group of health checks.
+
+    Attributes
+    ----------
+    group : str
+        name of the group of checks
+    results : tuple of CheckResult
+        one entry per check, in the order the checks were given
+    ok : bool
+        True if every check passed
+    time : float
+        epoch time at which the checks were started
+    elapsed : float
+        wall clock time (seconds) for the whole group
+    cached : bool
+        True if this report was reused from a recent run
+    '''
+    def __init__(self, group, results, start, elapsed, cached=False):
+        self.group   = group
+        self.results = tuple(results)
+        self.ok      = all(r.ok for r in self.results)
+        self.time    = start
+        self.elapsed = elapsed
+        self.cached  = cached
+
+    def __repr__(self):
+        return f'<HealthReport {self.group}: {"ok" if self.ok else "FAILED"}, {len(self.results)} checks in {1000*self.elapsed:.1f} ms>'
+
+    def failed(self):
+        '''Return the CheckResults of the checks that did not pass.'''
+        return [r for r in self.results if not r.ok]
+
+    def text(self):
+        '''Return the explanations of all the failed checks, one per line.'''
+        return ''.join(r.text if r.text.endswith('\n') else r.text+'\n' for r in self.failed())
+
+    def show(self):
+        '''Print a table of the checks, their outcomes, and their timings.'''
+        print(bold_msg(f'{self.group}: {"ok" if self.ok else "FAILED"} in {1000*self.elapsed:.1f} ms' +
+                       (' (cached)' if self.cached else '')))
+        for r in self.results:
+            if r.ok:
+                print(f'\t{r.name:24} ok      {1000*r.elapsed:8.1f} ms')
+            else:
+                print(error_msg(f'\t{r.name:24} FAILED  {1000*r.elapsed:8.1f} ms  {r.text.strip()}'))
+
+
+class HealthCheck():
+    '''Run a group of independent checks concurrently.
+
+    A check is a function of no arguments which returns a tuple of
+    (ok, text), where ok is a boolean and text explains a failure.  A
+    check which raises an exception, or which does not finish within
+    self.timeout seconds, is reported as failed.
+
+    A report in which every check passed is kept for self.ttl seconds.
+    Running the same group again within that time returns the cached
+    report, so back-to-back plans do not repeat the same checks.  A
+    failed report is never cached, so that a problem which has just
+    been fixed is noticed right away.
+
+    Attributes
+    ----------
+    ttl : float
+        lifetime (seconds) of a passing report, 0 to disable the cache
+    timeout : float
+        time (seconds) allowed for a group of checks
+    workers : int
+        number of threads used to run checks
+    verbose : bool
+        print the timing table every time a group is run
+
+    Example
+    -------
+    >>> report = health.run('clear to start', {'ring': check_ring, 'shb': check_shb})
+    >>> report.ok, report.text()
+    >>> report.show()
+    '''
+    def __init__(self):
+        self.ttl     = 5.0
+        self.timeout = 5.0
+        self.workers = 24
+        self.verbose = False
+        self.last    = dict()   # group -> most recent report
+        self.__cache = dict()   # group -> (report, names of checks)
+        self.__lock  = threading.Lock()
+        self.__pool  = None
+
+    def _pool(self):
+        if self.__pool is None or self.__pool._max_workers != self.workers:
+            self.__pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='BMM health')
+        return self.__pool
+
+    @staticmethod
+    def _timed(name, func):
+        start = time.time()
+        try:
+            ok, text = func()
+        except Exception as e:
+            ok, text = False, f'{name} could not be checked: {e}'
+        return CheckResult(name, bool(ok), text or '', time.time() - start)
+
+    def run(self, group, checks, fresh=False):
+        '''Run the checks in the dict checks (name -> function) and return
+        a HealthReport.  Set fresh to True to ignore the cache.'''
+        names = tuple(checks.keys())
+        now = time.time()
+        with self.__lock:
+            hit = self.__cache.get(group)
+        if not fresh and self.ttl > 0 and hit is not None and hit[1] == names and now - hit[0].time < self.ttl:
+            report = HealthReport(group, hit[0].results, hit[0].time, hit[0].elapsed, cached=True)
+            self.last[group] = report
+            return report
+
+        futures = {name: self._pool().submit(self._timed, name, func) for name, func in checks.items()}
+        done, pending = wait(futures.values(), timeout=self.timeout)
+        results = []
+        for name, f in futures.items():
+            if f in done:
+                results.append(f.result())
+            else:
+                f.cancel()
+                results.append(CheckResult(name, False, f'{name} did not respond within {self.timeout:.1f} seconds', self.timeout))
+        report = HealthReport(group, results, now, time.time() - now)
+
+        with self.__lock:
+            if report.ok:
+                self.__cache[group] = (report, names)
+            else:
+                self.__cache.pop(group, None)
+        self.last[group] = report
+        if self.verbose:
+            report.show()
+        return report
+
+    def clear(self):
+        '''Forget all cached reports.'''
+        with self.__lock:
+            self.__cache.clear()
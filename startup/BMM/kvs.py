@@ -0,0 +1,197 @@
+import time, threading, datetime
+import redis
+
+from BMM.functions import error_msg, warning_msg, bold_msg, whisper
+
+
+## the keys this profile keeps in redis and the type of each value
+##   BMM:scan:*  -- the scan in progress, read by cadashboard
+##   BMM:pds:*   -- the element and edge the photon delivery system is configured for
+SCHEMA = {'BMM:scan:type'       : str,
+          'BMM:scan:starttime'  : str,
+          'BMM:scan:estimated'  : float,
+          'BMM:pds:element'     : str,
+          'BMM:pds:edge'        : str,
+          'BMM:pds:edge_energy' : float,
+}
+
+
+class BMMRedis():
+    '''The beamline state kept in redis, made at startup as rkvs.
+
+    Every key must be declared in the schema, which also says how its
+    value is typed.  Several keys changed together, as at the start
+    and end of a scan, are sent in one pipelined round trip.
+
+    The connection pool uses short timeouts so that a slow or missing
+    redis server costs a plan at most a fraction of a second.  When
+    the server cannot be reached, values are kept locally and reads
+    come from the local copy.  The server is not tried again for
+    self.retry seconds, then everything written in the meantime is
+    sent along with the next write.
+
+    get() and set() behave like those of a redis client, so values
+    come back from get() as bytes.  value() and values() return them
+    as the type declared in the schema.
+
+    Attributes
+    ----------
+    client : redis.Redis
+        the client, any object with get, mget, ping, and pipeline methods
+        will do (e.g. fakeredis.FakeRedis)
+    timeout : float
+        socket and connection timeout in seconds
+    retry : float
+        seconds to wait before trying an unreachable server again
+    cache : dict
+        most recent value of each key, as bytes
+    dirty : set
+        keys written while the server was unreachable
+
+    Example
+    -------
+    >>> rkvs.scan_started('xafs', estimated=1800)
+    >>> rkvs.update({'BMM:pds:element': 'Fe', 'BMM:pds:edge': 'K'})
+    >>> rkvs.values('BMM:pds:element', 'BMM:pds:edge')
+    {'BMM:pds:element': 'Fe', 'BMM:pds:edge': 'K'}
+    >>> rkvs.scan_finished()
+    '''
+    def __init__(self, host='xf06bm-ioc2', port=6379, db=0, client=None, timeout=0.5, retry=30):
+        self.host       = host
+        self.timeout    = timeout
+        self.retry      = retry
+        self.schema     = dict(SCHEMA)
+        self.cache      = dict()
+        self.dirty      = set()
+        self.down_since = None
+        self.__lock     = threading.Lock()
+        if client is None:
+            pool = redis.ConnectionPool(host=host, port=port, db=db, max_connections=8,
+                                        socket_timeout=timeout, socket_connect_timeout=timeout,
+                                        health_check_interval=30)
+            client = redis.Redis(connection_pool=pool)
+        self.client = client
+
+    def __repr__(self):
+        return f'<BMMRedis {self.host} ({"unreachable" if self.down_since else "available"})>'
+
+    def _encode(self, key, value):
+        if key not in self.schema:
+            raise KeyError(f'{key} is not a declared BMM redis key')
+        if isinstance(value, bytes):
+            return value
+        if value is None or value == '':
+            return b''
+        return str(self.schema[key](value)).encode('utf-8')
+
+    def _available(self):
+        return self.down_since is None or time.time() - self.down_since > self.retry
+
+    def _failed(self, E):
+        if self.down_since is None:
+            print(warning_msg(f'redis server {self.host} is unreachable ({E}), keeping beamline state locally'))
+        self.down_since = time.time()
+
+    def _recovered(self):
+        if self.down_since is not None:
+            print(whisper(f'  redis server {self.host} is reachable again'))
+        self.down_since = None
+
+    ## ---- writing ------------------------------------------------------
+
+    def update(self, mapping):
+        '''Set several keys in one round trip.  Returns True if the
+        server has them, False if they are only held locally.'''
+        values = {k: self._encode(k, v) for k, v in mapping.items()}
+        with self.__lock:
+            self.cache.update(values)
+            self.dirty.update(values)
+            if not self._available():
+                return False
+            try:
+                pipe = self.client.pipeline(transaction=False)
+                for k in self.dirty:
+                    pipe.set(k, self.cache[k])
+                pipe.execute()
+            except redis.exceptions.RedisError as E:
+                self._failed(E)
+                return False
+            self.dirty.clear()
+            self._recovered()
+            return True
+
+    def set(self, key, value):
+        '''Set one key, see update().'''
+        return self.update({key: value})
+
+    def scan_started(self, kind, estimated=0):
+        '''Tell cadashboard that a scan of this kind has begun and will
+        take about estimated seconds.'''
+        return self.update({'BMM:scan:type'      : kind,
+                            'BMM:scan:starttime' : str(datetime.datetime.timestamp(datetime.datetime.now())),
+                            'BMM:scan:estimated' : estimated})
+
+    def scan_finished(self):
+        '''Tell cadashboard that no scan is running.'''
+        return self.update({'BMM:scan:type'      : '',
+                            'BMM:scan:starttime' : '',
+                            'BMM:scan:estimated' : 0})
+
+    ## ---- reading ------------------------------------------------------
+
+    def mget(self, *keys):
+        '''Get several keys in one round trip, as bytes, falling back to
+        the local copies if the server cannot be reached.'''
+        for k in keys:
+            if k not in self.schema:
+                raise KeyError(f'{k} is not a declared BMM redis key')
+        with self.__lock:
+            if self.dirty or not self._available():
+                return [self.cache.get(k) for k in keys]
+            try:
+                found = self.client.mget(keys)
+            except redis.exceptions.RedisError as E:
+                self._failed(E)
+                return [self.cache.get(k) for k in keys]
+            self._recovered()
+            for k, v in zip(keys, found):
+                if v is not None:
+                    self.cache[k] = v
+            return found
+
+    def get(self, key):
+        '''Get one key as bytes, see mget().'''
+        return self.mget(key)[0]
+
+    def values(self, *keys):
+        '''Return a dict of key -> value, typed as in the schema.  Keys
+        which are unset or empty are None.'''
+        typed = dict()
+        for k, v in zip(keys, self.mget(*keys)):
+            typed[k] = None if v is None or v == b'' else self.schema[k](v.decode('utf-8'))
+        return typed
+
+    def value(self, key):
+        '''Return the value of one key, typed as in the schema.'''
+        return self.values(key)[key]
+
+    def ping(self):
+        '''Return True if the server answers.'''
+        try:
+            self.client.ping()
+        except redis.exceptions.RedisError as E:
+            self._failed(E)
+            return False
+        self._recovered()
+        return True
+
+    def status(self):
+        '''Print a short summary of the state store.'''
+        print(bold_msg(f'Redis state store on {self.host}:'))
+        print(f'\treachable      : {self.ping()}')
+        print(f'\ttimeout        : {self.timeout} s')
+        if self.dirty:
+            print(error_msg(f'\tnot yet sent   : {", ".join(sorted(self.dirty))}'))
+        for k in self.schema:
+            if k in self.cache:
+                print(f'\t{k:22} : {self.cache[k].decode("utf-8")}')
@@ -16,19 +16,71 @@
 ##                           Ovid, Metamorphosis
 ##                           Book II:531-565
 
-import numpy
-from larch import (Group, Parameter, isParameter, param_value, isNamedClass, Interpreter) 
-from larch.xafs import (find_e0, pre_edge, autobk, xftf, xftr)
-import larch.utils.show as lus
+import numpy, os, multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
 
-from BMM.functions import etok, ktoe
+from BMM.functions import etok, ktoe, warning_msg
 
 from IPython import get_ipython
 user_ns = get_ipython().user_ns
 
-LARCH = Interpreter()
+## Larch takes several seconds to import and to make its Interpreter,
+## so neither is done until data are first processed.  BMM.larch_worker
+## imports Larch and holds the Interpreter for this process.
+def _larch():
+    import BMM.larch_worker
+    return BMM.larch_worker
+
+## processed data, keyed by (uid, mode, processing parameters), most recently used last
+LARCH_CACHE_SIZE = 200
+_larch_cache = OrderedDict()
+
+def _cache_get(key):
+    if key not in _larch_cache:
+        return None
+    _larch_cache.move_to_end(key)
+    return _larch_cache[key]
+
+def _readonly(value):
+    '''A copy of an exported state in which every array is read-only.'''
+    if isinstance(value, dict):
+        return {k: _readonly(v) for k, v in value.items()}
+    if isinstance(value, numpy.ndarray):
+        value = value.copy()
+        value.flags.writeable = False
+    return value
+
+def _cache_put(key, value):
+    ## the cached arrays are shared by every Pandrosus restored from
+    ## them, so they are copied from the live group and made read-only
+    _larch_cache[key] = _readonly(value)
+    _larch_cache.move_to_end(key)
+    while len(_larch_cache) > LARCH_CACHE_SIZE:
+        _larch_cache.popitem(last=False)
+
+def clear_larch_cache():
+    '''Forget all processed data sets.'''
+    _larch_cache.clear()
+
+_pool = None
+def _process_pool(workers):
+    '''A pool of worker processes for Larch processing, kept for the
+    whole session so that each worker only imports Larch once.  The
+    workers are spawned rather than forked, so they do not inherit
+    the EPICS connections of this process.'''
+    global _pool
+    if _pool is None or _pool._max_workers != workers:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+def _frozen(d):
+    return tuple(sorted(d.items()))
 
 
 class Pandrosus():
@@ -112,7 +164,9 @@ class Pandrosus():
         self.rmax   = 6
 
         ## flow control parameters
-        
+        self._prepped = None
+        self._default_xftf = True
+
     def make_xmu(self, uid, mode):
         '''Load energy and mu(E) arrays into Larch and into this wrapper object.
         
@@ -169,68 +223,77 @@ class Pandrosus():
             self.group.i0 = numpy.array(table['I0'])
             self.group.signal = numpy.array(table['It'])
             
+    def cache_key(self, mode):
+        '''Key for the processed data cache: the uid, the measurement
+        mode, and all the processing parameters.'''
+        return (self.uid, mode, _frozen(self.pre), _frozen(self.bkg), _frozen(self.fft))
+
+    def export(self):
+        '''Return the processed state of this object in a form suitable for caching.'''
+        return {'title': self.title, 'pre': dict(self.pre), 'group': _larch().export_group(self.group)}
+
+    def restore(self, cached):
+        '''Restore a processed state previously returned by export.'''
+        self.title = cached['title']
+        self.pre   = dict(cached['pre'])
+        _larch().import_group(self.group, cached['group'])
+        self._prepped = self._prep_key()
+        self._default_xftf = True
+
+    def load(self, uid, mode='transmission'):
+        '''Read the title and mu(E) of a data set from the database, without processing it.'''
+        db = user_ns['db']
+        self.title = db.v2[uid].metadata['start']['XDI']['Sample']['name']
+        self.make_xmu(uid, mode=mode)
+
     def fetch(self, uid, name=None, mode='transmission'):
-        db, BMMuser = user_ns['db'], user_ns['BMMuser']
         self.uid = uid
         if name is not None:
             self.name = name
         else:
             self.name = uid[-6:]
-        self.group = Group(__name__=self.name)
-        self.title = db.v2[uid].metadata['start']['XDI']['Sample']['name']
-        self.make_xmu(uid, mode=mode)
+        self.group = _larch().Group(__name__=self.name)
+        key = self.cache_key(mode)
+        cached = _cache_get(key)
+        if cached is not None:
+            self.restore(cached)
+            return
+        self.load(uid, mode=mode)
         self.prep()
+        _cache_put(key, self.export())
 
     def put(self, energy, mu, name):
         self.name = name
-        self.group = Group(__name__=self.name)
+        self.group = _larch().Group(__name__=self.name)
         self.group.energy = energy
         self.group.mu = mu
         self.prep()
-        
+
+    def _prep_key(self):
+        return (id(self.group), id(self.group.energy), id(self.group.mu),
+                _frozen(self.pre), _frozen(self.bkg), _frozen(self.fft))
+
     def prep(self):
-        ## the next several lines seem necessary because the version
-        ## of Larch currently at BMM is not correctly resolving
-        ## pre1=pre2=None or norm1=norm2=None.  The following
-        ## approximates Larch's defaults
-        if self.pre['e0'] is None:
-            find_e0(self.group.energy, mu=self.group.mu, group=self.group, _larch=LARCH)
-            ezero = self.group.e0
-        else:
-            ezero = self.pre['e0']
-        if self.pre['norm2'] is None:
-            self.pre['norm2'] = self.group.energy.max() - ezero
-        if self.pre['norm1'] is None:
-            self.pre['norm1'] = self.pre['norm2'] / 5
-        if self.pre['pre1'] is None:
-            self.pre['pre1'] = self.group.energy.min() - ezero
-        if self.pre['pre2'] is None:
-            self.pre['pre2'] = self.pre['pre1'] / 3
-        pre_edge(self.group.energy, mu=self.group.mu, group=self.group,
-                 e0    = ezero,
-                 step  = None,
-                 pre1  = self.pre['pre1'],
-                 pre2  = self.pre['pre2'],
-                 norm1 = self.pre['norm1'],
-                 norm2 = self.pre['norm2'],
-                 nnorm = self.pre['nnorm'],
-                 nvict = self.pre['nvict'],
-                 _larch=LARCH)
-        autobk(self.group.energy, mu=self.group.mu, group=self.group,
-               rbkg    = self.bkg['rbkg'],
-               e0      = self.bkg['e0'],
-               kmin    = self.bkg['kmin'],
-               kmax    = self.bkg['kmax'],
-               kweight = self.bkg['kweight'],
-               _larch=LARCH)
-        xftf(self.group.k, chi=self.group.chi, group=self.group,
-             window = self.fft['window'],
-             kmin   = self.fft['kmin'],
-             kmax   = self.fft['kmax'],
-             dk     = self.fft['dk'],
-             _larch=LARCH)
+        '''Normalize, background subtract, and forward transform the data.
+        This is skipped if neither the data nor the processing
+        parameters have changed since the last time.'''
+        if self._prepped is not None and self._prepped == self._prep_key():
+            if not self._default_xftf:
+                _larch().xftf(self.group.k, chi=self.group.chi, group=self.group,
+                              window = self.fft['window'],
+                              kmin   = self.fft['kmin'],
+                              kmax   = self.fft['kmax'],
+                              dk     = self.fft['dk'],
+                              _larch=_larch().interpreter())
+                self._default_xftf = True
+            return
+        _larch().normalize(self.group, self.pre, self.bkg, self.fft, _larch().interpreter())
+        self._prepped = self._prep_key()
+        self._default_xftf = True
 
     def show(self, which=None):
+        import larch.utils.show as lus
+        LARCH = _larch().interpreter()
         if which is None:
             lus.show(self.group, _larch=LARCH)
         elif 'pre' in which:
@@ -364,13 +427,14 @@ class Pandrosus():
     plot_chik = plot_chi
         
     def do_xftf(self, kw=2):
-        xftf(self.group.k, chi=self.group.chi, group=self.group,
-             window  = self.fft['window'],
-             kmin    = self.fft['kmin'],
-             kmax    = self.fft['kmax'],
-             dk      = self.fft['dk'],
-             kweight = kw,
-             with_phase=True, _larch=LARCH)
+        self._default_xftf = False
+        _larch().xftf(self.group.k, chi=self.group.chi, group=self.group,
+                      window  = self.fft['window'],
+                      kmin    = self.fft['kmin'],
+                      kmax    = self.fft['kmax'],
+                      dk      = self.fft['dk'],
+                      kweight = kw,
+                      with_phase=True, _larch=_larch().interpreter())
     def plot_chir(self, kw=2, win=True, parts='m'):
         '''Make a plot in R-space of a single data set.
 
@@ -444,12 +508,12 @@ class Pandrosus():
         plt.legend(loc='best', shadow=True)
         
     def do_xftr(self):
-        xftr(self.group.r, chir=self.group.chir, group=self.group,
-             window = self.bft['window'],
-             rmin   = self.bft['rmin'],
-             rmax   = self.bft['rmax'],
-             dr     = self.bft['dr'],
-             with_phase=True, _larch=LARCH)
+        _larch().xftr(self.group.r, chir=self.group.chir, group=self.group,
+                      window = self.bft['window'],
+                      rmin   = self.bft['rmin'],
+                      rmax   = self.bft['rmax'],
+                      dr     = self.bft['dr'],
+                      with_phase=True, _larch=_larch().interpreter())
     def plot_chiq(self, kw=2, parts='r', win=True):
         '''Make a plot in back-transformed k-space of a single data set.
 
@@ -602,10 +666,16 @@ class Kekropidai():
         name of this collection
     rmax : float
         upper bound of R-space plot
+    workers : int
+        number of worker processes (and database reading threads) used by put
       
 
     Methods
     -------
+    put :
+        fetch and process a list of uids as a batch
+    merge :
+        return a Pandrosus object with the merge of all the groups
     add :
         add a single group or a list of groups to the Kekropidai object
     plot_xmu : 
@@ -632,12 +702,52 @@ class Kekropidai():
         self.groups = list()
         self.name   = name
         self.rmax   = 6
+        self.workers = min(4, os.cpu_count() or 1)
 
-    def put(self, uidlist):
+    def put(self, uidlist, mode='transmission'):
+        '''Fetch and process a list of uids.
+
+        Data sets already processed with the same parameters are taken
+        from the cache.  The rest are read from the database in
+        parallel threads, then normalized and background subtracted in
+        parallel worker processes, each with its own Larch
+        interpreter.  If the worker processes cannot be used, the
+        processing is done here, one data set at a time.
+        '''
+        groups, todo = [], []
         for u in uidlist:
-            this = Pandrosus()
-            this.fetch(u)
-            self.add(this)
+            this = Pandrosus(uid=u, name=u[-6:])
+            this.group = _larch().Group(__name__=this.name)
+            key = this.cache_key(mode)
+            cached = _cache_get(key)
+            if cached is None:
+                todo.append((this, key))
+            else:
+                this.restore(cached)
+            groups.append(this)
+
+        if len(todo) > 0:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                list(pool.map(lambda job: job[0].load(job[0].uid, mode=mode), todo))
+            ## one data set is not worth the overhead of the worker processes
+            if len(todo) > 1 and self.workers > 1:
+                try:
+                    pool    = _process_pool(self.workers)
+                    futures = [pool.submit(_larch().process, this.group.energy, this.group.mu,
+                                           this.pre, this.bkg, this.fft) for (this, key) in todo]
+                    for (this, key), f in zip(todo, futures):
+                        pre, attrs = f.result()
+                        this.pre = pre
+                        _larch().import_group(this.group, attrs)
+                        this._prepped = this._prep_key()
+                except (BrokenProcessPool, OSError) as e:
+                    print(warning_msg(f'Larch worker processes unavailable ({e}), processing serially'))
+            for (this, key) in todo:
+                if this._prepped is None:
+                    this.prep()
+            for (this, key) in todo:
+                _cache_put(key, this.export())
+        self.add(groups)
 
     def merge(self):
         base = self.groups[0]
@@ -0,0 +1,101 @@
+'''The Larch processing chain used by Pandrosus, in a form that can
+be run in a worker process.
+
+Nothing in this module may touch the IPython user namespace, since
+it is imported fresh by each worker process of Kekropidai's batch
+processor.  Each worker process makes its own Larch Interpreter.
+'''
+
+import numpy
+from larch import Group, Interpreter
+from larch.xafs import find_e0, pre_edge, autobk, xftf, xftr
+
+_interpreter = None
+
+def interpreter():
+    '''Return this process' Larch Interpreter, making it the first time.'''
+    global _interpreter
+    if _interpreter is None:
+        _interpreter = Interpreter()
+    return _interpreter
+
+
+def normalize(group, pre, bkg, fft, _larch):
+    '''Normalize, background subtract, and forward transform the data
+    in group.  pre, bkg, and fft are the Pandrosus parameter
+    dictionaries.  Unset pre-edge and normalization ranges in pre are
+    filled in.'''
+    ## the next several lines seem necessary because the version
+    ## of Larch currently at BMM is not correctly resolving
+    ## pre1=pre2=None or norm1=norm2=None.  The following
+    ## approximates Larch's defaults
+    if pre['e0'] is None:
+        find_e0(group.energy, mu=group.mu, group=group, _larch=_larch)
+        ezero = group.e0
+    else:
+        ezero = pre['e0']
+    if pre['norm2'] is None:
+        pre['norm2'] = group.energy.max() - ezero
+    if pre['norm1'] is None:
+        pre['norm1'] = pre['norm2'] / 5
+    if pre['pre1'] is None:
+        pre['pre1'] = group.energy.min() - ezero
+    if pre['pre2'] is None:
+        pre['pre2'] = pre['pre1'] / 3
+    pre_edge(group.energy, mu=group.mu, group=group,
+             e0    = ezero,
+             step  = None,
+             pre1  = pre['pre1'],
+             pre2  = pre['pre2'],
+             norm1 = pre['norm1'],
+             norm2 = pre['norm2'],
+             nnorm = pre['nnorm'],
+             nvict = pre['nvict'],
+             _larch=_larch)
+    autobk(group.energy, mu=group.mu, group=group,
+           rbkg    = bkg['rbkg'],
+           e0      = bkg['e0'],
+           kmin    = bkg['kmin'],
+           kmax    = bkg['kmax'],
+           kweight = bkg['kweight'],
+           _larch=_larch)
+    xftf(group.k, chi=group.chi, group=group,
+         window = fft['window'],
+         kmin   = fft['kmin'],
+         kmax   = fft['kmax'],
+         dk     = fft['dk'],
+         _larch=_larch)
+
+
+def export_group(group):
+    '''Flatten a Larch group into a dictionary of arrays, numbers, and
+    strings (and nested dictionaries for nested groups) which can be
+    pickled and sent between processes.'''
+    out = dict()
+    for k,v in vars(group).items():
+        if k.startswith('__'):
+            continue
+        if isinstance(v, Group):
+            out[k] = export_group(v)
+        elif isinstance(v, (numpy.ndarray, numpy.number, int, float, str, bool, type(None))):
+            out[k] = v
+    return out
+
+def import_group(group, attrs):
+    '''Inverse of export_group: set the attributes in attrs on group.'''
+    for k,v in attrs.items():
+        if isinstance(v, dict):
+            v = import_group(Group(__name__=k), v)
+        setattr(group, k, v)
+    return group
+
+
+def process(energy, mu, pre, bkg, fft):
+    '''Worker process entry point: process one spectrum.  Returns the
+    filled-in pre dictionary and the exported group.'''
+    group = Group(__name__='worker')
+    group.energy = numpy.asarray(energy)
+    group.mu     = numpy.asarray(mu)
+    pre = dict(pre)
+    normalize(group, pre, bkg, fft, interpreter())
+    return pre, export_group(group)
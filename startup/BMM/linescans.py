@@ -117,9 +117,7 @@ def slit_height(start=-1.5, stop=1.5, nsteps=31, move=False, force=False, slp=1.
         plot = DerivedPlot(func, xlabel=motor.name, ylabel='I0', title='I0 signal vs. slit height')
         line1 = '%s, %s, %.3f, %.3f, %d -- starting at %.3f\n' % \
                 (motor.name, 'i0', start, stop, nsteps, motor.user_readback.get())
-        rkvs.set('BMM:scan:type',      'line')
-        rkvs.set('BMM:scan:starttime', str(datetime.datetime.timestamp(datetime.datetime.now())))
-        rkvs.set('BMM:scan:estimated', 0)
+        rkvs.scan_started('line')
 
         @subs_decorator(plot)
         #@subs_decorator(src.callback)
@@ -234,9 +232,7 @@ def rocking_curve(start=-0.10, stop=0.10, nsteps=101, detector='I0', choice='pea
 
         plot = DerivedPlot(func, xlabel=motor.name, ylabel=sgnl, title=titl)
 
-        rkvs.set('BMM:scan:type',      'line')
-        rkvs.set('BMM:scan:starttime', str(datetime.datetime.timestamp(datetime.datetime.now())))
-        rkvs.set('BMM:scan:estimated', 0)
+        rkvs.scan_started('line')
 
         @subs_decorator(plot)
         #@subs_decorator(src.callback)
@@ -532,9 +528,7 @@ def linescan(detector, axis, start, stop, nsteps, pluck=True, force=False, intti
         thismd['XDI']['Facility']['GUP'] = BMMuser.gup
         thismd['XDI']['Facility']['SAF'] = BMMuser.saf
 
-        rkvs.set('BMM:scan:type',      'line')
-        rkvs.set('BMM:scan:starttime', str(datetime.datetime.timestamp(datetime.datetime.now())))
-        rkvs.set('BMM:scan:estimated', 0)
+        rkvs.scan_started('line')
 
         @subs_decorator(plot)
         #@subs_decorator(src.callback)
@@ -1,6 +1,8 @@
 import logging
 import os
+import time, queue, threading, atexit, hashlib
 from urllib import request, parse
+from urllib.error import HTTPError
 import json
 from os import chmod
 from slack_sdk import WebClient
@@ -14,6 +16,199 @@ user_ns = get_ipython().user_ns
 
 #run_report(__file__, text='BMM-specific logging')
 
+class LogDestination(logging.Handler):
+    '''A log handler which never makes the caller wait on the file system.
+
+    Formatted messages go onto a bounded queue and are written by a
+    background thread, so each destination (the local master log, the
+    NAS log, the experiment log) gets its own queue and writer.  A
+    slow destination only holds up its own writer.
+
+    The file is opened once, keeping it read-only (0444) apart from
+    the moment it is opened.  Since an open file stays writable, its
+    permissions do not need to change for every message.
+
+    If the destination cannot be written, or a write takes longer than
+    self.slow seconds, the destination is considered to be down for
+    self.retry seconds.  Meanwhile the writer puts messages in the
+    spool file, which should be on local disk.  Spooled messages are
+    moved to the destination, in order, as soon as it can be written
+    to again.  The spool file is not allowed to grow beyond
+    self.spool_max bytes.  Messages which do not fit, or which arrive
+    when there is no spool file, are counted in self.dropped.
+
+    If the queue is full, the caller waits up to self.block seconds
+    for room.  After that the message is dropped and counted, and a
+    line saying how many messages were lost goes into the queue at the
+    next opportunity, so the file shows where the gap is.  Messages
+    are only ever written by the writer thread, so they stay in order.
+
+    Attributes
+    ----------
+    filename : str
+        the log file
+    spool : str or None
+        local file for messages which could not be written to filename
+    slow : float
+        a write taking longer than this (seconds) marks the destination as down
+    retry : float
+        time (seconds) before trying a destination which was down
+    block : float
+        time (seconds) a caller will wait when the queue is full
+    spool_max : int
+        largest size (bytes) of the spool file
+    opener : callable
+        used like open() to open filename, can be replaced for testing
+    '''
+    def __init__(self, filename, spool=None, maxsize=10000, slow=1.0, retry=30.0, block=0.1, spool_max=50*1024*1024):
+        super().__init__()
+        self.filename   = filename
+        self.spool      = spool
+        self.slow       = slow
+        self.retry      = retry
+        self.block      = block
+        self.spool_max  = spool_max
+        self.opener     = open
+        self.dropped    = 0
+        self.spooled    = 0
+        self.queue      = queue.Queue(maxsize)
+        self.__stream   = None
+        self.__down     = 0     # epoch time until which the destination is considered down
+        self.__lost     = 0     # messages dropped since the last gap line was queued
+        self.__full     = False # True once the spool file has reached spool_max
+        self.__spool_lock = threading.Lock()
+        self.__writer   = threading.Thread(target=self._run, name=f'BMM log {os.path.basename(filename)}', daemon=True)
+        self.__writer.start()
+
+    def emit(self, record):
+        try:
+            msg = self.format(record) + '\n'
+        except Exception:
+            self.handleError(record)
+            return
+        ## emit is called with the handler's lock held, so one message
+        ## at a time is placed on the queue
+        if self.__lost > 0:
+            try:
+                self.queue.put_nowait(self._gap(f'{self.__lost} log messages were dropped here'))
+                self.__lost = 0
+            except queue.Full:
+                pass
+        try:
+            if self.__lost > 0:
+                raise queue.Full
+            self.queue.put(msg, timeout=self.block)
+        except queue.Full:
+            self.__lost  += 1
+            self.dropped += 1
+
+    def _gap(self, what):
+        return f'{time.strftime("%Y-%m-%d %H:%M:%S")} - {what}\n'
+
+    def _run(self):
+        while True:
+            msg = self.queue.get()
+            if msg is None:
+                self.queue.task_done()
+                break
+            batch = [msg]
+            while len(batch) < 500:
+                try:
+                    more = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if more is None:
+                    self.queue.put(None)   # finish this batch, then stop
+                    self.queue.task_done()
+                    break
+                batch.append(more)
+            self._write(batch)
+            for i in range(len(batch)):
+                self.queue.task_done()
+
+    def _open(self):
+        if self.__stream is None:
+            if os.path.isfile(self.filename):
+                chmod(self.filename, 0o644)
+            self.__stream = self.opener(self.filename, 'a')
+            chmod(self.filename, 0o444)
+        return self.__stream
+
+    def _close(self):
+        try:
+            if self.__stream is not None:
+                self.__stream.close()
+        except Exception:
+            pass
+        self.__stream = None
+
+    def _write(self, lines):
+        if time.time() < self.__down:
+            self._to_spool(lines)
+            return
+        start = time.time()
+        try:
+            stream = self._open()
+            self._from_spool(stream)
+            stream.write(''.join(lines))
+            stream.flush()
+        except Exception:
+            self._close()
+            self.__down = time.time() + self.retry
+            self._to_spool(lines)
+            return
+        if time.time() - start > self.slow:
+            self.__down = time.time() + self.retry
+
+    def _to_spool(self, lines):
+        if self.spool is None:
+            self.dropped += len(lines)
+            return
+        with self.__spool_lock:
+            try:
+                room = self.spool_max - (os.path.getsize(self.spool) if os.path.isfile(self.spool) else 0)
+                keep = 0
+                while keep < len(lines) and len(lines[keep]) <= room and not self.__full:
+                    room -= len(lines[keep])
+                    keep += 1
+                with open(self.spool, 'a') as fh:
+                    fh.write(''.join(lines[:keep]))
+                    if keep < len(lines) and not self.__full:
+                        fh.write(self._gap('the spool file is full, later log messages were dropped'))
+                        self.__full = True
+                self.spooled += keep
+                self.dropped += len(lines) - keep
+            except Exception:
+                self.dropped += len(lines)
+
+    def _from_spool(self, stream):
+        if self.spool is None:
+            return
+        with self.__spool_lock:
+            if not os.path.isfile(self.spool) or os.path.getsize(self.spool) == 0:
+                return
+            with open(self.spool, 'r') as fh:
+                stream.write(fh.read())
+            stream.flush()
+            os.remove(self.spool)
+            self.__full = False
+
+    def flush(self):
+        '''Block until every queued message has been handled.'''
+        self.queue.join()
+
+    def close(self):
+        '''Write out the queue, stop the writer, and close the file.'''
+        if self.__writer.is_alive():
+            if self.__lost > 0:
+                self.queue.put(self._gap(f'{self.__lost} log messages were dropped here'))
+                self.__lost = 0
+            self.queue.put(None)
+            self.__writer.join(timeout=max(5, 2*self.slow))
+        self._close()
+        super().close()
+
+
 BMM_logger          = logging.getLogger('BMM_logger')
 BMM_logger.handlers = []
 
@@ -24,27 +219,18 @@ BMM_formatter       = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s\
 BMM_log_master_file = os.path.join(os.environ['HOME'], 'Data', 'BMM_master.log')
 if not os.path.isdir(os.path.join(os.environ['HOME'], 'Data')):
     os.makedirs(os.path.join(os.environ['HOME'], 'Data'))
-if not os.path.isfile(BMM_log_master_file):
-    os.mknod(BMM_log_master_file)
-if os.path.isfile(BMM_log_master_file):
-    chmod(BMM_log_master_file, 0o644)
-    BMM_log_master = logging.FileHandler(BMM_log_master_file)
-    BMM_log_master.setFormatter(BMM_formatter)
-    BMM_logger.addHandler(BMM_log_master)
-    chmod(BMM_log_master_file, 0o444)
+BMM_log_master = LogDestination(BMM_log_master_file)
+BMM_log_master.setFormatter(BMM_formatter)
+BMM_logger.addHandler(BMM_log_master)
 
+## when the NAS is slow or missing, messages for it wait in a local spool file
 BMM_nas_log_file = os.path.join(user_ns['nas_mount_point'], 'xf06bm', 'data', 'BMM_master.log')
-if os.path.isdir('/mnt/nfs/nas1'):
-    if not os.path.isfile(BMM_nas_log_file):
-        basedir = os.path.dirname(BMM_nas_log_file)
-        if not os.path.exists(basedir):
-            os.makedirs(basedir)
-        os.mknod(BMM_nas_log_file)
-    if os.path.isfile(BMM_nas_log_file):
-        chmod(BMM_nas_log_file, 0o644)
-        BMM_log_nas = logging.FileHandler(BMM_nas_log_file)
-        BMM_log_nas.setFormatter(BMM_formatter)
-        BMM_logger.addHandler(BMM_log_nas)
+BMM_nas_spool_file = os.path.join(os.environ['HOME'], 'Data', 'BMM_nas_spool.log')
+if os.path.isdir(user_ns['nas_mount_point']):
+    os.makedirs(os.path.dirname(BMM_nas_log_file), exist_ok=True)
+BMM_log_nas = LogDestination(BMM_nas_log_file, spool=BMM_nas_spool_file)
+BMM_log_nas.setFormatter(BMM_formatter)
+BMM_logger.addHandler(BMM_log_nas)
 
 BMM_logger.setLevel(logging.INFO)
 
@@ -54,84 +240,366 @@ BMM_log_user = None
 ## thus all scans, etc. relevant to the experiment will be logged with the data
 ## call this at the beginning of the beamtime
 def BMM_user_log(filename):
-    BMM_log_user = logging.FileHandler(filename)
+    global BMM_log_user
+    BMM_log_user = LogDestination(filename)
     BMM_log_user.setFormatter(BMM_formatter)
     BMM_logger.addHandler(BMM_log_user)
 
 ## remove all but the master log from the list of handlers
 def BMM_unset_user_log():
+    for h in BMM_logger.handlers:
+        if h not in (BMM_log_master, BMM_log_nas):
+            h.close()
     BMM_logger.handlers = []
     BMM_logger.addHandler(BMM_log_master)
     BMM_logger.addHandler(BMM_log_nas)
 
-## use this command to properly format the log message, manage file permissions, etc
+## use this command to properly format the log message
 def BMM_log_info(message):
-    chmod(BMM_log_master_file, 0o644)
-    chmod(BMM_nas_log_file, 0o644)
     entry = ''
     for line in message.split('\n'):
         entry += '    ' + line + '\n'
     BMM_logger.info(entry)
-    chmod(BMM_log_master_file, 0o444)
-    chmod(BMM_nas_log_file, 0o444)
+
+## write out anything still queued when bsui exits
+atexit.register(lambda: [h.close() for h in list(BMM_logger.handlers)])
 
 
 ## small effort to obfuscate the web hook URL, which is secret-ish.  See:
 ##   https://api.slack.com/messaging/webhooks#create_a_webhook
 ## in the future, this could be an ini with per-user channel URLs...
 slack_secret = os.path.join(os.path.dirname(get_ipython_module_path('BMM.functions')), 'slack_secret')
+default_slack_channel = None
 try:
     with open(slack_secret, "r") as f:
         default_slack_channel = f.read().replace('\n','')
 except:
     print(error_msg('\t\t\tslack_secret file not found!'))
 
-def post_to_slack(text):
-    try:
-        channel = BMMuser.slack_channel
-    except:
-        channel = default_slack_channel
-    if channel is None:
-        channel = default_slack_channel
-    post = {"text": "{0}".format(text)}
-    try:
-        json_data = json.dumps(post)
-        req = request.Request(channel,
-                              data=json_data.encode('ascii'),
-                              headers={'Content-Type': 'application/json'}) 
-        resp = request.urlopen(req)
-    except Exception as em:
-        print("EXCEPTION: " + str(em))
-        print(f'slack_secret = {slack_secret}')
 
+class SlackRateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f'rate limited for {retry_after} seconds')
+        self.retry_after = retry_after
 
-## Simple but useful guide to configuring a slack app:        
+class SlackRejected(Exception):
+    '''Slack refused a message in a way that retrying will not fix.'''
+    pass
+
+
+def webhook_post(channel, text, timeout=10):
+    '''Post text to a Slack webhook URL.  Raises SlackRateLimited or
+    SlackRejected when Slack says so, other exceptions on network
+    trouble.'''
+    req = request.Request(channel,
+                          data=json.dumps({"text": "{0}".format(text)}).encode('ascii'),
+                          headers={'Content-Type': 'application/json'})
+    try:
+        request.urlopen(req, timeout=timeout).read()
+    except HTTPError as e:
+        if e.code == 429:
+            raise SlackRateLimited(float(e.headers.get('Retry-After', 30)))
+        if 400 <= e.code < 500:
+            raise SlackRejected(f'HTTP {e.code}: {e.reason}')
+        raise
+
+## Simple but useful guide to configuring a slack app:
 ## https://hamzaafridi.com/2019/11/03/sending-a-file-to-a-slack-channel-using-api/
-def img_to_slack(imagefile):
+def slack_upload(imagefile, timeout=30):
+    '''Upload an image to the #beamtime channel.'''
+    if not os.path.isfile(imagefile):
+        raise SlackRejected(f'{imagefile} does not exist')
     token_file = os.path.join(os.path.dirname(get_ipython_module_path('BMM.functions')), 'image_uploader_token')
     try:
         with open(token_file, "r") as f:
             token = f.read().replace('\n','')
     except:
-        post_to_slack(f'failed to post image: {imagefile}')
-        return()
-    client = WebClient(token=token)
+        raise SlackRejected('image uploader token not found')
+    client = WebClient(token=token, timeout=timeout)
     #client = WebClient(token=os.environ['SLACK_API_TOKEN'])
     try:
         response = client.files_upload(channels='#beamtime', file=imagefile)
         assert response["file"]  # the uploaded file
     except SlackApiError as e:
-        post_to_slack('failed to post image: {imagefile}')
         # You will get a SlackApiError if "ok" is False
-        assert e.response["ok"] is False
-        assert e.response["error"]  # str like 'invalid_auth', 'channel_not_found'
-        print(f"Got an error: {e.response['error']}")
-    except Exception as em:
-        print("EXCEPTION: " + str(em))
-        report(f'failed to post image: {imagefile}', level='bold', slack=True)
+        if e.response["error"] == 'ratelimited':
+            raise SlackRateLimited(float(e.response.headers.get('Retry-After', 30)))
+        raise SlackRejected(e.response["error"])  # str like 'invalid_auth', 'channel_not_found'
+
+
+class SlackDispatcher():
+    '''Deliver messages and images to Slack from a background thread.
+
+    Posting only puts the message on a queue, so a slow or unreachable
+    webhook never holds up the RunEngine.  The delivery thread:
+
+    * waits self.coalesce seconds after a message arrives, then sends
+      all the waiting messages for a channel as one post, up to
+      self.max_length characters per post
+    * leaves at least self.interval seconds between posts, and obeys
+      Slack's Retry-After when it is rate limited
+    * retries a failed delivery with exponential backoff, starting at
+      self.backoff and going up to self.max_backoff seconds
+    * drops a message that Slack rejects outright (for instance a bad
+      webhook URL or a missing image file), with an error on screen
+
+    Messages which have not been delivered are saved in self.outbox.
+    They are sent the next time a dispatcher using that outbox starts,
+    so messages are not lost when bsui restarts while Slack or the
+    network is down.  Messages older than self.max_age seconds are
+    dropped, as are the oldest ones beyond self.max_pending.
+
+    A webhook URL is a secret, so it is never written to the outbox.
+    Each webhook is known by a key: the key it was given in
+    self.channels, or a hash of the URL for a webhook which was only
+    passed to post().  A saved message is delivered once the key of
+    its webhook is known again.
+
+    Attributes
+    ----------
+    outbox : str or None
+        JSON file holding undelivered messages
+    channels : dict
+        webhook URL for each channel key, e.g. {'default': url}
+    max_age : float
+        time (seconds) after which an undelivered message is dropped
+    max_pending : int
+        largest number of undelivered messages kept
+    coalesce, interval, backoff, max_backoff : float
+        timings (seconds) as described above
+    max_length : int
+        largest number of characters in a single post
+    delivered : int
+        number of messages and images delivered
+    posts : int
+        number of requests which delivered them
+    '''
+    def __init__(self, outbox=None, channels=None):
+        self.outbox      = outbox
+        self.channels    = dict(channels or {})
+        self.max_age     = 86400.0
+        self.max_pending = 1000
+        self.coalesce    = 2.0
+        self.interval    = 1.1
+        self.backoff     = 2.0
+        self.max_backoff = 300.0
+        self.max_length  = 3500
+        self.timeout     = 10.0
+        self.delivered   = 0
+        self.posts       = 0
+        self.send_text   = webhook_post
+        self.send_image  = slack_upload
+        self.__queue     = queue.Queue()
+        self.__pending   = []        # undelivered items, oldest first
+        self.__idle      = threading.Event()
+        self.__thread    = None
+        self.__lock      = threading.Lock()
+        self.__stop      = False
+
+    def key(self, channel):
+        '''The key for a channel, which is either a key in self.channels
+        or a webhook URL.  A URL not already in self.channels is added
+        under a hash of the URL.'''
+        if channel in self.channels:
+            return channel
+        for k, url in list(self.channels.items()):
+            if url == channel:
+                return k
+        key = 'hook-' + hashlib.sha256(channel.encode('utf-8')).hexdigest()[:16]
+        self.channels[key] = channel
+        return key
+
+    def post(self, text, channel=None):
+        '''Queue text for a channel, given as a key in self.channels or as
+        a webhook URL (the default channel if None).'''
+        channel = channel or ('default' if 'default' in self.channels else None)
+        if channel is None:
+            return
+        self._put({'kind': 'text', 'channel': self.key(channel), 'text': str(text), 'time': time.time()})
+
+    def image(self, imagefile):
+        '''Queue an image file for upload to #beamtime.'''
+        self._put({'kind': 'image', 'file': imagefile, 'time': time.time()})
+
+    def _put(self, item):
+        self.__idle.clear()
+        self.__queue.put(item)
+        self.start()
+
+    def start(self):
+        with self.__lock:
+            if self.__thread is None or not self.__thread.is_alive():
+                self.__stop = False
+                self.__thread = threading.Thread(target=self._run, name='BMM slack', daemon=True)
+                self.__thread.start()
+
+    def stop(self, timeout=5):
+        '''Stop the delivery thread.  Undelivered messages stay in the outbox.'''
+        self.__stop = True
+        self.__queue.put(None)
+        if self.__thread is not None:
+            self.__thread.join(timeout=timeout)
+
+    def flush(self, timeout=30):
+        '''Deliver everything now, without waiting to coalesce.  Returns
+        True if everything that can be delivered was delivered within
+        timeout seconds.  Messages for a channel whose webhook is not
+        known are left in the outbox.'''
+        self.__idle.clear()
+        self.__queue.put('flush')
+        self.start()
+        return self.__idle.wait(timeout)
+
+    @property
+    def pending(self):
+        return len(self.__pending)
+
+    def _load(self):
+        if self.outbox is None or not os.path.isfile(self.outbox):
+            return
+        try:
+            with open(self.outbox, 'r') as fh:
+                saved = json.load(fh)
+        except Exception as E:
+            print(error_msg(f'could not read undelivered slack messages from {self.outbox}: {E}'))
+            return
+        for item in saved:      # an outbox written before webhooks were saved by key
+            if item['kind'] == 'text' and item['channel'].startswith('http'):
+                item['channel'] = self.key(item['channel'])
+        self.__pending = saved + self.__pending
+        self._expire()
+        self._save()
+
+    def _expire(self):
+        '''Drop messages which are too old or too many.'''
+        old = time.time() - self.max_age
+        keep = [item for item in self.__pending if item['time'] > old][-self.max_pending:]
+        if len(keep) < len(self.__pending):
+            print(warning_msg(f'dropping {len(self.__pending)-len(keep)} undelivered slack messages'))
+            self.__pending = keep
+
+    def _ready(self, item):
+        '''True if there is somewhere to deliver item.'''
+        return item['kind'] == 'image' or item['channel'] in self.channels
+
+    def _save(self):
+        if self.outbox is None:
+            return
+        try:
+            if len(self.__pending) == 0:
+                if os.path.isfile(self.outbox):
+                    os.remove(self.outbox)
+                return
+            temp = self.outbox + '.part'
+            with open(temp, 'w') as fh:
+                json.dump(self.__pending, fh)
+            os.replace(temp, self.outbox)
+        except Exception as E:
+            print(error_msg(f'could not save undelivered slack messages to {self.outbox}: {E}'))
+
+    def _batch(self):
+        '''The first pending image, or the first pending message joined
+        with the later messages for the same channel, skipping messages
+        for channels whose webhook is not known.  None if there is
+        nothing which can be delivered.'''
+        ready = [item for item in self.__pending if self._ready(item)]
+        if len(ready) == 0:
+            return None
+        first = ready[0]
+        if first['kind'] == 'image':
+            return [first]
+        batch, length = [first], len(first['text'])
+        for item in ready[1:]:
+            if item['kind'] == 'text' and item['channel'] == first['channel']:
+                if length + len(item['text']) + 1 > self.max_length:
+                    break
+                batch.append(item)
+                length += len(item['text']) + 1
+        return batch
+
+    def _run(self):
+        self._load()
+        next_post, delay, flushing = 0, self.backoff, False
+        while not self.__stop:
+            ## wait for the next message, or until it is time to send
+            self._expire()
+            timeout = None
+            batch = self._batch() if len(self.__pending) > 0 else None
+            if batch is not None:
+                due = next_post if flushing else max(next_post, batch[0]['time'] + self.coalesce)
+                timeout = max(0, due - time.time())
+            elif len(self.__pending) > 0:
+                timeout = self.coalesce     # until a webhook becomes known or messages expire
+                if flushing and self.__queue.empty():
+                    flushing = False
+                    self.__idle.set()
+            elif self.__queue.empty():
+                flushing = False
+                self.__idle.set()
+            try:
+                item = self.__queue.get(timeout=timeout)
+                received = [item]
+                while True:
+                    try:
+                        received.append(self.__queue.get_nowait())
+                    except queue.Empty:
+                        break
+                for item in received:
+                    if item == 'flush':
+                        flushing = True
+                    elif item is not None:
+                        self.__pending.append(item)
+                self._save()
+                continue
+            except queue.Empty:
+                pass
+
+            ## deliver the oldest pending item, with whatever it coalesces with
+            if batch is None:
+                continue
+            try:
+                if batch[0]['kind'] == 'image':
+                    self.send_image(batch[0]['file'])
+                else:
+                    self.send_text(self.channels[batch[0]['channel']], '\n'.join(b['text'] for b in batch), timeout=self.timeout)
+            except SlackRateLimited as E:
+                next_post = time.time() + E.retry_after
+                continue
+            except SlackRejected as E:
+                print(error_msg(f'slack rejected a message, not retrying: {E}'))
+                if batch[0]['kind'] == 'image':
+                    self.post(f'failed to post image: {batch[0]["file"]}')
+            except Exception as E:
+                next_post = time.time() + delay
+                delay = min(2*delay, self.max_backoff)
+                continue
+            else:
+                self.delivered += len(batch)
+                self.posts += 1
+            for b in batch:
+                self.__pending.remove(b)
+            self._save()
+            next_post, delay = time.time() + self.interval, self.backoff
+
+
+BMM_slack = SlackDispatcher(outbox=os.path.join(os.environ['HOME'], 'Data', 'BMM_slack_outbox.json'),
+                            channels={'default': default_slack_channel} if default_slack_channel else None)
+if BMM_slack.outbox is not None and os.path.isfile(BMM_slack.outbox):
+    BMM_slack.start()           # deliver what was left undelivered last time
+
+def post_to_slack(text):
+    '''Queue text for the beamtime slack channel.  This returns right
+    away, the message is delivered by BMM_slack.'''
+    channel = getattr(user_ns.get('BMMuser'), 'slack_channel', None)
+    BMM_slack.post(text, channel)
+
+def img_to_slack(imagefile):
+    '''Queue an image for upload to the beamtime slack channel.  This
+    returns right away, the image is uploaded by BMM_slack.'''
+    BMM_slack.image(imagefile)
+
 
 
-        
 def report(text, level=None, slack=False):
     '''Print a string to:
       * the log file
@@ -203,5 +671,3 @@ def BMM_msg_hook(msg):
             report('Setting %s to %.3f' % (msg[1].name, msg[2][0]), 'whisper')
         elif 'PseudoSingle' in str(type(msg[1])):
             report('Moving %s to %.3f'  % (msg[1].name, msg[2][0]))
-
-
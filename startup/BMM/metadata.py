@@ -27,19 +27,36 @@ class Ring(Device):
 
 ## some heuristics for determining state of M2 and M3
 def mirror_state():
-    if user_ns['m2'].vertical.readback.get() > 0:
+    m2, m3 = user_ns['m2'], user_ns['m3']
+    snap = user_ns['pvsnap'].take({'m2_vertical' : m2.vertical.readback,
+                                   'm2_pitch'    : m2.pitch.readback,
+                                   'm2_bender'   : user_ns['m2_bender'].user_readback,
+                                   'm3_lateral'  : m3.lateral.readback,
+                                   'm3_vertical' : m3.vertical.readback, }, fallback=True)
+    ## a signal which could not be read is None, say so rather than guessing
+    if snap['m2_vertical'] is None:
+        m2state = 'unknown'
+    elif snap['m2_vertical'] > 0:
         m2state = 'not in use'
+    elif snap['m2_pitch'] is None or snap['m2_bender'] is None:
+        m2state = 'torroidal mirror, 5 nm Rh on 30 nm Pt'
     else:
-        m2state = 'torroidal mirror, 5 nm Rh on 30 nm Pt, pitch = %.2f mrad, bender = %d counts' % (7.0 - user_ns['m2'].pitch.readback.get(),
-                                                                                                    int(user_ns['m2_bender'].user_readback.get()))
-    if user_ns['m3'].lateral.readback.get() > 0:
+        m2state = 'torroidal mirror, 5 nm Rh on 30 nm Pt, pitch = %.2f mrad, bender = %d counts' % (7.0 - snap['m2_pitch'],
+                                                                                                    int(snap['m2_bender']))
+    if snap['m3_lateral'] is None:
+        stripe =  'unknown stripe'
+    elif snap['m3_lateral'] > 0:
         stripe =  'Pt stripe'
     else:
         stripe =  'Si stripe'
-    if abs(user_ns['m3'].vertical.readback.get() + 1.5) < 0.1:
+    if snap['m3_vertical'] is None:
+        m3state = 'unknown'
+    elif abs(snap['m3_vertical'] + 1.5) < 0.1:
         m3state = 'not in use'
+    elif snap['m2_pitch'] is None:
+        m3state = 'flat mirror, %s' % stripe
     else:
-        m3state = 'flat mirror, %s, pitch = %.1f mrad relative to beam' % (stripe, 7.0 - user_ns['m2'].pitch.readback.get())
+        m3state = 'flat mirror, %s, pitch = %.1f mrad relative to beam' % (stripe, 7.0 - snap['m2_pitch'])
     return(m2state, m3state)
 
 
@@ -134,8 +151,14 @@ def bmm_metadata(measurement   = 'transmission',
     md['Scan']['experimenters']      = experimenters
     md['Mono']['name']               = 'Si(%s)' % user_ns['dcm']._crystal
     md['Mono']['d_spacing']          = '%.7f' % (user_ns['dcm']._twod/2)
-    md['Mono']['encoder_resolution'] = user_ns['dcm'].bragg.resolution.get()
-    md['Mono']['angle_offset']       = user_ns['dcm'].bragg.user_offset.get()
+    ## these are configuration values which rarely change, so a cached value is fine
+    mono = user_ns['pvsnap'].take({'dcm_bragg_resolution'  : (user_ns['dcm'].bragg.resolution,  600),
+                                   'dcm_bragg_user_offset' : (user_ns['dcm'].bragg.user_offset, 600), }, fallback=True)
+    ## leave out what could not be read rather than writing None into the XDI header
+    if mono['dcm_bragg_resolution'] is not None:
+        md['Mono']['encoder_resolution'] = mono['dcm_bragg_resolution']
+    if mono['dcm_bragg_user_offset'] is not None:
+        md['Mono']['angle_offset']       = mono['dcm_bragg_user_offset']
     md['Detector']['I0']             = '10 cm ' + i0_gas
     md['Detector']['It']             = '25 cm ' + it_gas
     md['Detector']['Ir']             = '25 cm ' + ir_gas
@@ -153,7 +176,7 @@ def bmm_metadata(measurement   = 'transmission',
 
     if ththth:
         md['Mono']['name']            = 'Si(333)'
-        md['Mono']['d_spacing']       = '%.7f' % (dcm._twod/6)
+        md['Mono']['d_spacing']       = '%.7f' % (user_ns['dcm']._twod/6)
             
         
     (md['Beamline']['focusing'], md['Beamline']['harmonic_rejection']) = mirror_state()
@@ -204,9 +227,13 @@ def metadata_at_this_moment():
     #rightnow['Mono']['compton_shield_temperature'] = float(compton_shield.temperature.get())
     #rightnow['Facility']['current']  = str(ring.current.get()) + ' mA'
     try:
-        rightnow['Facility']['current']  = str(round(ring.current.get(), 1))
-        rightnow['Facility']['energy']   = str(round(ring.energy.get()/1000., 1))
-        rightnow['Facility']['mode']     = ring.mode.get()
+        ring = user_ns['ring']
+        snap = user_ns['pvsnap'].take({'ring_current' : ring.current,
+                                       'ring_energy'  : (ring.energy, 600),
+                                       'ring_mode'    : (ring.mode,    60), }, fallback=True)
+        rightnow['Facility']['current']  = str(round(snap['ring_current'], 1))
+        rightnow['Facility']['energy']   = str(round(snap['ring_energy']/1000., 1))
+        rightnow['Facility']['mode']     = snap['ring_mode']
     except:
         rightnow['Facility']['current']  = '0'
         rightnow['Facility']['energy']   = '0'
@@ -7,12 +7,9 @@ import matplotlib.pyplot as plt
 import h5py
 import os
 
-#from sklearn.neighbors import KNeighborsClassifier
-from sklearn.ensemble import RandomForestClassifier
-#from sklearn.neural_network import MLPClassifier
-
-from sklearn.model_selection import train_test_split
-from joblib import dump, load
+## scikit-learn takes a couple of seconds to import, so it and the
+## model are only loaded when a scan is first evaluated (or the model
+## is trained)
 
 from IPython import get_ipython
 user_ns = get_ipython().user_ns
@@ -24,7 +21,7 @@ class BMMDataEvaluation():
     '''
     def __init__(self):
         self.GRIDSIZE = 401
-        self.clf      = None
+        self._clf     = None
         self.X        = None
         self.y        = None
         self.folder   = os.path.join(os.getenv('HOME'), '.ipython', 'profile_collection', 'startup', 'ML')
@@ -34,9 +31,19 @@ class BMMDataEvaluation():
                          os.path.join(self.folder, 'verygood_training_set.hdf5'),]
         self.good_emoji = ':heavy_check_mark:'
         self.bad_emoji  = ':heavy_multiplication_x:'
-        if os.path.isfile(self.model):
-            self.clf = load(self.model)
-        
+
+    @property
+    def clf(self):
+        '''The evaluation model, read from disk the first time it is needed.'''
+        if self._clf is None and os.path.isfile(self.model):
+            from joblib import load
+            self._clf = load(self.model)
+        return self._clf
+
+    @clf.setter
+    def clf(self, value):
+        self._clf = value
+
 
     def extract_mu(self, clog=None, uid=None, mode='transmission', fig=None, ax=None, show_plot=True):
         '''Slurp a record from Databroker, contruct transmission or
@@ -208,6 +215,11 @@ class BMMDataEvaluation():
                     scores.append(score)
                     data.append(mu)
 
+        #from sklearn.neighbors import KNeighborsClassifier
+        from sklearn.ensemble import RandomForestClassifier
+        #from sklearn.neural_network import MLPClassifier
+        from sklearn.model_selection import train_test_split
+        from joblib import dump
         X_train, X_test, y_train, y_test = train_test_split(data, scores, random_state=0)
         print("training model...")
         #self.clf=KNeighborsClassifier(n_neighbors=1)
@@ -225,7 +237,7 @@ class BMMDataEvaluation():
         '''Thin wrapper around the classifier object's score method.'''
         return(self.clf.score(self.X, self.y))
 
-    def evaluate(self, uid, mode=None):
+    def evaluate(self, uid, mode=None, element=None, db=None):
         '''Perform an evaluation of a measurement.  The data will be
         interpolated onto the same grid used for the training set,
         then get subjected to the model.  This returns a tuple with
@@ -238,12 +250,19 @@ class BMMDataEvaluation():
             uid of data to be evaluated
         mode : bool
             when not None, used to specify fluorescence or transmission (for a data set that has both)
+        element : str
+            for xs mode, the element of the xspress3 ROIs at the time of the
+            measurement, None to use the current value of BMMuser.element
+        db : databroker object
+            where to find the measurement, None to use user_ns['db']
 
         '''
+        if db is None:
+            db = user_ns['db']
         if mode == 'xs':
-            BMMuser, db = user_ns['BMMuser'], user_ns['db']
-            t = db[-1].table()
-            el = BMMuser.element
+            BMMuser = user_ns['BMMuser']
+            t = db[uid].table()
+            el = element or BMMuser.element
             i0 = numpy.array(t['I0'])
             en = numpy.array(t['dcm_energy'])
             dtc1 = numpy.array(t[el+'1'])
@@ -253,7 +272,6 @@ class BMMDataEvaluation():
             signal = dtc1+dtc2+dtc3+dtc4
             mu = signal/i0
         else:
-            db = user_ns['db']
             this = db.v2[uid]
             if mode is None:
                 mode = this.metadata['start']['XDI']['_mode'][0]
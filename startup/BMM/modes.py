@@ -20,22 +20,31 @@ def read_mode_data():
 if os.path.isfile(os.path.join(user_ns["BMM_CONFIGURATION_LOCATION"], 'Modes.json')):
      MODEDATA = read_mode_data()
 
-def pds_motors_ready():
+def _amplifier_check(m):
+    '''Return a health check function for the amplifier fault bits of an FMBO motor.'''
+    def check():
+        amfe, amfae = m.amfe.get(), m.amfae.get()
+        if amfe or amfae:
+            return (False, "%-12s : %s / %s" % (m.name, m.amfe.enum_strs[amfe], m.amfae.enum_strs[amfae]))
+        return (True, '')
+    return check
+
+def pds_motors_ready(fresh=False):
+    '''Check the amplifier fault bits of the photon delivery system motors.
+    Returns True if none are faulted.
+
+    The motors are checked concurrently by the health check service and
+    a passing result is reused for a few seconds, see BMM.healthcheck.
+    Set fresh to True to force the checks to be made again.
+    '''
     m3, m2, m2_bender, dm3_bct = user_ns['m3'], user_ns['m2'], user_ns['m2_bender'], user_ns['dm3_bct']
-    dcm_pitch, dcm_roll, dcm_perp, dcm_roll, dcm_bragg = user_ns["dcm_pitch"], user_ns["dcm_roll"], user_ns["dcm_perp"], user_ns["dcm_roll"], user_ns["dcm_bragg"]
-    mcs8_motors = [m3.xu, m3.xd, m3.yu, m3.ydo, m3.ydi, m2.xu, m2.xd, m2.yu, m2.ydo, m2.ydi, m2_bender, dcm_pitch, dcm_roll, dcm_perp, dcm_roll, dcm_bragg, dm3_bct]
-
-    count = 0
-    for m in mcs8_motors:
-        if m.amfe.get() or m.amfae.get():
-            print(error_msg("%-12s : %s / %s" % (m.name, m.amfe.enum_strs[m.amfe.get()], m.amfae.enum_strs[m.amfae.get()])))
-            count += 1
-        else:
-            pass
-    if count > 0:
-        return(False)
-    else:
-        return(True)
+    dcm_pitch, dcm_roll, dcm_perp, dcm_bragg = user_ns["dcm_pitch"], user_ns["dcm_roll"], user_ns["dcm_perp"], user_ns["dcm_bragg"]
+    mcs8_motors = [m3.xu, m3.xd, m3.yu, m3.ydo, m3.ydi, m2.xu, m2.xd, m2.yu, m2.ydo, m2.ydi, m2_bender, dcm_pitch, dcm_roll, dcm_perp, dcm_bragg, dm3_bct]
+
+    report = user_ns['health'].run('PDS motors', {m.name: _amplifier_check(m) for m in mcs8_motors}, fresh=fresh)
+    for r in report.failed():
+        print(error_msg(r.text))
+    return(report.ok)
 
      
 def change_mode(mode=None, prompt=True, edge=None, reference=None, bender=True):
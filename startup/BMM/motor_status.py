@@ -34,17 +34,13 @@ def motor_metadata(uid=None):
         table = db[uid].table('baseline')
     except:
         pass
-    for m in biglist:
-        if table is None:
-            try:
-                md[m.name] = m.readback.get()
-            except:
-                pass
-            try:
-                md[m.name] = m.user_readback.get()
-            except:
-                pass
-        else:
+    if table is None:
+        snap = user_ns['pvsnap'].take({m.name: m for m in biglist}, fallback=True)
+        for m in biglist:
+            if snap[m.name] is not None:
+                md[m.name] = snap[m.name]
+    else:
+        for m in biglist:
             md[m.name] = table[m.name][1]
             
     return(md)
@@ -0,0 +1,237 @@
+import os, time, threading, queue, traceback
+
+from BMM.functions import error_msg, warning_msg, go_msg, url_msg, bold_msg, verbosebold_msg, list_msg, disconnected_msg, info_msg, whisper
+from BMM.gdrive    import copy_to_gdrive, synch_gdrive_folder
+from BMM.logging   import BMM_log_info, report
+from BMM.xdi       import write_XDI, xdi_context
+
+from IPython import get_ipython
+user_ns = get_ipython().user_ns
+
+
+class BMMPostScan():
+    '''A work queue for the chores that follow each repetition of an
+    XAFS scan sequence.
+
+    Writing the XDI file, evaluating the data with the ML model, and
+    pushing the data file to Google drive all used to happen in the
+    plan, blocking the RunEngine before the mono could start the next
+    repetition.  Now the plan enqueues the uid and moves on.  A
+    worker thread does the chores in the background.
+
+    Jobs are processed strictly in the order they were enqueued and
+    each job does its steps in order (XDI file, then evaluation, then
+    Google drive).  A step that raises an exception is retried up to
+    self.retries times, waiting self.delay seconds (doubling each
+    time) between attempts.  A job whose XDI or Google drive step
+    exhausts its retries is kept in self.failed, from which it can be
+    resubmitted with retry_failed().  A failed evaluation is reported,
+    but the job carries on.
+
+    A worker thread is used rather than a process pool because the
+    chores rely on the ophyd objects in the IPython user namespace.
+    By the time a job is done, the next scan has likely begun, so
+    everything the chores need from BMMuser is captured when the job
+    is enqueued.
+
+    Attributes
+    ----------
+    enabled : bool
+        False to do the chores synchronously in the plan, as before
+    retries : int
+        number of attempts for each step of a job
+    delay : float
+        initial wait (seconds) between attempts
+    catalog : databroker object or None
+        where to find run headers for the XDI file and the evaluation,
+        None means user_ns['db']
+    gdrive : function
+        function which copies a data file to Google drive
+    synch : function
+        function which pushes the Google drive folder, None to skip
+    evaluate : bool
+        False to skip the data evaluation step
+
+    Example
+    -------
+    >>> postscan.enqueue(uid=uid, datafile='/path/to/data.001', mode='transmission')
+    >>> postscan.join()      # wait for all outstanding jobs
+    >>> postscan.status()    # report on the queue
+
+    To test with a local catalog and a fake Google drive, set
+    postscan.catalog to a temporary databroker and postscan.gdrive to
+    a function that copies into a temporary directory.
+    '''
+    def __init__(self):
+        self.enabled  = True
+        self.retries  = 3
+        self.delay    = 2.0
+        self.catalog  = None
+        self.gdrive   = copy_to_gdrive
+        self.synch    = synch_gdrive_folder
+        self.evaluate = True
+        self.done     = []
+        self.failed   = []
+        self.current  = None
+        self.__queue  = queue.Queue()
+        self.__lock   = threading.Lock()
+        self.__thread = None
+
+    def start(self):
+        '''Start the worker thread, if it is not already running.'''
+        with self.__lock:
+            if self.__thread is not None and self.__thread.is_alive():
+                return
+            self.__thread = threading.Thread(target=self._worker, name='BMM post-scan', daemon=True)
+            self.__thread.start()
+
+    def enqueue(self, uid=None, datafile=None, mode='transmission', stage=None, context=None, span=None):
+        '''Submit the chores for a finished scan.
+
+        Parameters
+        ----------
+        uid : str
+            uid of the scan
+        datafile : str
+            fully resolved path of the XDI file to write
+        mode : str
+            measurement mode, used to select the data evaluation
+        stage : str or None
+            Sample.stage metadata line, captured when the scan finished
+            since the sample stage will likely have moved on by the
+            time the XDI file is written
+        context : SimpleNamespace or None
+            the state needed to write the XDI file, as captured by
+            xdi_context() when the scan finished, None to capture it
+            now (using stage)
+        span : Span or None
+            the timing span of the repetition, each step is recorded
+            as a span inside it, see BMM/spans.py
+        '''
+        if context is None:
+            context = xdi_context(stage)
+        job = {'uid'      : uid,
+               'datafile' : datafile,
+               'fname'    : os.path.basename(datafile),
+               'mode'     : mode,
+               'context'  : context,
+               'span'     : span,
+               'enqueued' : time.time(),
+               'steps'    : [], }
+        if self.enabled is False:
+            self._process(job)
+            return
+        self.start()
+        self.__queue.put(job)
+        print(whisper(f'  queued post-scan chores for {job["fname"]} ({self.__queue.qsize()} waiting)'))
+
+    def join(self, timeout=None):
+        '''Block until all enqueued jobs are finished.  Returns True if the
+        queue drained, False if the timeout (in seconds) was reached.'''
+        if self.__thread is None or not self.__thread.is_alive():
+            return self.__queue.unfinished_tasks == 0
+        if timeout is None:
+            self.__queue.join()
+            return True
+        end = time.time() + timeout
+        while self.__queue.unfinished_tasks > 0:
+            if time.time() > end:
+                return False
+            time.sleep(0.1)
+        return True
+
+    def pending(self):
+        '''Number of jobs either waiting or in progress.'''
+        return self.__queue.unfinished_tasks
+
+    def status(self):
+        '''Print a short summary of the state of the work queue.'''
+        print(bold_msg('Post-scan work queue:'))
+        print(f'\tworker running : {self.__thread is not None and self.__thread.is_alive()}')
+        print(f'\tin progress    : {self.current}')
+        print(f'\tpending        : {self.pending()}')
+        print(f'\tfinished       : {len(self.done)}')
+        if len(self.failed) > 0:
+            print(error_msg(f'\tfailed         : {len(self.failed)}'))
+            for job in self.failed:
+                print(error_msg(f'\t\t{job["fname"]}  ({job["uid"]})  {", ".join(job["steps"])}'))
+
+    def retry_failed(self):
+        '''Resubmit all jobs that previously exhausted their retries.'''
+        failed, self.failed = self.failed, []
+        for job in failed:
+            self.enqueue(uid=job['uid'], datafile=job['datafile'], mode=job['mode'], context=job['context'])
+
+    def _worker(self):
+        while True:
+            job = self.__queue.get()
+            self.current = job['fname']
+            try:
+                self._process(job)
+            except Exception as e:  # never let the worker die
+                print(error_msg(f'post-scan worker: {e}'))
+            finally:
+                self.current = None
+                self.__queue.task_done()
+
+    def _span(self, job, step):
+        '''Begin a timing span for a step, if the job came with one.'''
+        if job.get('span') is None or 'spans' not in user_ns:
+            return None
+        return user_ns['spans'].begin(step, parent=job['span'], waited=time.time()-job['enqueued'])
+
+    def _attempt(self, job, step, func):
+        '''Run func, retrying with a doubling delay.  Returns True on success.'''
+        delay = self.delay
+        span = self._span(job, step)
+        for attempt in range(1, self.retries+1):
+            try:
+                func()
+                if span is not None: span.end()
+                return True
+            except Exception as e:
+                if attempt == self.retries:
+                    if span is not None: span.end(ok=False)
+                    print(error_msg(f'post-scan {step} failed for {job["fname"]} after {attempt} attempts: {e}'))
+                    BMM_log_info(f'post-scan {step} failed for {job["fname"]}, uid = {job["uid"]}\n{traceback.format_exc()}')
+                    job['steps'].append(step)
+                    return False
+                print(warning_msg(f'post-scan {step} failed for {job["fname"]} (attempt {attempt}), retrying in {delay:.1f} s'))
+                time.sleep(delay)
+                delay = delay * 2
+        return False
+
+    def _process(self, job):
+        db = self.catalog
+        if db is None:
+            db = user_ns['db']
+
+        ## the XDI file must exist before anything else can happen, it
+        ## will already be there if XDIStreamWriter wrote it during the scan
+        def xdi():
+            if os.path.isfile(job['datafile']):
+                return
+            write_XDI(job['datafile'], db[job['uid']], context=job['context'])
+            print(bold_msg('wrote %s' % job['datafile']))
+        if not self._attempt(job, 'xdi', xdi):
+            self.failed.append(job)
+            return
+
+        if any(md in job['mode'] for md in ('trans', 'fluo', 'flou', 'both', 'ref', 'xs')):
+            ## the evaluation only informs, a job whose evaluation fails
+            ## still goes on to Google drive and is not counted as failed
+            def evaluation():
+                score, emoji = user_ns['clf'].evaluate(job['uid'], mode=job['mode'], element=job['context'].element, db=db)
+                report(f"Data evaluation ({job['fname']}): {emoji}", level='bold', slack=True)
+            if self.evaluate is True and 'clf' in user_ns:
+                self._attempt(job, 'evaluation', evaluation)
+
+            def gdrive():
+                self.gdrive(job['fname'])
+                if self.synch is not None:
+                    self.synch()
+            if not self._attempt(job, 'gdrive', gdrive):
+                report(f"Failed to push {job['fname']} to Google drive...", level='bold', slack=True)
+                self.failed.append(job)
+                return
+        self.done.append(job)
@@ -0,0 +1,193 @@
+import time, math, threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from types import MappingProxyType
+
+from BMM.functions import warning_msg
+
+from IPython import get_ipython
+user_ns = get_ipython().user_ns
+
+
+def readback(obj):
+    '''Return the signal to read for a motor-like object: its user
+    readback, its readback, or the object itself if it is a signal.'''
+    for attr in ('user_readback', 'readback'):
+        if hasattr(obj, attr):
+            return getattr(obj, attr)
+    return obj
+
+
+class Snapshot():
+    '''An immutable, timestamped record of a set of signal values.
+
+    Attributes
+    ----------
+    time : float
+        epoch time at which the snapshot was taken
+    values : mapping
+        name -> value, None for a signal that could not be read
+    timestamps : mapping
+        name -> epoch time at which that value was read
+    failed : tuple of str
+        names of the signals which could not be read (or timed out)
+    cached : tuple of str
+        names of the signals whose values came from the cache
+    '''
+    def __init__(self, values, timestamps, failed, cached):
+        object.__setattr__(self, 'time',       time.time())
+        object.__setattr__(self, 'values',     MappingProxyType(dict(values)))
+        object.__setattr__(self, 'timestamps', MappingProxyType(dict(timestamps)))
+        object.__setattr__(self, 'failed',     tuple(failed))
+        object.__setattr__(self, 'cached',     tuple(cached))
+
+    def __setattr__(self, key, value):
+        raise AttributeError('a snapshot cannot be changed')
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def __contains__(self, key):
+        return key in self.values
+
+    def __repr__(self):
+        return f'<Snapshot of {len(self.values)} signals, {len(self.failed)} failed, {len(self.cached)} cached>'
+
+    def get(self, key, default=None):
+        value = self.values.get(key)
+        return default if value is None else value
+
+    def ok(self):
+        return len(self.failed) == 0
+
+
+class PVSnapshot():
+    '''Read a set of signals concurrently.
+
+    Reading ~70 motor positions one after another at the start of each
+    scan adds up.  This reads them from a pool of threads, so the time
+    for the whole set is about the time of the slowest signal.
+
+    Attributes
+    ----------
+    timeout : float
+        time (seconds) allowed for each signal, passed to the signal's
+        get(timeout=...).  A signal that takes longer is reported as
+        failed.  The signals are read self.workers at a time, so a
+        snapshot of n signals takes at most about
+        timeout * (ceil(n/workers) + 1) seconds.  The extra timeout is
+        grace for signals whose get() ignores the timeout.
+    workers : int
+        number of reader threads
+    verbose : bool
+        report failed signals when a snapshot is taken
+
+    Example
+    -------
+    >>> snap = pvsnap.take({'m2_pitch': m2.pitch, 'ring_mode': (ring.mode, 600)})
+    >>> snap['m2_pitch'], snap.failed
+
+    Each entry of the dict is either a signal (or motor) or a
+    (signal, max_age) tuple.  A value read less than max_age seconds
+    ago is taken from the cache rather than read again.  This is meant
+    for things that change slowly, like the mono encoder resolution or
+    the storage ring mode.
+
+    A signal whose read from an earlier snapshot has still not
+    returned is not read again, it is reported as failed right away,
+    so a hung signal ties up at most one reader thread.
+
+    With fallback=True, each failed signal is read once more, directly
+    and with the same timeout, before giving up on it.
+
+    For testing, ophyd.sim signals can be given a slow get() to
+    inject latency.
+    '''
+    def __init__(self):
+        self.timeout  = 1.0
+        self.workers  = 32
+        self.verbose  = True
+        self.__cache  = dict()   # name -> (value, time read)
+        self.__busy   = set()    # names of signals being read right now
+        self.__lock   = threading.Lock()
+        self.__pool   = None
+
+    def _pool(self):
+        if self.__pool is None or self.__pool._max_workers != self.workers:
+            self.__pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='BMM snapshot')
+        return self.__pool
+
+    def _get(self, signal):
+        signal = readback(signal)
+        try:
+            return signal.get(timeout=self.timeout)
+        except TypeError:       # a signal-like object whose get() has no timeout
+            return signal.get()
+
+    def _read(self, name, signal):
+        try:
+            value = self._get(signal)
+            now = time.time()
+            with self.__lock:
+                self.__cache[name] = (value, now)
+            return value, now
+        finally:
+            with self.__lock:
+                self.__busy.discard(name)
+
+    def take(self, signals, fallback=False):
+        '''Read all the signals in the dict signals and return a Snapshot.
+        With fallback=True, failed signals are read once more directly.'''
+        values, timestamps, failed, cached = dict(), dict(), list(), list()
+        now = time.time()
+        futures = dict()
+        for name, entry in signals.items():
+            signal, max_age = entry if type(entry) is tuple else (entry, None)
+            with self.__lock:
+                hit = self.__cache.get(name)
+            if max_age is not None and hit is not None and now - hit[1] < max_age:
+                values[name], timestamps[name] = hit
+                cached.append(name)
+                continue
+            with self.__lock:
+                busy = name in self.__busy
+                self.__busy.add(name)
+            if busy:            # still hung from an earlier snapshot
+                values[name], timestamps[name] = None, None
+                failed.append(name)
+                continue
+            futures[self._pool().submit(self._read, name, signal)] = name
+
+        if len(futures) > 0:
+            ## each read has its own timeout, the signals are read in
+            ## waves of self.workers at a time
+            waves = math.ceil(len(futures) / self.workers)
+            done, pending = wait(futures, timeout=self.timeout*(waves+1))
+            for f in done:
+                name = futures[f]
+                try:
+                    values[name], timestamps[name] = f.result()
+                except Exception:
+                    values[name], timestamps[name] = None, None
+                    failed.append(name)
+            for f in pending:
+                name = futures[f]
+                f.cancel()      # only stops reads which have not started
+                values[name], timestamps[name] = None, None
+                failed.append(name)
+        if fallback:
+            for name in list(failed):
+                entry = signals[name]
+                signal = entry[0] if type(entry) is tuple else entry
+                try:
+                    values[name], timestamps[name] = self._get(signal), time.time()
+                    failed.remove(name)
+                except Exception:
+                    pass
+        if len(failed) > 0 and self.verbose:
+            print(warning_msg(f'could not read: {", ".join(sorted(failed))}'))
+        return Snapshot(values, timestamps, failed, cached)
+
+    def clear(self):
+        '''Forget all cached values.'''
+        with self.__lock:
+            self.__cache.clear()
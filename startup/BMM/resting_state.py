@@ -8,10 +8,7 @@ user_ns = get_ipython().user_ns
 from BMM.logging import BMM_msg_hook
 
 def resting_redis():
-    rkvs = user_ns['rkvs']
-    rkvs.set('BMM:scan:type',      '')
-    rkvs.set('BMM:scan:starttime', '')
-    rkvs.set('BMM:scan:estimated', 0)
+    user_ns['rkvs'].scan_finished()
 
 def resting_state():
     '''
@@ -0,0 +1,803 @@
+'''A simulated BMM, for measuring the overhead of the BMM plans offline.
+
+SimulatedBMM puts ophyd.sim style stand-ins for the beamline into the
+IPython user namespace, under the names the plans look up: the DCM,
+the mirrors and slits, the XAFS table and sample motors, the ion
+chambers (quadem1), the Struck (vor), the Xspress3, the cameras, the
+shutters and ring status, a fake redis, and a temporary databroker.
+Everything it replaces is put back when it is done.  The software
+services made at startup (BMMuser, pvsnap, health, postscan, and so
+on) are used as they are, so this is meant to be run in a BMM session.
+
+PlanProfile wraps a plan and accounts for the wall clock and CPU time
+spent on each kind of message (set, wait, trigger, read, save, ...)
+and in the plan itself between messages.
+
+bmm_benchmark() runs the real linescan, areascan, timescan,
+change_edge, change_mode, and xafs plans against the simulation.  It
+keeps the results in a JSON file and compares each run with the
+previous one, so the effect of a change to a plan can be measured
+without the beamline.
+
+Example
+-------
+>>> bmm_benchmark()                         # all of them
+>>> bmm_benchmark(['linescan', 'xafs'], repeat=3)
+>>> benchmark_history('xafs')
+'''
+
+import os, time, json, shutil, socket, datetime, tempfile, subprocess, threading, builtins
+import numpy
+
+from ophyd import Device, Signal, Component as Cpt
+from ophyd.status import DeviceStatus
+from bluesky import RunEngine
+from bluesky.plan_stubs import null, mv
+
+from BMM.functions import HBARC, error_msg, warning_msg, bold_msg, whisper
+from BMM.gdrive    import GdriveSync
+from BMM.kvs       import BMMRedis
+from BMM.spans     import SpanRecorder
+
+from IPython import get_ipython
+user_ns = get_ipython().user_ns
+
+
+class FakeRedis():
+    '''An in-memory stand-in for the redis client used as rkvs.  Values
+    come back as bytes, as they do from redis.'''
+    def __init__(self):
+        self.store = dict()
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def set(self, key, value):
+        if not isinstance(value, bytes):
+            value = str(value).encode('utf-8')
+        self.store[key] = value
+        return True
+
+    def delete(self, *keys):
+        return sum(self.store.pop(k, None) is not None for k in keys)
+
+    def exists(self, key):
+        return int(key in self.store)
+
+    def keys(self, pattern='*'):
+        import fnmatch
+        return [k.encode('utf-8') for k in self.store if fnmatch.fnmatch(k, pattern)]
+
+    def mget(self, keys):
+        return [self.store.get(k) for k in keys]
+
+    def ping(self):
+        return True
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline():
+    '''Commands queued on a FakeRedis, run by execute().'''
+    def __init__(self, client):
+        self.client   = client
+        self.commands = []
+
+    def set(self, key, value):
+        self.commands.append((key, value))
+        return self
+
+    def execute(self):
+        return [self.client.set(k, v) for k, v in self.commands]
+
+
+class SimEpicsMotor(Device):
+    '''A motor which moves at its velocity, with the user_readback and
+    user_setpoint of an EpicsMotor.  The class name contains
+    "EpicsMotor" so that the plans' type checks accept it.'''
+    user_readback = Cpt(Signal, value=0.0, kind='hinted')
+    user_setpoint = Cpt(Signal, value=0.0, kind='normal')
+    velocity      = Cpt(Signal, value=5.0, kind='config')
+    acceleration  = Cpt(Signal, value=0.2, kind='config')
+    kill_cmd      = Cpt(Signal, value=0,   kind='omitted')
+    llm           = Cpt(Signal, value=-1e6, kind='omitted')
+    hlm           = Cpt(Signal, value=1e6,  kind='omitted')
+    resolution    = Cpt(Signal, value=5e-6, kind='config')
+    user_offset   = Cpt(Signal, value=0.0,  kind='config')
+    amfe          = Cpt(Signal, value=0,    kind='omitted')
+    amfae         = Cpt(Signal, value=0,    kind='omitted')
+
+    def __init__(self, *args, value=0.0, velocity=5.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user_readback.name = self.name
+        self.user_readback.put(value)
+        self.user_setpoint.put(value)
+        self.velocity.put(velocity)
+        self.settle = 0.01
+
+    @property
+    def position(self):
+        return self.user_readback.get()
+
+    @property
+    def readback(self):
+        return self.user_readback
+
+    @property
+    def limits(self):
+        return (self.llm.get(), self.hlm.get())
+
+    def set(self, target):
+        start = self.user_readback.get()
+        self.user_setpoint.put(target)
+        status = DeviceStatus(self)
+        def finish():
+            time.sleep(self.settle + abs(target - start) / max(self.velocity.get(), 1e-6))
+            self.user_readback.put(target)
+            status.set_finished()
+        threading.Thread(target=finish, daemon=True).start()
+        return status
+
+    def move(self, target, wait=True):
+        status = self.set(target)
+        if wait:
+            status.wait()
+        return status
+
+    def stop(self, *, success=False):
+        pass
+
+
+class SimWheel(SimEpicsMotor):
+    '''A sample or reference wheel with 24 slots, 15 degrees apart.'''
+    content = ['Ti', 'V',  'Cr', 'Mn', 'Fe', 'Co', 'Ni', 'Cu', 'Zn', 'Ga', 'Ge', 'As',
+               'Se', 'Br', 'Zr', 'Nb', 'Mo', 'Pt', 'Au', 'Pb', 'Bi', 'Ce', 'Sn', 'Hf']
+
+    def current_slot(self, value=None):
+        if value is None:
+            value = self.position
+        return int(round(value / 15)) % 24 + 1
+
+    def position_of_slot(self, target):
+        if isinstance(target, str):
+            target = self.content.index(target) + 1
+        return 15 * (target - 1)
+
+    def set_slot(self, slot):
+        yield from mv(self, self.position_of_slot(slot))
+
+    def recenter(self):
+        yield from null()
+
+
+class SimTelemetry():
+    '''A fixed overhead per point, in place of the scan history.'''
+    def __init__(self, overhead=0.15):
+        self.overhead = overhead
+
+    def interpolate(self, energy):
+        return self.overhead
+
+    def overhead_per_point(self, element, edge=None):
+        return [self.overhead, 0]
+
+
+class SimSpinners():
+    '''The glancing angle stage, as seen by the xafs plan.'''
+    def __init__(self):
+        self.alignment_filename = ''
+        self.y_uid, self.pitch_uid, self.f_uid = '', '', ''
+
+    def current(self):
+        return 1
+
+
+def _no_op_plan(self):
+    yield from null()
+
+
+def sim_axes(name, axes, **kwargs):
+    '''Make a Device with a SimEpicsMotor for each name in axes.'''
+    attrs = {ax: Cpt(SimEpicsMotor, '', **kwargs) for ax in axes}
+    attrs['kill_jacks'] = _no_op_plan
+    cls = type(f'Sim{name.capitalize()}', (Device,), attrs)
+    dev = cls('', name=name)
+    for ax in axes:
+        getattr(dev, ax).user_readback.name = f'{name}_{ax}'
+    return dev
+
+
+class SimDCM(Device):
+    '''A double crystal monochromator.  Moving the energy moves the
+    Bragg angle, at the Bragg axis' velocity.'''
+    bragg = Cpt(SimEpicsMotor, '', value=15.0, velocity=1.0)
+    pitch = Cpt(SimEpicsMotor, '', value=4.0)
+    roll  = Cpt(SimEpicsMotor, '', value=-5.0)
+    perp  = Cpt(SimEpicsMotor, '', value=30.0)
+    para  = Cpt(SimEpicsMotor, '', value=100.0)
+    x     = Cpt(SimEpicsMotor, '', value=0.0)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._crystal = '111'
+        self._twod    = 2*3.13597211
+        self.mode     = 'fixed'
+        self.suppress_channel_cut = False
+        self.offset   = 0
+        for m in ('bragg', 'pitch', 'roll', 'perp', 'para', 'x'):
+            getattr(self, m).user_readback.name = f'dcm_{m}'
+        self.energy = SimEnergy(self, name='dcm_energy')
+
+    def e2a(self, energy):
+        return 180*numpy.arcsin(2*numpy.pi*HBARC/(energy*self._twod))/numpy.pi
+
+    def a2e(self, angle):
+        return 2*numpy.pi*HBARC/self.wavelength(angle)
+
+    def wavelength(self, angle):
+        return self._twod*numpy.sin(numpy.pi*angle/180)
+
+    def set_crystal(self, crystal=None):
+        if crystal is not None:
+            self._crystal = crystal
+
+    def kill(self):
+        pass
+
+    def kill_plan(self):
+        yield from null()
+
+    def where(self):
+        return f'Energy = {self.energy.position:.2f}'
+    wh = where
+
+
+class SimEnergy(Device):
+    '''The energy axis of a SimDCM.'''
+    user_readback = Cpt(Signal, value=0.0, kind='hinted')
+    user_setpoint = Cpt(Signal, value=0.0, kind='normal')
+
+    def __init__(self, dcm, *args, **kwargs):
+        super().__init__('', *args, **kwargs)
+        self.dcm = dcm
+        self.user_readback.name = self.name
+        self.user_setpoint.name = f'{self.name}_setpoint'
+
+    @property
+    def readback(self):
+        return self.user_readback
+
+    @property
+    def position(self):
+        return self.dcm.a2e(self.dcm.bragg.position)
+
+    def read(self):
+        self.user_readback.put(self.position)
+        return super().read()
+
+    def set(self, energy):
+        self.user_setpoint.put(energy)
+        return self.dcm.bragg.set(self.dcm.e2a(energy))
+
+    def move(self, energy, wait=True):
+        status = self.set(energy)
+        if wait:
+            status.wait()
+        return status
+
+
+class SimAcquiring():
+    '''on/off for detectors, which are always on in the simulation.'''
+    def on(self):
+        pass
+
+    def off(self):
+        pass
+
+    def on_plan(self):
+        yield from null()
+
+    def off_plan(self):
+        yield from null()
+
+
+class SimIonChambers(SimAcquiring, Device):
+    '''The ion chambers, reading transmission through a simulated foil
+    at the DCM energy.  A reading integrates for averaging_time seconds.'''
+    I0 = Cpt(Signal, value=1.0, kind='hinted')
+    It = Cpt(Signal, value=1.0, kind='hinted')
+    Ir = Cpt(Signal, value=1.0, kind='hinted')
+    Iy = Cpt(Signal, value=1.0, kind='hinted')
+    averaging_time = Cpt(Signal, value=0.1, kind='config')
+
+    def __init__(self, *args, dcm=None, e0=7112, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dcm, self.e0 = dcm, e0
+        self._rng = numpy.random.default_rng(0)
+        for s in (self.I0, self.It, self.Ir, self.Iy):
+            s.name = s.attr_name
+
+    def mu(self, energy):
+        return 0.5 + 1.0/(1 + numpy.exp(-(energy-self.e0)/2.0)) - 0.0001*(energy-self.e0)
+
+    def trigger(self):
+        status = DeviceStatus(self)
+        def integrate():
+            time.sleep(self.averaging_time.get())
+            energy = self.dcm.energy.position if self.dcm is not None else self.e0
+            i0 = 1e5 * (1 + 0.001*self._rng.standard_normal())
+            self.I0.put(i0)
+            self.It.put(i0*numpy.exp(-self.mu(energy)))
+            self.Ir.put(i0*numpy.exp(-2*self.mu(energy)))
+            self.Iy.put(i0*0.01*self.mu(energy))
+            status.set_finished()
+        threading.Thread(target=integrate, daemon=True).start()
+        return status
+
+
+class SimStruckChannels(Device):
+    locals().update({f'chan{i}': Cpt(Signal, value=0.0, kind='normal') for i in range(1, 17)})
+
+
+class SimStruck(SimAcquiring, Device):
+    '''The Struck scaler with a 4-element detector: the ROI channels
+    (chan3 to chan14), the deadtime corrected signals, and the Bicron.'''
+    channels = Cpt(SimStruckChannels, '')
+    dtcorr1  = Cpt(Signal, value=0.0, kind='hinted')
+    dtcorr2  = Cpt(Signal, value=0.0, kind='hinted')
+    dtcorr3  = Cpt(Signal, value=0.0, kind='hinted')
+    dtcorr4  = Cpt(Signal, value=0.0, kind='hinted')
+    Bicron   = Cpt(Signal, value=0.0, kind='hinted')
+    preset_time = Cpt(Signal, value=0.1, kind='config')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for i, s in enumerate((self.dtcorr1, self.dtcorr2, self.dtcorr3, self.dtcorr4)):
+            s.name = f'DTC{i+1}'
+        self.Bicron.name = 'Bicron'
+        for i in range(1, 17):
+            getattr(self.channels, f'chan{i}').name = f'ROI{i}'
+
+    def trigger(self):
+        status = DeviceStatus(self)
+        def count():
+            time.sleep(self.preset_time.get())
+            for i in range(1, 17):
+                getattr(self.channels, f'chan{i}').put(float(numpy.random.poisson(1000)))
+            for s in (self.dtcorr1, self.dtcorr2, self.dtcorr3, self.dtcorr4):
+                s.put(float(numpy.random.poisson(5000)))
+            self.Bicron.put(float(numpy.random.poisson(100)))
+            status.set_finished()
+        threading.Thread(target=count, daemon=True).start()
+        return status
+
+
+class SimDwellTime(Device):
+    '''Sets the integration time of the ion chambers and the Struck together.'''
+    dwell_time        = Cpt(Signal, value=0.1, kind='hinted')
+    quadem_dwell_time = Cpt(Signal, value=0.1, kind='omitted')
+    struck_dwell_time = Cpt(Signal, value=0.1, kind='omitted')
+
+    def __init__(self, *args, quadem=None, struck=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.quadem, self.struck = quadem, struck
+
+    def set(self, value):
+        for sig in (self.dwell_time, self.quadem_dwell_time, self.struck_dwell_time):
+            sig.put(value)
+        for sig in (self.quadem.averaging_time, self.struck.preset_time):
+            sig.put(value)
+        status = DeviceStatus(self)
+        status.set_finished()
+        return status
+
+    def move(self, value, wait=True):
+        return self.set(value)
+
+
+class SimState(Device):
+    '''A shutter or a power supply, with a state and open/close commands.'''
+    state = Cpt(Signal, value=1)
+
+    def open(self):
+        self.state.put(0 if self.name == 'shb' else 1)
+
+    def close(self):
+        self.state.put(1 if self.name == 'shb' else 0)
+
+
+class SimRing(Device):
+    current    = Cpt(Signal, value=400.0)
+    filltarget = Cpt(Signal, value=400.0)
+    mode       = Cpt(Signal, value='Operations')
+    lifetime   = Cpt(Signal, value=10.0)
+
+
+_MISSING = object()
+
+class SimulatedBMM():
+    '''Put a simulated beamline into the user namespace.
+
+    Use it as a context manager, or call install() and restore().
+    While installed, input() answers "y" to every question, so the
+    plans run without a person at the keyboard, and HOME points at
+    the temporary folder, so nothing is copied to the real ~/gdrive.
+
+    Attributes
+    ----------
+    folder : str
+        temporary folder for data, images, and HDF5 files
+    speedup : float
+        motor velocities are multiplied by this
+    cameras : bool
+        serve the webcams from local synthetic cameras
+    '''
+    def __init__(self, folder=None, speedup=1.0, cameras=True):
+        self.folder  = folder or tempfile.mkdtemp(prefix='simulated_bmm_')
+        self.speedup = speedup
+        self.cameras = cameras
+        self.names   = dict()
+        self.saved   = dict()
+        self.servers = []
+        self._input  = None
+
+    def build(self):
+        '''Make the simulated devices, returning a dict of name -> object.'''
+        v = self.speedup
+        ns = dict()
+        dcm = SimDCM('', name='dcm')
+        for m in ('bragg', 'pitch', 'roll', 'perp', 'para', 'x'):
+            getattr(dcm, m).velocity.put(getattr(dcm, m).velocity.get()*v)
+        ns.update(dcm=dcm, dcm_bragg=dcm.bragg, dcm_pitch=dcm.pitch, dcm_roll=dcm.roll,
+                  dcm_perp=dcm.perp, dcm_para=dcm.para, dcm_x=dcm.x)
+
+        sample = ('xafs_x', 'xafs_y', 'xafs_linx', 'xafs_liny', 'xafs_pitch', 'xafs_roll', 'xafs_roth',
+                  'xafs_rots', 'xafs_lins', 'xafs_linxs', 'xafs_ref', 'xafs_wheel', 'xafs_refx', 'xafs_refy',
+                  'xafs_mtr8', 'xafs_xu', 'xafs_xd', 'dm3_bct', 'dm3_foils', 'dm2_fs', 'm2_bender')
+        for name in sample:
+            cls = SimWheel if name in ('xafs_wheel', 'xafs_ref') else SimEpicsMotor
+            ns[name] = cls('', name=name, velocity=5.0*v)
+        def kill_mirror_jacks():
+            yield from ns['m2'].kill_jacks()
+            yield from ns['m3'].kill_jacks()
+        ns['kill_mirror_jacks'] = kill_mirror_jacks
+        ns['xafs_rotb'] = ns['xafs_wheel']
+        ns['m2_bender'] = SimEpicsMotor('', name='m2_bender', value=212225, velocity=20000*v)
+        ns['ga'] = SimSpinners()
+        ns['tele'] = SimTelemetry()
+        mirror = ('vertical', 'lateral', 'pitch', 'roll', 'yaw', 'yu', 'ydo', 'ydi', 'xu', 'xd')
+        slits  = ('top', 'bottom', 'inboard', 'outboard', 'vsize', 'vcenter', 'hsize', 'hcenter')
+        ns['m1']          = sim_axes('m1', mirror, velocity=1.0*v)
+        ns['m2']          = sim_axes('m2', mirror, velocity=1.0*v)
+        ns['m3']          = sim_axes('m3', mirror, velocity=1.0*v)
+        ns['xafs_table']  = sim_axes('xafs_table', ('vertical', 'pitch', 'roll', 'yu', 'ydo', 'ydi'), velocity=1.0*v)
+        for name in ('slits2', 'slits3', 'slitsg'):
+            ns[name]      = sim_axes(name, slits, velocity=1.0*v)
+        ## the jacks are also known by their own names, e.g. m2_yu, xafs_ydo
+        for dev, prefix in (('m1', 'm1'), ('m2', 'm2'), ('m3', 'm3'), ('xafs_table', 'xafs')):
+            for jack in ('yu', 'ydo', 'ydi', 'xu', 'xd'):
+                if hasattr(ns[dev], jack):
+                    ns[f'{prefix}_{jack}'] = getattr(ns[dev], jack)
+        ns['motor_nicknames'] = {'x': ns['xafs_x'], 'y': ns['xafs_y'], 'roll': ns['xafs_roll'], 'pitch': ns['xafs_pitch'],
+                                 'roth': ns['xafs_roth'], 'rots': ns['xafs_rots'], 'wheel': ns['xafs_wheel'], 'ref': ns['xafs_ref']}
+
+        quadem1 = SimIonChambers('', name='quadem1', dcm=dcm)
+        vor     = SimStruck('', name='vor')
+        ns.update(quadem1=quadem1, vor=vor)
+        ns['_locked_dwell_time'] = SimDwellTime('', name='dwti', quadem=quadem1, struck=vor)
+        ns['dwell_time'] = ns['_locked_dwell_time'].dwell_time
+        ns['with_dualem'], ns['dualio'] = False, None
+
+        ## BMM.xspress3 and BMM.camera_device look things up in the user
+        ## namespace when they are imported
+        self.put(ns)
+        try:
+            from BMM.xspress3 import FakeXspress3
+            ns['xs'] = FakeXspress3('', name='xs', folder=self.folder, arm_time=0.05)
+            ns['with_xspress3'] = True
+        except Exception as E:
+            print(warning_msg(f'simulated Xspress3 not available: {E}'))
+            ns['with_xspress3'] = False
+
+        if self.cameras:
+            from BMM.camera_device import BMMSnapshot, SyntheticCamera
+            for cam in ('xascam', 'anacam'):
+                server = SyntheticCamera(latency=0.2).start()
+                self.servers.append(server)
+                ns[cam] = BMMSnapshot(root=self.folder, which='XAS', name=cam)
+                ns[cam]._url = server.url
+
+        ns['ring'] = SimRing('', name='ring')
+        for name in ('bmps', 'idps', 'shb'):
+            ns[name] = SimState('', name=name)
+        ns['shb'].state.put(0)
+        ns['rkvs'] = BMMRedis(host='simulated', client=FakeRedis())
+        ns['rkvs'].update({'BMM:pds:element': 'Fe', 'BMM:pds:edge': 'K'})
+
+        ## keep the timing spans of simulated plans out of the beamline's record
+        ns['spans'] = SpanRecorder(os.path.join(self.folder, 'spans.sqlite'))
+        ## copy into the temporary ~/gdrive, never push
+        ns['gsync'] = GdriveSync(command=None)
+
+        RE = RunEngine({})
+        ns['RE'] = RE
+        try:
+            from databroker import temp
+            ns['db'] = temp()
+            RE.subscribe(ns['db'].insert)
+        except Exception as E:
+            print(warning_msg(f'temporary databroker not available: {E}'))
+        return ns
+
+    def put(self, names):
+        '''Put names into the user namespace, keeping the originals.'''
+        for k, v in names.items():
+            if k not in self.saved:
+                self.saved[k] = user_ns.get(k, _MISSING)
+            user_ns[k] = v
+
+    def install(self):
+        '''Build the simulation and put it into the user namespace,
+        keeping whatever it replaces.'''
+        self.names = self.build()
+        self.put(self.names)
+        BMMuser = user_ns.get('BMMuser')
+        if BMMuser is not None:
+            settings = {'prompt': False, 'macro_dryrun': False, 'use_slack': False,
+                        'folder': self.folder, 'DATA': self.folder, 'name': 'Simulated',
+                        'date': datetime.date.today().isoformat(),
+                        'dtc1': 'DTC1', 'dtc2': 'DTC2', 'dtc3': 'DTC3', 'dtc4': 'DTC4'}
+            self.saved_user = {k: getattr(BMMuser, k, None) for k in settings}
+            for k, v in settings.items():
+                setattr(BMMuser, k, v)
+        gdrive = os.path.join(self.folder, 'gdrive', 'Data', 'Simulated', datetime.date.today().isoformat())
+        for sub in ('snapshots', 'dossier', 'prj', 'XRF'):
+            os.makedirs(os.path.join(self.folder, sub), exist_ok=True)
+            os.makedirs(os.path.join(gdrive, sub), exist_ok=True)
+        ## keep copies meant for ~/gdrive and the like in the temporary
+        ## folder, and never push anything to Google drive
+        self._home, os.environ['HOME'] = os.environ['HOME'], self.folder
+        postscan = user_ns.get('postscan')
+        if postscan is not None:
+            self.saved_postscan = {k: getattr(postscan, k) for k in ('gdrive', 'synch', 'evaluate', 'catalog')}
+            postscan.gdrive   = lambda fname: shutil.copyfile(os.path.join(self.folder, fname), os.path.join(gdrive, fname))
+            postscan.synch    = None
+            postscan.evaluate = False
+            postscan.catalog  = self.names.get('db')
+        self._input = builtins.input
+        builtins.input = lambda prompt='': 'y'
+        return self
+
+    def restore(self):
+        '''Put back everything install() replaced.'''
+        for k, v in self.saved.items():
+            if v is _MISSING:
+                user_ns.pop(k, None)
+            else:
+                user_ns[k] = v
+        self.saved = dict()
+        BMMuser = user_ns.get('BMMuser')
+        if BMMuser is not None and hasattr(self, 'saved_user'):
+            for k, v in self.saved_user.items():
+                setattr(BMMuser, k, v)
+        postscan = user_ns.get('postscan')
+        if postscan is not None and hasattr(self, 'saved_postscan'):
+            postscan.join()
+            for k, v in self.saved_postscan.items():
+                setattr(postscan, k, v)
+        if self._input is not None:
+            builtins.input = self._input
+            os.environ['HOME'] = self._home
+            self._input = None
+        for server in self.servers:
+            server.stop()
+        self.servers = []
+        if 'gsync' in self.names:
+            self.names['gsync'].enabled = False
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *args):
+        self.restore()
+
+
+class PlanProfile():
+    '''Wall clock and CPU time of a plan, broken down by phase.
+
+    Each message's phase is its command, and the time charged to it
+    runs from when the plan yields it until the RunEngine sends back
+    the response.  That includes waiting on hardware and running
+    callbacks.  Time spent in the plan's own code, between getting a
+    response and yielding the next message, is charged to "plan".
+    CPU time is process time, so it includes all threads.
+    '''
+    def __init__(self):
+        self.phases = dict()    # phase -> [wall, cpu, count]
+
+    def add(self, phase, wall, cpu):
+        this = self.phases.setdefault(phase, [0.0, 0.0, 0])
+        this[0] += wall
+        this[1] += cpu
+        this[2] += 1
+
+    def wrap(self, plan):
+        '''Return plan, instrumented.'''
+        response, exception = None, None
+        try:
+            while True:
+                w0, c0 = time.perf_counter(), time.process_time()
+                try:
+                    if exception is not None:
+                        msg = plan.throw(exception)
+                    else:
+                        msg = plan.send(response)
+                except StopIteration as e:
+                    self.add('plan', time.perf_counter()-w0, time.process_time()-c0)
+                    return e.value
+                self.add('plan', time.perf_counter()-w0, time.process_time()-c0)
+                w0, c0 = time.perf_counter(), time.process_time()
+                try:
+                    response, exception = (yield msg), None
+                except GeneratorExit:
+                    raise
+                except Exception as e:
+                    response, exception = None, e
+                self.add(msg.command, time.perf_counter()-w0, time.process_time()-c0)
+        finally:
+            plan.close()
+
+    def as_dict(self):
+        return {k: {'wall': v[0], 'cpu': v[1], 'count': v[2]} for k, v in self.phases.items()}
+
+
+def _xafs_ini(folder):
+    '''Write a short Fe K edge INI file for the xafs benchmark.'''
+    inifile = os.path.join(folder, 'benchmark.ini')
+    with open(inifile, 'w') as fh:
+        fh.write(f'''[scan]
+experimenters = benchmark
+folder        = {folder}
+filename      = benchmark
+sample        = Fe foil
+prep          = simulated
+comment       = simulated BMM benchmark
+element       = Fe
+edge          = K
+nscans        = 1
+start         = next
+mode          = transmission
+bounds        = -30 -10 15.5 6k
+steps         =    2.0  0.5  0.1k
+times         =    0.2  0.2  0.1k
+snapshots     = True
+htmlpage      = False
+lims          = False
+''')
+    return inifile
+
+## name -> (plan module, function of the SimulatedBMM returning the plan)
+BENCHMARKS = {
+    'linescan':    ('BMM.linescans', lambda sim, f: f('it', 'x', -1, 1, 21, pluck=False, inttime=0.1)),
+    'areascan':    ('BMM.areascan',  lambda sim, f: f('it', 'x', -1, 1, 5, 'y', -1, 1, 5, pluck=False, dwell=0.1)),
+    'timescan':    ('BMM.timescan',  lambda sim, f: f('it', 21, 0.1, 0)),
+    'change_edge': ('BMM.edge',      lambda sim, f: f('Fe', focus=True, slits=False)),
+    'change_mode': ('BMM.modes',     lambda sim, f: f('E', prompt=False)),
+    'xafs':        ('BMM.xafs',      lambda sim, f: f(_xafs_ini(sim.folder))),
+}
+
+
+def benchmark_file():
+    return os.path.join(os.environ['HOME'], 'Data', 'benchmarks', 'bmm_benchmarks.json')
+
+def _revision():
+    try:
+        here = os.path.dirname(os.path.abspath(__file__))
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=here,
+                              capture_output=True, text=True).stdout.strip()
+    except Exception:
+        return ''
+
+def _load_results(fname):
+    if not os.path.isfile(fname):
+        return []
+    with open(fname, 'r') as fh:
+        return json.load(fh)
+
+
+def run_benchmark(name, sim, repeat=1):
+    '''Run one benchmark in an installed SimulatedBMM.  Returns a dict
+    with the median wall and CPU times and the phases of the fastest run.'''
+    module, make = BENCHMARKS[name]
+    RE = user_ns['RE']
+    walls, cpus, best, error, nevents = [], [], None, None, 0
+    counter = {'events': 0}
+    def count(name, doc):
+        if name == 'event':
+            counter['events'] += 1
+        elif name == 'event_page':
+            counter['events'] += len(doc['seq_num'])
+    token = RE.subscribe(count)
+    try:
+        func = getattr(__import__(module, fromlist=[name]), name)
+        for i in range(repeat):
+            counter['events'] = 0
+            profile = PlanProfile()
+            w0, c0 = time.perf_counter(), time.process_time()
+            RE(profile.wrap(make(sim, func)))
+            walls.append(time.perf_counter()-w0)
+            cpus.append(time.process_time()-c0)
+            if best is None or walls[-1] <= min(walls):
+                best = profile
+            nevents = counter['events']
+    except Exception as E:
+        error = f'{type(E).__name__}: {E}'
+    finally:
+        RE.unsubscribe(token)
+    return {'name': name, 'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'revision': _revision(), 'host': socket.gethostname(), 'repeat': len(walls),
+            'wall': float(numpy.median(walls)) if walls else None,
+            'cpu':  float(numpy.median(cpus))  if cpus  else None,
+            'events': nevents, 'phases': best.as_dict() if best else {}, 'error': error}
+
+
+def show_benchmark(result, previous=None):
+    '''Print a benchmark result, compared with a previous result if given.'''
+    if result['error'] is not None:
+        print(error_msg(f'{result["name"]}: failed -- {result["error"]}'))
+        return
+    line = f'{result["name"]}: {result["wall"]:.2f} s wall, {result["cpu"]:.2f} s CPU, {result["events"]} events'
+    if previous is not None and previous.get('wall'):
+        change = 100*(result['wall'] - previous['wall'])/previous['wall']
+        line += f'  ({change:+.1f}% vs. {previous["revision"]} on {previous["time"]})'
+    print(bold_msg(line))
+    before = previous['phases'] if previous is not None else {}
+    for phase, p in sorted(result['phases'].items(), key=lambda x: x[1]['wall'], reverse=True):
+        text = f'\t{phase:14} {p["wall"]:8.3f} s wall {p["cpu"]:8.3f} s CPU {p["count"]:6d} msgs'
+        if phase in before:
+            text += f'   was {before[phase]["wall"]:8.3f} s'
+        print(text)
+
+
+def bmm_benchmark(names=None, repeat=1, speedup=10.0, save=True):
+    '''Run the plan benchmarks against a simulated BMM, print the
+    results compared with the previous run, and save them.
+
+    Parameters
+    ----------
+    names : list of str
+        benchmarks to run, from BENCHMARKS, default all
+    repeat : int
+        times to run each, the median is reported
+    speedup : float
+        factor by which the simulated motors are faster than the real ones
+    save : bool
+        append the results to the file returned by benchmark_file()
+    '''
+    names = names or list(BENCHMARKS.keys())
+    fname = benchmark_file()
+    history = _load_results(fname)
+    results = []
+    with SimulatedBMM(speedup=speedup) as sim:
+        for name in names:
+            print(whisper(f'running {name} benchmark ...'))
+            result = run_benchmark(name, sim, repeat=repeat)
+            previous = next((r for r in reversed(history) if r['name'] == name and r['error'] is None), None)
+            show_benchmark(result, previous)
+            results.append(result)
+    if save:
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with open(fname, 'w') as fh:
+            json.dump(history + results, fh, indent=1)
+    return results
+
+
+def benchmark_history(name):
+    '''Print the wall clock time of every saved run of a benchmark.'''
+    for r in _load_results(benchmark_file()):
+        if r['name'] == name:
+            if r['error'] is None:
+                print(f'{r["time"]}  {r["revision"]:10} {r["wall"]:8.2f} s wall {r["cpu"]:8.2f} s CPU  {r["events"]:5d} events')
+            else:
+                print(error_msg(f'{r["time"]}  {r["revision"]:10} failed -- {r["error"]}'))
@@ -0,0 +1,306 @@
+import os, time, json, sqlite3, threading, queue, atexit, datetime
+import numpy
+
+from BMM.functions import error_msg, warning_msg, bold_msg, whisper
+
+
+class Span():
+    '''A named, timed phase of a plan.
+
+    Made by SpanRecorder.begin() or SpanRecorder.span(), not directly.
+    Call end() when the phase is over, or use it as a context manager.
+
+    Attributes
+    ----------
+    name : str
+        name of this phase, e.g. "snapshots"
+    path : str
+        names of this span and the spans enclosing it, e.g. "xafs/repetition/scan"
+    tags : dict
+        context of the span, e.g. element, edge, mode, sequence, repetition
+    start : float
+        epoch time at which the span began
+    '''
+    def __init__(self, recorder, name, path, tags):
+        self.recorder = recorder
+        self.name     = name
+        self.path     = path
+        self.tags     = tags
+        self.start    = time.time()
+        self._wall    = time.perf_counter()
+        self._cpu     = time.process_time()
+        self.done     = False
+
+    def __repr__(self):
+        return f'<Span {self.path}{" (done)" if self.done else ""}>'
+
+    def end(self, ok=True):
+        '''End this span, and any spans begun inside it which are still open.'''
+        self.recorder._end(self, ok)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end(ok=exc_type is None)
+
+
+class SpanRecorder():
+    '''Record named, nested spans for the phases of a plan and keep them
+    in a local time series store.
+
+    Spans nest: a span begun while another is open in the same thread
+    is its child, and its path is the parent's path plus its own name.
+    The tags of the enclosing spans are inherited, so tagging the
+    outermost span of an XAFS scan sequence with the element, edge,
+    and mode tags every phase within it.  Work done on another thread,
+    such as the post-scan chores, names its parent explicitly.
+
+    Spans are written to an SQLite database by a background thread, so
+    ending a span costs the plan only a put on a queue.
+
+    Attributes
+    ----------
+    database : str
+        the SQLite file, ~/Data/BMM_spans.sqlite by default
+    enabled : bool
+        False to record nothing
+    verbose : bool
+        print each span as it ends
+
+    Example
+    -------
+    >>> with spans.span('xafs', element='Fe', edge='K', mode='transmission'):
+    ...     with spans.span('metadata'):
+    ...         md = bmm_metadata(...)
+    >>> s = spans.begin('snapshots')
+    >>> ...
+    >>> s.end()
+    >>> spans.summary(element='Fe', days=7)
+    >>> spans.timeline()           # the most recent XAFS scan sequence
+    '''
+    columns = ('time', 'name', 'path', 'depth', 'wall', 'cpu', 'ok',
+               'sequence', 'repetition', 'element', 'edge', 'mode', 'tags')
+
+    def __init__(self, database=None):
+        self.database = database or os.path.join(os.environ['HOME'], 'Data', 'BMM_spans.sqlite')
+        self.enabled  = True
+        self.verbose  = False
+        self.__local  = threading.local()
+        self.__queue  = queue.Queue()
+        self.__thread = None
+        self.__lock   = threading.Lock()
+        self.__failed = False
+        atexit.register(self.flush)
+
+    ## ---- recording --------------------------------------------------
+
+    def _stack(self):
+        if not hasattr(self.__local, 'stack'):
+            self.__local.stack = []
+        return self.__local.stack
+
+    def begin(self, name, parent=None, **tags):
+        '''Begin a span and return it.
+
+        Parameters
+        ----------
+        name : str
+            name of the phase
+        parent : Span or str or None
+            the span (or path) which encloses this one, needed only on
+            a thread other than the one which began the parent
+        tags : keyword arguments
+            context for this span and the spans inside it
+        '''
+        stack = self._stack()
+        if parent is None and len(stack) > 0:
+            parent = stack[-1]
+        if isinstance(parent, Span):
+            path, tags = f'{parent.path}/{name}', {**parent.tags, **tags}
+        elif parent is not None:
+            path = f'{parent}/{name}'
+        else:
+            path = name
+        span = Span(self, name, path, tags)
+        stack.append(span)
+        return span
+
+    def span(self, name, parent=None, **tags):
+        '''Same as begin(), for use as a context manager.'''
+        return self.begin(name, parent=parent, **tags)
+
+    def current(self):
+        '''The innermost open span in this thread, or None.'''
+        stack = self._stack()
+        return stack[-1] if len(stack) > 0 else None
+
+    def tag(self, **tags):
+        '''Add tags to every open span in this thread.  Useful when, say,
+        the edge is not known until the INI file has been read inside
+        a span.'''
+        for span in self._stack():
+            span.tags.update(tags)
+
+    def clear(self):
+        '''End, as unfinished, any spans left open in this thread, say by
+        a plan which was interrupted before it could close them.'''
+        stack = self._stack()
+        if len(stack) > 0:
+            stack[0].end(ok=False)
+
+    def _end(self, span, ok):
+        stack = self._stack()
+        if span.done:
+            return
+        ## children left open, say by a plan which was aborted, end with their parent
+        while span in stack:
+            this = stack.pop()
+            self._finish(this, ok if this is span else False)
+        if not span.done:       # begun in another thread
+            self._finish(span, ok)
+
+    def _finish(self, span, ok):
+        span.done = True
+        wall = time.perf_counter() - span._wall
+        cpu  = time.process_time() - span._cpu
+        if self.verbose:
+            print(whisper(f'  {span.path}: {wall:.3f} s'))
+        if not self.enabled:
+            return
+        tags = dict(span.tags)
+        element = tags.pop('element', None)
+        row = (span.start, span.name, span.path, span.path.count('/'), wall, cpu, int(ok),
+               tags.pop('sequence', None), tags.pop('repetition', None),
+               element.capitalize() if isinstance(element, str) else element,
+               tags.pop('edge', None), tags.pop('mode', None),
+               json.dumps(tags, default=str))
+        self.__queue.put(row)
+        self._start()
+
+    ## ---- the store ----------------------------------------------------
+
+    def _start(self):
+        with self.__lock:
+            if self.__thread is not None and self.__thread.is_alive():
+                return
+            self.__thread = threading.Thread(target=self._writer, name='BMM spans', daemon=True)
+            self.__thread.start()
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.database), exist_ok=True)
+        connection = sqlite3.connect(self.database, timeout=10)
+        connection.execute(f'CREATE TABLE IF NOT EXISTS spans ({", ".join(self.columns)})')
+        connection.execute('CREATE INDEX IF NOT EXISTS spans_by_edge ON spans (element, edge, mode)')
+        connection.execute('CREATE INDEX IF NOT EXISTS spans_by_time ON spans (time)')
+        connection.execute('CREATE INDEX IF NOT EXISTS spans_by_sequence ON spans (sequence)')
+        return connection
+
+    def _writer(self):
+        connection = None
+        while True:
+            rows = [self.__queue.get()]
+            while len(rows) < 500:
+                try:
+                    rows.append(self.__queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if connection is None:
+                    connection = self._connect()
+                with connection:
+                    connection.executemany(f'INSERT INTO spans VALUES ({", ".join("?"*len(self.columns))})', rows)
+            except Exception as E:
+                if not self.__failed:
+                    print(warning_msg(f'could not record timing spans in {self.database}: {E}'))
+                    self.__failed = True
+                connection = None
+            finally:
+                for r in rows:
+                    self.__queue.task_done()
+
+    def flush(self):
+        '''Wait until every ended span is in the database.'''
+        if self.__thread is not None and self.__thread.is_alive():
+            self.__queue.join()
+
+    ## ---- queries -------------------------------------------------------
+
+    def query(self, name=None, path=None, element=None, edge=None, mode=None, sequence=None, days=None):
+        '''Return the recorded spans which match all the arguments given,
+        oldest first, as a list of dicts.  days limits the search to the
+        most recent days.'''
+        self.flush()
+        if not os.path.isfile(self.database):
+            return []
+        where, args = [], []
+        for column, value in (('name', name), ('path', path), ('element', element), ('edge', edge),
+                              ('mode', mode), ('sequence', sequence)):
+            if value is not None:
+                where.append(f'{column} = ?')
+                args.append(value.capitalize() if column == 'element' else value)
+        if days is not None:
+            where.append('time > ?')
+            args.append(time.time() - days*86400)
+        sql = 'SELECT * FROM spans' + (' WHERE ' + ' AND '.join(where) if where else '') + ' ORDER BY time'
+        connection = sqlite3.connect(self.database, timeout=10)
+        try:
+            rows = connection.execute(sql, args).fetchall()
+        finally:
+            connection.close()
+        found = []
+        for r in rows:
+            this = dict(zip(self.columns, r))
+            this['tags'] = json.loads(this['tags'] or '{}')
+            found.append(this)
+        return found
+
+    def medians(self, element=None, edge=None, mode=None, days=None):
+        '''Return a dict of path -> median wall clock time (seconds) of the
+        successful spans matching the arguments.'''
+        times = dict()
+        for r in self.query(element=element, edge=edge, mode=mode, days=days):
+            if r['ok']:
+                times.setdefault(r['path'], []).append(r['wall'])
+        return {k: float(numpy.median(v)) for k, v in times.items()}
+
+    def summary(self, element=None, edge=None, mode=None, days=None):
+        '''Print the count, median, and total wall clock time of every
+        phase, for the spans matching the arguments.'''
+        rows = self.query(element=element, edge=edge, mode=mode, days=days)
+        if len(rows) == 0:
+            print(warning_msg('no timing spans match'))
+            return
+        phases = dict()
+        for r in rows:
+            phases.setdefault(r['path'], []).append(r)
+        which = ', '.join(f'{k}={v}' for k, v in (('element', element), ('edge', edge), ('mode', mode), ('days', days)) if v is not None)
+        print(bold_msg(f'{"phase":40} {"count":>6} {"median":>9} {"total":>10} {"failed":>7}   {which}'))
+        for path in sorted(phases):
+            walls = [r['wall'] for r in phases[path]]
+            failed = sum(1 for r in phases[path] if not r['ok'])
+            text = f'{path:40} {len(walls):6d} {numpy.median(walls):9.2f} {sum(walls):10.1f} {failed:7d}'
+            print(error_msg(text) if failed else text)
+
+    def timeline(self, sequence=None):
+        '''Print the spans of a scan sequence, indented by depth.  The
+        default is the most recent sequence.'''
+        if sequence is None:
+            rows = [r for r in self.query() if r['sequence'] is not None]
+            if len(rows) == 0:
+                print(warning_msg('no scan sequences have been recorded'))
+                return
+            sequence = rows[-1]['sequence']
+        rows = self.query(sequence=sequence)
+        start = min(r['time'] for r in rows)
+        top = [r for r in rows if r['depth'] == 0]
+        if len(top) > 0:
+            r = top[0]
+            print(bold_msg(f'{r["element"]} {r["edge"]} {r["mode"]}, sequence {sequence}, '
+                           f'{datetime.datetime.fromtimestamp(start).strftime("%Y-%m-%d %H:%M:%S")}'))
+        for r in rows:
+            label = '  '*r['depth'] + r['name']
+            if r['repetition'] is not None and r['name'] == 'repetition':
+                label += f' {r["repetition"]}'
+            text = f'{r["time"]-start:8.1f}  {label:36} {r["wall"]:9.2f} s'
+            print(text if r['ok'] else error_msg(text + '  (did not finish)'))
@@ -1,7 +1,7 @@
 from ophyd import Component as Cpt, EpicsSignalWithRBV, EpicsSignal, Signal, DerivedSignal
 from ophyd.scaler import EpicsScaler
 
-from numpy import exp
+import numpy
 
 from bluesky.plan_stubs import abs_set
 
@@ -50,6 +50,72 @@ ocrs = {'XF:06BM-ES:1{Sclr:1}.S3' : ts,
         'XF:06BM-ES:1{Sclr:1}.S22' : ts}
 
 
+## see Woicik et al, https://doi.org/10.1107/S0909049510009064
+def dtcorrect_array(roi, icr, ocr, inttime, dt=280.0, maxiter=20):
+    '''Dead-time correct arrays of ROI, ICR, and OCR values.
+
+    This solves the same self-consistent equation as the original
+    scalar correction, but for all elements at once.  Each element
+    stops iterating as soon as it converges.  No element iterates more
+    than maxiter+1 times.  The arguments can be scalars, numpy arrays,
+    or pandas Series (e.g. columns of a run's table for reprocessing
+    old data) and are broadcast against each other.
+
+    Parameters
+    ----------
+    roi : float or array
+        ROI counts
+    icr : float or array
+        input count rate counts
+    ocr : float or array
+        output count rate counts
+    inttime : float or array
+        integration time in seconds
+    dt : float
+        dead time in nanoseconds
+    maxiter : int
+        maximum number of iterations
+
+    Returns
+    -------
+    corrected : numpy array
+        dead-time corrected ROI values
+    niter : numpy array of int
+        number of iterations used by each element
+    converged : numpy array of bool
+        False for elements which reached maxiter without converging
+    '''
+    rr = numpy.asarray(roi, dtype=float)
+    ii = numpy.maximum(numpy.asarray(icr, dtype=float), 1.0)
+    oo = numpy.maximum(numpy.asarray(ocr, dtype=float), 1.0)
+    tt = numpy.maximum(numpy.asarray(inttime, dtype=float), 0.001)
+    rr, ii, oo, tt = numpy.broadcast_arrays(rr, ii, oo, tt)
+    dt = dt*1e-9
+    niter     = numpy.zeros(rr.shape, dtype=int)
+    converged = numpy.ones(rr.shape, dtype=bool)
+    if dt < 1e-9:
+        return rr*ii/oo, niter, converged
+
+    rate   = ii/tt
+    toto   = rate.copy()
+    totn   = numpy.where(ii <= 1.0, oo, 0.0)
+    active = ii > 1.0
+    converged = ~active
+    with numpy.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        for count in range(1, maxiter+2):
+            if not active.any():
+                break
+            new  = rate * numpy.exp(toto*dt)
+            test = (new - toto) / toto
+            totn = numpy.where(active, new, totn)
+            toto = numpy.where(active, new, toto)
+            niter[active] = count
+            done = active & ~(test > dt)
+            converged |= done
+            active &= ~done
+    return rr * (totn*tt/oo), niter, converged
+
+
 ####################################################################################
 ####                  ROI           ICR              OCR             time       ####
 class DTCorr(DerivedSignal):
@@ -329,40 +395,15 @@ class BMMVortex(EpicsScaler):
 
     ## see Woicik et al, https://doi.org/10.1107/S0909049510009064
     def dtcorrect(self, roi, icr, ocr, inttime, dt=280.0, off=False):
+        '''Dead-time correct a single ROI value, see dtcorrect_array.'''
         if off: return roi      # return ROI value for a channel not being considered at this time
         if roi is None: roi = 1.0
         if icr is None: icr = 1.0
         if ocr is None: ocr = 1.0
         if inttime is None: inttime = 1.0
-        if icr is None or icr<1.0:
-            icr=1.0
-        if ocr is None or ocr<1.0:
-            ocr=1.0
-        rr = float(roi)
-        ii = float(icr)
-        oo = float(ocr)
-        tt = float(inttime)
-        dt = dt*1e-9
-        if tt<0.001:
-            tt=0.001
-        if dt<1e-9:
-            return rr*ii/oo
-        totn  = 0.0
-        test  = 1.0
-        count = 0
-        toto  = ii/tt
-        if icr <= 1.0:
-            totn = oo
-            test = 0
-        while test > dt:
-            totn = (ii/tt) * exp(toto*dt)
-            test = (totn - toto) / toto
-            toto = totn
-            count = count+1
-            if (count > self.maxiter):
-                test = 0
-        self.niter = count
-        return float(rr * (totn*tt/oo))
+        corrected, niter, converged = dtcorrect_array(roi, icr, ocr, inttime, dt=dt, maxiter=self.maxiter)
+        self.niter = int(niter)
+        return float(corrected)
 
     def set_hints(self, chan):
         '''Set the dead time correction attributes to hinted for the selected,
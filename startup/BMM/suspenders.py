@@ -50,23 +50,43 @@ def BMM_suspenders():
     for s in all_BMM_suspenders:
         user_ns['RE'].install_suspender(s)
 
-def BMM_clear_to_start():
-    ok = True
-    text = ''
-    # return (ok, text)
+def _check_ring():
     if user_ns['ring'].current.get() < 10:
-        ok = False
-        text += 'There is no current in the storage ring. Solution: wait for beam to come back\n'
+        return (False, 'There is no current in the storage ring. Solution: wait for beam to come back\n')
+    return (True, '')
+
+def _check_bmps():
     if user_ns['bmps'].state.get() == 0:
-        ok = False
-        text += 'BMPS is closed. Solution: call floor coordinator\n'
+        return (False, 'BMPS is closed. Solution: call floor coordinator\n')
+    return (True, '')
+
+def _check_idps():
     if user_ns['idps'].state.get() == 0:
-        ok = False
-        text += 'Front end shutter (sha) is closed. Solution: do sha.open()\n'
+        return (False, 'Front end shutter (sha) is closed. Solution: do sha.open()\n')
+    return (True, '')
+
+def _check_shb():
     if user_ns['shb'].state.get() == 1:
-        ok = False
-        text += 'Photon shutter (shb) is closed. Solution: search the hutch then do shb.open()\n'
-    # if quadem1.I0.get() < 0.1:
-    #     ok = 0
-    #     text += 'There is no signal on I0\n'
-    return (ok, text)
+        return (False, 'Photon shutter (shb) is closed. Solution: search the hutch then do shb.open()\n')
+    return (True, '')
+
+# def _check_I0():
+#     if quadem1.I0.get() < 0.1:
+#         return (False, 'There is no signal on I0\n')
+#     return (True, '')
+
+CLEAR_TO_START = {'ring current' : _check_ring,
+                  'bmps'         : _check_bmps,
+                  'sha'          : _check_idps,
+                  'shb'          : _check_shb, }
+
+def BMM_clear_to_start(fresh=False):
+    '''Check that the ring has current and the shutters are open.
+    Returns (ok, text) where text explains any problems.
+
+    The checks are run concurrently by the health check service and
+    a passing result is reused for a few seconds, see BMM.healthcheck.
+    Set fresh to True to force the checks to be made again.
+    '''
+    report = user_ns['health'].run('clear to start', CLEAR_TO_START, fresh=fresh)
+    return (report.ok, report.text())
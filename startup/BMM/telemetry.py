@@ -1,6 +1,7 @@
 from databroker import catalog
 from databroker.queries import TimeRange
-import numpy, json, os, time
+import numpy, json, os, time, datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm           # progress bar
 
 from BMM.periodictable import element_symbol, edge_energy, Z_number
@@ -21,14 +22,35 @@ class BMMTelementry():
     in the start and stop document.  The measurement time is the sum
     of the dwell time column in the datatable from the measurement.
 
+    Reading every XAFS run from the database is slow, so the per-run
+    statistics are kept in an index file (self.index_file).  Each
+    call to update_index() only examines runs newer than the last
+    checkpoint.  The per-element statistics are recomputed from the
+    index.
+
+    A run which cannot be read is tried again on the next update, but
+    after self.attempts failures it is indexed as skipped so that it
+    does not hold the checkpoint back forever.  The same is done for
+    a run which has no stop document self.stale seconds after it
+    started.
+
+    The catalog is self.bc, which can be replaced by any databroker
+    catalog (for example a temporary one filled with simulated XAFS
+    runs) to test this class.
     '''
     def __init__(self):
         self.folder      = os.path.join(os.getenv('HOME'), '.ipython', 'profile_collection', 'startup', 'telemetry')
         self.json        = os.path.join(self.folder, 'telemetry.json')
+        self.index_file  = os.path.join(self.folder, 'telemetry_index.json')
         self.bc          = catalog['bmm']
         self.start_date  = '2019-09-01'
         self.reliability = 10
         self.beamdump    = 3
+        self.workers     = 8
+        self.attempts    = 3
+        self.stale       = 86400
+        self._model      = None
+        self._stamp      = None
         ###                         k-edges               l-edges
         self.all_elements = list(range(22, 46)) + list(range(55, 93))
 
@@ -41,39 +63,143 @@ class BMMTelementry():
         print(f'Number of records for {element} since {self.start_date}: {len(element_search)}')
         return(element_search)
         
-    def overhead(self, element=None):
+    def load_index(self):
+        '''Read the index of per-run overhead statistics from disk.
+
+        The index has three entries: "checkpoint" is the start time of
+        the most recent run that has been processed, "runs" is a
+        dictionary of per-run statistics keyed by uid, and "failures"
+        is the number of failed attempts to read each run which has
+        not yet been indexed, keyed by uid.
+        '''
+        if not os.path.isfile(self.index_file):
+            return {'checkpoint': 0, 'runs': {}, 'failures': {}}
+        with open(self.index_file) as fh:
+            index = json.load(fh)
+        index.setdefault('failures', {})
+        return index
+
+    def save_index(self, index):
+        tmp = self.index_file + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(index, fh)
+        os.replace(tmp, self.index_file)
+
+    def run_statistics(self, uid):
+        '''Gather the overhead statistics for a single run.
+
+        Returns a dictionary with the element, start time, number of
+        points, total measurement time, and elapsed time of the run.
+        Runs which did not complete normally or which could not be
+        read are flagged with a "skip" entry so they are not examined
+        again.  Returns None for a run that has not yet finished.
+        '''
+        this  = self.bc[uid]
+        start = this.metadata['start']
+        stop  = this.metadata['stop']
+        if stop is None:
+            return None
+        try:
+            record = {'element' : start['XDI']['Element']['symbol'],
+                      'time'    : start['time'], }
+        except KeyError:
+            return {'element': None, 'time': start.get('time', 0), 'skip': 'metadata'}
+        ## records that did not complete normally
+        if 'primary' in stop['num_events']:
+            if start['num_points'] != stop['num_events']['primary']:
+                record['skip'] = 'incomplete'
+                return record
+        try:
+            t = this.primary.read()['dwti_dwell_time']
+            record['npoints']     = len(t)
+            record['measurement'] = float(t.sum())
+            record['elapsed']     = stop['time'] - start['time']
+        except Exception:
+            record['skip'] = 'unreadable'
+        return record
+
+    def update_index(self, workers=None):
+        '''Add all XAFS runs newer than the last checkpoint to the index.
+
+        The runs are examined in parallel using a pool of worker
+        threads (the work is dominated by waiting on the database).
+        Returns the updated index.
+        '''
+        if workers is None: workers = self.workers
+        index = self.load_index()
+        since = max(index['checkpoint'], datetime.datetime.fromisoformat(self.start_date).timestamp())
+        query = TimeRange(since=since, until='2040')
+        uids  = [u for u in self.bc.search(query).search({'XDI._kind':'xafs'}) if u not in index['runs']]
+        print(f'Number of new XAFS records since {datetime.datetime.fromtimestamp(since)}: {len(uids)}')
+
+        unfinished = []
+        if len(uids) > 0:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(self.run_statistics, u): u for u in uids}
+                for f in tqdm(as_completed(futures), total=len(futures)):
+                    uid = futures[f]
+                    try:
+                        record = f.result()
+                    except Exception as E:
+                        record = self._failed(index, uid, since, 'error', repr(E))
+                    else:
+                        if record is None:
+                            record = self._failed(index, uid, since, 'unfinished')
+                    if 'retry' in record:
+                        unfinished.append(record['retry'])  # try again next time
+                        continue
+                    index['failures'].pop(uid, None)
+                    index['runs'][uid] = record
+
+        ## do not move the checkpoint past a run that has not yet been indexed
+        times = [r['time'] for r in index['runs'].values()]
+        if len(unfinished) > 0:
+            index['checkpoint'] = min(unfinished)
+        elif len(times) > 0:
+            index['checkpoint'] = max(times)
+        self.save_index(index)
+        return index
+
+    def _failed(self, index, uid, since, why, error=None):
+        '''Count a failed attempt to index a run.  Returns a record with
+        a "retry" entry (the time to hold the checkpoint at) if the run
+        should be tried again, or a skipped record once it has failed
+        self.attempts times or has been unfinished for self.stale
+        seconds.'''
+        try:
+            started = self.bc[uid].metadata['start']['time']
+        except Exception:
+            started = None
+        if why == 'unfinished':
+            if started is not None and time.time() - started < self.stale:
+                return {'retry': started}
+        else:
+            index['failures'][uid] = index['failures'].get(uid, 0) + 1
+            if index['failures'][uid] < self.attempts:
+                return {'retry': since if started is None else started}
+            print(f'Giving up on {uid} after {self.attempts} attempts: {error}')
+        return {'element': None, 'time': since if started is None else started, 'skip': why}
+
+    def overhead(self, element=None, index=None):
+        '''Compute the overhead statistics for an element from the index
+        of per-run statistics.  Call update_index() first to include
+        recent runs.'''
         if element is None: return(0)
-        db = user_ns['db']
-        element_search = self.records(element)
-        ratio, difference, dpp = numpy.array([]), numpy.array([]), numpy.array([])
-        l = len(list(element_search))
-        if l == 0: return(0)
-        count = 0
-        for u in tqdm(list(element_search)):
-            
-            this=db.v2[u]
-
-            ## records that did not complete normally
-            if 'primary' in this.metadata['stop']['num_events']:
-                if this.metadata['start']['num_points'] != this.metadata['stop']['num_events']['primary']:
-                    continue
-            try:
-                t = this.primary.read()['dwti_dwell_time']
-                measurement_time = float(t.sum())
-                elapsed_time = this.metadata['stop']['time'] - this.metadata['start']['time']
-
-                ## records that scan beam dumps or other pauses would skew the statistics
-                if elapsed_time/measurement_time > self.beamdump:
-                    continue
-
-                difference = numpy.append(difference, (elapsed_time - measurement_time))
-                ratio = numpy.append(ratio, elapsed_time/measurement_time)
-                diff_per_point = (elapsed_time - measurement_time) / len(t)
-                dpp = numpy.append(dpp, diff_per_point)
-                count = count + 1
-            except:
-                pass
-        return({'count'     : count,
+        if index is None: index = self.load_index()
+        since = datetime.datetime.fromisoformat(self.start_date).timestamp()
+        runs  = [r for r in index['runs'].values()
+                 if r['element'] == element and r['time'] >= since and 'skip' not in r]
+        if len(runs) == 0: return(0)
+        measurement = numpy.array([r['measurement'] for r in runs])
+        elapsed     = numpy.array([r['elapsed']     for r in runs])
+        npoints     = numpy.array([r['npoints']     for r in runs])
+
+        ## records that scan beam dumps or other pauses would skew the statistics
+        ratio = elapsed/measurement
+        keep  = ratio <= self.beamdump
+        if not keep.any(): return(0)
+        ratio, difference, dpp = ratio[keep], (elapsed-measurement)[keep], ((elapsed-measurement)/npoints)[keep]
+        return({'count'     : int(keep.sum()),
                 'ratio'     : [ratio.mean(), ratio.std()],
                 'difference': [difference.mean(), difference.std()],
                 'dpp'       : [dpp.mean(), dpp.std()],
@@ -84,11 +210,15 @@ class BMMTelementry():
     ## parameter, extract just those, modify json file for those
     ## elements
     def periodic_table(self, el=None):
+        '''Bring the index up to date, then recompute the overhead
+        statistics for every element and write them to the telemetry
+        json file.'''
         start = time.time()
+        index = self.update_index()
         results = {}
         for z in self.all_elements:
             el = element_symbol(z)
-            results[el] = self.overhead(el)
+            results[el] = self.overhead(el, index=index)
             
         j = json.dumps(results)
         f = open(self.json,"w")
@@ -98,29 +228,57 @@ class BMMTelementry():
         print('\n\nThat took %.1f min' % ((end-start)/60))
         
 
-    def interpolate(self, energy):
+    def model(self):
+        '''Return the telemetry model, a dictionary with the contents of
+        the json file ("table") and the sorted arrays of edge energies
+        ("energy") and overhead per point ("dpp") used for
+        interpolation.
+
+        The json file is read once and held in memory.  It is read
+        again only when it changes on disk, for example after running
+        periodic_table().
+        '''
+        try:
+            s = os.stat(self.json)
+            stamp = (s.st_mtime_ns, s.st_size)
+        except OSError:
+            stamp = None
+        if self._model is not None and stamp == self._stamp:
+            return self._model
+
         a = json.load(open(self.json))
-        e, t = numpy.array([]), numpy.array([])
+        e, t = [], []
         for z in self.all_elements:
-            if 'count' not in a[element_symbol(z)]:
+            this = a.get(element_symbol(z))
+            if type(this) is not dict or 'count' not in this:
                 continue
-            if a[element_symbol(z)]['count'] < self.reliability:
+            if this['count'] < self.reliability:
                 continue
-            t = numpy.append(t, a[element_symbol(z)]['dpp'][0])
+            t.append(this['dpp'][0])
             if z < 46:
-                e=numpy.append(e, edge_energy(z, 'k'))
+                e.append(edge_energy(z, 'k'))
             else:
-                e=numpy.append(e, edge_energy(z, 'l3'))
-                             
-        s=numpy.argsort(e)
-        return(numpy.interp(energy, e[s], t[s]))
+                e.append(edge_energy(z, 'l3'))
+        e, t = numpy.array(e, dtype=float), numpy.array(t, dtype=float)
+        s = numpy.argsort(e)
+        e, t = e[s], t[s]
+        e.flags.writeable = False
+        t.flags.writeable = False
+        self._model = {'table': a, 'energy': e, 'dpp': t}
+        self._stamp = stamp
+        return self._model
+
+    def interpolate(self, energy):
+        '''Interpolate the overhead per point at one energy or an array of energies.'''
+        m = self.model()
+        return(numpy.interp(energy, m['energy'], m['dpp']))
 
     def overhead_per_point(self, element, edge=None):
-        a = json.load(open(self.json))
+        a = self.model()['table']
         element = element_symbol(element)
         if edge is not None and edge.lower() in ('l2', 'l1'):
             return([self.interpolate(edge_energy(element, edge)), 0])
-        if element in a and 'dpp' in a[element]:
+        if element in a and type(a[element]) is dict and 'dpp' in a[element]:
             return(a[element]['dpp'])
         else:
             if edge is None or edge.lower() not in ('l2', 'l1'):
@@ -128,4 +286,3 @@ class BMMTelementry():
                 if Z_number(element) > 45:
                     edge = 'l3'
             return([self.interpolate(edge_energy(element, edge)), 0])
-        
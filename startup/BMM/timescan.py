@@ -1,11 +1,11 @@
 
-from bluesky.plans import grid_scan
+from bluesky.plans import grid_scan, count
 from bluesky.callbacks import LiveGrid
 from bluesky.plan_stubs import abs_set, sleep, mv, mvr, null
 from bluesky import __version__ as bluesky_version
 
 import numpy
-import os
+import os, datetime
 import pandas
 
 from bluesky.preprocessors import subs_decorator
@@ -58,7 +58,7 @@ def timescan(detector, readings, dwell, delay, force=False, md={}):
     '''
 
     RE, BMMuser, quadem1, _locked_dwell_time = user_ns['RE'], user_ns['BMMuser'], user_ns['quadem1'], user_ns['_locked_dwell_time']
-    rkvs = user_ns['rkvs']
+    rkvs, dcm, vor, db = user_ns['rkvs'], user_ns['dcm'], user_ns['vor'], user_ns['db']
     ######################################################################
     # this is a tool for verifying a macro.  this replaces an xafs scan  #
     # with a sleep, allowing the user to easily map out motor motions in #
@@ -146,9 +146,7 @@ def timescan(detector, readings, dwell, delay, force=False, md={}):
         uid = yield from count(dets, num=readings, delay=delay, md={**thismd, **md})
         return uid
         
-    rkvs.set('BMM:scan:type',      'time')
-    rkvs.set('BMM:scan:starttime', str(datetime.datetime.timestamp(datetime.datetime.now())))
-    rkvs.set('BMM:scan:estimated', 0)
+    rkvs.scan_started('time')
 
     uid = yield from count_scan(dets, readings, delay)
     
@@ -274,25 +274,8 @@ class BMM_User(Borg):
     def verify_roi(self, xs, el, edge):
         print(bold_msg(f'Attempting to set ROIs for {el} {edge} edge'))
         try:
-            ## if el is not one of the "standard" 12 ROI sets, insert it into xs.slots[12]/index 13
-            if xs.check_element(el, edge):
-                forceit = False
-                if el.capitalize() in ('Pb', 'Pt') and edge.capitalize() in ('L2', 'L1'):
-                    forceit = True # Pb and Pt L3 edges are "standard" ROIs
-                if el not in xs.slots or forceit:
-                    startup_dir = get_ipython().profile_dir.startup_dir
-                    with open(os.path.join(startup_dir, 'rois.json'), 'r') as fl:
-                        js = fl.read()
-                    allrois = json.loads(js)
-                    xs.set_rois()
-                    xs.slots[14] = el
-                    for ch in range(1,5):
-                        xs.set_roi_channel(channel=ch, index=15, name=f'{el.capitalize()}{ch}',
-                                           low =allrois[el.capitalize()][edge.lower()]['low'],
-                                           high=allrois[el.capitalize()][edge.lower()]['high'])
-
-                xs.measure_roi()
-            else:
+            ## xs reads back its ROIs, so only the ROI PVs which need to change are written
+            if not xs.select_element(el, edge):
                 report(f'No tabulated ROIs for the {el.capitalize()} {edge.capitalize()} edge.  Not setting ROIs for mesaurement.',
                        level='bold', slack=True)
         except Exception as E:
@@ -307,9 +290,9 @@ class BMM_User(Borg):
             for k in config.keys():
                 setattr(self, k, config[k])
             user_ns['rois'].trigger = True
-        rkvs.set('BMM:pds:edge',        str(config['edge']))
-        rkvs.set('BMM:pds:element',     str(config['element']))
-        rkvs.set('BMM:pds:edge_energy', edge_energy(config['element'], config['edge']))
+        rkvs.update({'BMM:pds:edge'        : str(config['edge']),
+                     'BMM:pds:element'     : str(config['element']),
+                     'BMM:pds:edge_energy' : edge_energy(config['element'], config['edge'])})
             
             
     def show(self, scan=False):
@@ -1,13 +1,14 @@
 
-import os, subprocess, shutil, socket
+import os, subprocess, shutil, socket, time
+from concurrent.futures import ThreadPoolExecutor
 from IPython.paths import get_ipython_module_path
-import redis
 from BMM.functions import verbosebold_msg, error_msg
+from BMM.kvs       import BMMRedis
 
 ###################################################################
 # things that are configurable                                    #
 ###################################################################
-rkvs = redis.Redis(host='xf06bm-ioc2', port=6379, db=0)
+rkvs = BMMRedis(host='xf06bm-ioc2', port=6379, db=0)
 NAS = '/mnt/nfs/nas1'
 SECRETS = os.path.join(NAS, 'xf06bm', 'secrets')
 SECRET_FILES = ('slack_secret', 'image_uploader_token')
@@ -33,16 +34,44 @@ def initialize_workspace():
     possible.  Some failures print a warning to screen, with no
     corrective action.
 
+    The checks on local disk are done right away.  The ones which go
+    over the network (git, redis, ssh) can take seconds, so they are
+    run at the same time on background threads while the rest of
+    startup continues.  workspace_report() waits for them and prints
+    their results.
+
     '''
+    global _pending
     print(verbosebold_msg('Checking workspace on this computer ...'))
     initialize_data_directories()
-    initialize_beamline_configuration()
     initialize_nas()
     initialize_secrets()
-    initialize_redis()
     #initialize_gdrive()
-    initialize_ssh()
-    
+    pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix='BMM workspace')
+    _pending = [pool.submit(_timed, check) for check in (check_beamline_configuration, check_redis, check_ssh)]
+    pool.shutdown(wait=False)
+
+_pending = []
+
+def _timed(check):
+    start = time.time()
+    try:
+        text = check()
+    except Exception as e:
+        text = error_msg(f'{TAB}{check.__name__} failed: {e}')
+    return text, time.time() - start
+
+def workspace_report():
+    '''Wait for the network checks started by initialize_workspace and
+    print their results.  Returns the time spent waiting.'''
+    global _pending
+    start = time.time()
+    for f in _pending:
+        text, elapsed = f.result()
+        print(text)
+    _pending = []
+    return time.time() - start
+
 
 def check_directory(dir, desc):
     if os.path.isdir(dir):
@@ -75,18 +104,31 @@ def initialize_beamline_configuration():
     to date.
 
     '''
+    print(check_beamline_configuration())
+
+def check_beamline_configuration():
     GIT=f'{os.environ["HOME"]}/git'
-    check_directory(GIT, 'git')
+    lines = []
+    for folder in (GIT, f'{GIT}/BMM-beamline-configuration'):
+        if os.path.isdir(folder):
+            lines.append(f'{TAB}Git directory {folder}: {CHECK}')
+        else:
+            lines.append(f'{TAB}Making git directory {folder}')
     BLC = f'{GIT}/BMM-beamline-configuration'
-    existed = check_directory(BLC, 'git')
-    here = os.getcwd()
-    if existed:
-        os.chdir(BLC)
-        subprocess.run(['git', 'pull']) 
+    ## git is run in the right folder rather than changing the working
+    ## directory, which would affect every thread of this process
+    if os.path.isdir(BLC):
+        s = subprocess.run(['git', 'pull'], cwd=BLC, capture_output=True, text=True)
     else:
-        os.chdir(GIT)
-        subprocess.run(['git', 'clone', 'https://github.com/NSLS-II-BMM/BMM-beamline-configuration']) 
-    os.chdir(here)
+        os.makedirs(GIT, exist_ok=True)
+        s = subprocess.run(['git', 'clone', 'https://github.com/NSLS-II-BMM/BMM-beamline-configuration'],
+                           cwd=GIT, capture_output=True, text=True)
+    output = (s.stdout + s.stderr).strip()
+    if s.returncode == 0:
+        lines.append(f'{TAB}{output}' if output else f'{TAB}Updated beamline configuration: {CHECK}')
+    else:
+        lines.append(error_msg(f'{TAB}Could not update beamline configuration: {output}'))
+    return '\n'.join(lines)
 
 def initialize_nas():
     '''Check if a the NAS1 mount point is mounted.  If not, complain on
@@ -122,10 +164,13 @@ def initialize_redis():
     server.  If not, complain on screen.
 
     '''
-    if rkvs.get(REDISVAR) is not None:
-        print(f'{TAB}Found Redis server: {CHECK}')
+    print(check_redis())
+
+def check_redis():
+    if rkvs.ping():
+        return f'{TAB}Found Redis server: {CHECK}'
     else:
-        print(error_msg(f'{TAB}Did not find redis server'))
+        return error_msg(f'{TAB}Did not find redis server')
 
 
 def initialize_ssh():
@@ -133,12 +178,15 @@ def initialize_ssh():
     computer.  If not, complain on screen.
 
     '''
+    print(check_ssh())
+
+def check_ssh():
     if socket.gethostname() == 'xf06bm-ws1':
-        print(f'{TAB}This is xf06bm-ws1, no ssh key needed: {CHECK}')
-        return
-    s = subprocess.run(['ssh', '-oBatchMode=yes', 'xf06bm@xf06bm-ws1', 'true'])
+        return f'{TAB}This is xf06bm-ws1, no ssh key needed: {CHECK}'
+    s = subprocess.run(['ssh', '-oBatchMode=yes', '-oConnectTimeout=10', 'xf06bm@xf06bm-ws1', 'true'],
+                       capture_output=True)
     if s.returncode == 0:
-        print(f'{TAB}Key exists for xf06bm@xf06bm-ws1: {CHECK}')
+        return f'{TAB}Key exists for xf06bm@xf06bm-ws1: {CHECK}'
     else:
-        print(error_msg(f'{TAB}Key does not exist for xf06bm@xf06bm-ws1'))
+        return error_msg(f'{TAB}Key does not exist for xf06bm@xf06bm-ws1')
         
@@ -1,17 +1,19 @@
 from bluesky.plans import rel_scan, scan_nd, count
 from bluesky.plan_stubs import abs_set, sleep, mv, null
-from bluesky.preprocessors import subs_decorator, finalize_wrapper
+from bluesky.preprocessors import subs_decorator, subs_wrapper, finalize_wrapper
 from databroker.core import SingleRunCache
 
-import numpy, os, re, shutil
+import numpy, os, re, shutil, copy, hashlib, uuid
 import textwrap, configparser, datetime
+from types import MappingProxyType
 from cycler import cycler
 import matplotlib
 import matplotlib.pyplot as plt
 
 #from BMM.camera_device import snap
 from BMM.db            import file_resource
-from BMM.demeter       import toprj
+from BMM.demeter       import toprj, write_athena_project
+from BMM.dossier       import read_template, next_sequence, add_to_index, rebuild_index
 from BMM.derivedplot   import DerivedPlot, interpret_click, close_all_plots, close_last_plot
 from BMM.functions     import countdown, boxedtext, now, isfloat, inflect, e2l, etok, ktoe, present_options
 from BMM.functions     import error_msg, warning_msg, go_msg, url_msg, bold_msg, verbosebold_msg, list_msg, disconnected_msg, info_msg, whisper
@@ -25,7 +27,7 @@ from BMM.motor_status  import motor_sidebar, motor_status
 from BMM.periodictable import edge_energy, Z_number, element_name
 from BMM.resting_state import resting_state_plan
 from BMM.suspenders    import BMM_suspenders, BMM_clear_to_start
-from BMM.xdi           import write_XDI
+from BMM.xdi           import write_XDI, sample_stage, XDIStreamWriter
 from BMM.xafs_functions import conventional_grid, sanitize_step_scan_parameters
 
 from IPython import get_ipython
@@ -56,6 +58,295 @@ def next_index(folder, stub):
     
 
 
+class ScanParameters():
+    '''An immutable, typed record of the parameters of an XAFS scan
+    sequence, as read from an INI file and composed with kwargs.
+
+    Values are accessed either as attributes or as dictionary keys:
+
+    >>> p = scan_parameters('scan.ini')
+    >>> p.e0, p['nscans']
+
+    The grid parameters (bounds, bounds_given, steps, times) are
+    stored as tuples.  The kwargs used to compose the parameters are
+    kept, so that additional kwargs given later are applied on top of
+    them.  Use as_dict() for a modifiable copy in the form
+    returned by scan_metadata.
+
+    A ScanParameters object can be handed directly to xafs(),
+    howlong(), and xafs_grid() in place of an INI file name.
+    '''
+    grids    = ('bounds', 'steps', 'times')
+    strings  = ('folder', 'experimenters', 'element', 'edge', 'filename', 'comment',
+                'mode', 'sample', 'prep', 'url', 'doi', 'cif')
+    integers = ('nscans', 'npoints')
+    floats   = ('e0', 'inttime', 'dwell', 'delay')
+    booleans = ('snapshots', 'htmlpage', 'bothways', 'channelcut', 'usbstick', 'rockingcurve', 'ththth')
+
+    def __init__(self, inifile, kwargs, parameters, found, depends):
+        frozen = {k: tuple(v) if type(v) is list else v for k,v in parameters.items()}
+        object.__setattr__(self, 'inifile',     inifile)
+        object.__setattr__(self, 'kwargs',      MappingProxyType(dict(kwargs)))
+        object.__setattr__(self, '_parameters', MappingProxyType(frozen))
+        object.__setattr__(self, '_found',      MappingProxyType(dict(found)))
+        object.__setattr__(self, '_depends',    depends)
+
+    def __setattr__(self, key, value):
+        raise AttributeError('scan parameters cannot be changed, use as_dict() for a modifiable copy')
+
+    def __getattr__(self, key):
+        try:
+            return self._parameters[key]
+        except KeyError:
+            raise AttributeError(key)
+
+    def __getitem__(self, key):
+        return self._parameters[key]
+
+    def __contains__(self, key):
+        return key in self._parameters
+
+    def __repr__(self):
+        return f'<ScanParameters {self.inifile}>'
+
+    def keys(self):
+        return self._parameters.keys()
+
+    def items(self):
+        return self._parameters.items()
+
+    def as_dict(self):
+        '''Return modifiable copies of the parameters and found dictionaries.'''
+        parameters = {k: list(v) if type(v) is tuple else v for k,v in self._parameters.items()}
+        return parameters, dict(self._found)
+
+    def found(self):
+        '''Return a copy of the dictionary of which parameters were found in the INI file or kwargs.'''
+        return dict(self._found)
+
+    def is_current(self):
+        '''True if nothing that went into these parameters has changed.
+
+        That is: the INI file's contents, the listing of the data
+        folder (only if start is "next"), the BMMuser attributes used
+        as default values, and the DCM crystal.
+        '''
+        BMMuser, dcm = user_ns['BMMuser'], user_ns['dcm']
+        stamp, digest = self._depends['ini']
+        if _file_stamp(self.inifile) != stamp:
+            if _file_digest(self.inifile) != digest:
+                return False
+            self._depends['ini'] = (_file_stamp(self.inifile), digest)
+        if self._depends['folder'] is not None:
+            folder, stamp = self._depends['folder']
+            if _file_stamp(folder) != stamp:
+                return False
+        if any(getattr(BMMuser, a) != v for a,v in self._depends['defaults'].items()):
+            return False
+        if dcm._crystal != self._depends['crystal']:
+            return False
+        return True
+
+
+def _file_stamp(fname):
+    try:
+        s = os.stat(fname)
+    except OSError:
+        return None
+    return (s.st_mtime_ns, s.st_size)
+
+def _file_digest(fname):
+    try:
+        with open(fname, 'rb') as fh:
+            return hashlib.sha1(fh.read()).hexdigest()
+    except OSError:
+        return None
+
+
+_scan_parameters_cache = dict()
+
+def scan_parameters(inifile=None, **kwargs):
+    '''Return a ScanParameters object for an INI file, composed with kwargs.
+
+    The INI file is parsed and validated only once.  The result is
+    reused until the INI file's contents change (checked by
+    modification time, then by checksum) or until something else it
+    depends on changes -- see ScanParameters.is_current.
+
+    All problems with the INI file are reported together.  None is
+    returned if there are any.  See scan_metadata for the meaning of
+    the parameters.
+    '''
+    if isinstance(inifile, ScanParameters):
+        if not kwargs and inifile.is_current():
+            return inifile
+        kwargs  = {**inifile.kwargs, **kwargs}
+        inifile = inifile.inifile
+    if inifile is None:
+        print(error_msg('\nNo inifile specified\n'))
+        return None
+    if not os.path.isfile(inifile):
+        print(error_msg('\ninifile does not exist\n'))
+        return None
+
+    key = (os.path.realpath(inifile), tuple(sorted((k, repr(v)) for k,v in kwargs.items())))
+    if key in _scan_parameters_cache and _scan_parameters_cache[key].is_current():
+        return _scan_parameters_cache[key]
+    _scan_parameters_cache.pop(key, None)
+
+    BMMuser, dcm = user_ns['BMMuser'], user_ns['dcm']
+    depends = {'ini'      : (_file_stamp(inifile), _file_digest(inifile)),
+               'folder'   : None,
+               'defaults' : dict(),
+               'crystal'  : dcm._crystal, }
+    parameters = dict()
+    found      = dict()
+    errors     = list()
+
+    def default(a):
+        value = getattr(BMMuser, a)
+        depends['defaults'][a] = copy.deepcopy(value)
+        return value
+
+    config = configparser.ConfigParser(interpolation=None)
+    try:
+        with open(inifile) as fh:
+            config.read_file(fh)
+    except configparser.Error as e:
+        print(error_msg(f'\n{inifile} could not be parsed:\n{e}\n'))
+        return None
+    def option(a):
+        return config.get('scan', a)
+
+    def convert(a, func, given):
+        found[a] = False
+        try:
+            if a in kwargs:
+                parameters[a] = func(kwargs[a])
+                found[a] = True
+            elif given is not None:
+                parameters[a] = func(given)
+                found[a] = True
+            else:
+                parameters[a] = default(a)
+        except (ValueError, TypeError):
+            errors.append(f'{a} = {kwargs.get(a, given)} is not a valid value')
+            parameters[a] = default(a)
+            found[a] = False
+
+    def fetch(a, getter=option):
+        try:
+            return getter(a)
+        except (configparser.NoOptionError, configparser.NoSectionError):
+            return None
+
+    ## ----- scan regions
+    for a in ScanParameters.grids:
+        found[a] = False
+        parameters[a] = []
+        if a not in kwargs:
+            given = fetch(a)
+            if given is None:
+                parameters[a] = list(default(a))
+            else:
+                for f in re.split('[ \t,]+', given.strip()):
+                    try:
+                        parameters[a].append(float(f))
+                    except:
+                        parameters[a].append(f)
+                    found[a] = True
+        else:
+            for f in str(kwargs[a]).split():
+                try:
+                    parameters[a].append(float(f))
+                except:
+                    parameters[a].append(f)
+            found[a] = True
+    parameters['bounds_given'] = parameters['bounds'].copy()
+
+    (problem, text) = sanitize_step_scan_parameters(parameters['bounds'], parameters['steps'], parameters['times'])
+    if text:
+        print(text)
+    if problem:
+        errors.append('the scan regions (bounds, steps, times) are not valid')
+
+    ## ----- strings, integers, floats, booleans
+    for a in ScanParameters.strings:
+        convert(a, str, fetch(a))
+    for a in ScanParameters.integers:
+        convert(a, int, fetch(a))
+    for a in ScanParameters.floats:
+        convert(a, float, fetch(a))
+    for a in ScanParameters.booleans:
+        found[a] = False
+        if a in kwargs:
+            parameters[a] = bool(kwargs[a])
+            found[a] = True
+            continue
+        try:
+            given = fetch(a, lambda x: config.getboolean('scan', x))
+        except ValueError:
+            errors.append(f'{a} = {option(a)} is not a valid true/false value')
+            given = None
+        if given is None:
+            parameters[a] = default(a)
+        else:
+            parameters[a] = given
+            found[a] = True
+
+    if not os.path.isdir(parameters['folder']):
+        errors.append('folder %s does not exist' % parameters['folder'])
+    parameters['mode'] = parameters['mode'].lower()
+
+    ## ----- start value
+    found['start'] = False
+    if 'start' in kwargs:
+        parameters['start'] = str(kwargs['start'])
+        found['start'] = True
+    elif fetch('start') is not None:
+        parameters['start'] = str(option('start'))
+        found['start'] = True
+    else:
+        parameters['start'] = default('start')
+    try:
+        if parameters['start'] == 'next':
+            depends['folder'] = (parameters['folder'], _file_stamp(parameters['folder']))
+            parameters['start'] = next_index(parameters['folder'],parameters['filename'])
+        else:
+            parameters['start'] = int(parameters['start'])
+    except (ValueError, OSError):
+        errors.append('start value must be a positive integer or "next"')
+        parameters['start'] = -1
+        found['start'] = False
+
+    if dcm._crystal != '111' and parameters['ththth']:
+        errors.append('You must be using the Si(111) crystal to make a Si(333) measurement')
+
+    if not found['e0'] and found['element'] and found['edge']:
+        parameters['e0'] = edge_energy(parameters['element'], parameters['edge'])
+        if parameters['e0'] is None:
+            errors.append('Cannot figure out edge energy from element = %s and edge = %s' % (parameters['element'], parameters['edge']))
+        else:
+            found['e0'] = True
+            if parameters['e0'] > 23500:
+                errors.append('The %s %s edge is at %.1f, which is ABOVE the measurement range for BMM' %
+                              (parameters['element'], parameters['edge'], parameters['e0']))
+            if parameters['e0'] < 4000:
+                errors.append('The %s %s edge is at %.1f, which is BELOW the measurement range for BMM' %
+                              (parameters['element'], parameters['edge'], parameters['e0']))
+
+    if len(errors) > 0:
+        print(error_msg(f'\nFound {inflect("problem", len(errors))} with {inifile}:'))
+        for e in errors:
+            print(error_msg(f'\t{e}'))
+        print('')
+        return None
+
+    p = ScanParameters(inifile, kwargs, parameters, found, depends)
+    _scan_parameters_cache[key] = p
+    return p
+
+
 def scan_metadata(inifile=None, **kwargs):
     """Typical use is to specify an INI file, which contains all the
     metadata relevant to a set of scans.  This function is called with
@@ -78,7 +369,7 @@ def scan_metadata(inifile=None, **kwargs):
         folder for saved XDI files
     filename : str
         filename stub for saved XDI files
-    experimenters [str] 
+    experimenters [str]
         names of people involved in this measurements
     e0 : float
         edge energy, reference value for energy grid
@@ -100,7 +391,7 @@ def scan_metadata(inifile=None, **kwargs):
         True = capture analog and XAS cameras before scan sequence
     usbstick : bool
         True = munge filenames so they can be written to a VFAT USB stick
-    rockingcurve  [bool] 
+    rockingcurve  [bool]
         True = measure rocking curve at pseudo channel cut energy
     htmlpage : bool
         True = capture dossier of a scan sequence as a static html page
@@ -124,156 +415,14 @@ def scan_metadata(inifile=None, **kwargs):
     are specified neither in the INI file nor in the function call,
     (possibly) sensible defaults are used.
 
-    """
-    #frame = inspect.currentframe()          # see https://stackoverflow.com/a/582206 and
-    #args  = inspect.getargvalues(frame)[3]  # https://docs.python.org/3/library/inspect.html#inspect.getargvalues
-
-    BMMuser, dcm = user_ns['BMMuser'], user_ns['dcm']
-    parameters = dict()
-
-    if inifile is None:
-        print(error_msg('\nNo inifile specified\n'))
-        return {}, {}
-    if not os.path.isfile(inifile):
-        print(error_msg('\ninifile does not exist\n'))
-        return {}, {}
-
-    config = configparser.ConfigParser(interpolation=None)
-    config.read_file(open(inifile))
-
-    found = dict()
-
-    ## ----- scan regions (what about kwargs???)
-    for a in ('bounds', 'steps', 'times'):
-        found[a] = False
-        parameters[a] = []
-        if a not in kwargs:
-            try:
-                #for f in config.get('scan', a).split():
-                for f in re.split('[ \t,]+', config.get('scan', a).strip()):
-                    try:
-                        parameters[a].append(float(f))
-                    except:
-                        parameters[a].append(f)
-                    found[a] = True
-            except:
-                parameters[a] = getattr(BMMuser, a)
-        else:
-            this = str(kwargs[a])
-            for f in this.split():
-                try:
-                    parameters[a].append(float(f))
-                except:
-                    parameters[a].append(f)
-            found[a] = True
-        parameters['bounds_given'] = parameters['bounds'].copy()
+    The INI file is parsed once and cached, see scan_parameters.  The
+    dictionaries returned are copies which can be modified freely.
 
-    (problem, text) = sanitize_step_scan_parameters(parameters['bounds'], parameters['steps'], parameters['times'])
-    print(text)
-    if problem:
-        return {}, {}
-
-    ## ----- strings
-    for a in ('folder', 'experimenters', 'element', 'edge', 'filename', 'comment',
-              'mode', 'sample', 'prep', 'url', 'doi', 'cif'):
-        found[a] = False
-        if a not in kwargs:
-            try:
-                parameters[a] = config.get('scan', a)
-                found[a] = True
-            except configparser.NoOptionError:
-                parameters[a] = getattr(BMMuser, a)
-        else:
-            parameters[a] = str(kwargs[a])
-            found[a] = True
-
-    if not os.path.isdir(parameters['folder']):
-        print(error_msg('\nfolder %s does not exist\n' % parameters['folder']))
-        return {}, {}
-    parameters['mode'] = parameters['mode'].lower()
-    
-    ## ----- start value
-    if 'start' not in kwargs:
-        try:
-            parameters['start'] = str(config.get('scan', 'start'))
-            found['start'] = True
-        except configparser.NoOptionError:
-            parameters[a] = getattr(BMMuser, a)
-    else:
-        parameters['start'] = str(kwargs['start'])
-        found['start'] = True
-    try:
-        if parameters['start'] == 'next':
-            parameters['start'] = next_index(parameters['folder'],parameters['filename'])
-        else:
-            parameters['start'] = int(parameters['start'])
-    except ValueError:
-        print(error_msg('\nstart value must be a positive integer or "next"'))
-        parameters['start'] = -1
-        found['start'] = False
-
-    ## ----- integers
-    for a in ('nscans', 'npoints'):
-        found[a] = False
-        if a not in kwargs:
-            try:
-                parameters[a] = int(config.get('scan', a))
-                found[a] = True
-            except configparser.NoOptionError:
-                parameters[a] = getattr(BMMuser, a)
-        else:
-            parameters[a] = int(kwargs[a])
-            found[a] = True
-
-    ## ----- floats
-    for a in ('e0', 'inttime', 'dwell', 'delay'):
-        found[a] = False
-        if a not in kwargs:
-            try:
-                parameters[a] = float(config.get('scan', a))
-                found[a] = True
-            except configparser.NoOptionError:
-                parameters[a] = getattr(BMMuser, a)
-        else:
-            parameters[a] = float(kwargs[a])
-            found[a] = True
-
-    ## ----- booleans
-    for a in ('snapshots', 'htmlpage', 'bothways', 'channelcut', 'usbstick', 'rockingcurve', 'ththth'):
-        found[a] = False
-        if a not in kwargs:
-            try:
-                parameters[a] = config.getboolean('scan', a)
-                found[a] = True
-            except configparser.NoOptionError:
-                parameters[a] = getattr(BMMuser, a)
-        else:
-            parameters[a] = bool(kwargs[a])
-            found[a] = True
-
-    if dcm._crystal != '111' and parameters['ththth']:
-        print(error_msg('\nYou must be using the Si(111) crystal to make a Si(333) measurement\n'))
+    """
+    p = scan_parameters(inifile, **kwargs)
+    if p is None:
         return {}, {}
-
-    if not found['e0'] and found['element'] and found['edge']:
-        parameters['e0'] = edge_energy(parameters['element'], parameters['edge'])
-        if parameters['e0'] is None:
-            print(error_msg('\nCannot figure out edge energy from element = %s and edge = %s\n' % (parameters['element'], parameters['edge'])))
-            return {}, {}
-        else:
-            found['e0'] = True
-            #print('\nUsing tabulated value of %.1f for the %s %s edge\n' % (parameters['e0'], parameters['element'], parameters['edge']))
-        if parameters['e0'] > 23500:
-            print(error_msg('\nThe %s %s edge is at %.1f, which is ABOVE the measurement range for BMM\n' %
-                            (parameters['element'], parameters['edge'], parameters['e0'])))
-            return {}, {}
-        if parameters['e0'] < 4000:
-            print(error_msg('\nThe %s %s edge is at %.1f, which is BELOW the measurement range for BMM\n' %
-                            (parameters['element'], parameters['edge'], parameters['e0'])))
-            return {}, {}
-
-            
-    return parameters, found
+    return p.as_dict()
 
 
 
@@ -349,22 +498,12 @@ from pygments.formatters import HtmlFormatter
 
 from urllib.parse import quote
 
-def make_merged_triplot(uidlist, filename, mode):
-    #k=Kekropidai()
-    #k.put(uidlist)
-    #merge=k.merge()
-    base = Pandrosus()
-    base.fetch(uidlist[0], mode=mode)
-    ee = base.group.energy
-    mm = base.group.mu
-    for uid in uidlist[1:]:
-        this = Pandrosus()
-        this.fetch(uid, mode=mode)
-        mu = numpy.interp(ee, this.group.energy, this.group.mu)
-        mm = mm + mu
-    mm = mm / len(uidlist)
-    merge = Pandrosus()
-    merge.put(ee, mm, 'merge')
+def make_merged_triplot(uidlist, filename, mode, kek=None):
+    k = kek
+    if k is None:
+        k = Kekropidai()
+        k.put(uidlist, mode=mode)
+    merge = k.merge()
     thisagg = matplotlib.get_backend()
     matplotlib.use('Agg') # produce a plot without screen display
     merge.triplot()
@@ -395,9 +534,8 @@ def scan_sequence_static_html(inifile       = None,
                               times         = None,
                               clargs        = '',
                               websnap       = '',
-                              webuid        = '',
+                              snapuid       = '',
                               anasnap       = '',
-                              anauid        = '',
                               xrfsnap       = '',
                               xrffile       = '',
                               xrfuid        = '',
@@ -429,26 +567,22 @@ def scan_sequence_static_html(inifile       = None,
             tmpl = 'sample_ga.tmpl'
         else:
             tmpl = 'sample_xs.tmpl'
-    with open(os.path.join(os.getenv('HOME'), '.ipython', 'profile_collection', 'startup', tmpl)) as f:
-        content = f.readlines()
-    basename     = filename
-    htmlfilename = os.path.join(BMMuser.DATA, 'dossier/',   filename+'-01.html')
-    seqnumber = 1
-    if os.path.isfile(htmlfilename):
-        seqnumber = 2
-        while os.path.isfile(os.path.join(BMMuser.DATA, 'dossier', "%s-%2.2d.html" % (filename,seqnumber))):
-            seqnumber += 1
-        basename     = "%s-%2.2d" % (filename,seqnumber)
-        htmlfilename = os.path.join(BMMuser.DATA, 'dossier', "%s-%2.2d.html" % (filename,seqnumber))
-
-
-    ## generate a png image, preferably of a quadplot of the data, using Demeter
-    prjfilename, pngfilename = None, None
+    content = read_template(os.path.join(os.getenv('HOME'), '.ipython', 'profile_collection', 'startup', tmpl))
+    seqnumber, basename, htmlfilename = next_sequence(os.path.join(BMMuser.DATA, 'dossier'), filename)
+
+
+    ## write an Athena project file from the data as processed by Larch
+    prjfilename, pngfilename, kek = None, None, None
     try:
-          pngfile = toprj(folder=BMMuser.DATA, name=filename, base=basename, start=start, end=end, bounds=bounds, mode=mode)
-          prjfilename = os.path.join(BMMuser.folder, 'prj', basename+'.prj')
+        if uidlist is not None:
+            kek = Kekropidai(name=basename)
+            kek.put(uidlist, mode=mode)
+            labels = ["%s.%3.3d" % (filename, i) for i in range(int(start), int(end)+1)]
+            prjfilename = write_athena_project(os.path.join(BMMuser.folder, 'prj', basename+'.prj'), kek.groups, labels=labels)
     except Exception as e:
-          print(e)
+        print(error_msg('failure to write Athena project file'))
+        print(e)
+        kek = None              # it may be only partly filled, let the triplot fetch its own data
 
 
     #print(warning_msg(f'{uidlist}  {BMMuser.DATA}   {basename}   {mode}'))
@@ -456,7 +590,7 @@ def scan_sequence_static_html(inifile       = None,
         if uidlist is not None:
             pngfilename = os.path.join(BMMuser.DATA, 'snapshots', f"{basename}.png")
             #print(warning_msg(f'   {pngfilename}'))
-            make_merged_triplot(uidlist, pngfilename, mode)
+            make_merged_triplot(uidlist, pngfilename, mode, kek=kek)   # reuse the data fetched for the project file
     except Exception as e:
         print(error_msg('failure to make triplot'))
         print(e)
@@ -468,7 +602,7 @@ def scan_sequence_static_html(inifile       = None,
         
     o = open(htmlfilename, 'w')
     pdstext = '%s (%s)' % (get_mode(), describe_mode())
-    o.write(''.join(content).format(filename      = filename,
+    o.write(content.format(filename      = filename,
                                     basename      = basename,
                                     encoded_basename = quote(basename),
                                     experimenters = experimenters,
@@ -496,9 +630,8 @@ def scan_sequence_static_html(inifile       = None,
                                     times         = times,
                                     clargs        = highlight(clargs, PythonLexer(), HtmlFormatter()),
                                     websnap       = quote('../snapshots/'+websnap),
-                                    webuid        = webuid,
+                                    snapuid       = snapuid,
                                     anasnap       = quote('../snapshots/'+anasnap),
-                                    anauid        = anauid,
                                     xrffile       = quote('../XRF/'+str(xrffile)),
                                     xrfuid        = xrfuid,
                                     xrfsnap       = quote('../XRF/'+str(xrfsnap)),
@@ -515,11 +648,7 @@ def scan_sequence_static_html(inifile       = None,
                                 ))
     o.close()
 
-    manifest = open(os.path.join(BMMuser.DATA, 'dossier', 'MANIFEST'), 'a')
-    manifest.write(htmlfilename + '\n')
-    manifest.close()
-
-    write_manifest()
+    add_to_index(os.path.join(BMMuser.DATA, 'dossier'), BMMuser.date, htmlfilename)
 
     pngfile = os.path.join(BMMuser.DATA, 'snapshots', f"{basename}.png")
     if os.path.isfile(pngfile):
@@ -535,25 +664,11 @@ def scan_sequence_static_html(inifile       = None,
 
 
 def write_manifest():
-    '''Update the scan manifest and the corresponding static html file.'''
+    '''Regenerate the static html index of the dossier from the whole
+    scan manifest.  Scan sequences add themselves to the index as they
+    finish, see BMM/dossier.py, so this is only needed to repair it.'''
     BMMuser = user_ns['BMMuser']
-    with open(os.path.join(BMMuser.DATA, 'dossier', 'MANIFEST')) as f:
-        lines = [line.rstrip('\n') for line in f]
-
-    experimentlist = ''
-    for l in lines:
-        if not os.path.isfile(l):
-            continue
-        this = os.path.basename(l)
-        experimentlist += '<li><a href="./%s">%s</a></li>\n' % (this, this)
-        
-    with open(os.path.join(BMMuser.DATA, 'dossier', 'manifest.tmpl')) as f:
-        content = f.readlines()
-    indexfile = os.path.join(BMMuser.DATA, 'dossier', '00INDEX.html')
-    o = open(indexfile, 'w')
-    o.write(''.join(content).format(date           = BMMuser.date,
-                                    experimentlist = experimentlist,))
-    o.close()
+    rebuild_index(os.path.join(BMMuser.DATA, 'dossier'), BMMuser.date)
     
 
 
@@ -563,8 +678,13 @@ def write_manifest():
 def xafs(inifile=None, **kwargs):
     '''
     Read an INI file for scan matadata, then perform an XAFS scan sequence.
+    inifile can also be a ScanParameters object.
     '''
     def main_plan(inifile, **kwargs):
+        ## timing spans for each phase of the scan sequence, see BMM/spans.py
+        spans.clear()
+        timing['xafs']  = spans.begin('xafs', sequence=uuid.uuid4().hex[:12])
+        timing['setup'] = spans.begin('setup')
         if '311' in dcm._crystal and dcm_x.user_readback.get() < 10:
             BMMuser.final_log_entry = False
             print(error_msg('The DCM is in the 111 position, configured as 311'))
@@ -615,9 +735,12 @@ def xafs(inifile=None, **kwargs):
             BMMuser.final_log_entry = False
             yield from null()
             return
-        (p, f) = scan_metadata(inifile=inifile, **kwargs)
-        if not any(p):          # scan_metadata returned having printed an error message
+        params = scan_parameters(inifile, **kwargs)
+        if params is None:      # scan_parameters returned having printed an error message
             return(yield from null())
+        (p, f) = params.as_dict()
+        inifile = params.inifile
+        spans.tag(element=p['element'], edge=p['edge'], mode=p['mode'], filename=p['filename'], nscans=p['nscans'])
 
         
         ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
@@ -676,6 +799,7 @@ def xafs(inifile=None, **kwargs):
             BMMuser.final_log_entry = False
             yield from null()
             return
+        timing['setup'].end()
 
             
         ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
@@ -731,6 +855,7 @@ def xafs(inifile=None, **kwargs):
         ## BlueSky gets confused about the plotting window
         #if not dcm.suppress_channel_cut:
         report('entering pseudo-channel-cut mode at %.1f eV' % eave, 'bold')
+        span = spans.begin('channel cut', rockingcurve=p['rockingcurve'])
         dcm.mode = 'fixed'
         #dcm_bragg.clear_encoder_loss()
         yield from mv(dcm.energy, eave)
@@ -740,12 +865,14 @@ def xafs(inifile=None, **kwargs):
             #RE.msg_hook = None
             close_last_plot()
         dcm.mode = 'channelcut'
+        span.end()
 
 
 
         ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
         ## organize metadata for injection into database and XDI output
         print(bold_msg('gathering metadata'))
+        span = spans.begin('metadata')
         md = bmm_metadata(measurement   = p['mode'],
                           experimenters = p['experimenters'],
                           edge          = p['edge'],
@@ -765,16 +892,18 @@ def xafs(inifile=None, **kwargs):
                           comment       = p['comment'],
                           ththth        = p['ththth'],
         )
+        span.end()
 
         
         ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
         ## measure XRF spectrum at Eave
         xrfuid, xrffile, xrfimage = None, None, None
-        image_web, xascam_uid, image_ana, anacam_uid = None, None, None, None
+        image_web, image_ana, snapshot_uid = None, None, None
 
         html_dict['xrffile'], html_dict['xrfsnap'] = None, None
         if user_ns['with_xspress3'] and any(x in p['mode'] for x in ('xs', 'fluo', 'flou')) and BMMuser.lims is True:
             report('measuring an XRF spectrum at %.1f eV' % eave, 'bold')
+            span = spans.begin('xrf')
             yield from mv(xs.settings.acquire_time, 1)
             xrfuid = yield from count([xs], 1, md = {'XDI':md})
 
@@ -807,10 +936,12 @@ def xafs(inifile=None, **kwargs):
             plt.savefig(xrfimage)
             xs.to_xdi(xrffile)
             matplotlib.use(thisagg) # return to screen display
+            span.end()
 
         ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
         ## snap photos
         if p['snapshots']:
+            span = spans.begin('snapshots')
             ahora = now()
 
             #annotation = 'NIST BMM (NSLS-II 06BM)      ' + p['filename'] + '      ' + ahora
@@ -818,21 +949,24 @@ def xafs(inifile=None, **kwargs):
             html_dict['websnap'] = "%s_XASwebcam_%s.jpg" % (p['filename'], ahora)
             image_web = os.path.join(p['folder'], 'snapshots', html_dict['websnap'])
             xascam._annotation_string = annotation
-            print(bold_msg('XAS webcam snapshot'))
-            xascam_uid = yield from count([xascam], 1, md = {'XDI':md})
-            shutil.copyfile(file_resource(db.v2[xascam_uid]), image_web)
             #snap('XAS', filename=image_web, annotation=annotation)
 
             html_dict['anasnap'] = "%s_analog_%s.jpg" % (p['filename'], ahora)
             image_ana = os.path.join(p['folder'], 'snapshots', html_dict['anasnap'])
             anacam._annotation_string = p['filename']
-            print(bold_msg('analog camera snapshot'))
-            anacam_uid = yield from count([anacam], 1, md = {'XDI':md})
+
+            ## both cameras are triggered together and captured concurrently,
+            ## so both images are in one run, recorded as snapshot_uid
+            print(bold_msg('XAS webcam and analog camera snapshots'))
             try:
-                shutil.copyfile(file_resource(db.v2[anacam_uid]), image_ana)
-            except:
-                print(error_msg('Could not copy analog snapshot, probably because it\'s capture failed.'))
-                pass
+                snapshot_uid = yield from count([xascam, anacam], 1, md = {'XDI':md})
+            except Exception as E:
+                print(error_msg(f'Camera snapshots failed, continuing without them: {E}'))
+            for camera, image in ((xascam, image_web), (anacam, image_ana)):
+                try:
+                    shutil.copyfile(file_resource(db.v2[snapshot_uid], spec=camera._SPEC), image)
+                except Exception:
+                    print(error_msg(f'Could not copy {camera.name} snapshot, probably because its capture failed.'))
             #snap('analog', filename=image_ana, sample=p['filename'])
 
             
@@ -840,11 +974,11 @@ def xafs(inifile=None, **kwargs):
                                       'target': os.path.join(os.environ['HOME'], 'gdrive', 'Data', BMMuser.name, BMMuser.date, 'snapshots', html_dict['websnap'])}
             gdrive_dict['anacam']  = {'source': image_ana,
                                       'target': os.path.join(os.environ['HOME'], 'gdrive', 'Data', BMMuser.name, BMMuser.date, 'snapshots', html_dict['anasnap'])}
-            
+            span.end()
 
         md['_snapshots'] = {'xrf_uid': xrfuid, 'xrf_image': xrfimage,
-                            'webcam_file': image_web, 'webcam_uid': xascam_uid,
-                            'analog_file': image_ana, 'anacam_uid': anacam_uid, }
+                            'webcam_file': image_web, 'analog_file': image_ana,
+                            'snapshot_uid': snapshot_uid, }
             
 
         #legends = []
@@ -982,8 +1116,7 @@ def xafs(inifile=None, **kwargs):
             html_dict['htmlpage']      = p['htmlpage']
             html_dict['ththth']        = p['ththth']
             html_dict['xrfuid']        = xrfuid
-            html_dict['webuid']        = xascam_uid
-            html_dict['anauid']        = anacam_uid
+            html_dict['snapuid']       = snapshot_uid
             ## https://www.codespeedy.com/check-if-a-string-is-a-valid-url-or-not-in-python/
             html_dict['url']           = p['url']
             html_dict['doi']           = p['doi']
@@ -994,9 +1127,7 @@ def xafs(inifile=None, **kwargs):
                 
             ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
             ## store data in redis, used by cadashboard
-            rkvs.set('BMM:scan:type',      'xafs')
-            rkvs.set('BMM:scan:starttime', str(datetime.datetime.timestamp(datetime.datetime.now())))
-            rkvs.set('BMM:scan:estimated', (approx_time * int(p['nscans']) * 60))
+            rkvs.scan_started('xafs', estimated=(approx_time * int(p['nscans']) * 60))
             print(str(datetime.datetime.timestamp(datetime.datetime.now())))
             print((approx_time * int(p['nscans']) * 60))
                 
@@ -1025,11 +1156,12 @@ def xafs(inifile=None, **kwargs):
                     slotno = f', spinner {ga.current()}'
                 report(f'starting repetition {cnt} of {p["nscans"]} -- {fname} -- {len(energy_grid)} energy points{slotno}', level='bold', slack=True)
                 md['_filename'] = fname
+                repetition = spans.begin('repetition', repetition=cnt, fname=fname)
 
                 if user_ns['with_xspress3'] and any(x in p['mode'] for x in ('xs', 'fluo', 'flou')):
                     yield from mv(xs.spectra_per_point, 1) 
                     yield from mv(xs.total_points, len(energy_grid))
-                    hdf5_uid = xs.hdf5.file_name.value
+                    hdf5_uid = xs.hdf5.file_name.get()
                 
                 ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
                 ## compute trajectory
@@ -1041,6 +1173,7 @@ def xafs(inifile=None, **kwargs):
                 ## mono direction, ... things that can change during or between scan sequences
                 
                 md['Mono']['direction'] = 'forward'
+                span = spans.begin('rewind')
                 if p['bothways'] and cnt%2 == 0:
                     energy_trajectory    = cycler(dcm.energy, energy_grid[::-1])
                     dwelltime_trajectory = cycler(dwell_time, time_grid[::-1])
@@ -1056,7 +1189,8 @@ def xafs(inifile=None, **kwargs):
                     yield from mv(dcm.energy, energy_grid[0]-5)
                     yield from mv(dcm_bragg.acceleration, BMMuser.acc_fast)
                     print(whisper('  Resetting DCM acceleration time to %.2f sec' % dcm_bragg.acceleration.get()))
-                    
+                span.end()
+
                 rightnow = metadata_at_this_moment() # see 62-metadata.py
                 for family in rightnow.keys():       # transfer rightnow to md
                     if type(rightnow[family]) is dict:
@@ -1076,63 +1210,48 @@ def xafs(inifile=None, **kwargs):
                 #mtr = {'BMM_motors' : motor_metadata()}
                 
                 ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
-                ## call the stock scan_nd plan with the correct detectors
+                ## call the stock scan_nd plan with the correct detectors,
+                ## writing the XDI file as the data arrive
                 uid = None
                 if any(md in p['mode'] for md in ('trans', 'ref', 'yield', 'test')):
-                    uid = yield from scan_nd([quadem1], energy_trajectory + dwelltime_trajectory,
-                                             md={**xdi, **supplied_metadata})
+                    detectors = [quadem1]
                 elif user_ns['with_xspress3'] is True:
-                    uid= yield from scan_nd([quadem1, xs], energy_trajectory + dwelltime_trajectory,
-                                            md={**xdi, **supplied_metadata})
+                    detectors = [quadem1, xs]
                 else:
-                    uid = yield from scan_nd([quadem1, vor], energy_trajectory + dwelltime_trajectory,
-                                             md={**xdi, **supplied_metadata})
+                    detectors = [quadem1, vor]
+                xdicb = XDIStreamWriter(datafile, stage=sample_stage())
+                span = spans.begin('scan', npoints=len(energy_grid))
+                uid = yield from subs_wrapper(scan_nd(detectors, energy_trajectory + dwelltime_trajectory,
+                                                      md={**xdi, **supplied_metadata}),
+                                              xdicb)
+                span.end()
                 ## here is where we would use the new SingleRunCache solution in databroker v1.0.3
                 ## see #64 at https://github.com/bluesky/tutorials
 
                 if user_ns['with_xspress3'] and any(x in p['mode'] for x in ('xs', 'fluo', 'flou')):
-                    hdf5_uid = xs.hdf5.file_name.value
+                    hdf5_uid = xs.hdf5.file_name.get()
                 
                 uidlist.append(uid)
-                header = db[uid]
-                write_XDI(datafile, header)
-                print(bold_msg('wrote %s' % datafile))
-                BMM_log_info(f'energy scan finished, uid = {uid}, scan_id = {header.start["scan_id"]}\ndata file written to {datafile}')
+                scan_id = RE.md['scan_id']
+                BMM_log_info(f'energy scan finished, uid = {uid}, scan_id = {scan_id}\ndata file written to {datafile}')
 
                 ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
-                ## data evaluation
-                if any(md in p['mode'] for md in ('trans', 'fluo', 'flou', 'both', 'ref', 'xs')):
-                    try:
-                        score, emoji = user_ns['clf'].evaluate(uid, mode=p['mode'])
-                        report(f"Data evaluation: {emoji}", level='bold', slack=True)
-                        ## FYI: db.v2[-1].metadata['start']['scan_id']
-                    except:
-                        pass
-                    try:
-                        copy_to_gdrive(fname)
-                        synch_gdrive_folder()
-                        # here = os.getcwd()
-                        # gdrive = os.path.join(os.environ['HOME'], 'gdrive')
-                        # os.chdir(gdrive)
-                        # print(f'copying {fname} to {gdrive}')
-                        # shutil.copyfile(os.path.join(BMMuser.folder, fname), os.path.join(gdrive, 'Data', BMMuser.name, BMMuser.date, fname))
-                        # print(f'updating {gdrive}')
-                        # subprocess.run(['/home/xf06bm/go/bin/drive', 'push', '-quiet']) 
-                        # os.chdir(here)
-                    except Exception as e:
-                        print(error_msg(e))
-                        report(f"Failed to push {fname} to Google drive...", level='bold', slack=True)
-                        
+                ## hand off the data evaluation and Google drive chores to the
+                ## post-scan work queue, see BMM/postscan.py.  The XDI file will
+                ## be written there only if the streaming writer failed.
+                postscan.enqueue(uid=uid, datafile=datafile, mode=p['mode'], context=xdicb.context, span=repetition)
+
                 ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
                 ## generate left sidebar text for the static html page for this scan sequence
-                js_text = f'<a href="javascript:void(0)" onclick="toggle_visibility(\'{fname}\');" title="This is the scan number for {fname}, click to show/hide its UID">#{header.start["scan_id"]}</a><div id="{fname}" style="display:none;"><small>{uid}</small></div>'
-                ##% (fname, fname, header.start['scan_id'], fname, uid)
+                js_text = f'<a href="javascript:void(0)" onclick="toggle_visibility(\'{fname}\');" title="This is the scan number for {fname}, click to show/hide its UID">#{scan_id}</a><div id="{fname}" style="display:none;"><small>{uid}</small></div>'
+                ##% (fname, fname, scan_id, fname, uid)
                 printedname = fname
                 if len(p['filename']) > 11:
                     printedname = fname[0:6] + '&middot;&middot;&middot;' + fname[-5:]
                 html_scan_list += f'<li><a href="../{quote(fname)}" title="Click to see the text of {fname}">{printedname}</a>&nbsp;&nbsp;&nbsp;&nbsp;{js_text}</li>\n' 
                 #                  % (quote(fname), fname, printedname, js_text)
                 html_dict['scanlist'] = html_scan_list
+                repetition.end()
 
 
             ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
@@ -1148,12 +1267,20 @@ def xafs(inifile=None, **kwargs):
 
         ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
         ## execute this scan sequence plan
+        span = spans.begin('sequence')
         yield from scan_sequence(clargs)
+        span.end()
 
     def cleanup_plan(inifile):
         print('Cleaning up after an XAFS scan sequence')
         RE.clear_suspenders()
 
+        ## the dossier and the gdrive copies need all the XDI files
+        with spans.span('postscan wait', parent=timing.get('xafs'), pending=postscan.pending()):
+            if postscan.pending() > 0:
+                print(whisper(f'  waiting for {inflect("post-scan job", postscan.pending())} to finish'))
+            postscan.join()
+
         db = user_ns['db']
         ## db[-1].stop['num_events']['primary'] should equal db[-1].start['num_points'] for a complete scan
         how = 'finished'
@@ -1169,7 +1296,8 @@ def xafs(inifile=None, **kwargs):
             BMM_log_info(f'most recent uid = {db[-1].start["uid"]}, scan_id = {db[-1].start["scan_id"]}')
             ## FYI: db.v2[-1].metadata['start']['scan_id']
             if 'htmlpage' in html_dict and html_dict['htmlpage']:
-                (htmlout, prjout, pngout) = scan_sequence_static_html(inifile=inifile, **html_dict)
+                with spans.span('dossier', parent=timing.get('xafs')):
+                    (htmlout, prjout, pngout) = scan_sequence_static_html(inifile=inifile, **html_dict)
                 if htmlout is not None:
                     report('wrote dossier %s' % htmlout, 'bold')
                     gdrive_dict['dossier']   = {'source': htmlout,
@@ -1181,16 +1309,18 @@ def xafs(inifile=None, **kwargs):
                     gdrive_dict['processed'] = {'source': pngout,
                                                 'target': os.path.join(os.environ['HOME'], 'gdrive', 'Data', BMMuser.name, BMMuser.date, 'snapshots', os.path.basename(htmlout).replace('html', 'png'))}
                     
+            span = spans.begin('gdrive copies', parent=timing.get('xafs'), nfiles=len(gdrive_dict))
+            ## the copies and the push are done by the Google drive sync service, see BMM/gdrive.py
             for k,v in gdrive_dict.items():
                 #print(f'\n{k}')
                 #print(f'   source: {v["source"]}')
                 #print(f'   target: {v["target"]}')
-                if v['source'] is not None:
-                    try:
-                        shutil.copyfile(v['source'], v['target'])
-                    except Exception as e:
-                        print(e)
-                    
+                gsync.add(v['source'], v['target'])
+            gsync.push()
+            span.end()
+        if 'xafs' in timing:
+            timing['xafs'].end(ok=(how == 'finished' and BMMuser.final_log_entry is True))
+
         dcm.mode = 'fixed'
         yield from resting_state_plan()
         yield from sleep(2.0)
@@ -1202,7 +1332,7 @@ def xafs(inifile=None, **kwargs):
     quadem1, vor = user_ns['quadem1'], user_ns['vor']
     xafs_wheel, ga = user_ns['xafs_wheel'], user_ns['ga']
     xascam, anacam = user_ns['xascam'], user_ns['anacam']
-    rkvs = user_ns['rkvs']
+    rkvs, postscan, spans, gsync = user_ns['rkvs'], user_ns['postscan'], user_ns['spans'], user_ns['gsync']
     try:
         xs = user_ns['xs']
     except:
@@ -1230,12 +1360,17 @@ def xafs(inifile=None, **kwargs):
     html_scan_list = ''
     html_dict = {}
     gdrive_dict = {}
+    timing = {}
     BMMuser.final_log_entry = True
     RE.msg_hook = None
     if BMMuser.lims is False:
         BMMuser.snapshot = False
         BMMuser.htmlout  = False
 
+    if isinstance(inifile, ScanParameters):
+        yield from finalize_wrapper(main_plan(inifile, **kwargs), cleanup_plan(inifile.inifile))
+        RE.msg_hook = BMM_msg_hook
+        return
     if inifile is None:
         inifile = present_options('ini')
     if inifile is None:
@@ -1246,32 +1381,28 @@ def xafs(inifile=None, **kwargs):
     RE.msg_hook = BMM_msg_hook
 
 
-def howlong(inifile=None, interactive=True, **kwargs):
-    '''
-    Estimate how long the scan sequence in an XAFS control file will take.
-    Parameters from control file are composable via kwargs.
-
-    Examples
-    --------
-    Interactive (command line) use:
-        
-    >>> howlong('scan.ini')
+def read_control_file(inifile=None, **kwargs):
+    '''Find, read, and sanity check an XAFS control file.
 
-    Non-interactive use (for instance, to display the control file contents and a time estimate):
-        
-    >>> howlong('scan.ini', interactive=False)
+    inifile is tried as given, then relative to BMMuser.DATA.  This
+    allows something like RE(xafs('myscan.ini')) -- short 'n' sweet.
+    inifile may also be a ScanParameters object.
 
+    Returns (inifile, parameters), where parameters is a
+    ScanParameters object or None if there is a problem.  inifile is
+    the resolved file name (or the ScanParameters object, if one was
+    given) on success.
     '''
-
-    ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
-    ## user input, find and parse the INI file
-    ## try inifile as given then DATA + inifile
-    ## this allows something like RE(xafs('myscan.ini')) -- short 'n' sweet
     BMMuser = user_ns['BMMuser']
+    if isinstance(inifile, ScanParameters):
+        params = scan_parameters(inifile, **kwargs)
+        if params is None:
+            return(inifile.inifile, None)
+        return(inifile if params is inifile else params, params)
     if inifile is None:
         inifile = present_options('ini')
     if inifile is None:
-        return('', -1)
+        return('', None)
     if inifile[-4:] != '.ini':
         inifile = inifile+'.ini'
     orig = inifile
@@ -1279,16 +1410,41 @@ def howlong(inifile=None, interactive=True, **kwargs):
         inifile = os.path.join(BMMuser.DATA, inifile)
         if not os.path.isfile(inifile):
             print(warning_msg('\n%s does not exist!  Bailing out....\n' % orig))
-            return(orig, -1)
+            return(orig, None)
     print(bold_msg('reading ini file: %s' % inifile))
-    (p, f) = scan_metadata(inifile=inifile, **kwargs)
-    if not p:
+    params = scan_parameters(inifile, **kwargs)
+    if params is None:
         print(error_msg('%s could not be read as an XAFS control file\n' % inifile))
-        return(orig, -1)
-    (ok, missing) = ini_sanity(f)
+        return(orig, None)
+    (ok, missing) = ini_sanity(params.found())
     if not ok:
         print(error_msg('\nThe following keywords are missing from your INI file: '), '%s\n' % str.join(', ', missing))
-        return(orig, -1)
+        return(orig, None)
+    return(inifile, params)
+
+
+def howlong(inifile=None, interactive=True, **kwargs):
+    '''
+    Estimate how long the scan sequence in an XAFS control file will take.
+    Parameters from control file are composable via kwargs.  inifile
+    can also be a ScanParameters object.
+
+    Examples
+    --------
+    Interactive (command line) use:
+        
+    >>> howlong('scan.ini')
+
+    Non-interactive use (for instance, to display the control file contents and a time estimate):
+        
+    >>> howlong('scan.ini', interactive=False)
+
+    '''
+
+    (inifile, params) = read_control_file(inifile, **kwargs)
+    if params is None:
+        return(inifile, -1)
+    (p, f) = params.as_dict()
     (energy_grid, time_grid, approx_time, delta) = conventional_grid(p['bounds'], p['steps'], p['times'], e0=p['e0'], element=p['element'], edge=p['edge'], ththth=p['ththth'])
     if delta == 0:
         text = f'One scan of {len(energy_grid)} points will take about {approx_time} minutes\n'
@@ -1322,36 +1478,15 @@ def howlong(inifile=None, interactive=True, **kwargs):
 
 def xafs_grid(inifile=None, **kwargs):
     '''
-    Return the energy and time grids specified in an INI file.
+    Return the energy and time grids specified in an INI file (or a
+    ScanParameters object).
 
     '''
 
-    ## --*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--*--
-    ## user input, find and parse the INI file
-    ## try inifile as given then DATA + inifile
-    ## this allows something like RE(xafs('myscan.ini')) -- short 'n' sweet
-    BMMuser = user_ns['BMMuser']
-    if inifile is None:
-        inifile = present_options('ini')
-    if inifile is None:
-        return('', -1)
-    if inifile[-4:] != '.ini':
-        inifile = inifile+'.ini'
-    orig = inifile
-    if not os.path.isfile(inifile):
-        inifile = os.path.join(BMMuser.DATA, inifile)
-        if not os.path.isfile(inifile):
-            print(warning_msg('\n%s does not exist!  Bailing out....\n' % orig))
-            return(orig, -1)
-    print(bold_msg('reading ini file: %s' % inifile))
-    (p, f) = scan_metadata(inifile=inifile, **kwargs)
-    if not p:
-        print(error_msg('%s could not be read as an XAFS control file\n' % inifile))
-        return(orig, -1)
-    (ok, missing) = ini_sanity(f)
-    if not ok:
-        print(error_msg('\nThe following keywords are missing from your INI file: '), '%s\n' % str.join(', ', missing))
-        return(orig, -1)
+    (inifile, params) = read_control_file(inifile, **kwargs)
+    if params is None:
+        return(inifile, -1)
+    (p, f) = params.as_dict()
     (energy_grid, time_grid, approx_time, delta) = conventional_grid(p['bounds'], p['steps'], p['times'], e0=p['e0'], element=p['element'], edge=p['edge'], ththth=p['ththth'])
     print(f'{p["element"]} {p["edge"]}')
     return(energy_grid, time_grid)
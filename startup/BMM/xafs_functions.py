@@ -1,7 +1,7 @@
 
 from BMM.functions     import error_msg, warning_msg, go_msg, url_msg, bold_msg, verbosebold_msg, list_msg, disconnected_msg, info_msg, whisper
 from BMM.functions     import countdown, boxedtext, now, isfloat, inflect, e2l, etok, ktoe
-import numpy
+import numpy, functools
 
 from IPython import get_ipython
 user_ns = get_ipython().user_ns
@@ -119,9 +119,9 @@ def conventional_grid(bounds=CS_BOUNDS, steps=CS_STEPS, times=CS_TIMES, e0=7112,
 
     Output
     ------
-    grid : list
+    grid : numpy array (read-only)
         absolute energy values
-    timegrid : list
+    timegrid : numpy array (read-only)
         integration times
     approximate_time : float
         a very crude estimate of how long in minutes the scan will take
@@ -147,6 +147,11 @@ def conventional_grid(bounds=CS_BOUNDS, steps=CS_STEPS, times=CS_TIMES, e0=7112,
     So at 5 invAng, integrate for 2.5 seconds.  At 10 invAng,
     integrate for 5 seconds.
 
+    Grids are memoized on the values of all the arguments, so asking
+    for the same grid again is essentially free.  The time estimate is
+    not memoized.  It is computed from the current telemetry model on
+    every call.  The bounds, steps, and times lists are not modified.
+
     Examples
     --------
     this is the default (same as (g,it,at) = conventional_grid()):
@@ -173,50 +178,72 @@ def conventional_grid(bounds=CS_BOUNDS, steps=CS_STEPS, times=CS_TIMES, e0=7112,
     >>>                                           steps=[0.25,],
     >>>                                           times=[0.5,], e0=7112)
     '''
-    tele = user_ns['tele']
-    
     if (len(bounds) - len(steps)) != 1:
-        return (None, None, None)
+        return (None, None, None, None)
     if (len(bounds) - len(times)) != 1:
-        return (None, None, None)
-    for i,s in enumerate(bounds):
-        if type(s) is str:
-            this = float(s[:-1])
-            bounds[i] = ktoe(this)
-    bounds.sort()
+        return (None, None, None, None)
+    (grid, timegrid) = _conventional_grid(tuple(bounds), tuple(steps), tuple(times), e0, ththth)
+
+    tele = user_ns['tele']
+    if element is not None:
+        overhead, uncertainty = tele.overhead_per_point(element, edge)
+    else:
+        overhead, uncertainty = tele.interpolate(e0), 0
+
+    approximate_time = (timegrid.sum() + len(timegrid)*overhead) / 60.0
+    delta = len(timegrid)*uncertainty / 60.0
+    return (grid, timegrid, round(float(approximate_time), 1), round(float(delta), 1))
 
+
+def _readonly(array):
+    array.flags.writeable = False
+    return array
+
+@functools.lru_cache(maxsize=512)
+def _conventional_grid(bounds, steps, times, e0, ththth):
+    '''Memoized worker for conventional_grid, returns (grid, timegrid).
+
+    The arguments are the same as for conventional_grid, except that
+    bounds, steps, and times must be tuples so that they are hashable.
+    Since the same grid is computed several times in the course of
+    preparing a scan sequence (howlong, xafs_grid, the macro builder,
+    and the scan itself), the result of each call is cached.  The
+    returned arrays are shared between callers, so they are made
+    read-only.
+
+    Only the grids are cached, they depend on nothing but the
+    arguments.  The time estimate, which depends on the telemetry
+    model, is made by conventional_grid.
+    '''
+    bounds = numpy.array(sorted(ktoe(float(b[:-1])) if type(b) is str else b for b in bounds), dtype=float)
     enot = e0
     if ththth:
-        enot = e0/3.0
-        bounds = list(numpy.array(bounds)/3)
-    grid = list()
-    timegrid = list()
+        enot   = e0/3.0
+        bounds = bounds/3.0
+
+    regions, timeregions = [], []
     for i,s in enumerate(steps):
         if type(s) is str:
             step = float(s[:-1])
             if ththth: step = step/3.
             ar = enot + ktoe(numpy.arange(etok(bounds[i]), etok(bounds[i+1]), step))
         else:
-            step = steps[i]
+            step = s
             if ththth: step = step/3.
             ar = numpy.arange(enot+bounds[i], enot+bounds[i+1], step)
-        grid = grid + list(ar)
-        grid = list(numpy.round(grid, decimals=2))
         if type(times[i]) is str:
             tar = etok(ar-enot)*float(times[i][:-1])
         else:
-            tar = times[i]*numpy.ones(len(ar))
-        timegrid = timegrid + list(tar)
-        timegrid = list(numpy.round(timegrid, decimals=2))
+            tar = numpy.full(len(ar), float(times[i]))
+        regions.append(ar)
+        timeregions.append(tar)
+    grid     = _readonly(numpy.round(numpy.concatenate(regions),     decimals=2))
+    timegrid = _readonly(numpy.round(numpy.concatenate(timeregions), decimals=2))
+    return (grid, timegrid)
 
-    if element is not None:
-        overhead, uncertainty = tele.overhead_per_point(element, edge)
-    else:
-        overhead = tele.interpolate(e0)
-        
-    approximate_time = (sum(timegrid) + float(len(timegrid))*overhead) / 60.0
-    delta = float(len(timegrid))*uncertainty / 60.0
-    return (grid, timegrid, round(approximate_time, 1), round(delta, 1))
+def clear_grid_cache():
+    '''Forget all energy grids computed by conventional_grid.'''
+    _conventional_grid.cache_clear()
 
 ## -----------------------
 ##  energy step scan plan concept
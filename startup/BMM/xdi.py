@@ -1,11 +1,15 @@
 from bluesky import __version__ as bluesky_version
-import re, pathlib, sys, datetime, pandas, numpy
+from bluesky.callbacks.core import CallbackBase
+import os, re, pathlib, sys, datetime, pandas, numpy, copy, types
+
+from BMM.functions import error_msg, bold_msg
 
 from IPython import get_ipython
 user_ns = get_ipython().user_ns
 
 
-def units(label):
+def units(label, context=None):
+    BMMuser = context or user_ns['BMMuser']
     label = label.lower()
     try:
         if 'energy' in label:
@@ -24,7 +28,7 @@ def units(label):
             return 'dead-time corrected count rate'
         elif 'encoder' in label:
             return 'counts'
-        elif user_ns['BMMuser'].xschannel1 in label:
+        elif BMMuser.xschannel1 in label:
             return 'dead-time corrected count rate'
         else:
             return ''
@@ -51,7 +55,7 @@ fluorescence_1ch = [quadem1.I0, quadem1.It, quadem1.Ir, vor.dtcorr1, vor.channel
 class metadata_for_XDI_file():
     def __init__(self):
         self.xdilist = []
-        self.dataframe = None
+        self.start = None
 
     def insert_line(self, line):
         '''Insert a line directly into the list of header lines. Presumably,
@@ -84,7 +88,7 @@ class metadata_for_XDI_file():
         text = ''
         (group,family,key) = datum.split('.') # e.g. XDI.Beamline.name
         try:
-            text = template % self.dataframe.start[group][family][key]
+            text = template % self.start[group][family][key]
         except:
             if '%s' in template:
                 text = template % ''
@@ -94,34 +98,93 @@ class metadata_for_XDI_file():
 
 
 
-def write_XDI(datafile, dataframe):
+def sample_stage():
+    '''Return the Sample.stage metadatum for the current position of the
+    sample instrument, or an empty string.  This is captured at the
+    end of a scan when the XDI file will be written later.'''
     BMMuser, xafs_wheel, ga = user_ns['BMMuser'], user_ns['xafs_wheel'], user_ns['ga']
-    handle = open(datafile, 'w')
-
-    ## set Scan.start_time & Scan.end_time ... this is how it is done
-    d=datetime.datetime.fromtimestamp(round(dataframe.start['time']))
-    start_time = datetime.datetime.isoformat(d)
-    d=datetime.datetime.fromtimestamp(round(dataframe.stop['time']))
-    end_time   = datetime.datetime.isoformat(d)
-    st = pandas.Timestamp(start_time) # this is a UTC problem
-
-    ##################################
-    # grab the "underscore" metadata #
-    ##################################
+    if BMMuser.instrument == 'sample wheel':
+        return f'{BMMuser.instrument} slot {xafs_wheel.current_slot()}'
+    elif BMMuser.instrument == 'glancing angle stage':
+        return f'{BMMuser.instrument} spinner {ga.current()}'
+    return ''
+
+
+## the parts of BMMuser which go into an XDI file
+_context_attributes = ('detector', 'element',
+                       'dtc1', 'dtc2', 'dtc3', 'dtc4',
+                       'roi1', 'roi2', 'roi3', 'roi4',
+                       'xs1', 'xs2', 'xs3', 'xs4',
+                       'xschannel1', 'xschannel2', 'xschannel3', 'xschannel4')
+
+def xdi_context(stage=None):
+    '''Capture everything from the user namespace which is needed to
+    write an XDI file -- the parts of BMMuser in _context_attributes,
+    with_xspress3, XDI_record, and the Sample.stage metadatum.
+
+    When the XDI file is written after the scan, as by the post-scan
+    work queue, the next scan has likely begun and BMMuser may have
+    been changed for it.  Capture this when the scan finishes and pass
+    it to write_XDI.
+
+    Parameters
+    ----------
+    stage : str or None
+        the Sample.stage metadatum, None to ask the sample instrument now
+    '''
+    BMMuser = user_ns['BMMuser']
+    context = types.SimpleNamespace(**{a: getattr(BMMuser, a, None) for a in _context_attributes})
+    context.stage         = sample_stage() if stage is None else stage
+    context.with_xspress3 = user_ns['with_xspress3']
+    context.XDI_record    = copy.deepcopy(user_ns['XDI_record'])
+    return context
+
+
+def xdi_underscore(start):
+    '''Return the "underscore" metadata -- mode, comment, and kind -- from
+    a start document, falling back to sensible defaults.'''
     try:
-        mode = dataframe.start['XDI']['_mode'][0]
+        mode = start['XDI']['_mode'][0]
     except:
         mode = 'transmission'
 
     try:
-        comment = dataframe.start['XDI']['_comment'][0]
+        comment = start['XDI']['_comment'][0]
     except:
         comment = ''
 
     try:
-        kind = dataframe.start['XDI']['_kind']
+        kind = start['XDI']['_kind']
     except:
         kind = 'xafs'
+    return mode, comment, kind
+
+
+def xdi_header(start, baseline, end_time, stage=None, context=None):
+    '''Return the list of header lines for an XDI file, without line endings.
+
+    Parameters
+    ----------
+    start : dict
+        the start document of the run
+    baseline : dict
+        the first baseline reading, keyed by data key
+    end_time : str
+        ISO 8601 time stamp for the Scan.end_time metadatum
+    stage : str or None
+        the Sample.stage metadatum, None to ask the sample instrument now
+    context : SimpleNamespace or None
+        the state captured by xdi_context(), None to capture it now
+    '''
+    if context is None:
+        context = xdi_context(stage)
+    BMMuser = context
+
+    ## set Scan.start_time & Scan.end_time ... this is how it is done
+    d=datetime.datetime.fromtimestamp(round(start['time']))
+    start_time = datetime.datetime.isoformat(d)
+
+    mode, comment, kind = xdi_underscore(start)
 
     ##########################
     # grab the detector list #
@@ -140,16 +203,16 @@ def write_XDI(datafile, dataframe):
         detectors = fluorescence
         if BMMuser.detector == 1:
             detectors = fluorescence_1ch
-            
-        
+
+
 
     ############################################
     # start gathering formatted metadata lines #
     ############################################
     metadata = metadata_for_XDI_file()
-    metadata.dataframe = dataframe
+    metadata.start = start
 
-    ## snarf XDI metadata from the dataframe and elsewhere
+    ## snarf XDI metadata from the start document and elsewhere
     metadata.insert_line('# XDI/1.0 BlueSky/%s BMM/%s' % (bluesky_version, pathlib.Path(sys.executable).parts[-3]))
     metadata.start_doc('# Beamline.name: %s',               'XDI.Beamline.name')
     metadata.start_doc('# Beamline.xray_source: %s',        'XDI.Beamline.xray_source')
@@ -193,32 +256,30 @@ def write_XDI(datafile, dataframe):
     metadata.start_doc('# Sample.name: %s',                      'XDI.Sample.name')
     metadata.start_doc('# Sample.prep: %s',                      'XDI.Sample.prep')
 
-    if BMMuser.instrument == 'sample wheel':
-        metadata.insert_line(f'# Sample.stage: {BMMuser.instrument} slot {xafs_wheel.current_slot()}')
-    elif BMMuser.instrument == 'glancing angle stage':
-        metadata.insert_line(f'# Sample.stage: {BMMuser.instrument} spinner {ga.current()}')
-        
+    if context.stage:
+        metadata.insert_line(f'# Sample.stage: {context.stage}')
+
     ## record selected baseline measurements as XDI metadata
-    XDI_record = user_ns['XDI_record']
+    XDI_record = context.XDI_record
     for r in XDI_record.keys():
         if XDI_record[r][0] is True:
-            if r in dataframe.table('baseline'):
-                metadata.insert_line('# %s: %.3f mm' % (XDI_record[r][1], dataframe.table('baseline')[r][1]))
-    
+            if r in baseline:
+                metadata.insert_line('# %s: %.3f mm' % (XDI_record[r][1], baseline[r]))
+
     metadata.start_doc('# Scan.experimenters: %s', 'XDI.Scan.experimenters')
     metadata.start_doc('# Scan.edge_energy: %s',   'XDI.Scan.edge_energy')
 
     if kind == '333':
         try:
-            ththth_energy = dataframe.start['XDI']['Scan']['edge_energy'] / 3.0
+            ththth_energy = start['XDI']['Scan']['edge_energy'] / 3.0
             metadata.insert_line('# Scan.edge_energy_333: %.1f'  % ththth_energy)
         except:
             pass
 
     metadata.insert_line('# Scan.start_time: %s'   % start_time)
     metadata.insert_line('# Scan.end_time: %s'     % end_time)
-    metadata.insert_line('# Scan.transient_id: %s' % dataframe.start['scan_id'])
-    metadata.insert_line('# Scan.uid: %s'          % dataframe.start['uid'])
+    metadata.insert_line('# Scan.transient_id: %s' % start['scan_id'])
+    metadata.insert_line('# Scan.uid: %s'          % start['uid'])
 
     if kind == 'sead':
         metadata.start_doc('# Beamline.energy: %.3f', 'XDI.Beamline.energy')
@@ -248,7 +309,7 @@ def write_XDI(datafile, dataframe):
     abscissa_columns = ('energy', 'requested_energy', 'measurement_time', 'xmu')
     if kind == 'sead': abscissa_columns = ('time',)
     for i, col in enumerate(abscissa_columns, start=1):     # 'encoder'
-        metadata.insert_line('# Column.%d: %s %s' % (i, col, units(col)))
+        metadata.insert_line('# Column.%d: %s %s' % (i, col, units(col, context)))
         labels.append(col)
 
     ###############################################################
@@ -265,28 +326,38 @@ def write_XDI(datafile, dataframe):
         else:
             this = d.name
         labels.append(this)
-        metadata.insert_line('# Column.%d: %s %s' % (i, this, units(this)))
-
-    ####################
-    # write it all out #
-    ####################
-    eol = '\n'
-    for line in metadata.xdilist:
-        handle.write(line + eol)
-    handle.write('# ///////////' + eol)
-    handle.write('# ' + comment + eol)
-    handle.write('# -----------' + eol)
-    handle.write('# ' + '  '.join(labels) + eol)
-    table = dataframe.table()
-    if user_ns['with_xspress3'] and 'fluo' in mode or 'flou' in mode or 'both' in mode:
-        table['xmu'] = (table[BMMuser.xs1]+table[BMMuser.xs2]+table[BMMuser.xs3]+table[BMMuser.xs4]) / table['I0']
+        metadata.insert_line('# Column.%d: %s %s' % (i, this, units(this, context)))
+
+    metadata.insert_line('# ///////////')
+    metadata.insert_line('# ' + comment)
+    metadata.insert_line('# -----------')
+    metadata.insert_line('# ' + '  '.join(labels))
+    return metadata.xdilist
+
+
+def xdi_layout(mode, kind, context=None):
+    '''Return the data columns of an XDI file for a measurement mode and kind.
+
+    This returns a tuple of
+      * the list of data keys to write, in order
+      * the printf-style template for a line of data
+      * a dict of derived columns (xmu and 333_energy), keyed by name,
+        whose values are functions which compute the column from
+        either a table or the data dict of a single event
+
+    context is the state captured by xdi_context(), None to use BMMuser
+    as it is now.
+    '''
+    BMMuser = context or user_ns['BMMuser']
+    with_xspress3 = context.with_xspress3 if context is not None else user_ns['with_xspress3']
+    derived = dict()
+    if with_xspress3 and 'fluo' in mode or 'flou' in mode or 'both' in mode:
+        derived['xmu'] = lambda t: (t[BMMuser.xs1]+t[BMMuser.xs2]+t[BMMuser.xs3]+t[BMMuser.xs4]) / t['I0']
         column_list = ['dcm_energy', 'dcm_energy_setpoint', 'dwti_dwell_time', 'xmu', 'I0', 'It', 'Ir']
         column_list.extend([BMMuser.xs1, BMMuser.xs2, BMMuser.xs3, BMMuser.xs4])
         template = "  %.3f  %.3f  %.3f  %.6f  %.6f  %.6f  %.6f  %.6f  %.6f  %.6f  %.6f\n"
     elif 'fluo' in mode or 'flou' in mode or 'both' in mode:
-        table['xmu'] = (table[BMMuser.dtc1] + table[BMMuser.dtc2] + table[BMMuser.dtc4]) / table['I0']
-        if kind == '333':
-            table['333_energy'] = table['dcm_energy']*3
+        derived['xmu'] = lambda t: (t[BMMuser.dtc1] + t[BMMuser.dtc2] + t[BMMuser.dtc4]) / t['I0']
         column_list = ['dcm_energy', 'dcm_energy_setpoint', 'dwti_dwell_time', 'xmu', 'I0', 'It', 'Ir',
                        BMMuser.dtc1, BMMuser.dtc2, BMMuser.dtc3, BMMuser.dtc4,
                        BMMuser.roi1, 'ICR1', 'OCR1',
@@ -294,9 +365,9 @@ def write_XDI(datafile, dataframe):
                        BMMuser.roi3, 'ICR3', 'OCR3',
                        BMMuser.roi4, 'ICR4', 'OCR4']
         if kind == '333':
-            table['333_energy'] = table['dcm_energy']*3
+            derived['333_energy'] = lambda t: t['dcm_energy']*3
             column_list[0] = '333_energy'
-        #             en    en    dwti  xmu   io    it    ir    dtc1  dtc2  dtc3  dtc4  |----- 1 ------|  |----- 2 ------|  |----- 3 ------|  |----- 4 ------|  
+        #             en    en    dwti  xmu   io    it    ir    dtc1  dtc2  dtc3  dtc4  |----- 1 ------|  |----- 2 ------|  |----- 3 ------|  |----- 4 ------|
         template = "  %.3f  %.3f  %.3f  %.6f  %.6f  %.6f  %.6f  %.6f  %.6f  %.6f  %.6f  %.1f  %.1f  %.1f  %.1f  %.1f  %.1f  %.1f  %.1f  %.1f  %.1f  %.1f  %.1f\n"
         if BMMuser.element == 1:
             #             en    en    dwti  xmu   io    it    ir    dtc1  |----- 1 ------|
@@ -306,18 +377,18 @@ def write_XDI(datafile, dataframe):
 
     else:
         if 'yield' in mode:     # yield is the primary measurement
-            table['xmu'] = table['Iy'] / table['I0']
+            derived['xmu'] = lambda t: t['Iy'] / t['I0']
         elif 'ref' in mode:     # reference is the primary measurement
-            table['xmu'] = numpy.log(table['It'] / table['Ir'])
+            derived['xmu'] = lambda t: numpy.log(t['It'] / t['Ir'])
         elif 'xs' in mode:     # reference is the primary measurement
-            table['xmu'] = (table[BMMuser.xs1]+table[BMMuser.xs2]+table[BMMuser.xs3]+table[BMMuser.xs4]) / table['I0']
+            derived['xmu'] = lambda t: (t[BMMuser.xs1]+t[BMMuser.xs2]+t[BMMuser.xs3]+t[BMMuser.xs4]) / t['I0']
         elif 'test' in mode:    # test scan, no log!
-            table['xmu'] = table['I0']
+            derived['xmu'] = lambda t: t['I0']
         else:                   # transmission is the primary measurement
-            table['xmu'] = numpy.log(table['I0'] / table['It'])
+            derived['xmu'] = lambda t: numpy.log(t['I0'] / t['It'])
         column_list = ['dcm_energy', 'dcm_energy_setpoint', 'dwti_dwell_time', 'xmu', 'I0', 'It', 'Ir']
         if kind == '333':
-            table['333_energy'] = table['dcm_energy']*3
+            derived['333_energy'] = lambda t: t['dcm_energy']*3
             column_list[0] = '333_energy'
         template = "  %.3f  %.3f  %.3f  %.6f  %.6f  %.6f  %.6f\n"
         if 'yield' in mode:
@@ -332,15 +403,187 @@ def write_XDI(datafile, dataframe):
         column_list.pop(0)
         column_list.insert(0, 'time')
         template = template[12:]
+    return column_list, template, derived
+
+
+def write_XDI(datafile, dataframe, stage=None, context=None):
+    '''Write an XDI file from a run fetched from databroker.  context is
+    the state captured by xdi_context() when the scan finished, None
+    to capture it now.'''
+    if context is None:
+        context = xdi_context(stage)
+    handle = open(datafile, 'w')
+
+    d=datetime.datetime.fromtimestamp(round(dataframe.start['time']))
+    start_time = datetime.datetime.isoformat(d)
+    d=datetime.datetime.fromtimestamp(round(dataframe.stop['time']))
+    end_time   = datetime.datetime.isoformat(d)
+    st = pandas.Timestamp(start_time) # this is a UTC problem
+
+    mode, comment, kind = xdi_underscore(dataframe.start)
+    baseline_table = dataframe.table('baseline')
+    baseline = {k: baseline_table[k][1] for k in baseline_table.columns}
+
+    ####################
+    # write it all out #
+    ####################
+    eol = '\n'
+    for line in xdi_header(dataframe.start, baseline, end_time, context=context):
+        handle.write(line + eol)
+
+    table = dataframe.table()
+    column_list, template, derived = xdi_layout(mode, kind, context)
+    for k, f in derived.items():
+        table[k] = f(table)
     this = table.loc[:,column_list]
 
-    for i in range(0,len(this)):
-        datapoint = list(this.iloc[i])
-        if kind == 'sead':
-            ti = this.iloc[i, 0]
-            elapsed =  (ti.value - st.value)/10**9
-            datapoint[0] = elapsed
-        handle.write(template % tuple(datapoint))
-        #handle.write(template % tuple(this.iloc[i]))
+    if kind == 'sead':
+        handle.write(xdi_data_block(this, template, elapsed_from=st))
+    else:
+        handle.write(xdi_data_block(this, template))
     handle.flush()
     handle.close()
+
+
+class XDIStreamWriter(CallbackBase):
+    '''A bluesky callback which writes an XDI file while the scan runs.
+
+    The header is written as soon as the baseline reading has arrived,
+    before the first data point.  Each row of data is appended to the
+    file as its event arrives.  The Scan.end_time metadatum is patched
+    in place when the stop document arrives.  There is no need to
+    fetch the run from databroker after the scan, and a partial file
+    survives if the scan is aborted.  The partial file is closed and
+    its last line is a comment giving the exit status of the run and
+    the number of points measured.
+
+    Should anything go wrong while writing, the partial file is
+    removed so that the run can be written with write_XDI instead.
+    The post-scan work queue does that for any file that does not
+    exist.
+
+    This is not suitable for sead scans.
+
+    Example
+    -------
+    >>> xdicb = XDIStreamWriter('/path/to/data.001')
+    >>> uid = yield from subs_wrapper(scan_nd(dets, trajectory, md=md), xdicb)
+
+    The state needed for the header and columns is captured by
+    xdi_context() when the writer is made and is available as
+    xdicb.context, to be handed to write_XDI should it be needed.
+    '''
+    def __init__(self, datafile, stage=None):
+        super().__init__()
+        self.datafile    = datafile
+        self.context     = xdi_context(stage)
+        self.stage       = self.context.stage
+        self.handle      = None
+        self.startdoc    = None
+        self.baseline    = dict()
+        self.streams     = dict()
+        self.layout      = None
+        self.end_offset  = None
+        self.npoints     = 0
+        self.failed      = False
+
+    def _fail(self, e):
+        print(error_msg(f'streaming XDI writer failed, {self.datafile} will be written after the scan: {e}'))
+        self.failed = True
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+        if os.path.isfile(self.datafile):
+            os.remove(self.datafile)
+
+    def _header(self):
+        d = datetime.datetime.fromtimestamp(round(self.startdoc['time']))
+        placeholder = datetime.datetime.isoformat(d) # same length as the real end time
+        self.handle = open(self.datafile, 'w')
+        for line in xdi_header(self.startdoc, self.baseline, placeholder, context=self.context):
+            if line.startswith('# Scan.end_time: '):
+                self.end_offset = self.handle.tell()
+            self.handle.write(line + '\n')
+        self.handle.flush()
+
+    def start(self, doc):
+        self.startdoc = doc
+        try:
+            mode, comment, kind = xdi_underscore(doc)
+            self.layout = xdi_layout(mode, kind, self.context)
+        except Exception as e:
+            self._fail(e)
+
+    def descriptor(self, doc):
+        self.streams[doc['uid']] = doc['name']
+
+    def event(self, doc):
+        if self.failed:
+            return
+        stream = self.streams.get(doc['descriptor'])
+        if stream == 'baseline':
+            if len(self.baseline) == 0:
+                self.baseline = dict(doc['data'])
+            return
+        if stream != 'primary':
+            return
+        try:
+            if self.handle is None:
+                self._header()
+            column_list, template, derived = self.layout
+            row = dict(doc['data'])
+            for k, f in derived.items():
+                row[k] = f(row)
+            self.handle.write(template % tuple(row[c] for c in column_list))
+            self.handle.flush()
+            self.npoints += 1
+        except Exception as e:
+            self._fail(e)
+
+    def stop(self, doc):
+        if self.failed:
+            return
+        try:
+            if self.handle is None:
+                self._header()
+            status = doc.get('exit_status', 'success')
+            if status != 'success':
+                self.handle.write(f'# scan ended early, exit status: {status}, {self.npoints} points measured\n')
+            d = datetime.datetime.fromtimestamp(round(doc['time']))
+            if self.end_offset is not None:
+                self.handle.seek(self.end_offset)
+                self.handle.write('# Scan.end_time: %s' % datetime.datetime.isoformat(d))
+            self.handle.close()
+            self.handle = None
+            print(bold_msg('wrote %s' % self.datafile))
+        except Exception as e:
+            self._fail(e)
+
+
+def xdi_data_block(table, template, elapsed_from=None):
+    '''Format an entire data table as the data section of an XDI file.
+
+    This replaces formatting the table one row at a time with
+    template % tuple(table.iloc[i]).  Indexing a DataFrame by row
+    is very slow, so the table is pulled apart into numpy columns,
+    then each row is formatted from those columns and everything is
+    returned as a single string to be written all at once.  The
+    output is identical to the row-by-row version.  Formatting column
+    by column, with numpy.char.mod or numpy.savetxt, is no faster --
+    both format one element at a time, and both are slower than this.
+
+    Parameters
+    ----------
+    table : pandas.DataFrame
+        the columns to write, in order
+    template : str
+        printf-style format for one line of data, including the newline
+    elapsed_from : pandas.Timestamp or None
+        for a sead scan, the first column contains time stamps which
+        are written as seconds elapsed since this time
+    '''
+    columns = [table.iloc[:, j].to_numpy() for j in range(table.shape[1])]
+    if elapsed_from is not None:
+        stamps = numpy.array([t.value for t in table.iloc[:, 0]], dtype=numpy.int64)
+        columns[0] = (stamps - elapsed_from.value) / 10**9
+    return ''.join(map(template.__mod__, zip(*[c.tolist() for c in columns])))
@@ -11,7 +11,7 @@ from ophyd.areadetector.filestore_mixins import (FileStoreIterativeWrite,
                                                  FileStoreHDF5IterativeWrite,
                                                  FileStoreTIFFSquashing,
                                                  FileStoreTIFF)
-from ophyd import Signal, EpicsSignal, EpicsSignalRO, DynamicDeviceComponent as DDCpt
+from ophyd import Device, Signal, EpicsSignal, EpicsSignalRO, Kind, DynamicDeviceComponent as DDCpt
 from ophyd.status import SubscriptionStatus, DeviceStatus
 from ophyd.sim import NullStatus  # TODO: remove after complete/collect are defined
 from ophyd import Component as Cpt, set_and_wait
@@ -27,7 +27,7 @@ from nslsii.detectors.xspress3 import (XspressTrigger, Xspress3Detector,
 
 import numpy, h5py, json
 #import pandas as pd
-import itertools, os
+import itertools, os, threading
 import time as ttime
 from collections import deque, OrderedDict
 from itertools import product
@@ -38,6 +38,7 @@ user_ns = get_ipython().user_ns
 
 from BMM.db            import file_resource
 from BMM.edge          import show_edges
+from BMM.periodictable import Z_number
 from BMM.functions     import error_msg, warning_msg, go_msg, url_msg, bold_msg, verbosebold_msg, list_msg, disconnected_msg, info_msg, whisper
 #import json
         
@@ -54,6 +55,9 @@ from databroker.assets.handlers import HandlerBase, Xspress3HDF5Handler, XS3_XRF
 #
 # This means that Xspress3 will require its own count plan
 # also that a linescan or xafs scan must set total_points up front
+#
+# In flyable mode (see Xspress3FlyerMixin), fly_size() sets
+# total_points from the expected duration of the measurement.
 
 
 
@@ -79,8 +83,142 @@ from databroker.assets.handlers import HandlerBase, Xspress3HDF5Handler, XS3_XRF
 # db.reg.register_handler(BMMXspress3HDF5Handler.HANDLER_NAME,
 #                         BMMXspress3HDF5Handler, overwrite=True)    
 
+################################################################################
+# Readers for Xspress3 HDF5 files.  The data set is (frames, channels,
+# bins).  These never load the whole file: the frames are read a block
+# at a time, straight from a memory map of the file when the data set
+# is stored contiguously and uncompressed, otherwise by hyperslab in
+# blocks aligned to the HDF5 chunking.
+
+XS3_DATASET = 'entry/instrument/detector/data'
+
+def xspress3_blocks(fname, chunk=256, start=0):
+    '''Yield (index of first frame, block of frames) from an Xspress3
+    HDF5 file, chunk frames at a time, beginning with frame start.'''
+    with h5py.File(fname, 'r') as f:
+        ds = f[XS3_DATASET]
+        nframes = ds.shape[0]
+        offset = ds.id.get_offset()
+        if ds.chunks is None and ds.compression is None and offset is not None:
+            data = numpy.memmap(fname, mode='r', dtype=ds.dtype, offset=offset, shape=ds.shape)
+        else:
+            data = ds
+            if ds.chunks is not None:
+                chunk = max(1, chunk // ds.chunks[0]) * ds.chunks[0]
+        for first in range(start, nframes, chunk):
+            yield first, numpy.asarray(data[first:first+chunk])
+
+def xspress3_roi_sums(fname, rois, chunk=256, start=0):
+    '''Yield (index of first frame, dict of ROI sums) from an Xspress3
+    HDF5 file, one block of frames at a time.
+
+    Parameters
+    ----------
+    fname : str
+        fully resolved path to the HDF5 file
+    rois : dict
+        name -> (channel index in the file, low bin, high bin), the bin
+        range is inclusive, as for the ROI PVs
+    chunk : int
+        number of frames to read at a time
+    start : int
+        first frame to read
+    '''
+    for first, block in xspress3_blocks(fname, chunk, start):
+        yield first, {name: block[:, c, low:high+1].sum(axis=-1, dtype=numpy.float64)
+                      for name, (c, low, high) in rois.items()}
+
+def xspress3_spectrum(fname, frame=0):
+    '''Return the (channels, bins) array of a single frame of an Xspress3 HDF5 file.'''
+    with h5py.File(fname, 'r') as f:
+        return f[XS3_DATASET][frame]
+
+
+class Xspress3FlyerMixin():
+    '''The flyer interface (kickoff, complete, collect) for an Xspress3.
+
+    In flyable mode, the detector free-runs for a number of frames of
+    fly_frame_time seconds each, sized from the expected length of the
+    measurement, rather than being triggered once per point.  The ROI
+    sums are read back from the HDF5 file a block of frames at a time
+    and emitted as events time-stamped at the middle of each frame.
+
+    A subclass provides _fly_start(nframes, frame_time), _fly_stop()
+    (returning a status which finishes when the file is closed),
+    _fly_file(), and fly_rois().
+
+    Attributes
+    ----------
+    fly_frame_time : float
+        exposure time (seconds) of each frame
+    fly_margin : float
+        the frame count is sized for this many times the expected duration
+    fly_chunk : int
+        number of frames read from the HDF5 file at a time
+    '''
+    fly_frame_time = 0.1
+    fly_margin     = 1.25
+    fly_chunk      = 256
+    fly_stream     = 'xspress3'
+
+    def fly_size(self, duration, frame_time=None):
+        '''Set the number of frames for a measurement expected to last
+        duration seconds.  Call this before the detector is staged.'''
+        if frame_time is not None:
+            self.fly_frame_time = frame_time
+        self._fly_nframes = int(numpy.ceil(duration * self.fly_margin / self.fly_frame_time)) + 10
+        self.total_points.put(self._fly_nframes)
+        return self._fly_nframes
+
+    def kickoff(self):
+        self._fly_t0 = ttime.time()
+        self._fly_start(self._fly_nframes, self.fly_frame_time)
+        status = DeviceStatus(self)
+        status.set_finished()
+        return status
+
+    def complete(self):
+        return self._fly_stop()
+
+    def describe_collect(self):
+        keys = {name: {'source': f'{self.name} HDF5 ROI', 'dtype': 'number', 'shape': []} for name in self.fly_rois()}
+        return {self.fly_stream: keys}
+
+    def collect(self):
+        rois = self.fly_rois()
+        for first, sums in xspress3_roi_sums(self._fly_file(), rois, chunk=self.fly_chunk):
+            count = len(next(iter(sums.values())))
+            for i in range(count):
+                t = self._fly_t0 + (first + i + 0.5) * self.fly_frame_time
+                yield {'time'       : t,
+                       'data'       : {name: float(v[i]) for name, v in sums.items()},
+                       'timestamps' : {name: t for name in sums}, }
+
+
+_rois = {'stamp': None, 'rois': None}
+
+def load_rois():
+    '''Return the contents of rois.json from the startup folder.  The
+    file is parsed once and read again only if it changes.'''
+    fname = os.path.join(get_ipython().profile_dir.startup_dir, 'rois.json')
+    s = os.stat(fname)
+    stamp = (s.st_mtime_ns, s.st_size)
+    if _rois['stamp'] != stamp:
+        with open(fname, 'r') as fl:
+            _rois['rois'] = json.load(fl)
+        _rois['stamp'] = stamp
+    return _rois['rois']
+
+
 class Xspress3FileStoreFlyable(Xspress3FileStore):
-    def warmup(self):
+    def needs_warmup(self):
+        '''True if the plugin has not seen a frame since the IOC started.'''
+        try:
+            return self.array_size.width.get() == 0
+        except Exception:
+            return True
+
+    def warmup(self, force=False):
         """
         A convenience method for 'priming' the plugin.
         The plugin has to 'see' one acquisition before it is ready to capture.
@@ -89,7 +227,12 @@ class Xspress3FileStoreFlyable(Xspress3FileStore):
             https://github.com/NSLS-II/ophyd/blob/master/ophyd/areadetector/plugins.py
         We had to replace "cam" with "settings" here.
         Also modified the stage sigs.
+
+        The warmup takes a few seconds, so it is skipped unless the
+        plugin needs it (or force is True).
         """
+        if not force and not self.needs_warmup():
+            return
         print(whisper("                warming up the hdf5 plugin..."))
         set_and_wait(self.enable, 1)
         sigs = OrderedDict([(self.parent.settings.array_callbacks, 1),
@@ -153,7 +296,7 @@ class BMMXspress3Channel(Xspress3Channel):
 ################################################################################
     
     
-class BMMXspress3DetectorBase(XspressTrigger, Xspress3Detector):
+class BMMXspress3DetectorBase(Xspress3FlyerMixin, XspressTrigger, Xspress3Detector):
     '''This class captures everything that is in common for the 1-element
     and 4-element detector interfaces.
     '''
@@ -205,6 +348,8 @@ class BMMXspress3DetectorBase(XspressTrigger, Xspress3Detector):
                       'Fe', 'Co', 'Ni', 'Cu',
                       'Zn', 'Ge', 'As', 'Br',
                       'Nb', 'Mo', None, 'OCR']
+        self.slot_edges = dict()   # slot index -> edge, for an element not measured at its usual edge
+        self._hinted    = None     # element whose ROIs are hinted
         self.restart()
         # self.settings.num_images.put(1)   # number of frames
         # self.settings.trigger_mode.put(1) # trigger mode internal
@@ -236,10 +381,104 @@ class BMMXspress3DetectorBase(XspressTrigger, Xspress3Detector):
         self._abs_trigger_count += 1
         return self._status
 
-    def set_rois():
-        '''Must be implemented by the subclass.
+    def roi_edge(self, el):
+        '''The edge used for the ROI of an element in the standard slots.'''
+        if Z_number(el) > 45:
+            return 'l3'
+        return 'k'
+
+    def desired_rois(self):
+        '''Return the ROI configuration implied by self.slots and rois.json
+        as a dict of (channel, roi index) -> (name, low, high).'''
+        allrois = load_rois()
+        desired = dict()
+        for i, el in enumerate(self.slots):
+            if el is None:
+                continue
+            for ch in self.fly_channels():
+                if el == 'OCR':
+                    desired[(ch, i+1)] = ('OCR', allrois['OCR']['low'], allrois['OCR']['high'])
+                else:
+                    edge = self.slot_edges.get(i, self.roi_edge(el))
+                    this = allrois[el.capitalize()][edge]
+                    desired[(ch, i+1)] = (f'{el.capitalize()}{ch}', this['low'], this['high'])
+        return desired
+
+    def apply_rois(self, desired):
+        '''Bring the ROIs on the detector into the state desired, which
+        is a dict of (channel, roi index) -> (name, low, high).
+
+        The bin_low and bin_high PVs are read back (concurrently, if
+        the PV snapshot service is running) and only those whose
+        values differ from the desired values are written.  They are
+        written all at once, then waited for together.  Since the
+        comparison is always with what is on the detector, a change
+        made elsewhere, e.g. by an IOC restart or in CSS, is noticed
+        and set right.  Returns the number of PVs written.
         '''
-        pass
+        signals = dict()
+        for (ch, index) in desired:
+            roi = getattr(getattr(self, f'channel{ch}').rois, 'roi{:02}'.format(index))
+            signals[f'{ch}:{index}:low']  = roi.bin_low
+            signals[f'{ch}:{index}:high'] = roi.bin_high
+        if 'pvsnap' in user_ns:
+            values = user_ns['pvsnap'].take(signals)   # None for a PV which could not be read
+        else:
+            values = {k: v.get() for k,v in signals.items()}
+
+        statuses = []
+        for (ch, index), (name, low, high) in desired.items():
+            roi = getattr(getattr(self, f'channel{ch}').rois, 'roi{:02}'.format(index))
+            roi.value.name = name
+            if values[f'{ch}:{index}:low'] != low:
+                statuses.append(roi.bin_low.set(low))
+            if values[f'{ch}:{index}:high'] != high:
+                statuses.append(roi.bin_high.set(high))
+        for st in statuses:
+            st.wait(timeout=5)
+        return len(statuses)
+
+    def set_rois(self):
+        '''Set the ROIs for all the channels from self.slots and rois.json,
+        writing only the ROI PVs that need to change.'''
+        return self.apply_rois(self.desired_rois())
+
+    def select_element(self, el, edge):
+        '''Configure the ROIs for measuring the el edge of element el.
+
+        An element which is not in one of the standard slots (or is
+        not measured at its standard edge) is put in slot 15.
+        Selecting the element already in place writes no PVs.
+        Returns False if no ROI is tabulated for el and edge.
+        '''
+        if not self.check_element(el, edge):
+            return False
+        el, edge = el.capitalize(), edge.lower()
+        if el not in self.slots or edge != self.roi_edge(el):
+            self.slots[14] = el
+            self.slot_edges[14] = edge
+        self.set_rois()
+        self.measure_roi()
+        return True
+
+    def measure_roi(self):
+        '''Hint the ROI currently in use for XAS, only touching the ROIs
+        whose hinting changes.'''
+        BMMuser = user_ns['BMMuser']
+        channels = self.fly_channels()
+        for i in range(16):
+            if self.slots[i] not in (BMMuser.element, self._hinted) and self._hinted is not None:
+                continue
+            for n in channels:
+                ch = getattr(self, f'channel{n}')
+                this = getattr(ch.rois, 'roi{:02}'.format(i+1))
+                if self.slots[i] == BMMuser.element:
+                    this.value.kind = 'hinted'
+                    setattr(BMMuser, f'xs{n}', this.value.name)
+                    setattr(BMMuser, f'xschannel{n}', this.value)
+                else:
+                    this.value.kind = 'omitted'
+        self._hinted = BMMuser.element
     
     def restart(self):
         self.settings.num_images.put(1)   # number of frames
@@ -261,6 +500,41 @@ class BMMXspress3DetectorBase(XspressTrigger, Xspress3Detector):
         self.hdf5.stop()
         return ret
 
+    def fly_channels(self):
+        '''Channel numbers in the order they are written to the HDF5 file.'''
+        return [getattr(self, sn).channel_num for sn in self.read_attrs if sn.startswith('channel') and '.' not in sn]
+
+    def fly_rois(self):
+        '''The hinted ROIs of each channel, as (HDF5 channel index, low bin, high bin).'''
+        rois = dict()
+        for c, n in enumerate(self.fly_channels()):
+            ch = getattr(self, f'channel{n}')
+            for r in range(1, 17):
+                roi = getattr(ch.rois, 'roi{:02}'.format(r))
+                if roi.value.kind == Kind.hinted:
+                    rois[roi.value.name] = (c, int(roi.bin_low.get()), int(roi.bin_high.get()))
+        return rois
+
+    def _fly_start(self, nframes, frame_time):
+        self.settings.acquire_time.put(frame_time)
+        self.settings.num_images.put(nframes)
+        self.settings.trigger_mode.put(1) # internal
+        self._acquisition_signal.put(1, wait=False)
+
+    def _fly_stop(self):
+        '''Stop acquiring, then close the HDF5 file so it can be read.'''
+        self.settings.acquire.put(0)
+        self.hdf5.capture.put(0)
+        def closed(value, **kwargs):
+            return value == 0
+        return SubscriptionStatus(self.hdf5.capture, closed, timeout=10)
+
+    def _fly_file(self):
+        fname = getattr(self.hdf5, '_fn', None)
+        if fname is None:
+            fname = self.hdf5.full_file_name.get()
+        return fname
+
     def stage(self):
         if self.spectra_per_point.get() != 1:
             raise NotImplementedError(
@@ -294,12 +568,7 @@ class BMMXspress3DetectorBase(XspressTrigger, Xspress3Detector):
             
         
     def set_roi_channel(self, channel=1, index=16, name='OCR', low=1, high=4095):
-        ch = getattr(self, f'channel{channel}')
-        rs = ch.rois
-        this = getattr(rs, 'roi{:02}'.format(index))
-        this.value.name = name
-        this.bin_low.put(low)
-        this.bin_high.put(high)
+        self.apply_rois({(channel, index): (name, low, high)})
         
     def reset_rois(self, el=None):
         BMMuser = user_ns['BMMuser']
@@ -346,11 +615,11 @@ class BMMXspress3DetectorBase(XspressTrigger, Xspress3Detector):
             rs = self.channel1.rois
             this = getattr(rs, 'roi{:02}'.format(i+1))
             if el is None:
-                print(template % (i+1, 'None', this.bin_low.value, this.bin_high.value))
+                print(template % (i+1, 'None', this.bin_low.get(), this.bin_high.get()))
             elif el == BMMuser.element:
-                print(go_msg(template % (i+1, el.capitalize(), this.bin_low.value, this.bin_high.value)))
+                print(go_msg(template % (i+1, el.capitalize(), this.bin_low.get(), this.bin_high.get())))
             else:
-                print(template % (i+1, el.capitalize(), this.bin_low.value, this.bin_high.value))
+                print(template % (i+1, el.capitalize(), this.bin_low.get(), this.bin_high.get()))
                 
 
     def show_rois(self):
@@ -378,14 +647,11 @@ class BMMXspress3DetectorBase(XspressTrigger, Xspress3Detector):
     def check_element(self, element, edge):
         '''Check that the current element and edge is tabulate in rois.json
         '''
-        startup_dir = get_ipython().profile_dir.startup_dir
-        with open(os.path.join(startup_dir, 'rois.json'), 'r') as fl:
-            js = fl.read()
-        allrois = json.loads(js)
+        allrois = load_rois()
         if element.capitalize() not in allrois:
             #print(f'{element} is not a tabulated element')
             return False
-        this = allrois[element]
+        this = allrois[element.capitalize()]
         if edge.lower() not in this:
             #print(f'ROIs for the {element} {edge} edge are not tabulated')
             return False
@@ -412,3 +678,119 @@ class BMMXspress3DetectorBase(XspressTrigger, Xspress3Detector):
         self.plot(add=True)
     
         
+
+
+################################################################################
+# A fake Xspress3 which writes HDF5 files locally, for testing the
+# flyable mode and the HDF5 readers without the IOC.
+
+class FakeXspress3(Xspress3FlyerMixin, Device):
+    '''A stand-in for the Xspress3 which writes frames of simulated MCA
+    spectra to an HDF5 file in a local folder.
+
+    It can be triggered once per point, like the real detector in
+    step scans, or used as a flyer.  arm_time stands in for the
+    overhead of starting each software-triggered acquisition, which
+    free-running frames do not pay.
+
+    Attributes
+    ----------
+    folder : str
+        where to write HDF5 files
+    nchannels, nbins : int
+        shape of each frame
+    '''
+    total_points = Cpt(Signal, value=1, kind='config')
+
+    def __init__(self, *args, folder='/tmp', nchannels=4, nbins=4096, arm_time=0.05, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.folder, self.nchannels, self.nbins = folder, nchannels, nbins
+        self.arm_time = arm_time
+        self.rois = {f'Fe{c+1}': (c, 630, 660) for c in range(nchannels)}
+        self.slots = ['Fe'] + [None]*14 + ['OCR']
+        self._rng    = numpy.random.default_rng(0)
+        self._handle = None
+        self._nwritten = 0
+        self._running = None
+        self.filename = None
+        bins = numpy.arange(nbins)
+        self._model = 2 + 50*numpy.exp(-(bins-640)**2/50.) + 20*numpy.exp(-(bins-700)**2/80.)
+
+    show_rois = BMMXspress3DetectorBase.show_rois
+
+    def select_element(self, el, edge):
+        '''Only the Fe K edge ROI is simulated, so this just labels slot 1.'''
+        self.slots[0] = el.capitalize()
+        return True
+
+    def fly_rois(self):
+        return self.rois
+
+    def _fly_file(self):
+        return self.filename
+
+    def _frame(self):
+        return self._rng.poisson(self._model, size=(self.nchannels, self.nbins)).astype(numpy.uint32)
+
+    def _write(self, frame):
+        ds = self._handle[XS3_DATASET]
+        if ds.shape[0] <= self._nwritten:
+            ds.resize(self._nwritten+1, axis=0)
+        ds[self._nwritten] = frame
+        self._nwritten += 1
+
+    def stage(self):
+        self.filename = os.path.join(self.folder, f'{self.name}_{ttime.time_ns()}.h5')
+        self._handle = h5py.File(self.filename, 'w')
+        shape = (self.nchannels, self.nbins)
+        self._handle.create_dataset(XS3_DATASET, shape=(0,)+shape, maxshape=(None,)+shape,
+                                    chunks=(1,)+shape, dtype=numpy.uint32)
+        self._nwritten = 0
+        return super().stage()
+
+    def unstage(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+        return super().unstage()
+
+    def trigger(self):
+        status = DeviceStatus(self)
+        def acquire():
+            ttime.sleep(self.arm_time + self.fly_frame_time)
+            self._last = self._frame()
+            self._write(self._last)
+            status.set_finished()
+        threading.Thread(target=acquire, daemon=True).start()
+        return status
+
+    def read(self):
+        now = ttime.time()
+        return {name: {'value': float(self._last[c, low:high+1].sum()), 'timestamp': now}
+                for name, (c, low, high) in self.rois.items()}
+
+    def describe(self):
+        return {name: {'source': 'FakeXspress3', 'dtype': 'number', 'shape': []} for name in self.rois}
+
+    def _fly_start(self, nframes, frame_time):
+        self._running = threading.Event()
+        def run():
+            start = ttime.time()
+            while not self._running.is_set() and self._nwritten < nframes:
+                self._write(self._frame())
+                wait = start + self._nwritten*frame_time - ttime.time()
+                if wait > 0:
+                    ttime.sleep(wait)
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def _fly_stop(self):
+        status = DeviceStatus(self)
+        def stop():
+            self._running.set()
+            self._thread.join()
+            self._handle.close()
+            self._handle = None
+            status.set_finished()
+        threading.Thread(target=stop, daemon=True).start()
+        return status
@@ -15,7 +15,7 @@ from BMM.functions     import error_msg, warning_msg, go_msg, url_msg, bold_msg,
 from BMM.functions     import now
 from BMM.metadata      import mirror_state
 from BMM.periodictable import Z_number
-from BMM.xspress3      import Xspress3FileStoreFlyable, BMMXspress3DetectorBase, BMMXspress3Channel
+from BMM.xspress3      import Xspress3FileStoreFlyable, BMMXspress3DetectorBase, BMMXspress3Channel, xspress3_spectrum
 
 
 
@@ -80,41 +80,6 @@ class BMMXspress3Detector_4Element(BMMXspress3DetectorBase):
         #XF:06BM-ES{Xsp:1}:C1_PluginControlValExtraROI
         super().restart()
         
-    def set_rois(self):
-        '''Read ROI values from a JSON serialization on disk and set all 16 ROIs for channels 1-4.
-        '''
-        startup_dir = get_ipython().profile_dir.startup_dir
-        with open(os.path.join(startup_dir, 'rois.json'), 'r') as fl:
-            js = fl.read()
-        allrois = json.loads(js)
-        for i, el in enumerate(self.slots):
-            if el == 'OCR':
-                for ch in range(1,5):
-                    self.set_roi_channel(channel=ch, index=i+1, name='OCR', low=allrois['OCR']['low'], high=allrois['OCR']['high'])
-                continue
-            elif el is None:
-                continue
-            edge = 'k'
-            if Z_number(el) > 45:
-                edge = 'l3'
-            for ch in range(1,5):
-                self.set_roi_channel(channel=ch, index=i+1, name=f'{el.capitalize()}{ch}', low=allrois[el][edge]['low'], high=allrois[el][edge]['high'])
-                    
-    def measure_roi(self):
-        '''Hint the ROI currently in use for XAS
-        '''
-        BMMuser = user_ns['BMMuser']
-        for i in range(16):
-            for n in range(1,5):
-                ch = getattr(self, f'channel{n}')
-                this = getattr(ch.rois, 'roi{:02}'.format(i+1))
-                if self.slots[i] == BMMuser.element:
-                    this.value.kind = 'hinted'
-                    setattr(BMMuser, f'xs{n}', this.value.name)
-                    setattr(BMMuser, f'xschannel{n}', this.value)
-                else:
-                    this.value.kind = 'omitted'
-
     def plot(self, uid=None, add=False, only=None):
         '''Make a plot appropriate for the 4-element detector.
 
@@ -141,24 +106,19 @@ class BMMXspress3Detector_4Element(BMMXspress3DetectorBase):
             fname = file_resource(uid)
             db = user_ns['db']
             plt.title(db.v2[uid].metadata['start']['XDI']['Sample']['name'])
-            f = h5py.File(fname,'r')
-            g = f['entry']['instrument']['detector']['data']
-            data_array = g.value
-            s1 = data_array[0][0]
-            s2 = data_array[0][1]
-            s3 = data_array[0][2]
-            s4 = data_array[0][3]
+            ## read only the first frame rather than the whole file
+            s1, s2, s3, s4 = xspress3_spectrum(fname, 0)[:4]
         except Exception as e:
             if uid is not None: print(e)
             plt.title('XRF Spectrum')
-            s1 = self.mca1.value
-            s2 = self.mca2.value
-            s3 = self.mca3.value
-            s4 = self.mca4.value
+            s1 = self.mca1.get()
+            s2 = self.mca2.get()
+            s3 = self.mca3.get()
+            s4 = self.mca4.get()
         e = numpy.arange(0, len(s1)) * 10
         if only is not None and only in (1, 2, 3, 4):
             this = getattr(self, f'mca{only}')
-            plt.plot(e, this.value, label=f'channel {only}')
+            plt.plot(e, this.get(), label=f'channel {only}')
             plt.legend()
         elif add is True:
             plt.plot(e, s1+s2+s3+s4, label='sum of four channels')
@@ -228,10 +188,10 @@ class BMMXspress3Detector_4Element(BMMXspress3DetectorBase):
         handle.write('# Beamline.energy: %.3f\n'             % dcm.energy.position)
         handle.write('# Detector.fluorescence: SII Vortex ME4 (4-element silicon drift)\n')
         handle.write('# Scan.end_time: %s\n'                 % now())
-        handle.write('# Scan.dwell_time: %.2f\n'             % self.settings.acquire_time.value)
+        handle.write('# Scan.dwell_time: %.2f\n'             % self.settings.acquire_time.get())
         handle.write('# Facility.name: NSLS-II\n')
-        handle.write('# Facility.current: %.1f mA\n'         % ring.current.value)
-        handle.write('# Facility.mode: %s\n'                 % ring.mode.value)
+        handle.write('# Facility.current: %.1f mA\n'         % ring.current.get())
+        handle.write('# Facility.mode: %s\n'                 % ring.mode.get())
         handle.write('# Facility.cycle: %s\n'                % BMMuser.cycle)
         handle.write('# Facility.GUP: %d\n'                  % BMMuser.gup)
         handle.write('# Facility.SAF: %d\n'                  % BMMuser.saf)
@@ -244,8 +204,8 @@ class BMMXspress3Detector_4Element(BMMXspress3DetectorBase):
         handle.write('# energy ')
 
         ## data table
-        e=numpy.arange(0, len(self.mca1.value)) * 10
-        a=numpy.vstack([self.mca1.value, self.mca2.value, self.mca3.value, self.mca4.value])
+        e=numpy.arange(0, len(self.mca1.get())) * 10
+        a=numpy.vstack([self.mca1.get(), self.mca2.get(), self.mca3.get(), self.mca4.get()])
         b=pd.DataFrame(a.transpose(), index=e, columns=column_list)
         handle.write(b.to_csv(sep=' '))
 
@@ -0,0 +1,88 @@
+import os, sys, types, importlib, tempfile
+import numpy
+import pytest
+
+## BMM is imported from startup/, as it is in the IPython profile
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'startup'))
+
+## the BMM modules look up the IPython user namespace when they are
+## imported, so there must be a shell before any of them are
+from IPython.core.interactiveshell import InteractiveShell
+shell = InteractiveShell.instance()
+
+## logging.py keeps a copy of the log on the NAS, which is not mounted here
+shell.user_ns.setdefault('nas_mount_point', tempfile.mkdtemp(prefix='nas_'))
+
+
+@pytest.fixture
+def user_ns():
+    '''The IPython user namespace, put back the way it was after the test.'''
+    saved = dict(shell.user_ns)
+    yield shell.user_ns
+    shell.user_ns.clear()
+    shell.user_ns.update(saved)
+
+
+def profile_import(name):
+    '''Import a BMM module, skipping the calling test module if the
+    module needs a package which is not installed here, or something
+    which only the running profile puts in the user namespace.'''
+    try:
+        return importlib.import_module(name)
+    except (ImportError, KeyError) as E:
+        pytest.skip(f'{name} cannot be imported here ({E!r})', allow_module_level=True)
+
+
+@pytest.fixture
+def beamline(user_ns):
+    '''A RunEngine saving to a temporary databroker, with a simulated
+    DCM, ion chambers, and dwell time, xafs_x in the baseline, and the
+    parts of BMMuser that go into an XDI file.  The ion chambers stop
+    working after beamline.quadem1.fail_after readings, if that is
+    not None.'''
+    pytest.importorskip('databroker')
+    from databroker.v2 import temp
+    from bluesky import RunEngine
+    from bluesky.preprocessors import SupplementalData
+    simulated = profile_import('BMM.simulated')
+
+    class FailingIonChambers(simulated.SimIonChambers):
+        def trigger(self):
+            self.readings += 1
+            if self.fail_after is not None and self.readings > self.fail_after:
+                raise RuntimeError('pretend the electrometer went away')
+            return super().trigger()
+
+    db = temp().v1
+    RE = RunEngine({})
+    RE.subscribe(db.insert)
+    bl = types.SimpleNamespace(RE=RE, db=db, dcm=simulated.SimDCM('', name='dcm'))
+    bl.dcm.bragg.velocity.put(100)
+    bl.quadem1 = FailingIonChambers('', name='quadem1', dcm=bl.dcm, e0=8979)
+    bl.quadem1.fail_after, bl.quadem1.readings = None, 0
+    bl.dwti = simulated.SimDwellTime('', name='dwti', quadem=bl.quadem1, struck=simulated.SimStruck('', name='vor'))
+    RE.preprocessors.append(SupplementalData(baseline=[simulated.SimEpicsMotor('', name='xafs_x', value=12.5)]))
+    user_ns['BMMuser'] = types.SimpleNamespace(instrument='', detector=4, element=4,
+                                               **{f'{k}{i}': f'{k.upper()}{i}' for k in ('dtc', 'roi', 'xs', 'xschannel')
+                                                  for i in range(1, 5)})
+    user_ns['with_xspress3'] = False
+    user_ns['XDI_record'] = {'xafs_x': (True, 'Sample.x')}
+    return bl
+
+
+def transmission_scan(bl, npoints=20, subs=()):
+    '''Measure a transmission scan through the Cu K edge with scan_nd
+    on a beamline from the beamline fixture, with the callbacks subs
+    subscribed to the run.  Returns the uid of the run, None if the
+    run failed.'''
+    from cycler import cycler
+    from bluesky.plans import scan_nd
+    from bluesky.preprocessors import subs_wrapper
+    md = {'XDI': {'_mode': ['transmission'], '_comment': ['simulated'], '_kind': 'xafs',
+                  'Element': {'symbol': 'Cu', 'edge': 'K'}, 'Scan': {'edge_energy': 8979},
+                  'Beamline': {'name': 'BMM (06BM) -- Beamline for Materials Measurement'}}}
+    trajectory = cycler(bl.dcm.energy, list(numpy.linspace(8950, 9050, npoints))) + cycler(bl.dwti, [0.01]*npoints)
+    try:
+        return bl.RE(subs_wrapper(scan_nd([bl.quadem1], trajectory, md=md), subs))[0]
+    except RuntimeError:
+        return None
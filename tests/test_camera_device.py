@@ -0,0 +1,51 @@
+import os, time
+import numpy
+import pytest
+
+from conftest import shell, profile_import
+
+## camera_device.py registers its handlers with db when it is imported
+pytest.importorskip('databroker')
+from databroker.v2 import temp
+shell.user_ns.setdefault('db', temp().v1)
+camera_device = profile_import('BMM.camera_device')
+from PIL import Image
+
+
+def test_pooled_capture(tmp_path):
+    '''Trigger several webcams, served by SyntheticCamera, the way a count
+    plan does.  The cameras are read at the same time, connections are
+    reused, and every image on disk carries its annotation.'''
+    ncameras, nimages, latency = 3, 6, 0.3
+    servers = [camera_device.SyntheticCamera(latency=latency).start() for n in range(ncameras)]
+    cameras = []
+    for n, srv in enumerate(servers):
+        cam = camera_device.BMMSnapshot(root=str(tmp_path), which='XAS', name=f'testcam{n}')
+        cam._url = srv.url
+        cameras.append(cam)
+
+    for cam in cameras:
+        cam.stage()
+    start = time.time()
+    for i in range(nimages):
+        for cam in cameras:
+            cam._annotation_string = f'{cam.name} image {i}'
+        statuses = [cam.trigger() for cam in cameras]
+        for st in statuses:
+            st.wait(timeout=camera_device.camera_pool.timeout)
+    elapsed = time.time() - start
+    files = [os.path.join(tmp_path, cam._rel_path_template % i) for cam in cameras for i in range(nimages)]
+    for cam in cameras:
+        cam.unstage()
+    connections = sum(srv.connections for srv in servers)
+    for srv in servers:
+        srv.stop()
+
+    ## one at a time would take at least ncameras*latency per round
+    assert elapsed/nimages < ncameras*latency
+    ## each capture thread keeps its connection to a camera
+    assert connections <= camera_device.camera_pool.workers * ncameras < ncameras*nimages
+    ## a 24 point annotation darkens the banner, a plain synthetic image has a uniform banner
+    for f in files:
+        banner = numpy.asarray(Image.open(f).convert('L'))[-20:, :]
+        assert banner.std() > 5, f'{f} is not annotated'
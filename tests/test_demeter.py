@@ -0,0 +1,45 @@
+import os, time
+import numpy
+import pytest
+
+from conftest import profile_import
+
+larchio = pytest.importorskip('larch.io')
+demeter = profile_import('BMM.demeter')
+larch   = profile_import('BMM.larch')
+
+
+def synthetic_groups(nspectra):
+    '''Pandrosus groups holding synthetic Cu K edge spectra.'''
+    energy = numpy.linspace(8800, 9800, 600)
+    k      = numpy.sqrt(numpy.clip(energy-8979, 0, None) * 0.2625)
+    groups = []
+    for i in range(nspectra):
+        this = larch.Pandrosus()
+        mu   = 0.1 + 0.0001*(energy-8800) + (energy>8979)*(1+0.1*numpy.sin(5*k+i)*numpy.exp(-0.02*k*k))
+        this.put(energy, mu, f'synthetic.{i+1:03d}')
+        this.group.i0     = numpy.full(len(energy), 1e5+i)
+        this.group.signal = this.group.i0 * numpy.exp(-mu)
+        this.title = 'synthetic data'
+        groups.append(this)
+    return groups
+
+
+def test_athena_project_round_trip(tmp_path):
+    filename = os.path.join(tmp_path, 'roundtrip.prj')
+    groups = synthetic_groups(3)
+    demeter.write_athena_project(filename, groups)
+    project = larchio.read_athena(filename, do_preedge=False)
+    for g in groups:
+        back = getattr(project, g.name.replace('.', '_'))
+        for a in ('energy', 'mu', 'i0'):
+            assert numpy.array_equal(getattr(g.group, a), getattr(back, a)), f'{a} differs for {g.name}'
+        assert float(back.athena_params.bkg.e0) == pytest.approx(g.group.e0, abs=1e-6)
+
+
+def test_athena_project_is_quick(tmp_path):
+    ## a long scan sequence should not hold up the end of xafs()
+    groups = synthetic_groups(20)
+    start = time.time()
+    demeter.write_athena_project(os.path.join(tmp_path, 'sequence.prj'), groups)
+    assert time.time() - start < 2
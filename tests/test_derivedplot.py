@@ -0,0 +1,34 @@
+import time
+import numpy
+
+from conftest import profile_import
+
+derivedplot = profile_import('BMM.derivedplot')
+plt = derivedplot.plt
+
+
+def test_time_per_event():
+    '''A synthetic run drawn with the Agg backend, so that it can be run
+    without a display.'''
+    nevents = 10000
+    backend = plt.get_backend()
+    plt.switch_backend('Agg')
+    try:
+        fig, ax = plt.subplots()
+        dp = derivedplot.DerivedPlot(lambda doc: (doc['data']['x'], doc['data']['y']), ax=ax)
+        dp('start', {'uid': 'benchmark', 'time': time.time(), 'scan_id': 0})
+        dp('descriptor', {'uid': 'desc', 'run_start': 'benchmark', 'name': 'primary', 'data_keys': {}})
+        begin = time.time()
+        for i in range(nevents):
+            x = i * 0.01
+            dp('event', {'descriptor': 'desc', 'seq_num': i+1, 'time': time.time(),
+                         'data': {'x': x, 'y': numpy.sin(x) + 0.001*x}, 'timestamps': {}})
+        fig.canvas.draw()
+        elapsed = time.time() - begin
+        dp('stop', {'uid': 'benchmarkstop', 'run_start': 'benchmark', 'time': time.time(), 'exit_status': 'success'})
+        assert len(dp.x_data) == nevents and dp.x_data[-1] == x
+        plt.close(fig)
+    finally:
+        plt.switch_backend(backend)
+    ## redrawing the whole figure for every event took tens of milliseconds per event
+    assert elapsed/nevents < 1e-3
@@ -0,0 +1,51 @@
+import os, shutil
+
+from BMM import dossier
+
+
+def test_index_written_in_place(tmp_path):
+    '''Adding pages one at a time gives the same index page as making it
+    from the whole MANIFEST.'''
+    folder, count = str(tmp_path), 200
+    startup = os.path.dirname(os.path.dirname(os.path.abspath(dossier.__file__)))
+    shutil.copyfile(os.path.join(startup, 'manifest.tmpl'), os.path.join(folder, 'manifest.tmpl'))
+    open(os.path.join(folder, 'MANIFEST'), 'w').close()
+    for i in range(count):
+        seqnumber, basename, htmlfile = dossier.next_sequence(folder, 'Fe-foil')
+        with open(htmlfile, 'w') as fh:
+            fh.write(basename)
+        dossier.add_to_index(folder, '2023-01-01', htmlfile)
+    assert seqnumber == count and basename == f'Fe-foil-{count}'
+    with open(os.path.join(folder, '00INDEX.html')) as fh:
+        incremental = fh.read()
+    dossier._indexes.clear()
+    with open(dossier.rebuild_index(folder, '2023-01-01')) as fh:
+        rebuilt = fh.read()
+    assert incremental == rebuilt
+    assert incremental.count('<li><a href="./Fe-foil') == count
+
+
+def test_index_rebuilt_when_changed_elsewhere(tmp_path):
+    folder = str(tmp_path)
+    startup = os.path.dirname(os.path.dirname(os.path.abspath(dossier.__file__)))
+    shutil.copyfile(os.path.join(startup, 'manifest.tmpl'), os.path.join(folder, 'manifest.tmpl'))
+    open(os.path.join(folder, 'MANIFEST'), 'w').close()
+    pages = []
+    for i in range(3):
+        seqnumber, basename, htmlfile = dossier.next_sequence(folder, 'Cu-foil')
+        with open(htmlfile, 'w') as fh:
+            fh.write(basename)
+        pages.append(htmlfile)
+        dossier.add_to_index(folder, '2023-01-01', htmlfile)
+    ## someone else rewrites the index page, the next addition starts over from the MANIFEST
+    os.remove(pages[1])
+    with open(os.path.join(folder, '00INDEX.html'), 'a') as fh:
+        fh.write('<!-- edited -->\n')
+    seqnumber, basename, htmlfile = dossier.next_sequence(folder, 'Cu-foil')
+    with open(htmlfile, 'w') as fh:
+        fh.write(basename)
+    dossier.add_to_index(folder, '2023-01-01', htmlfile)
+    with open(os.path.join(folder, '00INDEX.html')) as fh:
+        index = fh.read()
+    assert 'edited' not in index
+    assert index.count('<li><a href="./Cu-foil') == 3
@@ -0,0 +1,172 @@
+import time, math, threading
+import numpy
+
+from ophyd import Device, Signal, Component as Cpt
+from ophyd.status import DeviceStatus
+
+from conftest import shell, profile_import
+
+## flyscan_functions.py imports xdi.py, which builds its detector lists
+## from the ion chambers and the Struck, the simulated ones will do,
+## as will a simulated telemetry for conventional_grid
+simulated = profile_import('BMM.simulated')
+shell.user_ns.setdefault('quadem1', simulated.SimIonChambers('', name='quadem1'))
+shell.user_ns.setdefault('vor',     simulated.SimStruck('', name='vor'))
+shell.user_ns.setdefault('tele',    simulated.SimTelemetry())
+flyscan = profile_import('BMM.flyscan_functions')
+conventional_grid = profile_import('BMM.xafs_functions').conventional_grid
+bragg2energy = flyscan.bragg2energy
+
+SI111 = 6.2712                  # 2d spacing of Si(111), in Angstroms
+
+
+class SimulatedBragg(Device):
+    '''A Bragg axis which slews at its velocity.'''
+    user_readback = Cpt(Signal, value=15.0, kind='hinted')
+    user_setpoint = Cpt(Signal, value=15.0, kind='config')
+    velocity      = Cpt(Signal, value=1.0,  kind='config')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user_readback.name = self.name
+        self._motion = None     # (start, target, start time, velocity)
+
+    def position_now(self):
+        if self._motion is None:
+            return self.user_readback.get()
+        start, target, t0, v = self._motion
+        travel = v * (time.time() - t0)
+        if travel >= abs(target - start):
+            return target
+        return start + math.copysign(travel, target - start)
+
+    def read(self):
+        self.user_readback.put(self.position_now())
+        return super().read()
+
+    def set(self, target):
+        self.user_readback.put(self.position_now())
+        start = self.user_readback.get()
+        self.user_setpoint.put(target)
+        self._motion = (start, target, time.time(), self.velocity.get())
+        status = DeviceStatus(self)
+        def finish():
+            time.sleep(abs(target - start) / self.velocity.get())
+            self.user_readback.put(target)
+            self._motion = None
+            status.set_finished()
+        threading.Thread(target=finish, daemon=True).start()
+        return status
+
+    @property
+    def position(self):
+        return self.position_now()
+
+
+class SimulatedIonChambers(Device):
+    '''Ion chambers reading a simulated metal foil as the energy of a
+    SimulatedBragg changes.  Each reading integrates for exposure seconds.'''
+    I0 = Cpt(Signal, value=1.0, kind='hinted')
+    It = Cpt(Signal, value=1.0, kind='hinted')
+    Ir = Cpt(Signal, value=1.0, kind='hinted')
+
+    def __init__(self, *args, bragg=None, twod=6.2712, e0=8979, exposure=0.02, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.bragg, self.twod, self.e0, self.exposure = bragg, twod, e0, exposure
+        for s in (self.I0, self.It, self.Ir):
+            s.name = s.attr_name
+
+    def mu(self, energy):
+        return 0.5 + 1.0/(1 + numpy.exp(-(energy-self.e0)/2.0)) - 0.0001*(energy-self.e0)
+
+    def trigger(self):
+        status = DeviceStatus(self)
+        def integrate():
+            samples = []
+            end = time.time() + self.exposure
+            while time.time() < end:
+                samples.append(bragg2energy(self.bragg.position_now(), self.twod))
+                time.sleep(self.exposure/10)
+            energy = numpy.mean(samples)
+            self.I0.put(1.0)
+            self.It.put(float(numpy.exp(-self.mu(energy))))
+            self.Ir.put(float(numpy.exp(-2*self.mu(energy))))
+            status.set_finished()
+        threading.Thread(target=integrate, daemon=True).start()
+        return status
+
+
+def fly(e0, twod, ththth=False, sample_time=0.02, speedup=10):
+    '''Fly through a simulated K edge at e0 and return the collector and
+    the ion chambers.  Dwell times are divided by speedup, to keep the
+    test short.'''
+    from bluesky import RunEngine
+    from bluesky.preprocessors import subs_wrapper
+    RE = RunEngine({})
+    bragg = SimulatedBragg(name='dcm_bragg')
+    energy_grid, time_grid, approx, delta = conventional_grid([-100, -30, -10, 20, '8k'], [10, 2, 0.3, '0.05k'],
+                                                              [0.5, 0.5, 0.5, 0.5], e0=e0, ththth=ththth)
+    ## the simulated foil sees the energy passed by the crystal, which is
+    ## 3 times the Si(111) energy in Si(333) mode
+    ic = SimulatedIonChambers(name='quadem1', bragg=bragg, twod=twod/3 if ththth else twod,
+                              e0=e0, exposure=sample_time)
+    time_grid = numpy.asarray(time_grid) / speedup
+    collector = flyscan.FlyCollector(None, energy_grid, twod, bragg='dcm_bragg', sample_time=sample_time)
+    RE(subs_wrapper(flyscan.fly_energy([ic], bragg, energy_grid, time_grid, twod, sample_time=sample_time), collector))
+    return collector, ic
+
+
+def test_trajectory_and_rebin():
+    '''Energy and angle convert back and forth, the trajectory runs
+    through the grid in order, and rebinning puts each reading in the bin
+    of the nearest grid point.'''
+    energy = numpy.array([8000., 9000., 10000.])
+    assert numpy.allclose(bragg2energy(flyscan.energy2bragg(energy, SI111), SI111), energy)
+    energy_grid, time_grid, approx, delta = conventional_grid([-100, -30, -10, 20, '8k'], [10, 2, 0.3, '0.05k'],
+                                                              [0.5, 0.5, 0.5, 0.5], e0=8979)
+    time_grid = numpy.asarray(time_grid)
+    angles = flyscan.energy2bragg(energy_grid, SI111)
+    segments = flyscan.bragg_trajectory(energy_grid, time_grid, SI111)
+    targets, velocities, durations = (numpy.array(x) for x in zip(*segments))
+    assert numpy.all(numpy.diff(targets) < 0) and targets[-1] == angles[-1]
+    assert numpy.all(velocities > 0)
+    assert numpy.isclose(durations.sum(), ((time_grid[:-1] + time_grid[1:])/2).sum())
+    assert len(segments) < len(energy_grid)
+
+    grid = numpy.array([1.0, 2.0, 3.0, 4.0])
+    energy = numpy.array([0.2, 0.9, 1.1, 2.9, 3.05, 3.2, 4.6])
+    binned, counts = flyscan.rebin(energy, {'y': 10*energy}, grid)
+    assert list(counts) == [2, 0, 3, 0]
+    assert numpy.allclose(binned['y'], [10, 20.25, 30.5, 30.5])
+
+
+def test_fly_through_edge():
+    '''Fly through a Cu K edge grid with the simulated Bragg axis and ion
+    chambers.  The rebinned transmission spectrum follows the simulated
+    absorption at the grid points and every grid point gets readings.'''
+    collector, ic = fly(8979, SI111)
+    data = collector.table()
+    mu = numpy.log(data['I0']/data['It'])
+    assert numpy.abs(mu - ic.mu(collector.grid)).max() < 0.02
+    assert (collector.counts > 0).all()
+
+
+def test_fly_ththth():
+    '''In Si(333) mode the grid is in Si(111) energies, so it is flown
+    with the Si(111) 2d spacing.  An edge at 20 keV, 6667 eV on the grid,
+    is near 17.3 degrees rather than the 62.8 degrees found by also
+    dividing 2d by 3.'''
+    e0 = 20000
+    energy_grid, time_grid, approx, delta = conventional_grid([-100, -30, -10, 20, '8k'], [10, 2, 0.3, '0.05k'],
+                                                              [0.5, 0.5, 0.5, 0.5], e0=e0, ththth=True)
+    assert abs(flyscan.energy2bragg(e0/3, SI111) - 17.3) < 0.1
+    segments = flyscan.bragg_trajectory(energy_grid, time_grid, SI111)
+    assert 14 < segments[-1][0] < 18
+    ## this grid repeats a point at a region boundary, it is flown once
+    assert (numpy.diff(energy_grid) == 0).any()
+    assert all(v > 0 for a,v,d in segments)
+    collector, ic = fly(e0, SI111, ththth=True)
+    data = collector.table()
+    mu = numpy.log(data['I0']/data['It'])
+    assert numpy.abs(mu - ic.mu(3*collector.grid)).max() < 0.02
+    assert (collector.counts > 0).all()
@@ -0,0 +1,69 @@
+import os, sys, time
+import pytest
+
+from BMM.gdrive import GdriveSync
+
+
+@pytest.fixture
+def sync(tmp_path):
+    '''The sync service between two local folders, with a pretend push
+    command which fails the first time, then succeeds.  Each attempt is
+    logged in the file named by sync.log.'''
+    data, remote = os.path.join(tmp_path, 'data'), os.path.join(tmp_path, 'gdrive')
+    for sub in ('', 'dossier', 'snapshots'):
+        os.makedirs(os.path.join(data, sub), exist_ok=True)
+    log = os.path.join(tmp_path, 'pushes')
+    script = (f'import os, sys; first = not os.path.exists({log!r}); '
+              f'open({log!r}, "a").write("push\\n"); sys.exit(1 if first else 0)')
+    sync = GdriveSync(command=[sys.executable, '-c', script], folder=data, remote=remote)
+    sync.interval, sync.quiet, sync.max_wait, sync.delay = 0.1, 0.3, 2, 0.2
+    sync.log = log
+    yield sync
+    sync.enabled = False
+
+
+def write(folder, name, text=None):
+    with open(os.path.join(folder, name), 'w') as fh:
+        fh.write(name if text is None else text)
+
+
+def test_sync_and_retry(sync, tmp_path):
+    data, remote = sync.folder, sync.remote
+    for name in ('Fe-foil.001', 'Fe-foil.002', os.path.join('dossier', 'Fe-foil-01.html'), '.hidden', 'MANIFEST'):
+        write(data, name)
+    sync.start()
+    write(tmp_path, 'picture.png', 'png')
+    sync.add(os.path.join(tmp_path, 'picture.png'), os.path.join(remote, 'snapshots', 'processed.png'))
+    assert sync.wait(timeout=20)
+
+    for e in ('Fe-foil.001', 'Fe-foil.002', os.path.join('dossier', 'Fe-foil-01.html'), os.path.join('snapshots', 'processed.png')):
+        assert os.path.isfile(os.path.join(remote, e))
+    assert not os.path.exists(os.path.join(remote, '.hidden'))
+    assert not os.path.exists(os.path.join(remote, 'MANIFEST'))
+    with open(sync.log) as fh:
+        assert fh.read().count('push') == 2
+    assert sync.pushes == 1 and sync.backlog() == 0
+
+    ## a changed file is pushed again, an unchanged one is not
+    time.sleep(0.05)
+    write(data, 'Fe-foil.002', 'changed')
+    time.sleep(0.5)
+    assert sync.wait(timeout=20) and sync.copied == 5
+    with open(os.path.join(remote, 'Fe-foil.002')) as fh:
+        assert fh.read() == 'changed'
+
+
+def test_failed_copy_is_retried(sync):
+    open(sync.log, 'w').close()     # every push succeeds
+    sync.start()
+    copy, tries = sync._copy, []
+    def flaky(source, target):
+        tries.append(source)
+        if len(tries) == 1:
+            raise OSError('pretend the Google drive folder is busy')
+        copy(source, target)
+    sync._copy = flaky
+    write(sync.folder, 'Fe-foil.003')
+    assert sync.wait(timeout=20)
+    assert len(tries) == 2 and sync.copied == 1
+    assert os.path.isfile(os.path.join(sync.remote, 'Fe-foil.003'))
@@ -0,0 +1,114 @@
+import time, tempfile
+
+from conftest import shell, profile_import
+
+## suspenders.py makes a suspender on the I0 of the ion chambers when
+## it is imported, the simulated ones will do for that
+simulated = profile_import('BMM.simulated')
+shell.user_ns.setdefault('quadem1', simulated.SimIonChambers('', name='quadem1'))
+healthcheck = profile_import('BMM.healthcheck')
+suspenders  = profile_import('BMM.suspenders')
+
+
+class Counted():
+    '''A check which returns (self.ok, text) and counts its calls.'''
+    def __init__(self, ok=True, delay=0.0):
+        self.ok, self.delay, self.calls = ok, delay, 0
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        return (self.ok, '' if self.ok else 'pretend something is wrong')
+
+
+def health(ttl=0.5):
+    h = healthcheck.HealthCheck()
+    h.ttl, h.timeout = ttl, 1.0
+    return h
+
+
+def test_passing_report_is_cached():
+    '''A passing report is reused for ttl seconds, then the checks are
+    made again.  A different set of checks is not answered from the
+    cache, nor is a run with fresh=True.'''
+    h = health()
+    a, b = Counted(), Counted()
+    first = h.run('group', {'a': a, 'b': b})
+    second = h.run('group', {'a': a, 'b': b})
+    assert first.ok and not first.cached
+    assert second.ok and second.cached and second.time == first.time
+    assert (a.calls, b.calls) == (1, 1)
+
+    assert not h.run('group', {'a': a}).cached and a.calls == 2
+    assert not h.run('group', {'a': a}, fresh=True).cached and a.calls == 3
+    time.sleep(h.ttl)
+    assert not h.run('group', {'a': a}).cached and a.calls == 4
+
+    h.ttl = 0
+    h.run('group', {'a': a})
+    assert a.calls == 5
+
+
+def test_failing_report_is_not_cached():
+    '''A failed report is never cached, and replaces a passing one, so
+    a problem is noticed right away and so is its fix.'''
+    h = health()
+    a, b = Counted(), Counted(ok=False)
+    for i in range(3):
+        report = h.run('group', {'a': a, 'b': b})
+        assert not report.ok and not report.cached
+    assert (a.calls, b.calls) == (3, 3)
+    assert [r.name for r in report.failed()] == ['b'] and report.text() == 'pretend something is wrong\n'
+
+    b.ok = True
+    assert h.run('group', {'a': a, 'b': b}).ok
+    assert h.run('group', {'a': a, 'b': b}).cached
+    b.ok = False
+    assert not h.run('group', {'a': a, 'b': b}, fresh=True).ok
+    assert not h.run('group', {'a': a, 'b': b}).cached and b.calls == 6
+
+
+def test_failures_and_timeouts():
+    '''Checks run concurrently.  One that raises or does not finish in
+    time is reported as failed.'''
+    h = health()
+    def broken():
+        raise RuntimeError('no such PV')
+    start = time.time()
+    report = h.run('group', {'slow': Counted(delay=5), 'broken': broken,
+                             'ok1': Counted(delay=0.3), 'ok2': Counted(delay=0.3)})
+    assert time.time() - start < h.timeout + 0.5
+    assert not report.ok and [r.name for r in report.failed()] == ['slow', 'broken']
+    assert 'did not respond' in report.results[0].text and 'no such PV' in report.results[1].text
+
+
+def test_clear_to_start_fresh(user_ns):
+    '''BMM_clear_to_start reuses a passing report until it is asked for
+    a fresh one.'''
+    user_ns['health'] = health(ttl=60)
+    user_ns['ring'] = simulated.SimRing('', name='ring')
+    for name in ('bmps', 'idps', 'shb'):
+        user_ns[name] = simulated.SimState('', name=name)
+    user_ns['shb'].state.put(0)
+    assert suspenders.BMM_clear_to_start() == (True, '')
+    user_ns['shb'].state.put(1)             # the hutch is opened
+    assert suspenders.BMM_clear_to_start() == (True, '')
+    ok, text = suspenders.BMM_clear_to_start(fresh=True)
+    assert not ok and 'shb' in text
+    assert not suspenders.BMM_clear_to_start()[0]
+
+
+def test_pds_motors_ready_fresh(user_ns):
+    '''pds_motors_ready reuses a passing report until it is asked for a
+    fresh one.'''
+    ## modes.py, and the modules it imports, look up much of the
+    ## beamline when it is imported, the simulated one will do
+    user_ns.setdefault('BMM_CONFIGURATION_LOCATION', tempfile.mkdtemp(prefix='bmm_config_'))
+    for name, thing in simulated.SimulatedBMM(cameras=False).build().items():
+        user_ns.setdefault(name, thing)
+    modes = profile_import('BMM.modes')
+    user_ns['health'] = health(ttl=60)
+    assert modes.pds_motors_ready() is True
+    user_ns['dcm_bragg'].amfe.put(1)        # an amplifier fault
+    assert modes.pds_motors_ready() is True
+    assert modes.pds_motors_ready(fresh=True) is False
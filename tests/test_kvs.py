@@ -0,0 +1,35 @@
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+from BMM.kvs import BMMRedis
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def store(server):
+    return BMMRedis(host='fakeredis', client=fakeredis.FakeRedis(server=server), retry=0)
+
+
+def test_typed_values(store):
+    assert store.update({'BMM:pds:element': 'Fe', 'BMM:pds:edge': 'K', 'BMM:pds:edge_energy': 7112})
+    assert store.values('BMM:pds:element', 'BMM:pds:edge_energy') == {'BMM:pds:element': 'Fe', 'BMM:pds:edge_energy': 7112.0}
+    with pytest.raises(KeyError):
+        store.set('BMM:no:such:key', 1)
+
+
+def test_outage(store, server):
+    ## an outage: writes are kept, reads come from the local copies
+    server.connected = False
+    assert store.scan_started('xafs', estimated=600) is False
+    assert store.value('BMM:scan:type') == 'xafs' and store.dirty
+
+    ## the server returns: what was missed is sent with the next write
+    server.connected = True
+    assert store.set('BMM:pds:edge', 'L3') is True and not store.dirty
+    raw = fakeredis.FakeRedis(server=server)
+    assert raw.get('BMM:scan:type') == b'xafs' and float(raw.get('BMM:scan:estimated')) == 600.0
+    assert store.scan_finished() and raw.get('BMM:scan:type') == b''
@@ -0,0 +1,103 @@
+import numpy
+import pytest
+
+from conftest import profile_import
+
+pytest.importorskip('larch')
+bmmlarch = profile_import('BMM.larch')
+
+
+def spectrum(uid):
+    '''A synthetic Cu K edge, slightly different for each uid.'''
+    energy = numpy.concatenate([numpy.arange(8779, 8969, 5.0), numpy.arange(8969, 9009, 0.5),
+                                8979 + bmmlarch.ktoe(numpy.arange(bmmlarch.etok(30), 14, 0.05))])
+    shift = sum(map(ord, uid)) % 7
+    k = bmmlarch.etok(numpy.clip(energy - 8979 - shift, 0, None))
+    mu = 0.2 + numpy.arctan((energy - 8979 - shift)/2)/numpy.pi + 0.5 + 0.1*numpy.sin(4.5*k)*numpy.exp(-0.01*k**2)
+    return energy, mu
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    '''Read synthetic spectra rather than the database, counting the reads.'''
+    count = []
+    def load(self, uid, mode='transmission'):
+        count.append(uid)
+        self.title = f'synthetic {uid}'
+        self.group.energy, self.group.mu = spectrum(uid)
+    monkeypatch.setattr(bmmlarch.Pandrosus, 'load', load)
+    bmmlarch.clear_larch_cache()
+    yield count
+    bmmlarch.clear_larch_cache()
+
+
+def test_cache_key():
+    '''The key changes with the uid, the mode, and every processing parameter.'''
+    a, b = bmmlarch.Pandrosus(uid='abc123'), bmmlarch.Pandrosus(uid='abc123')
+    assert a.cache_key('transmission') == b.cache_key('transmission')
+    assert a.cache_key('transmission') != a.cache_key('fluorescence')
+    assert a.cache_key('transmission') != bmmlarch.Pandrosus(uid='def456').cache_key('transmission')
+    for params, key, value in ((b.pre, 'e0', 8980), (b.bkg, 'rbkg', 1.2), (b.fft, 'kmax', 14)):
+        saved = params[key]
+        params[key] = value
+        assert a.cache_key('transmission') != b.cache_key('transmission')
+        params[key] = saved
+    assert a.cache_key('transmission') == b.cache_key('transmission')
+
+
+def test_cached_arrays_are_read_only(loads):
+    '''Processed data come from the cache the second time.  The cached
+    arrays, shared by every restored group, are read-only, the freshly
+    processed group is not affected, and a restored group can still be
+    processed with other parameters.'''
+    first = bmmlarch.Kekropidai()
+    first.workers = 1
+    first.put(['uid-0001'])
+    second = bmmlarch.Kekropidai()
+    second.put(['uid-0001'])
+    assert loads == ['uid-0001']
+
+    fresh, restored = first.groups[0].group, second.groups[0].group
+    assert numpy.array_equal(fresh.norm, restored.norm)
+    fresh.norm[0] = 0
+    with pytest.raises(ValueError):
+        restored.norm[0] = 0
+    assert not numpy.array_equal(fresh.norm, restored.norm)
+
+    second.groups[0].pre['e0'] = 8985
+    second.groups[0].prep()
+    assert restored.e0 == 8985
+
+    bmmlarch.clear_larch_cache()
+    bmmlarch.Kekropidai().put(['uid-0001'])
+    assert loads == ['uid-0001', 'uid-0001']
+
+
+def test_workers_and_serial(loads, monkeypatch):
+    '''A batch is processed by spawned worker processes, with the same
+    results as processing one data set at a time here.  When the
+    worker processes cannot be used, or there is only one data set,
+    the processing is done here.'''
+    uids = ['uid-0001', 'uid-0002', 'uid-0003']
+    spawned = bmmlarch.Kekropidai()
+    spawned.workers = 2
+    spawned.put(uids)
+    assert bmmlarch._pool is not None
+
+    bmmlarch.clear_larch_cache()
+    def no_pool(workers):
+        raise OSError('pretend worker processes cannot be started')
+    monkeypatch.setattr(bmmlarch, '_process_pool', no_pool)
+    serial = bmmlarch.Kekropidai()
+    serial.workers = 2
+    serial.put(uids)
+    for s, p in zip(serial.groups, spawned.groups):
+        assert s.pre == p.pre
+        assert numpy.allclose(s.group.chir_mag, p.group.chir_mag)
+
+    bmmlarch.clear_larch_cache()
+    def never(workers):
+        raise AssertionError('a single data set should not use the worker processes')
+    monkeypatch.setattr(bmmlarch, '_process_pool', never)
+    bmmlarch.Kekropidai().put(uids[:1])
+    assert len(loads) == 7
@@ -0,0 +1,156 @@
+import os, time, json, logging, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from conftest import profile_import
+
+bmmlog = profile_import('BMM.logging')
+
+
+class SlowFile():
+    '''A file whose writes each take delay seconds, standing in for a
+    slow NAS.  Use open_slowly(delay) as a LogDestination opener.'''
+    def __init__(self, filename, mode, delay):
+        self.__fh   = open(filename, mode)
+        self.delay  = delay
+    def write(self, text):
+        time.sleep(self.delay)
+        return self.__fh.write(text)
+    def flush(self):
+        self.__fh.flush()
+    def close(self):
+        self.__fh.close()
+
+def open_slowly(delay):
+    return lambda filename, mode: SlowFile(filename, mode, delay)
+
+
+class MockWebhook():
+    '''A local HTTP server which accepts Slack webhook posts.
+
+    The first self.limited posts are answered with 429 and a
+    Retry-After of self.retry_after seconds.  While self.down is True,
+    posts are answered with 503.  Posts which are accepted are kept in
+    self.received as (time, text) tuples.
+    '''
+    def __init__(self, latency=0.0, limited=0, retry_after=1):
+        self.latency     = latency
+        self.limited     = limited
+        self.retry_after = retry_after
+        self.down        = False
+        self.received    = []
+        self.__server    = None
+
+    def start(self):
+        hook = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                time.sleep(hook.latency)
+                if hook.down:
+                    self.send_response(503)
+                elif hook.limited > 0:
+                    hook.limited -= 1
+                    self.send_response(429)
+                    self.send_header('Retry-After', str(hook.retry_after))
+                else:
+                    hook.received.append((time.time(), body['text']))
+                    self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'ok')
+            def log_message(self, *args):
+                pass
+        self.__server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.__server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.__server.server_address[1]}/services/mock'
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+
+def test_slow_nas(tmp_path):
+    '''Log messages to a fast destination and to one which behaves like
+    a slow NAS.  The caller is not held up, the messages logged while
+    the NAS was slow go to the spool, and every message ends up in
+    both files, in order, once the slow one recovers.'''
+    messages, delay = 200, 2.0
+    fast = bmmlog.LogDestination(os.path.join(tmp_path, 'local', 'master.log'))
+    slow = bmmlog.LogDestination(os.path.join(tmp_path, 'nas', 'master.log'),
+                                 spool=os.path.join(tmp_path, 'spool.log'), slow=delay/2, retry=delay)
+    slow.opener = open_slowly(delay)
+    logger = logging.getLogger('BMM_test_logging')
+    logger.handlers = [fast, slow]
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    for d in ('local', 'nas'):
+        os.makedirs(os.path.join(tmp_path, d))
+
+    elapsed = 0
+    for i in range(messages):
+        if i == messages//2:    # let the first, slow write happen
+            slow.flush()
+        start = time.time()
+        logger.info(f'message {i}')
+        elapsed += time.time() - start
+    fast.flush()
+    slow.flush()
+    assert slow.spooled > 0
+    assert elapsed < 1
+
+    time.sleep(delay)           # the NAS comes back ...
+    slow.opener = open
+    slow._close()
+    logger.info('after recovery')
+    for h in (fast, slow):
+        h.close()
+
+    expected = [f'message {i}' for i in range(messages)] + ['after recovery']
+    for h in (fast, slow):
+        with open(h.filename) as fh:
+            assert [l.strip() for l in fh] == expected
+    assert fast.dropped + slow.dropped == 0
+
+
+def test_slack_dispatcher(tmp_path):
+    '''Send messages through a SlackDispatcher to a webhook which is
+    slow, rate limits the first post, and then goes down across a
+    "restart" of the dispatcher.  Posting never waits on the webhook,
+    messages are coalesced, and every message arrives once, in order.'''
+    messages = 50
+    outbox = os.path.join(tmp_path, 'outbox.json')
+    hook = MockWebhook(latency=0.5, limited=1, retry_after=1).start()
+    dispatcher = bmmlog.SlackDispatcher(outbox=outbox, channels={'mock': hook.url})
+    dispatcher.coalesce, dispatcher.backoff = 0.5, 0.2
+
+    start = time.time()
+    for i in range(messages):
+        dispatcher.post(f'message {i}', 'mock')
+    assert time.time() - start < 0.5
+    dispatcher.flush()
+
+    ## messages posted while the webhook is down survive a restart
+    hook.down = True
+    for i in range(messages, messages+5):
+        dispatcher.post(f'message {i}', 'mock')
+    time.sleep(1)
+    dispatcher.stop()
+    with open(outbox) as fh:    # saved, but without the webhook URL
+        text = fh.read()
+    assert 'message' in text and hook.url not in text
+    hook.down = False
+    dispatcher = bmmlog.SlackDispatcher(outbox=outbox, channels={'mock': hook.url})
+    dispatcher.start()
+    dispatcher.flush()
+    dispatcher.stop()
+    hook.stop()
+
+    texts = '\n'.join(t for (when, t) in hook.received).split('\n')
+    assert texts == [f'message {i}' for i in range(messages+5)]
+    assert len(hook.received) < messages
+    gaps = [b[0]-a[0] for a, b in zip(hook.received[:-1], hook.received[1:])]
+    assert min(gaps) >= dispatcher.interval - 0.05
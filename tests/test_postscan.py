@@ -0,0 +1,100 @@
+import os, shutil, io, contextlib
+import pytest
+
+from conftest import shell, profile_import, transmission_scan
+
+## postscan.py imports xdi.py, which needs the ion chambers and the Struck
+simulated = profile_import('BMM.simulated')
+shell.user_ns.setdefault('quadem1', simulated.SimIonChambers('', name='quadem1'))
+shell.user_ns.setdefault('vor',     simulated.SimStruck('', name='vor'))
+postscan = profile_import('BMM.postscan')
+
+
+class FakeEvaluation():
+    '''Stands in for the data evaluation model, keeping the catalog
+    each evaluation was given.  The first fails evaluations raise.'''
+    def __init__(self, fails=0):
+        self.fails, self.catalogs = fails, []
+
+    def evaluate(self, uid, mode=None, element=None, db=None):
+        self.catalogs.append(db)
+        if self.fails > 0:
+            self.fails -= 1
+            raise RuntimeError('pretend the model could not be loaded')
+        return 1, ':heavy_check_mark:'
+
+
+class FakeGdrive():
+    '''Copies data files from folder into a folder standing in for
+    Google drive.  The first fails copies raise OSError.'''
+    def __init__(self, folder, fails=0):
+        self.folder, self.fails, self.calls = folder, fails, 0
+        self.remote = os.path.join(folder, 'gdrive')
+        os.makedirs(self.remote)
+
+    def __call__(self, fname):
+        self.calls += 1
+        if self.fails > 0:
+            self.fails -= 1
+            raise OSError('pretend the Google drive folder is busy')
+        shutil.copyfile(os.path.join(self.folder, fname), os.path.join(self.remote, fname))
+
+
+@pytest.fixture
+def queue(beamline, user_ns, tmp_path):
+    '''A post-scan work queue using the temporary databroker of the
+    beamline fixture, a fake Google drive, and a fake evaluation.'''
+    user_ns['BMMuser'].use_slack = False
+    user_ns['clf'] = FakeEvaluation()
+    ps = postscan.BMMPostScan()
+    ps.catalog, ps.gdrive, ps.synch = beamline.db, FakeGdrive(str(tmp_path)), None
+    ps.retries, ps.delay = 3, 0.05
+    return ps
+
+
+def enqueue(ps, beamline, tmp_path, n):
+    datafile = os.path.join(tmp_path, f'Cu-foil.{n:03d}')
+    ps.enqueue(uid=transmission_scan(beamline, npoints=5), datafile=datafile, mode='transmission', stage='')
+    return datafile
+
+
+def test_enqueue_and_join(queue, beamline, user_ns, tmp_path):
+    '''Each job writes its XDI file from the catalog, is evaluated from
+    the same catalog, and is copied to Google drive, in order.'''
+    datafiles = [enqueue(queue, beamline, tmp_path, n) for n in range(1, 4)]
+    assert queue.join(timeout=30) and queue.pending() == 0
+    assert [j['datafile'] for j in queue.done] == datafiles and queue.failed == []
+    for d in datafiles:
+        assert os.path.isfile(d)
+        assert os.path.isfile(os.path.join(queue.gdrive.remote, os.path.basename(d)))
+    assert user_ns['clf'].catalogs == [beamline.db] * 3
+
+
+def test_retry(queue, beamline, user_ns, tmp_path):
+    '''A Google drive copy and an evaluation which fail once are tried
+    again, and the job finishes.'''
+    queue.gdrive.fails, user_ns['clf'].fails = 1, 1
+    enqueue(queue, beamline, tmp_path, 1)
+    assert queue.join(timeout=30)
+    assert len(queue.done) == 1 and queue.failed == []
+    assert queue.gdrive.calls == 2 and len(user_ns['clf'].catalogs) == 2
+
+
+def test_retry_failed(queue, beamline, user_ns, tmp_path):
+    '''A job whose Google drive step runs out of retries is kept in
+    failed and shown by status, and is finished by retry_failed.  An
+    evaluation which runs out of retries does not fail the job.'''
+    queue.gdrive.fails, user_ns['clf'].fails = queue.retries, queue.retries
+    datafile = enqueue(queue, beamline, tmp_path, 1)
+    assert queue.join(timeout=30)
+    assert queue.done == [] and len(queue.failed) == 1
+    assert queue.failed[0]['steps'] == ['evaluation', 'gdrive']
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        queue.status()
+    assert 'pending        : 0' in out.getvalue() and os.path.basename(datafile) in out.getvalue()
+
+    queue.retry_failed()
+    assert queue.join(timeout=30)
+    assert queue.failed == [] and len(queue.done) == 1
+    assert os.path.isfile(os.path.join(queue.gdrive.remote, os.path.basename(datafile)))
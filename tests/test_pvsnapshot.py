@@ -0,0 +1,126 @@
+import time, threading
+
+from ophyd.sim import SynSignal, SynAxis
+
+from conftest import profile_import
+
+pvsnapshot = profile_import('BMM.pvsnapshot')
+
+
+class SlowSignal(SynSignal):
+    '''A simulated signal whose get() takes latency seconds.  Like an
+    EPICS signal, a get() which would take longer than its timeout
+    raises TimeoutError when the timeout is up.  The first fails gets
+    raise RuntimeError.'''
+    def __init__(self, *args, latency=0.0, fails=0, **kwargs):
+        self.latency, self.fails, self.reads = latency, fails, 0
+        super().__init__(*args, **kwargs)
+
+    def get(self, timeout=None, **kwargs):
+        self.reads += 1
+        if timeout is not None and self.latency > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f'{self.name} timed out')
+        time.sleep(self.latency)
+        if self.fails > 0:
+            self.fails -= 1
+            raise RuntimeError(f'{self.name} could not be read')
+        return super().get(**kwargs)
+
+
+class HungSignal(SynSignal):
+    '''A simulated signal whose get() ignores its timeout and does not
+    return until self.release is set.'''
+    def __init__(self, *args, **kwargs):
+        self.release, self.reads = threading.Event(), 0
+        super().__init__(*args, **kwargs)
+
+    def get(self, **kwargs):
+        self.reads += 1
+        self.release.wait()
+        return super().get()
+
+
+def snapshotter(timeout=1.0):
+    pvsnap = pvsnapshot.PVSnapshot()
+    pvsnap.timeout, pvsnap.verbose = timeout, False
+    return pvsnap
+
+
+def test_concurrent():
+    '''Twenty signals of 0.25 seconds each, and a motor, are read in
+    about the time of one, not the sum.'''
+    pvsnap = snapshotter()
+    signals = {f's{i}': SlowSignal(lambda i=i: float(i), name=f's{i}', latency=0.25) for i in range(20)}
+    signals['motor'] = SynAxis(name='motor')
+    start = time.time()
+    snap = pvsnap.take(signals)
+    elapsed = time.time() - start
+    assert snap.ok() and len(snap.cached) == 0
+    assert [snap[f's{i}'] for i in range(20)] == [float(i) for i in range(20)]
+    assert snap['motor'] == 0
+    assert elapsed < 0.25 * 3
+
+
+def test_timeout():
+    '''A signal slower than the timeout is reported as failed, without
+    holding up the others.'''
+    pvsnap = snapshotter(timeout=0.3)
+    signals = {'fast': SlowSignal(lambda: 1.0, name='fast', latency=0.05),
+               'slow': SlowSignal(lambda: 2.0, name='slow', latency=5)}
+    start = time.time()
+    snap = pvsnap.take(signals)
+    assert time.time() - start < 1
+    assert snap.failed == ('slow',) and snap['slow'] is None
+    assert snap['fast'] == 1.0 and snap.get('slow', 'n/a') == 'n/a'
+
+
+def test_max_age():
+    '''A value younger than its max_age comes from the cache, an older
+    one, or one without a max_age, is read again.'''
+    pvsnap = snapshotter()
+    mode, pitch = SlowSignal(lambda: 'top-off', name='mode'), SlowSignal(lambda: 3.5, name='pitch')
+    signals = {'mode': (mode, 0.5), 'pitch': pitch}
+    first = pvsnap.take(signals)
+    second = pvsnap.take(signals)
+    assert first.cached == () and second.cached == ('mode',)
+    assert second['mode'] == 'top-off' and second.timestamps['mode'] == first.timestamps['mode']
+    assert mode.reads == 1 and pitch.reads == 2
+    time.sleep(0.5)
+    assert pvsnap.take(signals).cached == () and mode.reads == 2
+    pvsnap.take(signals)
+    pvsnap.clear()
+    assert pvsnap.take(signals).cached == () and mode.reads == 3
+
+
+def test_fallback():
+    '''A signal which fails once is read again with fallback=True.'''
+    pvsnap = snapshotter()
+    flaky = SlowSignal(lambda: 7.0, name='flaky', fails=1)
+    assert pvsnap.take({'flaky': flaky}).failed == ('flaky',)
+    flaky.fails = 1
+    snap = pvsnap.take({'flaky': flaky}, fallback=True)
+    assert snap.ok() and snap['flaky'] == 7.0 and flaky.reads == 3
+
+
+def test_hung_signal():
+    '''A signal whose get() never returns is reported as failed after
+    the timeout.  While it is still hung, later snapshots report it as
+    failed right away rather than tying up another reader.'''
+    pvsnap = snapshotter(timeout=0.2)
+    hung = HungSignal(lambda: 9.0, name='hung')
+    signals = {'hung': hung, 'ok': SlowSignal(lambda: 1.0, name='ok')}
+    try:
+        start = time.time()
+        snap = pvsnap.take(signals)
+        assert time.time() - start < 0.2 * 3
+        assert snap.failed == ('hung',) and snap['ok'] == 1.0
+        start = time.time()
+        snap = pvsnap.take(signals)
+        assert time.time() - start < 0.1
+        assert snap.failed == ('hung',) and hung.reads == 1
+    finally:
+        hung.release.set()
+    time.sleep(0.1)
+    snap = pvsnap.take(signals)
+    assert snap.ok() and snap['hung'] == 9.0 and hung.reads == 2
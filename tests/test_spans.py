@@ -0,0 +1,31 @@
+import os, time, threading
+
+from BMM.spans import SpanRecorder
+
+
+def test_nesting_and_tags(tmp_path):
+    '''The spans of a pretend scan sequence come back from the database
+    with their nesting and tags.'''
+    recorder = SpanRecorder(os.path.join(tmp_path, 'spans.sqlite'))
+    with recorder.span('xafs', element='fe', edge='K', mode='transmission', sequence='check'):
+        with recorder.span('metadata'):
+            time.sleep(0.01)
+        for i in range(1, 3):
+            with recorder.span('repetition', repetition=i) as rep:
+                with recorder.span('scan'):
+                    time.sleep(0.02)
+                ## post-scan chores on another thread
+                t = threading.Thread(target=lambda r=rep: recorder.begin('xdi', parent=r).end())
+                t.start()
+                t.join()
+        recorder.begin('dossier')   # left open, ended by its parent
+    recorder.flush()
+    rows = recorder.query(element='Fe', sequence='check')
+    paths = [r['path'] for r in rows]
+    assert paths.count('xafs/repetition/scan') == 2
+    assert paths.count('xafs/repetition/xdi') == 2
+    assert 'xafs/metadata' in paths and 'xafs' in paths
+    assert all(r['edge'] == 'K' for r in rows)
+    assert [r['ok'] for r in rows if r['path'] == 'xafs/dossier'] == [0]
+    assert [r['repetition'] for r in rows if r['path'] == 'xafs/repetition/scan'] == [1, 2]
+    recorder.timeline('check')
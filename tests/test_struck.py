@@ -0,0 +1,88 @@
+import time
+import numpy
+from numpy import exp
+
+from BMM.struck import dtcorrect_array
+
+
+def dtcorrect_scalar(roi, icr, ocr, inttime, dt=280.0, maxiter=20):
+    '''The original one-value-at-a-time dead-time correction, the
+    reference for dtcorrect_array.  Returns (corrected, niter).'''
+    if roi is None: roi = 1.0
+    if icr is None: icr = 1.0
+    if ocr is None: ocr = 1.0
+    if inttime is None: inttime = 1.0
+    if icr is None or icr<1.0:
+        icr=1.0
+    if ocr is None or ocr<1.0:
+        ocr=1.0
+    rr = float(roi)
+    ii = float(icr)
+    oo = float(ocr)
+    tt = float(inttime)
+    dt = dt*1e-9
+    if tt<0.001:
+        tt=0.001
+    if dt<1e-9:
+        return rr*ii/oo, 0
+    totn  = 0.0
+    test  = 1.0
+    count = 0
+    toto  = ii/tt
+    if icr <= 1.0:
+        totn = oo
+        test = 0
+    while test > dt:
+        totn = (ii/tt) * exp(toto*dt)
+        test = (totn - toto) / toto
+        toto = totn
+        count = count+1
+        if (count > maxiter):
+            test = 0
+    return float(rr * (totn*tt/oo)), count
+
+
+def synthetic(npoints, seed=0):
+    '''Synthetic ROI/ICR/OCR/time values spanning the useful range of the SDDs.'''
+    rng  = numpy.random.default_rng(seed)
+    tt   = rng.uniform(0.1, 5.0, npoints)
+    icr  = 10**rng.uniform(2, 6, npoints) * tt
+    ocr  = icr * numpy.exp(-icr/tt*280e-9)
+    roi  = ocr * rng.uniform(0.05, 0.5, npoints)
+    return roi, icr, ocr, tt
+
+
+def test_dtcorrect_array_matches_scalar():
+    roi, icr, ocr, tt = synthetic(10000)
+    ## include the edge cases handled specially by the scalar routine
+    roi = numpy.append(roi, [100, 100, 100, 100])
+    icr = numpy.append(icr, [0.5, 1.0, 1000, 1000])
+    ocr = numpy.append(ocr, [0.5, 1.0, 0.5, 900])
+    tt  = numpy.append(tt,  [1.0, 1.0, 1.0, 0.0001])
+    vector, niter, converged = dtcorrect_array(roi, icr, ocr, tt)
+    scalar = numpy.array([dtcorrect_scalar(*args) for args in zip(roi, icr, ocr, tt)])
+    reldiff = numpy.abs(vector - scalar[:,0]) / numpy.maximum(numpy.abs(scalar[:,0]), 1e-12)
+    assert reldiff.max() <= 1e-12
+    assert (niter == scalar[:,1]).all()
+    assert converged.all()
+
+
+def test_dtcorrect_array_reports_unconverged():
+    ## a high count rate needs many iterations, a low one only two
+    corrected, niter, converged = dtcorrect_array([100, 100], [1e6, 1e3], [5e5, 9e2], [1.0, 1.0], maxiter=1)
+    assert niter.tolist() == [2, 2]
+    assert converged.tolist() == [False, True]
+
+
+def test_dtcorrect_array_is_faster():
+    roi, icr, ocr, tt = synthetic(20000)
+    old, new = [], []
+    for i in range(3):
+        start = time.time()
+        for args in zip(roi, icr, ocr, tt):
+            dtcorrect_scalar(*args)
+        old.append(time.time() - start)
+        start = time.time()
+        dtcorrect_array(roi, icr, ocr, tt)
+        new.append(time.time() - start)
+    assert min(new) < min(old) / 5
@@ -0,0 +1,96 @@
+import os, json
+import pytest
+
+databroker = pytest.importorskip('databroker')
+pytest.importorskip('xraylib')
+from databroker.v2 import temp
+from event_model import compose_run
+
+import BMM.telemetry
+from BMM.telemetry import BMMTelementry
+
+
+def xafs_run(catalog, start, element='Fe', npoints=10, dwell=1.0, elapsed=15.0):
+    '''Insert a finished XAFS run into a catalog, returns its uid.'''
+    bundle = compose_run(time=start, metadata={'num_points': npoints,
+                                               'XDI': {'_kind': 'xafs', 'Element': {'symbol': element}}})
+    catalog.v1.insert('start', bundle.start_doc)
+    desc = bundle.compose_descriptor(name='primary',
+                                     data_keys={'dwti_dwell_time': {'source': 'sim', 'dtype': 'number', 'shape': []}})
+    catalog.v1.insert('descriptor', desc.descriptor_doc)
+    for i in range(npoints):
+        catalog.v1.insert('event', desc.compose_event(data={'dwti_dwell_time': dwell},
+                                                      timestamps={'dwti_dwell_time': start+i}, time=start+i))
+    catalog.v1.insert('stop', bundle.compose_stop(time=start+elapsed))
+    return bundle.start_doc['uid']
+
+
+@pytest.fixture
+def telemetry(tmp_path, monkeypatch):
+    monkeypatch.setattr(BMM.telemetry, 'catalog', {'bmm': temp()})
+    tele = BMMTelementry()
+    tele.folder     = str(tmp_path)
+    tele.json       = os.path.join(tmp_path, 'telemetry.json')
+    tele.index_file = os.path.join(tmp_path, 'telemetry_index.json')
+    tele.workers    = 2
+    return tele
+
+
+def test_update_index_is_incremental(telemetry):
+    first = [xafs_run(telemetry.bc, 1.6e9 + 100*i) for i in range(3)]
+    index = telemetry.update_index()
+    assert sorted(index['runs']) == sorted(first)
+    assert index['checkpoint'] == 1.6e9 + 200
+    assert index['runs'][first[0]]['measurement'] == 10.0
+
+    later = xafs_run(telemetry.bc, 1.6e9 + 1000, elapsed=20.0)
+    index = telemetry.update_index()
+    assert len(index['runs']) == 4 and index['checkpoint'] == 1.6e9 + 1000
+    assert telemetry.overhead('Fe', index=index)['count'] == 4
+
+
+def test_failing_run_does_not_pin_checkpoint(telemetry, monkeypatch):
+    good = xafs_run(telemetry.bc, 1.6e9)
+    bad  = xafs_run(telemetry.bc, 1.6e9 + 100)
+    last = xafs_run(telemetry.bc, 1.6e9 + 200)
+
+    statistics = telemetry.run_statistics
+    def flaky(uid):
+        if uid == bad:
+            raise RuntimeError('pretend the database timed out')
+        return statistics(uid)
+    monkeypatch.setattr(telemetry, 'run_statistics', flaky)
+
+    ## the failing run holds the checkpoint back until it has been tried enough times
+    for attempt in range(1, telemetry.attempts):
+        index = telemetry.update_index()
+        assert bad not in index['runs'] and index['failures'][bad] == attempt
+        assert index['checkpoint'] == 1.6e9 + 100
+        assert good in index['runs'] and last in index['runs']
+
+    ## then it is indexed as skipped and the checkpoint moves on
+    index = telemetry.update_index()
+    assert index['runs'][bad]['skip'] == 'error' and bad not in index['failures']
+    assert index['checkpoint'] == 1.6e9 + 200
+    assert telemetry.overhead('Fe', index=index)['count'] == 2
+
+
+def test_grid_estimate_follows_telemetry_json(telemetry, user_ns):
+    '''Grids are memoized, but the time estimate comes from whatever is
+    in telemetry.json now, without calling clear_grid_cache().'''
+    from BMM.xafs_functions import conventional_grid
+    user_ns['tele'] = telemetry
+    def write(dpp):
+        with open(telemetry.json, 'w') as fh:
+            json.dump({'Fe': {'count': 20, 'dpp': dpp}}, fh)
+
+    write([1.0, 0.1])
+    grid, timegrid, before, delta = conventional_grid(element='Fe', edge='K')
+    assert before == round(float(timegrid.sum() + len(timegrid)*1.0) / 60, 1)
+    assert delta  == round(len(timegrid)*0.1 / 60, 1)
+
+    write([2.75, 0.25])
+    again, timegrid, after, delta = conventional_grid(element='Fe', edge='K')
+    assert again is grid
+    assert after == round(float(timegrid.sum() + len(timegrid)*2.75) / 60, 1) and after > before
+    assert delta == round(len(timegrid)*0.25 / 60, 1)
@@ -0,0 +1,108 @@
+import os, time, types, tempfile, io, contextlib
+import pytest
+
+from conftest import shell, profile_import
+
+## xafs.py imports most of the profile, which looks up much of the
+## beamline when it is imported, the simulated one will do
+simulated = profile_import('BMM.simulated')
+shell.user_ns.setdefault('BMM_CONFIGURATION_LOCATION', tempfile.mkdtemp(prefix='bmm_config_'))
+for name, thing in simulated.SimulatedBMM(cameras=False).build().items():
+    shell.user_ns.setdefault(name, thing)
+xafs = profile_import('BMM.xafs')
+
+
+INI = '''[scan]
+folder        = {folder}
+filename      = Fe-foil
+experimenters = Bruce Ravel
+element       = Fe
+edge          = K
+sample        = Fe foil
+start         = next
+nscans        = {nscans}
+bounds        = -200 -30 -10 25 13k
+steps         = 10 2 0.3 0.05k
+times         = 0.5 0.5 0.5 0.25k
+mode          = transmission
+'''
+
+
+@pytest.fixture
+def inifile(user_ns, tmp_path):
+    '''An INI file for a Fe K edge scan sequence, with BMMuser giving
+    the default values of the parameters it does not set.'''
+    user_ns['BMMuser'] = types.SimpleNamespace(
+        bounds=[-200, -30, 15.3, '14k'], steps=[10, 0.5, '0.05k'], times=[0.5, 0.5, '0.25k'],
+        folder=str(tmp_path), experimenters='', element=None, edge='K', filename='data.dat', comment='',
+        mode='transmission', sample='', prep='', url=False, doi=False, cif=False, nscans=1, npoints=0,
+        e0=None, inttime=1, dwell=1.0, delay=0.1, snapshots=True, htmlpage=True, bothways=False,
+        channelcut=True, usbstick=True, rockingcurve=False, ththth=False, start=0)
+    fname = os.path.join(tmp_path, 'scan.ini')
+    write_ini(fname, folder=tmp_path, nscans=3)
+    xafs._scan_parameters_cache.clear()
+    yield fname
+    xafs._scan_parameters_cache.clear()
+
+
+def write_ini(fname, text=None, **kwargs):
+    with open(fname, 'w') as fh:
+        fh.write(text or INI.format(**kwargs))
+
+
+def test_parameters_are_cached(inifile, user_ns, tmp_path):
+    '''The parameters are reused until the INI file's contents, the data
+    folder, or a default taken from BMMuser change.  Touching the INI
+    file without changing it does not count.'''
+    p = xafs.scan_parameters(inifile)
+    assert p.nscans == 3 and p.e0 == pytest.approx(7112) and p.start == 1
+    assert p.bounds == (-200, -30, -10, 25, '13k') and p.found()['e0']
+    assert xafs.scan_parameters(inifile) is p and xafs.scan_parameters(p) is p
+    with pytest.raises(AttributeError):
+        p.nscans = 4
+
+    time.sleep(0.01)
+    os.utime(inifile)
+    assert xafs.scan_parameters(inifile) is p
+
+    write_ini(inifile, folder=tmp_path, nscans=5)
+    q = xafs.scan_parameters(inifile)
+    assert q is not p and q.nscans == 5
+    assert xafs.scan_parameters(p).nscans == 5
+
+    ## start = next depends on the files already in the folder
+    open(os.path.join(tmp_path, 'Fe-foil.001'), 'w').close()
+    r = xafs.scan_parameters(inifile)
+    assert r is not q and r.start == 2
+
+    ## comment is not in the INI file, so it comes from BMMuser
+    user_ns['BMMuser'].comment = 'a new comment'
+    s = xafs.scan_parameters(inifile)
+    assert s is not r and s.comment == 'a new comment'
+
+    ## kwargs are part of the key, and are kept when a ScanParameters is passed back in
+    t = xafs.scan_parameters(inifile, nscans=2)
+    assert t is not s and t.nscans == 2 and xafs.scan_parameters(inifile) is s
+    assert xafs.scan_parameters(t, comment='another').nscans == 2
+
+
+def test_all_problems_are_reported(inifile, tmp_path):
+    '''Every bad value in the INI file is reported at once, and no
+    parameters are returned.'''
+    text = INI.format(folder=os.path.join(tmp_path, 'nowhere'), nscans='three')
+    text = text.replace('start         = next', 'start         = soon')
+    text = text.replace('steps         = 10 2 0.3 0.05k', 'steps         = 10 2 0.05k')
+    text += 'e0            = seven thousand\nsnapshots     = maybe\n'
+    write_ini(inifile, text)
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        assert xafs.scan_parameters(inifile) is None
+    report = out.getvalue()
+    for problem in ('nscans = three is not a valid value',
+                    'e0 = seven thousand is not a valid value',
+                    'snapshots = maybe is not a valid true/false value',
+                    'the scan regions (bounds, steps, times) are not valid',
+                    'folder %s does not exist' % os.path.join(tmp_path, 'nowhere'),
+                    'start value must be a positive integer or "next"'):
+        assert problem in report
+    assert 'Found 6 problems' in report
@@ -0,0 +1,176 @@
+import os, time, types, datetime
+import numpy, pandas
+import pytest
+
+from conftest import shell, profile_import, transmission_scan
+
+## xdi.py builds its detector lists from the ion chambers and the
+## Struck when it is imported, the simulated ones will do for that
+simulated = profile_import('BMM.simulated')
+shell.user_ns.setdefault('quadem1', simulated.SimIonChambers('', name='quadem1'))
+shell.user_ns.setdefault('vor',     simulated.SimStruck('', name='vor'))
+xdi = profile_import('BMM.xdi')
+
+
+def synthetic_table(npoints=2000, ncolumns=20):
+    rng = numpy.random.default_rng(0)
+    table = pandas.DataFrame({f'col{i}': rng.uniform(0, 10**(i%6), npoints) for i in range(ncolumns)})
+    template = '  %.3f  %.3f  %.3f' + '  %.6f' * min(ncolumns-3, 8) + '  %.1f' * max(ncolumns-11, 0) + '\n'
+    return table, template
+
+
+def by_row(table, template):
+    return ''.join(template % tuple(table.iloc[i]) for i in range(len(table)))
+
+
+def test_data_block_matches_row_by_row():
+    table, template = synthetic_table()
+    assert xdi.xdi_data_block(table, template) == by_row(table, template)
+
+
+def test_data_block_elapsed_time():
+    begin = pandas.Timestamp('2023-01-01 12:00:00')
+    table = pandas.DataFrame({'time': [begin + pandas.Timedelta(seconds=1.5*i) for i in range(4)],
+                              'I0':   [1.0, 2.0, 3.0, 4.0]})
+    assert xdi.xdi_data_block(table, '  %.3f  %.1f\n', elapsed_from=begin) == \
+        '  0.000  1.0\n  1.500  2.0\n  3.000  3.0\n  4.500  4.0\n'
+
+
+def test_data_block_is_faster():
+    table, template = synthetic_table()
+    old, new = [], []
+    for i in range(3):
+        start = time.time()
+        by_row(table, template)
+        old.append(time.time() - start)
+        start = time.time()
+        xdi.xdi_data_block(table, template)
+        new.append(time.time() - start)
+    assert min(new) < min(old) / 2
+
+
+def stream_scan(bl, datafile, npoints=20):
+    '''Measure a transmission scan, writing datafile with an
+    XDIStreamWriter.  Returns the writer and the uid of the run, None
+    if the run failed.'''
+    xdicb = xdi.XDIStreamWriter(datafile, stage='')
+    return xdicb, transmission_scan(bl, npoints, subs=xdicb)
+
+
+def test_stream_writer_matches_write_XDI(beamline, tmp_path):
+    '''The file written during the scan is identical to the one written
+    by write_XDI from databroker afterwards.'''
+    streamed, written = str(tmp_path / 'streamed.001'), str(tmp_path / 'written.001')
+    xdicb, uid = stream_scan(beamline, streamed)
+    assert xdicb.npoints == 20 and not xdicb.failed and xdicb.handle is None
+    xdi.write_XDI(written, beamline.db[uid], context=xdicb.context)
+    with open(streamed, 'rb') as s, open(written, 'rb') as w:
+        text = s.read()
+        assert text == w.read()
+    assert b'# Sample.x: 12.500 mm' in text
+
+
+def test_stream_writer_aborted(beamline, tmp_path):
+    '''A run which fails part way leaves a closed file with the points
+    measured so far, marked at the end.'''
+    streamed = str(tmp_path / 'streamed.001')
+    beamline.quadem1.fail_after = 7
+    xdicb, uid = stream_scan(beamline, streamed)
+    assert uid is None and xdicb.handle is None and not xdicb.failed
+    with open(streamed) as fh:
+        lines = fh.read().splitlines()
+    data = [l for l in lines if not l.startswith('#')]
+    assert len(data) == 7
+    assert lines[-1] == '# scan ended early, exit status: fail, 7 points measured'
+    assert sum(l.startswith('# Scan.end_time: ') for l in lines) == 1
+
+
+def baseline_xdi():
+    '''xdi.py as it was before write_XDI was split into xdi_header,
+    xdi_layout, and xdi_data_block, taken from the first commit.'''
+    import subprocess, importlib.util
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        root = subprocess.run(['git', 'rev-list', '--max-parents=0', 'HEAD'], cwd=here,
+                              capture_output=True, text=True, check=True).stdout.split()[-1]
+        source = subprocess.run(['git', 'show', f'{root}:startup/BMM/xdi.py'], cwd=here,
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError, IndexError):
+        pytest.skip('the first version of xdi.py is not available from git')
+    spec = importlib.util.spec_from_loader('baseline_xdi', loader=None)
+    module = importlib.util.module_from_spec(spec)
+    exec(compile(source, 'baseline_xdi.py', 'exec'), module.__dict__)
+    return module
+
+
+class SyntheticRun():
+    '''Enough of a databroker header for write_XDI: a start document
+    for mode and kind, a stop document, a baseline table, and a
+    primary table with every column any layout uses.'''
+    def __init__(self, mode, kind, npoints=50):
+        rng = numpy.random.default_rng(1)
+        begin = 1700000000.4
+        self.start = {'time': begin, 'uid': 'e1d7a6f0-synthetic', 'scan_id': 1234,
+                      'XDI': {'_mode': [mode], '_comment': [f'{mode} {kind}'], '_kind': kind,
+                              'Element': {'symbol': 'Cu', 'edge': 'K'},
+                              'Scan': {'edge_energy': 8979, 'experimenters': 'Bruce Ravel',
+                                       'dwell_time': 1, 'delay': 0},
+                              'Beamline': {'name': 'BMM (06BM) -- Beamline for Materials Measurement',
+                                           'energy': 8979},
+                              'Mono': {'encoder_resolution': 0.0000050, 'angle_offset': 16.0557}}}
+        self.stop = {'time': begin + 300.6}
+        energy = numpy.linspace(8779, 9779, npoints)
+        data = {'dcm_energy': energy + rng.normal(0, 0.01, npoints), 'dcm_energy_setpoint': energy,
+                'dwti_dwell_time': numpy.full(npoints, 1.0)}
+        for k in ('I0', 'It', 'Ir', 'Iy'):
+            data[k] = rng.uniform(0.1, 200, npoints)
+        for i in range(1, 5):
+            for k in ('DTC', 'ROI', 'ICR', 'OCR', 'XS'):
+                data[f'{k}{i}'] = rng.uniform(1000, 100000, npoints)
+        start = pandas.Timestamp(datetime.datetime.isoformat(datetime.datetime.fromtimestamp(round(begin))))
+        data['time'] = [start + pandas.Timedelta(seconds=1.25*i + 0.1) for i in range(npoints)]
+        self.primary = pandas.DataFrame(data, index=range(1, npoints+1))
+        self.baseline = pandas.DataFrame({'xafs_x': [12.5, 12.5], 'xafs_y': [3.25, 3.25]}, index=[1, 2])
+
+    def table(self, stream='primary'):
+        return (self.baseline if stream == 'baseline' else self.primary).copy()
+
+
+@pytest.mark.parametrize('mode, kind, with_xspress3, element', [
+    ('transmission', 'xafs', False, 4),
+    ('fluorescence', 'xafs', False, 4),
+    ('fluorescence', 'xafs', False, 1),
+    ('fluorescence', 'xafs', True,  4),
+    ('xs',           'xafs', True,  4),
+    ('yield',        'xafs', False, 4),
+    ('reference',    'xafs', False, 4),
+    ('test',         'xafs', False, 4),
+    ('transmission', 'sead', False, 4),
+    ('fluorescence', 'sead', False, 4),
+    ('transmission', '333',  False, 4),
+    ('fluorescence', '333',  False, 4),
+    ## "with_xspress3 and 'fluo' in mode or ..." binds as "(with_xspress3
+    ## and 'fluo' in mode) or ...", so these take the xspress3 columns
+    ## even without an xspress3
+    ('both',         'xafs', False, 4),
+    ('flourescence', 'xafs', False, 4),
+])
+def test_write_XDI_matches_baseline(user_ns, tmp_path, mode, kind, with_xspress3, element):
+    '''write_XDI writes the same bytes as the first version of xdi.py for
+    every measurement mode and kind.'''
+    baseline = baseline_xdi()
+    user_ns['BMMuser'] = types.SimpleNamespace(instrument='sample wheel', detector=element, element=element,
+                                               **{f'{k}{i}': f'{k.upper()}{i}' for k in ('dtc', 'roi', 'xs')
+                                                  for i in range(1, 5)},
+                                               **{f'xschannel{i}': types.SimpleNamespace(name=f'XS{i}')
+                                                  for i in range(1, 5)})
+    user_ns['xafs_wheel'] = simulated.SimWheel('', name='xafs_wheel')
+    user_ns['ga'] = None
+    user_ns['with_xspress3'] = with_xspress3
+    user_ns['XDI_record'] = {'xafs_x': (True, 'Sample.x'), 'xafs_y': (False, 'Sample.y')}
+    run = SyntheticRun(mode, kind)
+    old, new = str(tmp_path / 'baseline.001'), str(tmp_path / 'new.001')
+    baseline.write_XDI(old, run)
+    xdi.write_XDI(new, run)
+    with open(old, 'rb') as o, open(new, 'rb') as n:
+        assert n.read() == o.read()
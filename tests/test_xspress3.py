@@ -0,0 +1,93 @@
+import os, time
+import numpy
+import pytest
+
+from conftest import profile_import
+
+h5py = pytest.importorskip('h5py')
+xspress3 = profile_import('BMM.xspress3')
+XS3_DATASET = xspress3.XS3_DATASET
+
+
+def test_fly_mode(tmp_path):
+    '''Measure frames with a FakeXspress3, first triggered once per point
+    as in a step scan, then free-running as a flyer.  The ROI sums
+    read back in chunks match the whole data set, and flying does not
+    pay the arm time for every point.'''
+    from bluesky import RunEngine
+    from bluesky import plan_stubs as bps
+    from bluesky.plans import count
+    from bluesky.preprocessors import stage_decorator, run_decorator
+    from event_model import unpack_event_page
+    npoints, frame_time, arm_time = 100, 0.1, 0.05
+    RE = RunEngine({})
+    events = []
+    def gather(name, doc):
+        if name == 'event':
+            events.append(doc)
+        elif name == 'event_page':
+            events.extend(unpack_event_page(doc))
+    RE.subscribe(gather)
+
+    fake = xspress3.FakeXspress3(name='xs', folder=str(tmp_path), arm_time=arm_time)
+    fake.fly_frame_time = frame_time
+    start = time.time()
+    RE(count([fake], npoints))
+    step = time.time() - start
+
+    @stage_decorator([fake])
+    @run_decorator()
+    def fly():
+        yield from bps.kickoff(fake, wait=True)
+        yield from bps.sleep(npoints*frame_time)
+        yield from bps.complete(fake, wait=True)
+        yield from bps.collect(fake)
+
+    events.clear()
+    fake.fly_size(npoints*frame_time)
+    start = time.time()
+    RE(fly())
+    fly_time = time.time() - start
+    fly_sums = numpy.array([[e['data'][k] for k in fake.rois] for e in events])
+
+    with h5py.File(fake.filename, 'r') as f:
+        whole = f[XS3_DATASET][()]
+    direct = numpy.array([[whole[i, c, low:high+1].sum() for (c, low, high) in fake.rois.values()] for i in range(len(whole))])
+    assert numpy.array_equal(direct, fly_sums)
+    assert step/npoints - frame_time > arm_time
+    assert fly_time/len(events) - frame_time < arm_time/5
+
+
+@pytest.mark.parametrize('layout', ['chunked', 'contiguous'])
+def test_roi_sums_in_blocks(tmp_path, layout):
+    '''ROI sums read a block of frames at a time are the same as those
+    from the whole data set, for a chunked and for a contiguous
+    (memory-mapped) file.'''
+    nframes, nchannels, nbins, chunk = 2000, 4, 4096, 256
+    rng = numpy.random.default_rng(0)
+    frames = rng.poisson(5, size=(nframes, nchannels, nbins)).astype(numpy.uint32)
+    rois = {f'Fe{c+1}': (c, 630, 660) for c in range(nchannels)}
+    fname = os.path.join(tmp_path, f'{layout}.h5')
+    with h5py.File(fname, 'w') as f:
+        if layout == 'chunked':
+            f.create_dataset(XS3_DATASET, data=frames, chunks=(1, nchannels, nbins))
+        else:
+            f.create_dataset(XS3_DATASET, data=frames)
+    start = time.time()
+    with h5py.File(fname, 'r') as f:
+        whole = f[XS3_DATASET][()]
+    old = {k: whole[:, c, low:high+1].sum(axis=-1) for k, (c, low, high) in rois.items()}
+    t_old = time.time() - start
+    start = time.time()
+    new = {k: [] for k in rois}
+    firsts = []
+    for first, sums in xspress3.xspress3_roi_sums(fname, rois, chunk=chunk):
+        firsts.append(first)
+        for k in rois:
+            new[k].append(sums[k])
+    t_new = time.time() - start
+    assert firsts == list(range(0, nframes, chunk))
+    for k in rois:
+        assert numpy.array_equal(old[k], numpy.concatenate(new[k]))
+    if layout == 'contiguous':
+        assert t_new < t_old